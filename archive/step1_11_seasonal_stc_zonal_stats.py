@@ -6,6 +6,10 @@ import rasterio
 import pandas as pd
 from rasterstats import zonal_stats
 import geopandas as gpd
+import mosaic_staging
+import memory_budget
+import zonal_engine
+import run_manifest
 import warnings
 import os
 from glob import glob
@@ -192,9 +196,6 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
     with rasterio.open(image_s, nodata=no_data) as srci:
         # image_results = 'image_' + im_name + '.csv'
 
-        affine = srci.transform
-        array = srci.read(1)
-
         # array = array - 100
 
         # open the 'GCSWGS84' projected shapefile (1ha sites)
@@ -204,8 +205,11 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
                     7: 'seven', 8: 'eight', 9: 'nine', 10: 'ten', 11: 'eleven', 12: 'twelve', 13: 'thirteen', 14: 'fourteen',
                     15: 'fifteen', 16: 'sixteen', 17: 'seventeen'}
 
-            zs = zonal_stats(src, array, affine=affine, nodata=no_data,
-                             stats=['count', 'min', 'max', 'mean', 'sum', 'std', 'median', 'majority', 'minority'], categorical=True, category_map=cmap, all_touched=True)
+            # windowed reads of each site (refer to zonal_engine.py), batched to the memory budget
+            zs = zonal_engine.extract_image_fn(srci, src, [1], no_data,
+                                               stats=['count', 'min', 'max', 'mean', 'sum', 'std', 'median',
+                                                      'majority', 'minority'],
+                                               categorical=True, category_map=cmap)[1]
 
             print(zs)
 
@@ -290,7 +294,9 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
 
     final_df = pd.concat(df_list)
     # print(final_df)
-    final_df.to_csv(os.path.join(stc_temp_dir_bands, "{0}_{1}.csv".format(variable, im_date)), index=False)
+    image_results = os.path.join(stc_temp_dir_bands, "{0}_{1}.csv".format(variable, im_date))
+    final_df.to_csv(image_results, index=False)
+    run_manifest.record_image_fn(variable, image_s, [image_results])
     # final_df.to_csv(r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\{0}_test.csv".format(str(im_date)))
     # final_results = None
     return final_df
@@ -347,6 +353,31 @@ def clean_data_frame_fn(output_list, output_dir, var_):
     return output
 
 
+def clean_zonal_stats_fn(output_zonal_stats):
+    """ Clean and reshape the concatenated zonal stats (all sites, or a single site when spilled to disk).
+
+    @param output_zonal_stats: dataframe object containing the concatenated stc zonal stats.
+    @return output_zonal_stats: dataframe object containing the cleaned stc zonal stats.
+    """
+
+    # -------------------------------------------------- Clean dataframe -----------------------------------------------
+    # output_zonal_stats.to_csv(r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\output_zonal_stats2.csv")
+    # Convert the date to a time stamp
+    time_stamp_fn(output_zonal_stats)
+
+    # remove 100 from zone_stats
+    # landsat_correction_fn(output_zonal_stats, num_bands)
+
+    # reshape the final dataframe
+    output_zonal_stats = output_zonal_stats[
+        ['uid', 'site', 'stc_image', 's_day', 's_month', 's_year', 's_date', 'e_day', 'e_month', 'e_year', 'e_date',
+         'band', 'count', 'min', 'max', 'mean', 'sum', 'std', 'median', 'majority', 'minority', 'one', 'two', 'three', 'four', 'five',
+         'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve', 'thirteen',
+         'fourteen', 'fifteen', 'sixteen', 'seventeen']]
+
+    return output_zonal_stats
+
+
 def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_data):
     """ Calculate the zonal statistics for each 1ha site per QLD monthly max_temp image (single band).
     Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
@@ -372,85 +403,25 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
     cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
 
     stc_temp_dir_bands = os.path.join(temp_dir_path, 'stc_temp_individual_bands')
-    os.makedirs(stc_temp_dir_bands)
+    os.makedirs(stc_temp_dir_bands, exist_ok=True)
 
-    # open the list of imagery and read it into memory and call the apply_zonal_stats_fn function
-    with open(csv_file, 'r') as imagery_list:
+    # loop through the list of imagery (staged on local disk when --stage_dir is set) and input the
+    # image into the raster zonal_stats function
+    for image_s in mosaic_staging.staged_images_fn(csv_file, variable):
+        # print('image: ', image)
 
-        # loop through the list of imagery and input the image into the raster zonal_stats function
-        for image in imagery_list:
-            # print('image: ', image)
+        print("image_s: ", image_s)
 
-            image_s = image.rstrip()
-            print("image_s: ", image_s)
-
-            df_list = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
-                                           stc_temp_dir_bands)  # cgs_df,projected_shape_path,
+        df_list = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
+                                       stc_temp_dir_bands)  # cgs_df,projected_shape_path,
 
     all_files = glob(os.path.join(stc_temp_dir_bands,
                                   '*.csv'))
-    # advisable to use os.path.join as this makes concatenation OS independent
-    df_from_each_file = (pd.read_csv(f) for f in all_files)
-    output_zonal_stats = pd.concat(df_from_each_file, ignore_index=False, axis=0, sort=False)
-    print("-" * 50)
-    print(output_zonal_stats.shape)
-    print(output_zonal_stats.columns)
-    print(output_zonal_stats)
 
-    # -------------------------------------------------- Clean dataframe -----------------------------------------------
-    # output_zonal_stats.to_csv(r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\output_zonal_stats2.csv")
-    # Convert the date to a time stamp
-    time_stamp_fn(output_zonal_stats)
-
-    # remove 100 from zone_stats
-    # landsat_correction_fn(output_zonal_stats, num_bands)
-
-    # reshape the final dataframe
-    output_zonal_stats = output_zonal_stats[
-        ['uid', 'site', 'stc_image', 's_day', 's_month', 's_year', 's_date', 'e_day', 'e_month', 'e_year', 'e_date',
-         'band', 'count', 'min', 'max', 'mean', 'sum', 'std', 'median', 'majority', 'minority', 'one', 'two', 'three', 'four', 'five',
-         'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve', 'thirteen',
-         'fourteen', 'fifteen', 'sixteen', 'seventeen']]
-
-    # uid_list = output_zonal_stats.uid.unique().tolist()
-    # print("length of uid list: ", len(uid_list))
-    # if len(uid_list) >= 1:
-    #     for i in uid_list:
-    #         out_df = output_zonal_stats[output_zonal_stats['uid'] == i]
-    #
-    #         out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-    #                                 "{0}_stc_zonal_stats.csv".format(str(i)))
-    #         print("export to: ", out_path)
-    #         # export the pandas df to a csv file
-    #         out_df.to_csv(out_path, index=False)
-    #
-    #
-    # else:
-    #     out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-    #                             "{0}_stc_zonal_stats.csv".format(str(uid_list[0])))
-    #     print("export to: ", out_path)
-    #     # export the pandas df to a csv file
-    #     output_zonal_stats.to_csv(out_path, index=False)
-
-    site_list = output_zonal_stats.site.unique().tolist()
-    print("length of site list: ", len(site_list))
-    if len(site_list) >= 1:
-        for i in site_list:
-            out_df = output_zonal_stats[output_zonal_stats['site'] == i]
-
-            out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                    "{0}_stc_zonal_stats.csv".format(str(i)))
-            print("export to: ", out_path)
-            # export the pandas df to a csv file
-            out_df.to_csv(out_path, index=False)
-
-
-    else:
-        out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                "{0}_stc_zonal_stats.csv".format(str(site_list[0])))
-        print("export to: ", out_path)
-        # export the pandas df to a csv file
-        output_zonal_stats.to_csv(out_path, index=False)
+    # concatenate, clean (refer to clean_zonal_stats_fn) and export a csv per site - the results are spilled to disk
+    # by site when they would exceed the memory budget (refer to memory_budget.py)
+    memory_budget.export_by_site_fn(all_files, clean_zonal_stats_fn, output_dir, "{0}_stc_zonal_stats.csv",
+                                    os.path.join(temp_dir_path, 'stc_temp_spill'))
 
     # ----------------------------------------------- Delete temporary files -------------------------------------------
     # remove the temp dir and single band csv files
@@ -6,8 +6,13 @@ import rasterio
 import pandas as pd
 from rasterstats import zonal_stats
 import geopandas as gpd
+import mosaic_staging
+import memory_budget
+import zonal_engine
+import run_manifest
 import warnings
 import os
+import shutil
 from glob import glob
 import numpy as np
 
@@ -130,16 +135,15 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data):
 
     with rasterio.open(image_s, nodata=no_data) as srci:
 
-        affine = srci.transform
-        array = srci.read(1)
-
         # array = array - 100
 
         with fiona.open(projected_shape_path) as src:
 
-            zs = zonal_stats(src, array, affine=affine, nodata=no_data,
-                             stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50',
-                                    'percentile_75', 'percentile_95', 'percentile_99', 'range'], all_touched=True)
+            # windowed reads of each site (refer to zonal_engine.py), batched to the memory budget
+            zs = zonal_engine.extract_image_fn(srci, src, [1], no_data,
+                                               stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25',
+                                                      'percentile_50', 'percentile_75', 'percentile_95',
+                                                      'percentile_99', 'range'])[1]
 
             # https://gis.stackexchange.com/questions/393413/rasterstats-zonal-statistics-does-not-ignore-nodata
             print("zs: ", zs)
@@ -283,14 +287,11 @@ def time_stamp_fn(output_zonal_stats):
     return output_zonal_stats
 
 
-def clean_data_frame_fn(output_list, output_dir, var_, band):
-    """ Create dataframe from output list, clean and export dataframe to a csv to export directory/max_temp sub-directory.
+def image_headers_fn(band):
+    """ Return the column headers of the per image zonal stats results (refer to apply_zonal_stats_fn).
 
-    @param output_list: list object created by appending the final results list elements.
-    @param max_temp_output_dir: string object containing the path to the export directory/max_temp sub-directory .
-    @param complete_tile: string object containing the current Landsat tile information.
-    @return output_max_temp: dataframe object containing all max_temp zonal stats based on the ODK 1ha plots created
-    based on the current Landsat tile.
+    @param band: integer object containing the band number.
+    @return headers: list object containing the column headers.
     """
 
     headers = ["uid",
@@ -310,15 +311,16 @@ def clean_data_frame_fn(output_list, output_dir, var_, band):
                "b" + str(band) + '_fpca2_p99',
                'image']
 
-    output = pd.DataFrame.from_records(output_list)
-    # output.to_csv(r"Z:\Scratch\Rob\test.csv")
-    for i in output.columns:
-        print(i)
+    return headers
+
 
-    print(output)
+def clean_data_frame_fn(output, band=1):
+    """ Clean the concatenated zonal stats dataframe (all sites, or a single site when spilled to disk).
 
-    output = pd.DataFrame.from_records(output_list, columns=headers)
-    # print('output_max_temp: ', output_max_temp)
+    @param output: dataframe object containing the concatenated per image results (refer to image_headers_fn).
+    @param band: integer object containing the band number.
+    @return output: dataframe object containing the cleaned fpca2 zonal stats.
+    """
 
     print("output: ", output.columns)
     # Convert the date to a time stamp
@@ -333,36 +335,6 @@ def clean_data_frame_fn(output_list, output_dir, var_, band):
                      'b1_fpca2_mean', 'b1_fpca2_med', 'b1_fpca2_std', 'b1_fpca2_p25', 'b1_fpca2_p50', 'b1_fpca2_p75',
                      'b1_fpca2_p95', 'b1_fpca2_p99', 'b1_fpca2_range']]
 
-    # uid = output['uid'].unique()
-    #
-    # print("length of uid list: ", len(uid))
-    # if len(uid) >= 1:
-    #     for i in uid:
-    #         out_df = output[output['uid'] == i]
-    #
-    #         out_path = os.path.join(output_dir, "{0}_{1}_zonal_stats.csv".format(
-    #             str(i), var_))
-    #         # export the pandas df to a csv file
-    #         out_df.to_csv(out_path, index=False)
-
-    site = output['site'].unique()
-
-    print("length of site list: ", len(site))
-    if len(site) >= 1:
-        for i in site:
-            out_df = output[output['site'] == i]
-
-            out_path = os.path.join(output_dir, "{0}_{1}_zonal_stats.csv".format(
-                str(i), var_))
-            # export the pandas df to a csv file
-            out_df.to_csv(out_path, index=False)
-
-    else:
-        out_path = os.path.join(output_dir, "{0}_{1}_zonal_stats.csv".format(
-            str(uid), var_))
-        # export the pandas df to a csv file
-        output.to_csv(out_path, index=False)
-
     return output
 
 
@@ -376,7 +348,6 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
     print("no_data: ", no_data)
 
     uid = 'uid'
-    output_list = []
     print("variable: ", variable)
 
     band = 1
@@ -392,24 +363,35 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
     # call the project_shapefile_gcs_wgs84_fn function
     cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
 
-    # open the list of imagery and read it into memory and call the apply_zonal_stats_fn function
-    with open(csv_file, 'r') as imagery_list:
+    fpca2_temp_dir_images = os.path.join(temp_dir_path, 'fpca2_temp_individual_images')
+    os.makedirs(fpca2_temp_dir_images, exist_ok=True)
+    # the image results completed before the run was resumed (refer to run_manifest.py)
+    image_files = run_manifest.image_outputs_fn(variable)
+
+    # loop through the list of imagery (staged on local disk when --stage_dir is set) and input the
+    # image into the raster zonal_stats function
+    for image_s in mosaic_staging.staged_images_fn(csv_file, variable):
+        # print('image: ', image)
 
-        # loop through the list of imagery and input the image into the raster zonal_stats function
-        for image in imagery_list:
-            # print('image: ', image)
+        print("image_s: ", image_s)
 
-            image_s = image.rstrip()
-            print("image_s: ", image_s)
+        final_results = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable,
+                                             no_data)  # cgs_df,projected_shape_path,
 
-            final_results = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable,
-                                                 no_data)  # cgs_df,projected_shape_path,
+        # write the image results to a temporary csv rather than holding every image in memory
+        image_results = os.path.join(fpca2_temp_dir_images, 'image_' + os.path.basename(image_s) + '.csv')
+        pd.DataFrame.from_records(final_results, columns=image_headers_fn(band)).to_csv(image_results, index=False)
+        image_files.append(image_results)
+        run_manifest.record_image_fn(variable, image_s, [image_results])
 
-            for i in final_results:
-                output_list.append(i)
+    # concatenate, clean (refer to clean_data_frame_fn) and export a csv per site - the results are spilled to disk
+    # by site when they would exceed the memory budget (refer to memory_budget.py)
+    memory_budget.export_by_site_fn(image_files, clean_data_frame_fn, output_dir,
+                                    "{0}_" + variable + "_zonal_stats.csv",
+                                    os.path.join(temp_dir_path, 'fpca2_temp_spill'), float_precision='round_trip')
 
-    # call the clean_data_frame_fn function
-    clean_output_temp = clean_data_frame_fn(output_list, output_dir, variable, band)
+    # remove the temp dir and single image csv files
+    shutil.rmtree(fpca2_temp_dir_images)
 
     return projected_shape_path
 
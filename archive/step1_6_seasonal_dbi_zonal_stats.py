@@ -50,11 +50,15 @@ import rasterio
 import pandas as pd
 from rasterstats import zonal_stats
 import geopandas as gpd
+import mosaic_staging
+import memory_budget
 import warnings
 import os
 from glob import glob
 import shutil
 import numpy as np
+import zonal_engine
+import run_manifest
 
 warnings.filterwarnings("ignore")
 
@@ -176,93 +180,57 @@ def project_shapefile_gcs_wgs84_fn(albers, geo_df):
     return cgs_df, projected_shape_path
 
 
-def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data, band):
+def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data, num_bands, executor=None,
+                         workers=1):
     """
-    Derive zonal stats for a list of Landsat imagery.
+    Derive zonal stats for all bands of a Landsat image using windowed reads (refer to zonal_engine.py).
 
-    @param image_s: string object containing the file path to the current max_temp tiff.
+    @param image_s: string object containing the file path to the current dbi tiff.
     @param projected_shape_path: string object containing the path to the current 1ha shapefile path.
     @param uid: ODK 1ha dataframe feature (unique numeric identifier)
-    @return final_results: list object containing the specified zonal statistic values.
+    @param num_bands: list object containing the band numbers to extract (i.e. [1, 2, 3, 4, 5, 6]).
+    @param executor: ProcessPoolExecutor object or None (refer to zonal_engine.worker_pool_fn).
+    @param workers: integer object containing the number of worker processes.
+    @return band_results: dictionary object containing the final results list for each band.
     """
 
     # create empty lists to append values
-    zone_stats = []
     list_site = []
     list_uid = []
-    list_band = []
 
-    with rasterio.open(image_s, nodata=no_data) as srci:
+    with fiona.open(projected_shape_path) as src:
 
-        affine = srci.transform
-        array = srci.read(band)
+        # using "all_touched=True" will increase the number of pixels used to produce the stats "False" reduces
+        # the number; all bands are read from each site window in a single read.
+        zs_bands = zonal_engine.extract_image_fn(
+            image_s, src, num_bands, no_data,
+            stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50',
+                   'percentile_75', 'percentile_95', 'percentile_99', 'range'], executor=executor, workers=workers)
 
-        # remove 100 from all values
-        # array = array - 100
+        for i in src:
+            # extract shapefile records
+            table_attributes = i['properties']
 
-        with fiona.open(projected_shape_path) as src:
+            uid_ = table_attributes[uid]
+            list_uid.append([uid_])
 
-            zs = zonal_stats(src, array, affine=affine, nodata=no_data,
-                             stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50',
-                                    'percentile_75', 'percentile_95', 'percentile_99', 'range'], all_touched=True)
+            site = table_attributes['site_name']
+            list_site.append([site])
 
-            print(zs)
-            # using "all_touched=True" will increase the number of pixels used to produce the stats "False" reduces
-            # the number extract the image name from the opened file from the input file read in by rasterio
-
-            path_, im_name = os.path.split(image_s)
-            print("path_: ", path_)
-            print("im_name: ", im_name)
-
-            image_name_split = im_name.split("_")
-
-            if str(image_name_split[-2]).startswith("m"):
-                print("seasonal")
-                im_date = image_name_split[-2]
-            else:
-                print("single date")
-                im_date = image_name_split[-2]
-
-            print("im_date: ", im_date)
-
-            for zone in zs:
-                bands = 'b' + str(band)
-                list_band.append(bands)
-
-                # extract 'values' as a tuple from a dictionary
-                keys, values = zip(*zone.items())
-                # convert tuple to a list and append to zone_stats
-                result = list(values)
-                print("Results: ", result)
-                zone_stats.append(result)
-
-            for i in src:
-                # extract shapefile records
-                table_attributes = i['properties']
-
-                uid_ = table_attributes[uid]
-                details = [uid_]
-                list_uid.append(details)
-
-                site = table_attributes['site_name']
-                site_ = [site]
-                # print("site_: ", site)
-                list_site.append(site_)
-
-                # join the elements in each of the lists row by row
-            final_results = [list_uid + list_site + zone_stats for
-                             list_uid, list_site, zone_stats in
-                             zip(list_uid, list_site, zone_stats)]
+    band_results = {}
+    for band in num_bands:
+        zone_stats = []
+        for zone in zs_bands[band]:
+            # extract 'values' as a tuple from a dictionary
+            keys, values = zip(*zone.items())
+            # convert tuple to a list and append to zone_stats
+            zone_stats.append(list(values))
 
-            print("final_results: ", final_results)
-            # close the vector and raster file
-            src.close()
-            srci.close()
+        # join the elements in each of the lists row by row
+        band_results[band] = [uid_ + site_ + zone for uid_, site_, zone in zip(list_uid, list_site, zone_stats)]
 
-        print("final results:", final_results)
-        print("list_site: ", list_site)
-        print("str(site_[0]): ", str(site_[0]))
-        return final_results, str(site_[0])
+    print("final results:", band_results)
+    return band_results
 
 
 #
@@ -307,103 +275,14 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
 #     return output_max_temp
 
 
-def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_data):
-    """ Calculate the zonal statistics for each 1ha site per QLD monthly max_temp image (single band).
-    Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
-
-    export_dir_path, zonal_stats_ready_dir, fpc_output_zonal_stats, fpc_complete_tile, i, csv_file, temp_dir_path, qld_dict"""
-
-    print("Mosaic dbi zonal stats beginning.........")
-    print("no_data: ", no_data, " - should be 0")
-
-    uid = 'uid'
-    output_list = []
-    print("variable: ", variable)
-
-    albers_dir = os.path.join(temp_dir_path, "albers")
-    print("albers Dir: ", albers_dir)
-
-    # # define the GCSWGS84 directory pathway
-    # gcs_wgs84_dir = (temp_dir_path + '\\gcs_wgs84')
-    #
-    # define the max_tempOutput directory pathway
-    output_dir = (os.path.join(export_dir_path, "{0}_zonal_stats".format(variable)))
+def clean_zonal_stats_fn(output_zonal_stats):
+    """ Rename, clean and reshape the band concatenated zonal stats (all sites, or a single site when spilled to disk).
 
-    # call the project_shapefile_gcs_wgs84_fn function
-    cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+    @param output_zonal_stats: dataframe object containing the dbi band csv files concatenated side by side.
+    @return output_zonal_stats: dataframe object containing the cleaned dbi zonal stats.
+    """
 
     num_bands = [1, 2, 3, 4, 5, 6]
-    # create temporary folders
-    dbi_temp_dir_bands = os.path.join(temp_dir_path, 'dbi_temp_individual_bands')
-    os.makedirs(dbi_temp_dir_bands)
-
-    for i in num_bands:
-        band_dir = os.path.join(dbi_temp_dir_bands, 'band{0}'.format(str(i)))
-        os.makedirs(band_dir)
-
-    for band in num_bands:
-        print("working on band: ", str(band))
-
-        # open the list of imagery and read it into memory and call the apply_zonal_stats_fn function
-        with open(csv_file, 'r') as imagery_list:
-
-            # loop through the list of imagery and input the image into the raster zonal_stats function
-            for image in imagery_list:
-                print('image: ', image)
-
-                image_s = image.rstrip()
-                # print("image_s: ", image_s)
-                path_, im_name = os.path.split(image_s)
-
-                # print("im_name_s: ", im_name_s)
-                # print('Image name: ', im_name)
-
-                image_name_split = im_name.split("_")
-
-                if str(image_name_split[-2]).startswith("m"):
-                    print("seasonal")
-                    im_date = image_name_split[-2]
-                else:
-                    print("single date")
-                    im_date = image_name_split[-2]
-
-                # loops through each image
-                with rasterio.open(image_s, nodata=no_data) as srci:
-                    image_results = 'image_' + im_name + '.csv'
-
-                    final_results, site = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable,
-                                                               no_data, band)
-
-                    header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_min',
-                              "b" + str(band) + '_max', "b" + str(band) + '_mean', "b" + str(band) + '_count',
-                              "b" + str(band) + '_std', "b" + str(band) + '_median', "b" + str(band) + '_range',
-                              "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
-                              "b" + str(band) + '_p95', "b" + str(band) + '_p99']
-
-                    df = pd.DataFrame.from_records(final_results, columns=header)
-
-                    df['band'] = band
-                    df['image'] = im_name
-                    df['date'] = str(im_date)
-                    df.to_csv(os.path.join(dbi_temp_dir_bands, "band{0}".format(str(band)), image_results), index=False)
-                    # df.to_csv(dbi_temp_dir_bands + '//band' + str(band) + '//' + image_results, index=False)
-
-                    print("exported to: ", os.path.join(dbi_temp_dir_bands, "band{0}".format(str(band)), image_results))
-
-    print("concat values in temp")
-    for x in num_bands:
-        location_output = dbi_temp_dir_bands + '//band' + str(x)
-        band_files = glob(os.path.join(location_output,
-                                       '*.csv'))
-
-        # advisable to use os.path.join as this makes concatenation OS independent
-        df_from_each_band_file = (pd.read_csv(f) for f in band_files)
-        concat_band_df = pd.concat(df_from_each_band_file, ignore_index=False, axis=0, sort=False)
-        # export the band specific results to a csv file (i.e. three outputs)
-        print("output csv to: ", dbi_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
-        concat_band_df.to_csv(dbi_temp_dir_bands + '//' + 'Band' + str(x) + '.csv', index=False)
-
-    # ----------------------------------------- Concatenate three bands together ---------------------------------------
 
     # Concatenate Three bands
     # header_all = ['uid', 'site', 'b1_dbi_count', 'b1_dbi_min', 'b1_dbi_max', 'b1_dbi_mean',
@@ -458,16 +337,6 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
                   'b6_dbi_p95', 'b6_dbi_p99', 'band3', 'image3', 'date3'
                   ]
 
-    all_files = glob(os.path.join(dbi_temp_dir_bands,
-                                  '*.csv'))
-    # advisable to use os.path.join as this makes concatenation OS independent
-    df_from_each_file = (pd.read_csv(f) for f in all_files)
-    output_zonal_stats = pd.concat(df_from_each_file, ignore_index=False, axis=1, sort=False)
-    print("-" * 50)
-    print(output_zonal_stats.shape)
-    print(output_zonal_stats.columns)
-    # output_zonal_stats.to_csv(
-    #     r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\six_band_test.csv")
     output_zonal_stats.columns = header_all
     # output_zonal_stats.to_csv(
     #     r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\six_band_test2.csv")
@@ -501,37 +370,112 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
          'b6_dbi_std', 'b6_dbi_p25', 'b6_dbi_p50', 'b6_dbi_p75', 'b6_dbi_p95', 'b6_dbi_p99', 'b6_dbi_range',
          ]]
 
-    # uid_list = output_zonal_stats.uid.unique().tolist()
-    # print("length of uid list: ", len(uid_list))
-    # if len(uid_list) >= 1:
-    #     for i in uid_list:
-    #         out_df = output_zonal_stats[output_zonal_stats['uid'] == i]
+    return output_zonal_stats
+
+
+def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_data, workers=1):
+    """ Calculate the zonal statistics for each 1ha site per QLD monthly max_temp image (single band).
+    Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
+
+    export_dir_path, zonal_stats_ready_dir, fpc_output_zonal_stats, fpc_complete_tile, i, csv_file, temp_dir_path, qld_dict"""
+
+    print("Mosaic dbi zonal stats beginning.........")
+    print("no_data: ", no_data, " - should be 0")
+
+    uid = 'uid'
+    output_list = []
+    print("variable: ", variable)
+
+    albers_dir = os.path.join(temp_dir_path, "albers")
+    print("albers Dir: ", albers_dir)
+
+    # # define the GCSWGS84 directory pathway
+    # gcs_wgs84_dir = (temp_dir_path + '\\gcs_wgs84')
     #
-    #         out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-    #                                 "{0}_dbi_zonal_stats.csv".format(str(i)))
-    #         print("export to: ", out_path)
-    #         # export the pandas df to a csv file
-    #         out_df.to_csv(out_path, index=False)
-
-    site_list = output_zonal_stats.site.unique().tolist()
-    print("length of site list: ", len(site_list))
-    if len(site_list) >= 1:
-        for i in site_list:
-            out_df = output_zonal_stats[output_zonal_stats['site'] == i]
-
-            out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                    "{0}_dbi_zonal_stats.csv".format(str(i)))
-            print("export to: ", out_path)
-            # export the pandas df to a csv file
-            out_df.to_csv(out_path, index=False)
-
-
-    else:
-        out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                "{0}_dbi_zonal_stats.csv".format(str(site_list[0])))
-        print("export to: ", out_path)
-        # export the pandas df to a csv file
-        output_zonal_stats.to_csv(out_path, index=False)
+    # define the max_tempOutput directory pathway
+    output_dir = (os.path.join(export_dir_path, "{0}_zonal_stats".format(variable)))
+
+    # call the project_shapefile_gcs_wgs84_fn function
+    cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+
+    num_bands = [1, 2, 3, 4, 5, 6]
+    # create temporary folders
+    dbi_temp_dir_bands = os.path.join(temp_dir_path, 'dbi_temp_individual_bands')
+    os.makedirs(dbi_temp_dir_bands, exist_ok=True)
+
+    for i in num_bands:
+        band_dir = os.path.join(dbi_temp_dir_bands, 'band{0}'.format(str(i)))
+        os.makedirs(band_dir, exist_ok=True)
+
+    # create the worker pool once for all images (None when running in a single process)
+    executor = zonal_engine.worker_pool_fn(workers)
+
+    try:
+        # loop through the list of imagery (staged on local disk when --stage_dir is set) and input the
+        # image into the raster zonal_stats function
+        for image_s in mosaic_staging.staged_images_fn(csv_file, variable):
+            print('image: ', image_s)
+
+            path_, im_name = os.path.split(image_s)
+
+            image_name_split = im_name.split("_")
+
+            if str(image_name_split[-2]).startswith("m"):
+                print("seasonal")
+                im_date = image_name_split[-2]
+            else:
+                print("single date")
+                im_date = image_name_split[-2]
+
+            image_results = 'image_' + im_name + '.csv'
+
+            band_results = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
+                                                num_bands, executor, workers)
+            image_outputs = []
+
+            for band in num_bands:
+                header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_min',
+                          "b" + str(band) + '_max', "b" + str(band) + '_mean', "b" + str(band) + '_count',
+                          "b" + str(band) + '_std', "b" + str(band) + '_median', "b" + str(band) + '_range',
+                          "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
+                          "b" + str(band) + '_p95', "b" + str(band) + '_p99']
+
+                df = pd.DataFrame.from_records(band_results[band], columns=header)
+
+                df['band'] = band
+                df['image'] = im_name
+                df['date'] = str(im_date)
+                df.to_csv(os.path.join(dbi_temp_dir_bands, "band{0}".format(str(band)), image_results),
+                          index=False)
+
+                print("exported to: ", os.path.join(dbi_temp_dir_bands, "band{0}".format(str(band)),
+                                                    image_results))
+                image_outputs.append(os.path.join(dbi_temp_dir_bands, "band{0}".format(str(band)), image_results))
+
+            run_manifest.record_image_fn(variable, image_s, image_outputs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("concat values in temp")
+    for x in num_bands:
+        location_output = dbi_temp_dir_bands + '//band' + str(x)
+        band_files = sorted(glob(os.path.join(location_output,
+                                              '*.csv')))
+
+        # export the band specific results to a csv file (i.e. three outputs), one image at a time when the
+        # results would exceed the memory budget (refer to memory_budget.py)
+        print("output csv to: ", dbi_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
+        memory_budget.concat_csv_fn(band_files, dbi_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
+
+    # ----------------------------------------- Concatenate three bands together ---------------------------------------
+
+    all_files = [os.path.join(dbi_temp_dir_bands, 'Band{0}.csv'.format(str(x))) for x in num_bands]
+
+    # concatenate the bands side by side, clean (refer to clean_zonal_stats_fn) and export a csv per site - the
+    # results are spilled to disk by site when they would exceed the memory budget (refer to memory_budget.py)
+    memory_budget.export_by_site_fn(all_files, clean_zonal_stats_fn, output_dir, "{0}_dbi_zonal_stats.csv",
+                                    os.path.join(temp_dir_path, 'dbi_temp_spill'), site_column='b1_site', axis=1)
 
     # ----------------------------------------------- Delete temporary files -------------------------------------------
     # remove the temp dir and single band csv files
@@ -6,6 +6,10 @@ import rasterio
 import pandas as pd
 from rasterstats import zonal_stats
 import geopandas as gpd
+import mosaic_staging
+import memory_budget
+import zonal_engine
+import run_manifest
 import warnings
 import os
 from glob import glob
@@ -192,17 +196,16 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
 
     with rasterio.open(image_s, nodata=no_data) as srci:
 
-        affine = srci.transform
-        array = srci.read(band)
-
         # remove 100 from all values
         # array = array - 100
 
         with fiona.open(projected_shape_path) as src:
 
-            zs = zonal_stats(src, array, affine=affine, nodata=no_data,
-                             stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50',
-                                    'percentile_75', 'percentile_95', 'percentile_99', 'range'], all_touched=True)
+            # windowed reads of each site (refer to zonal_engine.py), batched to the memory budget
+            zs = zonal_engine.extract_image_fn(srci, src, [band], no_data,
+                                               stats=['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25',
+                                                      'percentile_50', 'percentile_75', 'percentile_95',
+                                                      'percentile_99', 'range'])[band]
 
             print("ZS: ", zs)
             # using "all_touched=True" will increase the number of pixels used to produce the stats "False" reduces
@@ -319,109 +322,14 @@ def apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable, no_data,
 #     return output
 
 
-def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_data):
-    """ Calculate the zonal statistics for each 1ha site per QLD monthly max_temp image (single band).
-    Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
-
-    export_dir_path, zonal_stats_ready_dir, fpc_output_zonal_stats, fpc_complete_tile, i, csv_file, temp_dir_path, qld_dict"""
+def clean_zonal_stats_fn(output_zonal_stats):
+    """ Rename, clean and reshape the band concatenated zonal stats (all sites, or a single site when spilled to disk).
 
-    print("Mosaic DIM zonal stats beginning.........")
-    print("no_data: ", no_data)
-
-    uid = 'uid'
-    output_list = []
-    print("variable: ", variable)
-
-    albers_dir = os.path.join(temp_dir_path, "albers")
-    print("albers Dir: ", albers_dir)
-
-    # # define the GCSWGS84 directory pathway
-    # gcs_wgs84_dir = (temp_dir_path + '\\gcs_wgs84')
-    #
-    # define the max_tempOutput directory pathway
-    output_dir = (os.path.join(export_dir_path, "{0}_zonal_stats".format(variable)))
-
-    # call the project_shapefile_gcs_wgs84_fn function
-    cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+    @param output_zonal_stats: dataframe object containing the dim band csv files concatenated side by side.
+    @return output_zonal_stats: dataframe object containing the cleaned dim zonal stats.
+    """
 
     num_bands = [1, 2, 3]
-    # create temporary folders
-    dim_temp_dir_bands = os.path.join(temp_dir_path, 'dim_temp_individual_bands')
-    os.makedirs(dim_temp_dir_bands)
-
-    for i in num_bands:
-        band_dir = os.path.join(dim_temp_dir_bands, 'band{0}'.format(str(i)))
-        os.makedirs(band_dir)
-
-    for band in num_bands:
-        print("working on band: ", str(band))
-
-        # open the list of imagery and read it into memory and call the apply_zonal_stats_fn function
-        with open(csv_file, 'r') as imagery_list:
-
-            # loop through the list of imagery and input the image into the raster zonal_stats function
-            for image in imagery_list:
-                print('image: ', image)
-
-                image_s = image.rstrip()
-                # print("image_s: ", image_s)
-                path_, im_name = os.path.split(image_s)
-
-                # print("im_name_s: ", im_name_s)
-                # print('Image name: ', im_name)
-
-                image_name_split = im_name.split("_")
-
-                if str(image_name_split[-2]).startswith("m"):
-                    print("seasonal")
-                    im_date = image_name_split[-2]
-                else:
-                    print("single date")
-                    im_date = image_name_split[-2]
-
-                # loops through each image
-                with rasterio.open(image_s, nodata=no_data) as srci:
-                    image_results = 'image_' + im_name + '.csv'
-
-                    final_results, site = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable,
-                                                               no_data, band)
-
-                    # header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_count',
-                    #           "b" + str(band) + '_min', "b" + str(band) + '_max',
-                    #           "b" + str(band) + '_mean', "b" + str(band) + '_median', "b" + str(band) + '_std',
-                    #           "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
-                    #           "b" + str(band) + '_p95', "b" + str(band) + '_p99', "b" + str(band) + '_range']
-                    #
-                    header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_min',
-                              "b" + str(band) + '_max', "b" + str(band) + '_mean', "b" + str(band) + '_count',
-                              "b" + str(band) + '_std', "b" + str(band) + '_median', "b" + str(band) + '_range',
-                              "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
-                              "b" + str(band) + '_p95', "b" + str(band) + '_p99']
-
-                    df = pd.DataFrame.from_records(final_results, columns=header)
-
-                    df['band'] = band
-                    df['image'] = im_name
-                    df['date'] = str(im_date)
-                    df.to_csv(os.path.join(dim_temp_dir_bands, "band{0}".format(str(band)), image_results), index=False)
-                    # df.to_csv(dim_temp_dir_bands + '//band' + str(band) + '//' + image_results, index=False)
-
-                    print("exported to: ", os.path.join(dim_temp_dir_bands, "band{0}".format(str(band)), image_results))
-
-    print("concat values in temp")
-    for x in num_bands:
-        location_output = dim_temp_dir_bands + '//band' + str(x)
-        band_files = glob(os.path.join(location_output,
-                                       '*.csv'))
-
-        # advisable to use os.path.join as this makes concatenation OS independent
-        df_from_each_band_file = (pd.read_csv(f) for f in band_files)
-        concat_band_df = pd.concat(df_from_each_band_file, ignore_index=False, axis=0, sort=False)
-        # export the band specific results to a csv file (i.e. three outputs)
-        print("output csv to: ", dim_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
-        concat_band_df.to_csv(dim_temp_dir_bands + '//' + 'Band' + str(x) + '.csv', index=False)
-
-    # ----------------------------------------- Concatenate three bands together ---------------------------------------
 
     # Concatenate Three bands
 
@@ -449,16 +357,6 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
                   'b3_dim_count', 'b3_dim_std', 'b3_dim_med', 'b3_dim_range', 'b3_dim_p25', 'b3_dim_p50', 'b3_dim_p75',
                   'b3_dim_p95', 'b3_dim_p99', 'band3', 'image3', 'date3']
 
-    all_files = glob(os.path.join(dim_temp_dir_bands,
-                                  '*.csv'))
-    # advisable to use os.path.join as this makes concatenation OS independent
-    df_from_each_file = (pd.read_csv(f) for f in all_files)
-    output_zonal_stats = pd.concat(df_from_each_file, ignore_index=False, axis=1, sort=False)
-    print("-" * 50)
-    print(output_zonal_stats.shape)
-    print(output_zonal_stats.columns)
-    # output_zonal_stats.to_csv(
-    #     r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\three_band_test.csv")
     output_zonal_stats.columns = header_all
     # output_zonal_stats.to_csv(
     #     r"Z:\Scratch\Zonal_Stats_Pipeline\non_rmb_fractional_cover_zonal_stats\three_band_test2.csv")
@@ -483,47 +381,117 @@ def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_
          'b3_dim_std', 'b3_dim_p25', 'b3_dim_p50', 'b3_dim_p75', 'b3_dim_p95', 'b3_dim_p99', 'b3_dim_range',
          ]]
 
-    # uid_list = output_zonal_stats.uid.unique().tolist()
-    # print("length of uid list: ", len(uid_list))
-    # if len(uid_list) >= 1:
-    #     for i in uid_list:
-    #         out_df = output_zonal_stats[output_zonal_stats['uid'] == i]
-    #
-    #         out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-    #                                 "{0}_dim_zonal_stats.csv".format(str(i)))
-    #         print("export to: ", out_path)
-    #         # export the pandas df to a csv file
-    #         out_df.to_csv(out_path, index=False)
-    #
+    return output_zonal_stats
+
+
+def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, no_data):
+    """ Calculate the zonal statistics for each 1ha site per QLD monthly max_temp image (single band).
+    Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
+
+    export_dir_path, zonal_stats_ready_dir, fpc_output_zonal_stats, fpc_complete_tile, i, csv_file, temp_dir_path, qld_dict"""
+
+    print("Mosaic DIM zonal stats beginning.........")
+    print("no_data: ", no_data)
+
+    uid = 'uid'
+    output_list = []
+    print("variable: ", variable)
+
+    albers_dir = os.path.join(temp_dir_path, "albers")
+    print("albers Dir: ", albers_dir)
+
+    # # define the GCSWGS84 directory pathway
+    # gcs_wgs84_dir = (temp_dir_path + '\\gcs_wgs84')
     #
-    # else:
-    #     out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-    #                             "{0}_dim_zonal_stats.csv".format(str(uid_list[0])))
-    #     print("export to: ", out_path)
-    #     # export the pandas df to a csv file
-    #     output_zonal_stats.to_csv(out_path, index=False)
-
-
-    site_list = output_zonal_stats.site.unique().tolist()
-    print("length of site list: ", len(site_list))
-    if len(site_list) >= 1:
-        for i in site_list:
-            out_df = output_zonal_stats[output_zonal_stats['site'] == i]
-
-            out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                    "{0}_dim_zonal_stats.csv".format(str(i)))
-            print("export to: ", out_path)
-            # export the pandas df to a csv file
-            out_df.to_csv(out_path, index=False)
-
-
-    else:
-        out_path = os.path.join(export_dir_path, "{0}_zonal_stats".format(variable),
-                                "{0}_dim_zonal_stats.csv".format(str(site_list[0])))
-        print("export to: ", out_path)
-        # export the pandas df to a csv file
-        output_zonal_stats.to_csv(out_path, index=False)
+    # define the max_tempOutput directory pathway
+    output_dir = (os.path.join(export_dir_path, "{0}_zonal_stats".format(variable)))
+
+    # call the project_shapefile_gcs_wgs84_fn function
+    cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+
+    num_bands = [1, 2, 3]
+    # create temporary folders
+    dim_temp_dir_bands = os.path.join(temp_dir_path, 'dim_temp_individual_bands')
+    os.makedirs(dim_temp_dir_bands, exist_ok=True)
+
+    for i in num_bands:
+        band_dir = os.path.join(dim_temp_dir_bands, 'band{0}'.format(str(i)))
+        os.makedirs(band_dir, exist_ok=True)
+
+    for band in num_bands:
+        print("working on band: ", str(band))
+
+        # loop through the list of imagery (staged on local disk when --stage_dir is set) and input the
+        # image into the raster zonal_stats function
+        for image_s in mosaic_staging.staged_images_fn(csv_file, '{0}_band{1}'.format(variable, band)):
+            print('image: ', image_s)
+
+            # print("image_s: ", image_s)
+            path_, im_name = os.path.split(image_s)
+
+            # print("im_name_s: ", im_name_s)
+            # print('Image name: ', im_name)
+
+            image_name_split = im_name.split("_")
+
+            if str(image_name_split[-2]).startswith("m"):
+                print("seasonal")
+                im_date = image_name_split[-2]
+            else:
+                print("single date")
+                im_date = image_name_split[-2]
+
+            # loops through each image
+            with rasterio.open(image_s, nodata=no_data) as srci:
+                image_results = 'image_' + im_name + '.csv'
+
+                final_results, site = apply_zonal_stats_fn(image_s, projected_shape_path, uid, variable,
+                                                           no_data, band)
+
+                # header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_count',
+                #           "b" + str(band) + '_min', "b" + str(band) + '_max',
+                #           "b" + str(band) + '_mean', "b" + str(band) + '_median', "b" + str(band) + '_std',
+                #           "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
+                #           "b" + str(band) + '_p95', "b" + str(band) + '_p99', "b" + str(band) + '_range']
+                #
+                header = ["b" + str(band) + '_uid', "b" + str(band) + '_site', "b" + str(band) + '_min',
+                          "b" + str(band) + '_max', "b" + str(band) + '_mean', "b" + str(band) + '_count',
+                          "b" + str(band) + '_std', "b" + str(band) + '_median', "b" + str(band) + '_range',
+                          "b" + str(band) + '_p25', "b" + str(band) + '_p50', "b" + str(band) + '_p75',
+                          "b" + str(band) + '_p95', "b" + str(band) + '_p99']
+
+                df = pd.DataFrame.from_records(final_results, columns=header)
+
+                df['band'] = band
+                df['image'] = im_name
+                df['date'] = str(im_date)
+                df.to_csv(os.path.join(dim_temp_dir_bands, "band{0}".format(str(band)), image_results), index=False)
+                # df.to_csv(dim_temp_dir_bands + '//band' + str(band) + '//' + image_results, index=False)
+
+                print("exported to: ", os.path.join(dim_temp_dir_bands, "band{0}".format(str(band)), image_results))
+                run_manifest.record_image_fn('{0}_band{1}'.format(variable, band), image_s,
+                                             [os.path.join(dim_temp_dir_bands, "band{0}".format(str(band)),
+                                                           image_results)])
+
+    print("concat values in temp")
+    for x in num_bands:
+        location_output = dim_temp_dir_bands + '//band' + str(x)
+        band_files = sorted(glob(os.path.join(location_output,
+                                              '*.csv')))
+
+        # export the band specific results to a csv file (i.e. three outputs), one image at a time when the
+        # results would exceed the memory budget (refer to memory_budget.py)
+        print("output csv to: ", dim_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
+        memory_budget.concat_csv_fn(band_files, dim_temp_dir_bands + '//' + 'Band' + str(x) + '.csv')
+
+    # ----------------------------------------- Concatenate three bands together ---------------------------------------
+
+    all_files = [os.path.join(dim_temp_dir_bands, 'Band{0}.csv'.format(str(x))) for x in num_bands]
 
+    # concatenate the bands side by side, clean (refer to clean_zonal_stats_fn) and export a csv per site - the
+    # results are spilled to disk by site when they would exceed the memory budget (refer to memory_budget.py)
+    memory_budget.export_by_site_fn(all_files, clean_zonal_stats_fn, output_dir, "{0}_dim_zonal_stats.csv",
+                                    os.path.join(temp_dir_path, 'dim_temp_spill'), site_column='b1_site', axis=1)
 
     # ----------------------------------------------- Delete temporary files -------------------------------------------
     # remove the temp dir and single band csv files
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+"""
+benchmark_gate.py
+=================
+
+Description: This script is a performance regression gate. It runs the benchmark suite (benchmark_suite.py) several
+times on synthetic data and compares the run against the baseline stored in the repository
+(assets/benchmark/benchmark_baseline.json). The script exits with status 1 and prints a readable diff when:
+
+ - Throughput: the median throughput (sites x images per second) of a benchmark case drops by more than the allowed
+   tolerance. The tolerance is noise aware: the larger of --tolerance and --noise_factor times the relative spread
+   (median absolute deviation / median) of the runs of the case in the baseline or the new run. Cases shorter than
+   MIN_GATE_SECONDS are reported but not gated (timer noise).
+ - Memory: the median peak RSS of a benchmark case grows by more than the larger of --memory_tolerance and
+   --memory_slack_mb.
+ - Outputs: the zonal statistics csv files of a product differ from the baseline (file count, rows, column totals or
+   content digest). Line endings are ignored so a baseline can be checked on another operating system.
+
+The baseline records the benchmark configuration (sites, images, extent, products and workers) and the new run uses
+the same configuration. Timings are only comparable on the same workstation; the baseline records the workstation and
+a warning is printed when it differs (the memory and output checks still apply). Record a new baseline with --update
+after an intended change in performance or outputs and commit the baseline file.
+
+Commands:
+
+    python benchmark_gate.py -o D:\\benchmark_gate            (compare against the baseline)
+    python benchmark_gate.py -o D:\\benchmark_gate --update   (record the baseline)
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import benchmark_suite
+import product_registry
+import warnings
+
+warnings.filterwarnings("ignore")
+
+BASELINE_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'benchmark',
+                                             'benchmark_baseline.json'))
+
+# benchmark configuration recorded with a new baseline
+DEFAULT_CONFIG = {'sites': [500], 'images': 2, 'scale': 0.01, 'products': None, 'workers': 1, 'stack_depth': None,
+                  'fuse': False, 'repeat': 3}
+
+# cases faster than this (median seconds) are reported but not gated
+MIN_GATE_SECONDS = 0.05
+
+# relative tolerance of the column totals of the output check
+OUTPUT_TOLERANCE = 1e-9
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Compare the benchmark suite against the stored baseline and fail on a regression.''')
+
+    p.add_argument('-o', '--output_dir', help='The directory for the synthetic data and benchmark outputs.')
+
+    p.add_argument('-b', '--baseline', help='The baseline file (default: assets/benchmark/benchmark_baseline.json)',
+                   default=BASELINE_PATH)
+
+    p.add_argument('-u', '--update', action='store_true', help='Record a new baseline from this run.')
+
+    p.add_argument('-n', '--runs', type=int, help='Enter the number of runs of the benchmark suite (i.e. 3)',
+                   default=3)
+
+    p.add_argument('--tolerance', type=float, help='Enter the minimum allowed throughput drop (i.e. 0.1 = 10%%)',
+                   default=0.10)
+
+    p.add_argument('--noise_factor', type=float,
+                   help='Enter the multiple of the relative run to run spread added to the allowed drop (i.e. 3)',
+                   default=3.0)
+
+    p.add_argument('--memory_tolerance', type=float, help='Enter the allowed peak RSS growth (i.e. 0.1 = 10%%)',
+                   default=0.10)
+
+    p.add_argument('--memory_slack_mb', type=float, help='Enter the allowed peak RSS growth in MB (i.e. 32)',
+                   default=32.0)
+
+    p.add_argument('-v', '--verbose', action='store_true', help='Show the pipeline output (optional)')
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.output_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def case_key_fn(result):
+    """ Return the key of a benchmark case (i.e. 'end_to_end dbi 500'). """
+
+    return '{0} {1} {2}'.format(result['benchmark'], result['product'], result['sites'])
+
+
+def spread_fn(values):
+    """ Return the relative spread of a list of values (median absolute deviation / median). """
+
+    median = float(np.median(values))
+    if median == 0:
+        return 0.0
+
+    return float(np.median(np.abs(np.asarray(values) - median))) / median
+
+
+def summarise_runs_fn(runs):
+    """ Summarise the results of several runs of the benchmark suite by case.
+
+    @param runs: list object containing the result list of each run (refer to benchmark_suite.result_fn).
+    @return cases: dictionary object containing the median seconds, throughput and peak RSS and the throughput
+    spread of each case.
+    """
+
+    grouped = OrderedDict()
+    for results in runs:
+        for result in results:
+            grouped.setdefault(case_key_fn(result), []).append(result)
+
+    cases = OrderedDict()
+    for key, results in grouped.items():
+        throughput = [result['site_images_per_second'] for result in results if result['site_images_per_second']]
+        peak_rss = [result['peak_rss_mb'] for result in results if result['peak_rss_mb'] is not None]
+        cases[key] = {'seconds': round(float(np.median([result['seconds'] for result in results])), 4),
+                      'site_images_per_second': round(float(np.median(throughput)), 1) if throughput else None,
+                      'spread': round(spread_fn(throughput), 4) if throughput else None,
+                      'peak_rss_mb': round(float(np.median(peak_rss)), 1) if peak_rss else None,
+                      'runs': [result['site_images_per_second'] for result in results]}
+
+    return cases
+
+
+def output_summary_fn(export_dir_path, products):
+    """ Summarise the zonal statistics csv files of each product (file count, rows, column totals and digest).
+
+    @param export_dir_path: string object containing the path to the export directory of an end to end run.
+    @param products: list object containing the product names.
+    @return outputs: dictionary object containing the summary of each product.
+    """
+
+    outputs = OrderedDict()
+    for name in products:
+        csv_files = sorted(glob.glob(os.path.join(export_dir_path, '{0}_zonal_stats'.format(name), '*.csv')))
+        digest = hashlib.sha1()
+        frames = []
+        for csv_file in csv_files:
+            digest.update(os.path.basename(csv_file).encode('utf-8'))
+            with open(csv_file, 'rb') as f:
+                digest.update(f.read().replace(b'\r\n', b'\n'))
+            frames.append(pd.read_csv(csv_file, float_precision='round_trip'))
+
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        columns = OrderedDict()
+        for column in df.select_dtypes(include=[np.number]).columns:
+            columns[column] = [float('{0:.12g}'.format(df[column].sum())), int(df[column].isnull().sum())]
+
+        outputs[name] = {'files': len(csv_files), 'rows': len(df), 'digest': digest.hexdigest(), 'columns': columns}
+
+    return outputs
+
+
+def compare_cases_fn(baseline_cases, cases, cmd_args):
+    """ Compare the throughput and peak RSS of each case against the baseline.
+
+    @param baseline_cases: dictionary object containing the baseline cases (refer to summarise_runs_fn).
+    @param cases: dictionary object containing the cases of the new run.
+    @param cmd_args: command arguments (tolerances).
+    @return failures: list object containing a line per regression.
+    @return notes: list object containing a line per improvement, ungated or missing case.
+    """
+
+    failures = []
+    notes = []
+    for key, base in baseline_cases.items():
+        new = cases.get(key)
+        if new is None:
+            notes.append('MISSING     {0}: not run'.format(key))
+            continue
+
+        if base['site_images_per_second'] and new['site_images_per_second']:
+            change = new['site_images_per_second'] / base['site_images_per_second'] - 1
+            allowed = max(cmd_args.tolerance, cmd_args.noise_factor * max(base['spread'], new['spread']))
+            line = '{0}: {1} -> {2} sites x images / s ({3:+.1%}, allowed -{4:.1%})'.format(
+                key, base['site_images_per_second'], new['site_images_per_second'], change, allowed)
+            if base['seconds'] < MIN_GATE_SECONDS:
+                notes.append('NOT GATED   ' + line + ' - shorter than {0} s'.format(MIN_GATE_SECONDS))
+            elif change < -allowed:
+                failures.append('THROUGHPUT  ' + line)
+            elif change > allowed:
+                notes.append('FASTER      ' + line)
+
+        if base['peak_rss_mb'] is not None and new['peak_rss_mb'] is not None:
+            growth = new['peak_rss_mb'] - base['peak_rss_mb']
+            allowed_mb = max(cmd_args.memory_tolerance * base['peak_rss_mb'], cmd_args.memory_slack_mb)
+            if growth > allowed_mb:
+                failures.append('MEMORY      {0}: peak RSS {1} -> {2} MB ({3:+.1f} MB, allowed +{4:.1f} MB)'.format(
+                    key, base['peak_rss_mb'], new['peak_rss_mb'], growth, allowed_mb))
+
+    for key in cases:
+        if key not in baseline_cases:
+            notes.append('NEW         {0}: not in the baseline'.format(key))
+
+    return failures, notes
+
+
+def compare_outputs_fn(baseline_outputs, outputs):
+    """ Compare the zonal statistics outputs of each product against the baseline.
+
+    @param baseline_outputs: dictionary object containing the baseline output summaries by sites and product.
+    @param outputs: dictionary object containing the output summaries of the new run.
+    @return failures: list object containing a line per difference.
+    """
+
+    failures = []
+    for sites, products in baseline_outputs.items():
+        for name, base in products.items():
+            new = outputs.get(sites, {}).get(name)
+            label = 'OUTPUT      {0} ({1} sites)'.format(name, sites)
+            if new is None:
+                failures.append(label + ': no outputs')
+                continue
+            if new['digest'] == base['digest']:
+                continue
+
+            if (new['files'], new['rows']) != (base['files'], base['rows']):
+                failures.append(label + ': {0} files / {1} rows -> {2} files / {3} rows'.format(
+                    base['files'], base['rows'], new['files'], new['rows']))
+
+            changed = []
+            for column in sorted(set(base['columns']) | set(new['columns'])):
+                if column not in new['columns'] or column not in base['columns']:
+                    changed.append('{0} {1}'.format(column, 'removed' if column in base['columns'] else 'added'))
+                    continue
+                (base_sum, base_nulls), (new_sum, new_nulls) = base['columns'][column], new['columns'][column]
+                if base_nulls != new_nulls or abs(new_sum - base_sum) > OUTPUT_TOLERANCE * max(abs(base_sum), 1):
+                    changed.append('{0} total {1} -> {2}, nulls {3} -> {4}'.format(
+                        column, base_sum, new_sum, base_nulls, new_nulls))
+
+            if changed:
+                failures.append(label + ': values changed\n' + '\n'.join('              ' + line for line in changed))
+            else:
+                failures.append(label + ': csv content changed (column totals are unchanged, i.e. formatting, '
+                                        'row order or the last decimal place)')
+
+    return failures
+
+
+def config_args_fn(config, cmd_args):
+    """ Return the benchmark suite arguments of a benchmark configuration. """
+
+    return argparse.Namespace(output_dir=cmd_args.output_dir, products=config['products'], sites=config['sites'],
+                              images=config['images'], scale=config['scale'], workers=config['workers'],
+                              stack_depth=config['stack_depth'], fuse=config['fuse'], repeat=config['repeat'],
+                              micro_only=False, verbose=cmd_args.verbose)
+
+
+def main_routine():
+    """ Run the benchmark suite and compare it against (or record) the baseline. """
+
+    cmd_args = get_cmd_args_fn()
+
+    baseline = None
+    if not cmd_args.update:
+        if not os.path.isfile(cmd_args.baseline):
+            print('There is no baseline (record one with --update): ', cmd_args.baseline)
+            sys.exit(1)
+        with open(cmd_args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    config = dict(DEFAULT_CONFIG) if baseline is None else baseline['config']
+    products = config['products'] or product_registry.product_names_fn()
+    suite_args = config_args_fn(config, cmd_args)
+
+    runs = []
+    outputs = OrderedDict()
+    for run in range(max(cmd_args.runs, 1)):
+        print('-' * 50)
+        print('Benchmark run ', run + 1, ' of ', cmd_args.runs)
+        runs.append(benchmark_suite.run_benchmarks_fn(suite_args, products))
+        if run == 0:
+            # the outputs are checked once (every run processes the same synthetic data)
+            for n_sites in config['sites']:
+                outputs[str(n_sites)] = output_summary_fn(benchmark_suite.export_dir_fn(cmd_args.output_dir, n_sites),
+                                                          products)
+
+    cases = summarise_runs_fn(runs)
+    print('-' * 50)
+
+    if cmd_args.update:
+        baseline_dir = os.path.dirname(cmd_args.baseline)
+        if not os.path.exists(baseline_dir):
+            os.makedirs(baseline_dir)
+        with open(cmd_args.baseline, 'w') as f:
+            json.dump({'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                       'workstation': benchmark_suite.platform_fn(), 'config': config, 'cases': cases,
+                       'outputs': outputs}, f, indent=1)
+        print('Baseline recorded: ', cmd_args.baseline)
+        return
+
+    if baseline['workstation'] != benchmark_suite.platform_fn():
+        print('WARNING: the baseline was recorded on a different workstation, throughput is not comparable:')
+        print(' - baseline: ', baseline['workstation'])
+        print(' - this run: ', benchmark_suite.platform_fn())
+
+    failures, notes = compare_cases_fn(baseline['cases'], cases, cmd_args)
+    failures.extend(compare_outputs_fn(baseline['outputs'], outputs))
+
+    for line in notes:
+        if cmd_args.verbose or not line.startswith('NOT GATED'):
+            print(line)
+    ungated = len([line for line in notes if line.startswith('NOT GATED')])
+    if ungated:
+        print(ungated, ' cases shorter than ', MIN_GATE_SECONDS, ' seconds were not gated (refer to --verbose)')
+    for line in failures:
+        print(line)
+
+    if failures:
+        print('Performance gate FAILED: ', len(failures), ' regression(s) against ', cmd_args.baseline)
+        sys.exit(1)
+
+    print('Performance gate passed: ', len(cases), ' cases compared against ', cmd_args.baseline)
+
+
+if __name__ == '__main__':
+    main_routine()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+
+"""
+benchmark_suite.py
+==================
+
+Description: This script measures the pipeline on synthetic data (refer to synthetic_data.py) so performance can be
+compared between versions, settings and workstations without the network share mosaics or the field data.
+
+ - End to end: for each product the mosaics are listed (step1_2_list_of_images.py) and the zonal stats step
+   (step1_4_product_zonal_stats.py) is run with the requested workers, stack_depth or fuse settings.
+ - Microbenchmarks: the per row work of the zonal stats step on synthetic zonal statistics - date parsing (image dates
+   and start and end date columns), the image dataframe, the correction (scale, offset and null minimum) and the
+   fan-out of the concatenated results into a csv per site.
+
+Throughput is reported in sites x images per second (site visits multiplied by the number of images of the product,
+the number of rows of zonal statistics produced) together with the peak RSS of each benchmark. The results are printed and written to benchmark_results.json in
+the output directory together with the run report of the end to end runs (refer to run_report.py). The 1ha sites are
+derived from the synthetic csv as step1_3_project_buffer.py derives them, without writing a shapefile per site.
+
+Command (1,000 and 10,000 sites, 4 images per product, 2% of the NT extent):
+
+    python benchmark_suite.py -o D:\\benchmark -n 1000 10000 -i 4 --scale 0.02
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import contextlib
+from datetime import datetime
+from functools import partial
+import numpy as np
+import pandas as pd
+import memory_budget
+import product_registry
+import synthetic_data
+import warnings
+
+warnings.filterwarnings("ignore")
+
+RESULTS_NAME = 'benchmark_results.json'
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Benchmark the zonal stats pipeline on synthetic mosaics and sites.''')
+
+    p.add_argument('-o', '--output_dir', help='The directory for the synthetic data and benchmark outputs.')
+
+    p.add_argument('-p', '--products', nargs='+', help='The products to benchmark (default: every registered product)',
+                   default=None)
+
+    p.add_argument('-n', '--sites', type=int, nargs='+', help='Enter the number of site visits (i.e. 100 10000)',
+                   default=[1000])
+
+    p.add_argument('-i', '--images', type=int, help='Enter the number of images per product (i.e. 4)', default=4)
+
+    p.add_argument('--scale', type=float,
+                   help='Enter the fraction of the NT mosaic width and height to generate (i.e. 0.02)', default=0.02)
+
+    p.add_argument('-w', '--workers', type=int, help='Enter the number of worker processes (i.e. 4)', default=1)
+
+    p.add_argument('-t', '--stack_depth', type=int, help='Enter the time stack depth (optional)', default=None)
+
+    p.add_argument('-f', '--fuse', action='store_true', help='Run the products in a single fused pass (optional)')
+
+    p.add_argument('-r', '--repeat', type=int, help='Enter the number of repeats of each microbenchmark (best '
+                                                     'time is reported)', default=3)
+
+    p.add_argument('--micro_only', action='store_true', help='Run the microbenchmarks only (optional)')
+
+    p.add_argument('-v', '--verbose', action='store_true', help='Show the pipeline output (optional)')
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.output_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    if cmd_args.fuse and cmd_args.stack_depth:
+        print('The fuse and stack_depth arguments cannot be used together.')
+        sys.exit()
+
+    return cmd_args
+
+
+@contextlib.contextmanager
+def quiet_fn(verbose=False):
+    """ Suppress the pipeline output within a with block (unless verbose). """
+
+    if verbose:
+        yield
+        return
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def result_fn(benchmark, product, sites, images, seconds, stage=None, **settings):
+    """ Return a benchmark result (throughput in sites x images per second).
+
+    @param benchmark: string object containing the benchmark name (i.e. 'end_to_end' or 'correction').
+    @param product: string object containing the product name (or 'fused').
+    @param sites: integer object containing the number of site visits.
+    @param images: integer object containing the number of images.
+    @param seconds: float object containing the elapsed (wall) time.
+    @param stage: dictionary object containing the memory_budget.stage_fn record of the benchmark (peak RSS).
+    @param settings: keyword arguments recorded with the result (i.e. workers).
+    @return result: dictionary object.
+    """
+
+    result = {'benchmark': benchmark, 'product': product, 'sites': sites, 'images': images,
+              'seconds': round(seconds, 4),
+              'site_images_per_second': round(sites * images / seconds, 1) if seconds > 0 else None,
+              'peak_rss_mb': round(stage['peak_rss'] / 1024 ** 2, 1) if stage and stage['peak_rss'] else None}
+    result.update(settings)
+    print('{0:<12} {1:<8} sites: {2:>7} images: {3:>4} seconds: {4:>9.3f} sites x images / s: {5} '
+          'peak RSS (MB): {6}'.format(benchmark, product, sites, images, seconds, result['site_images_per_second'],
+                                      result['peak_rss_mb']))
+
+    return result
+
+
+def best_time_fn(fn, repeat, verbose=False):
+    """ Return the best wall time of several calls of a function (output suppressed).
+
+    @param fn: function object (no arguments).
+    @param repeat: integer object containing the number of calls.
+    @return float object containing the shortest elapsed time (seconds).
+    """
+
+    best = None
+    for _ in range(max(repeat, 1)):
+        with quiet_fn(verbose):
+            start = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    return best
+
+
+def run_dirs_fn(run_dir, products):
+    """ Create a clean export and temporary directory for an end to end run (directory structure of step1_1).
+
+    @param run_dir: string object containing the path to the run directory.
+    @param products: list object containing the product names.
+    @return export_dir_path, temp_dir_path: string objects.
+    """
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+    export_dir_path = os.path.join(run_dir, 'export')
+    temp_dir_path = os.path.join(run_dir, 'temp')
+    for name in products:
+        os.makedirs(os.path.join(export_dir_path, '{0}_zonal_stats'.format(name)))
+    os.makedirs(os.path.join(temp_dir_path, 'albers'))
+
+    return export_dir_path, temp_dir_path
+
+
+def end_to_end_fn(cmd_args, mosaics_dir, geo_df, n_sites, products):
+    """ Run the listing and zonal stats steps of each product on the synthetic data.
+
+    @param cmd_args: command arguments (workers, stack_depth, fuse and verbose).
+    @param mosaics_dir: string object containing the path to the synthetic mosaic directory.
+    @param geo_df: geo-dataframe object containing the 1ha sites.
+    @param n_sites: integer object containing the number of site visits.
+    @param products: list object containing the product names.
+    @return results: list object containing the benchmark results.
+    """
+    import step1_2_list_of_images
+    import step1_4_product_zonal_stats
+
+    settings = {'workers': cmd_args.workers, 'stack_depth': cmd_args.stack_depth, 'fuse': cmd_args.fuse}
+    export_dir_path, temp_dir_path = run_dirs_fn(os.path.dirname(export_dir_fn(cmd_args.output_dir, n_sites)),
+                                                 products)
+
+    results = []
+    export_csv_dict = {}
+    listing = {}
+    for name in products:
+        product = product_registry.product_fn(name)
+        with quiet_fn(cmd_args.verbose):
+            start = time.perf_counter()
+            export_csv_dict[name] = step1_2_list_of_images.main_routine(
+                export_dir_path, os.path.join(mosaics_dir, product['sub_dir']), name, product['pattern'])
+            listing[name] = time.perf_counter() - start
+
+    if cmd_args.fuse:
+        with quiet_fn(cmd_args.verbose), memory_budget.stage_fn('benchmark fused') as stage:
+            start = time.perf_counter()
+            step1_4_product_zonal_stats.fused_main_routine(export_dir_path, products, export_csv_dict, temp_dir_path,
+                                                           geo_df, cmd_args.workers)
+            seconds = time.perf_counter() - start + sum(listing.values())
+        results.append(result_fn('end_to_end', 'fused', n_sites, cmd_args.images * len(products), seconds, stage,
+                                 **settings))
+        return results
+
+    for name in products:
+        with quiet_fn(cmd_args.verbose), memory_budget.stage_fn('benchmark ' + name) as stage:
+            start = time.perf_counter()
+            step1_4_product_zonal_stats.main_routine(export_dir_path, name, export_csv_dict[name], temp_dir_path,
+                                                     geo_df, cmd_args.workers, cmd_args.stack_depth)
+            seconds = time.perf_counter() - start + listing[name]
+        results.append(result_fn('end_to_end', name, n_sites, cmd_args.images, seconds, stage, **settings))
+
+    return results
+
+
+def synthetic_zones_fn(product, n_sites, rng):
+    """ Return synthetic zonal statistics of every band of a product (the output of zonal_engine.extract_image_fn).
+
+    @param product: dictionary object containing the product registry entry.
+    @param n_sites: integer object containing the number of sites.
+    @param rng: NumPy random generator object.
+    @return zs_bands: dictionary object containing a list of zonal statistic dictionaries per band.
+    """
+
+    zs_bands = {}
+    for band in product['bands']:
+        values = rng.uniform(1, 250, (n_sites, len(product['stats'])))
+        zones = [dict(zip(product['stats'], row)) for row in values.tolist()]
+        if product['kind'] == 'categorical':
+            names = list(product['category_map'].values())
+            counts = rng.integers(0, 12, (n_sites, len(names)))
+            for zone, row in zip(zones, counts.tolist()):
+                zone.update((name, count) for name, count in zip(names, row) if count)
+        zs_bands[band] = zones
+
+    return zs_bands
+
+
+def micro_benchmarks_fn(cmd_args, name, geo_df, n_sites):
+    """ Run the microbenchmarks of a product (date parsing, dataframe, correction and fan-out).
+
+    @param cmd_args: command arguments (images, repeat and verbose).
+    @param name: string object containing the product name.
+    @param geo_df: geo-dataframe object containing the 1ha sites.
+    @param n_sites: integer object containing the number of site visits.
+    @return results: list object containing the benchmark results.
+    """
+    import step1_4_product_zonal_stats as zonal_stats
+
+    product = product_registry.product_fn(name)
+    rng = np.random.default_rng(n_sites)
+    image_names = synthetic_data.image_names_fn(product, cmd_args.images)
+    uid_list = geo_df['uid'].tolist()
+    site_list = geo_df['site_name'].tolist()
+    zones = [synthetic_zones_fn(product, len(uid_list), rng) for _ in image_names]
+
+    def dataframe_fn():
+        return [zonal_stats.image_df_fn(zs_bands, im_name, zonal_stats.image_date_fn(im_name), uid_list, site_list,
+                                        product) for zs_bands, im_name in zip(zones, image_names)]
+
+    with quiet_fn(cmd_args.verbose):
+        image_dfs = dataframe_fn()
+    output_zonal_stats = pd.concat(image_dfs, ignore_index=True)
+
+    def date_fn():
+        [zonal_stats.image_date_fn(im_name) for im_name in image_names]
+        if product['time_stamp']:
+            zonal_stats.time_stamp_fn(output_zonal_stats.copy())
+
+    # the image results csv files of the fan-out (as written by export_image_fn)
+    micro_dir = os.path.join(cmd_args.output_dir, 'micro', name)
+    shutil.rmtree(micro_dir, ignore_errors=True)
+    os.makedirs(os.path.join(micro_dir, 'sites'))
+    image_files = []
+    for im_name, df in zip(image_names, image_dfs):
+        image_files.append(os.path.join(micro_dir, 'image_' + im_name + '.csv'))
+        df.to_csv(image_files[-1], index=False)
+
+    def fan_out_fn():
+        memory_budget.export_by_site_fn(image_files, partial(zonal_stats.clean_zonal_stats_fn, product),
+                                        os.path.join(micro_dir, 'sites'), '{0}_' + name + '_zonal_stats.csv',
+                                        os.path.join(micro_dir, 'spill'), float_precision='round_trip')
+
+    results = []
+    for benchmark, fn in [('date_parsing', date_fn), ('dataframe', dataframe_fn),
+                          ('correction', lambda: zonal_stats.correction_fn(output_zonal_stats.copy(), product)),
+                          ('fan_out', fan_out_fn)]:
+        with quiet_fn(cmd_args.verbose), memory_budget.stage_fn('benchmark ' + benchmark) as stage:
+            seconds = best_time_fn(fn, cmd_args.repeat, cmd_args.verbose)
+        results.append(result_fn(benchmark, name, n_sites, cmd_args.images, seconds, stage))
+
+    shutil.rmtree(micro_dir)
+
+    return results
+
+
+def export_dir_fn(output_dir, n_sites):
+    """ Return the export directory of the end to end run of a number of sites (the zonal stats csv files). """
+
+    return os.path.join(output_dir, 'runs', 'sites_{0}'.format(n_sites), 'export')
+
+
+def run_benchmarks_fn(cmd_args, products):
+    """ Generate the synthetic data and run the end to end and microbenchmarks.
+
+    @param cmd_args: command arguments (refer to get_cmd_args_fn).
+    @param products: list object containing the product names.
+    @return results: list object containing the benchmark results (refer to result_fn).
+    """
+
+    if not os.path.exists(cmd_args.output_dir):
+        os.makedirs(cmd_args.output_dir)
+
+    mosaics_dir = os.path.join(cmd_args.output_dir, 'mosaics')
+    if not cmd_args.micro_only:
+        synthetic_data.generate_mosaics_fn(mosaics_dir, products, cmd_args.images, cmd_args.scale)
+
+    results = []
+    for n_sites in cmd_args.sites:
+        print('-' * 50)
+        csv_path = os.path.join(cmd_args.output_dir, 'synthetic_sites_{0}.csv'.format(n_sites))
+        with quiet_fn(cmd_args.verbose):
+            geo_df = synthetic_data.site_polygons_fn(synthetic_data.generate_sites_fn(csv_path, n_sites,
+                                                                                      cmd_args.scale))
+
+        if not cmd_args.micro_only:
+            results.extend(end_to_end_fn(cmd_args, mosaics_dir, geo_df, n_sites, products))
+
+        for name in products:
+            results.extend(micro_benchmarks_fn(cmd_args, name, geo_df, n_sites))
+
+    return results
+
+
+def platform_fn():
+    """ Return a description of the workstation (benchmark results are only comparable on the same workstation). """
+
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def main_routine():
+    """ Generate the synthetic data, run the end to end and microbenchmarks and write benchmark_results.json. """
+
+    cmd_args = get_cmd_args_fn()
+    products = cmd_args.products or product_registry.product_names_fn()
+    for name in products:
+        product_registry.product_fn(name)
+
+    import run_report
+    results = run_benchmarks_fn(cmd_args, products)
+
+    report = {'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'workstation': platform_fn(),
+              'arguments': vars(cmd_args),
+              'results': results}
+
+    results_path = os.path.join(cmd_args.output_dir, RESULTS_NAME)
+    with open(results_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('-' * 50)
+    print('Benchmark results: ', results_path)
+
+    if not cmd_args.micro_only:
+        run_report.write_run_report_fn(cmd_args.output_dir)
+
+
+if __name__ == '__main__':
+    main_routine()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+
+"""
+climate_cube.py
+===============
+
+Description: This script extracts a per site monthly time series from the climate grids (i.e. SILO rainfall and the
+QLD grids, refer to product_registry.CLIMATE_GRIDS). It replaces the archived step1_7_monthly_rainfall_zonal_stats.py
+and step1_8_qld_grid_zonal_stats.py, which opened each monthly grid and ran rasterstats on it.
+
+ - Cube: the monthly grids of a variable are stacked into a single (time, y, x) array on disk
+   (<variable>_cube.npy in the cube directory, written one month at a time and opened as a read only memory map) with
+   a header (<variable>_cube.json) containing the date index (date order), grid names, geo-transform, crs, no data
+   value and the size and modification time of every grid. The cube is rebuilt only when the grids change.
+ - Sites: the 1ha sites (csv or point / polygon shapefile, refer to site_batch.source_sites_fn) are rasterized once
+   on the grid (all_touched, as the archived rasterstats calls) and converted to the flat pixel index of each site.
+ - Extraction: the pixels of every site are gathered from the cube for every month in one vectorised gather and the
+   statistics of all sites and months are calculated with nan aware reductions; decades of monthly grids are
+   summarised in seconds rather than a rasterstats call per grid.
+ - Outputs: <variable>_zonal_stats/<site>_<variable>_zonal_stats.csv in the export directory with one row per month
+   and the corrected statistics (i.e. b1_rainfall_mean, refer to step1_4_product_zonal_stats.correction_fn).
+
+Command (i.e.):
+
+    python climate_cube.py -d U:\\biomass\\slats_tern_biomass.csv -g Z:\\Scratch\\climate -v rainfall max_temp
+        -x U:\\scratch\\climate --dates 1990 2020
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import product_registry
+
+warnings.filterwarnings("ignore")
+
+CUBE_DIR_NAME = 'climate_cube'
+
+# bump to rebuild cubes written by an earlier layout
+CUBE_VERSION = 1
+
+# the grids are dated by the first 8 (YYYYMMDD) or 6 (YYYYMM) digit run of the file name
+DATE_PATTERN = re.compile(r'(\d{8}|\d{6})')
+
+# the sites are read in Australian Albers and projected to the crs of the grids
+ALBERS_CRS = 'EPSG:3577'
+
+# maximum number of values (months x sites x pixels) reduced at once
+REDUCE_BUDGET = 2 ** 25
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Extract a per site monthly time series from the climate grids through a (time, y, x) cube.''')
+
+    p.add_argument('-d', '--data', help='The site points csv file (biomass csv format) or point / polygon shapefile.')
+
+    p.add_argument('-g', '--grid_dir', help='The climate grid directory (one sub-directory per variable).')
+
+    p.add_argument('-v', '--variables', nargs='+',
+                   help="Enter the climate grid variables to extract (i.e. rainfall, default all registered grids)",
+                   default=None)
+
+    p.add_argument('-x', '--export_dir',
+                   help='Enter the export directory for all of the final outputs.',
+                   default=r'U:\scratch\rob\pipelines\outputs')
+
+    p.add_argument('--cube_dir',
+                   help="Enter the directory the climate cubes are stored in between runs (default "
+                        "export_dir\\\\climate_cube)",
+                   default=None)
+
+    p.add_argument('--dates', nargs=2,
+                   help="Enter the first and last month to extract (YYYYMM or YYYY, i.e. 1990 2020, default all)",
+                   default=None)
+
+    p.add_argument('--rebuild', action='store_true',
+                   help="Rebuild the climate cubes even if the grids have not changed")
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.data is None or cmd_args.grid_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def grid_date_fn(file_name):
+    """ Return the date of a monthly grid from its file name (i.e. 199001.monthly_rain.tif -> 199001).
+
+    @param file_name: string object containing the grid file name.
+    @return string object containing the date (YYYYMM or YYYYMMDD), or None.
+    """
+
+    match = DATE_PATTERN.search(file_name)
+
+    return match.group(1) if match else None
+
+
+def list_grids_fn(grid_dir, grid):
+    """ List the monthly grids of a variable (year sub-directories included) in date order.
+
+    @param grid_dir: string object containing the path to the climate grid directory.
+    @param grid: dictionary object containing the climate grid registry entry.
+    @return list_grid: list object containing a (date, path) tuple per grid.
+    """
+
+    variable_dir = os.path.join(grid_dir, grid['sub_dir'])
+
+    list_grid = []
+    for root, dirs, files in os.walk(variable_dir):
+        for file in files:
+            if file.endswith(grid['suffix']):
+                im_date = grid_date_fn(file)
+                if im_date is None:
+                    print('The grid file name has no date, it is not included: ', os.path.join(root, file))
+                    continue
+                list_grid.append((im_date, os.path.join(root, file)))
+
+    return sorted(list_grid)
+
+
+def fingerprint_fn(list_grid):
+    """ Return the name, size and modification time of every grid (the cube is rebuilt when they change).
+
+    @param list_grid: list object containing a (date, path) tuple per grid (refer to list_grids_fn).
+    @return list object containing a [name, size, mtime] list per grid.
+    """
+
+    fingerprint = []
+    for im_date, path in list_grid:
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+
+    return fingerprint
+
+
+def cube_paths_fn(cube_dir, name):
+    """ Return the paths to the cube array and header of a variable. """
+
+    return os.path.join(cube_dir, '{0}_cube.npy'.format(name)), os.path.join(cube_dir, '{0}_cube.json'.format(name))
+
+
+def build_cube_fn(grid, list_grid, cube_dir):
+    """ Stack the monthly grids of a variable into a (time, y, x) cube, one month at a time, and write its header.
+    Every grid must share the shape, geo-transform, crs and data type of the first grid.
+
+    @param grid: dictionary object containing the climate grid registry entry.
+    @param list_grid: list object containing a (date, path) tuple per grid (refer to list_grids_fn).
+    @param cube_dir: string object containing the path to the cube directory.
+    @return header: dictionary object containing the cube header (refer to load_cube_fn).
+    """
+    import rasterio
+
+    start = time.time()
+    array_path, header_path = cube_paths_fn(cube_dir, grid['name'])
+    if not os.path.isdir(cube_dir):
+        os.makedirs(cube_dir)
+
+    with rasterio.open(list_grid[0][1]) as srci:
+        height, width = srci.height, srci.width
+        transform = srci.transform
+        crs = srci.crs
+        dtype = srci.dtypes[0]
+        no_data = grid['no_data'] if grid['no_data'] is not None else srci.nodata
+
+    # the cube is written to a temporary file and renamed into place once every month is stacked
+    cube = np.lib.format.open_memmap(array_path + '.tmp', mode='w+', dtype=dtype,
+                                     shape=(len(list_grid), height, width))
+    for position, (im_date, path) in enumerate(list_grid):
+        with rasterio.open(path) as srci:
+            if (srci.height, srci.width) != (height, width) or srci.transform != transform or srci.crs != crs or \
+                    srci.dtypes[0] != dtype:
+                print('The grid does not match the grid of ', list_grid[0][1], ' (shape, transform, crs and data '
+                      'type): ', path)
+                del cube
+                os.remove(array_path + '.tmp')
+                sys.exit()
+            cube[position] = srci.read(1)
+    cube.flush()
+    del cube
+    os.replace(array_path + '.tmp', array_path)
+
+    header = {'version': CUBE_VERSION, 'name': grid['name'], 'dates': [im_date for im_date, path in list_grid],
+              'names': [os.path.basename(path) for im_date, path in list_grid],
+              'shape': [len(list_grid), height, width], 'dtype': dtype, 'transform': list(transform)[:6],
+              'crs': crs.to_wkt() if crs else None, 'no_data': no_data, 'fingerprint': fingerprint_fn(list_grid)}
+    with open(header_path + '.tmp', 'w') as header_file:
+        json.dump(header, header_file)
+    os.replace(header_path + '.tmp', header_path)
+
+    print('Climate cube: ', grid['name'], ' - ', len(list_grid), ' grids (', height, ' x ', width, ') in ',
+          round(time.time() - start, 1), ' seconds: ', array_path)
+
+    return header
+
+
+def load_cube_fn(cube_dir, name):
+    """ Open the cube of a variable as a read only memory map.
+
+    @param cube_dir: string object containing the path to the cube directory.
+    @param name: string object containing the variable name.
+    @return cube: NumPy memory map with shape (time, y, x), or None if there is no cube.
+    @return header: dictionary object containing the version, name, dates, names, shape, dtype, transform, crs, no_data
+    and fingerprint of the cube, or None if there is no cube.
+    """
+
+    array_path, header_path = cube_paths_fn(cube_dir, name)
+    if not os.path.isfile(array_path) or not os.path.isfile(header_path):
+        return None, None
+
+    with open(header_path) as header_file:
+        header = json.load(header_file)
+    if header.get('version') != CUBE_VERSION:
+        return None, None
+
+    return np.load(array_path, mmap_mode='r'), header
+
+
+def cube_fn(grid, grid_dir, cube_dir, rebuild=False):
+    """ Return the cube of a variable, building it when there is no cube or the grids have changed.
+
+    @param grid: dictionary object containing the climate grid registry entry.
+    @param grid_dir: string object containing the path to the climate grid directory.
+    @param cube_dir: string object containing the path to the cube directory.
+    @param rebuild: boolean object, if True the cube is rebuilt even if the grids have not changed.
+    @return cube: NumPy memory map with shape (time, y, x) (refer to load_cube_fn).
+    @return header: dictionary object containing the cube header.
+    """
+
+    list_grid = list_grids_fn(grid_dir, grid)
+    if not list_grid:
+        print('There are no ', grid['name'], ' grids (*', grid['suffix'], ') in: ',
+              os.path.join(grid_dir, grid['sub_dir']))
+        sys.exit()
+
+    cube, header = load_cube_fn(cube_dir, grid['name'])
+    if rebuild or header is None or header['fingerprint'] != fingerprint_fn(list_grid):
+        build_cube_fn(grid, list_grid, cube_dir)
+        cube, header = load_cube_fn(cube_dir, grid['name'])
+    else:
+        print('Climate cube (unchanged): ', grid['name'], ' - ', len(list_grid), ' grids')
+
+    return cube, header
+
+
+def site_pixels_fn(geometries, header):
+    """ Rasterize the sites on the cube grid (all_touched, refer to zonal_engine.site_plan_fn) and return the flat
+    pixel index of every site pixel within the grid.
+
+    @param geometries: list object containing a geometry mapping per site (grid crs).
+    @param header: dictionary object containing the cube header.
+    @return pixels: NumPy array containing the distinct flat pixel indices of the sites.
+    @return index: NumPy array with shape (sites, max pixels per site) containing the position of each site pixel in
+    pixels (-1 pads the sites with fewer pixels).
+    """
+    from rasterio.transform import Affine
+    import zonal_engine
+
+    time_steps, height, width = header['shape']
+    plan = zonal_engine.site_plan_fn(geometries, Affine(*header['transform']))
+
+    site_pixels = []
+    for (row_off, col_off, _, _), ((row_start, _), (col_start, _)), mask in zip(plan['windows'], plan['sub_windows'],
+                                                                               plan['masks']):
+        rows, cols = np.nonzero(mask)
+        rows = rows + row_off + row_start
+        cols = cols + col_off + col_start
+        # pixels beyond the grid are no data (as the rasterstats boundless read)
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        site_pixels.append(rows[inside] * width + cols[inside])
+
+    pixels, inverse = np.unique(np.concatenate(site_pixels + [np.zeros(0, 'int64')]).astype('int64'),
+                                return_inverse=True)
+    index = np.full((len(site_pixels), max([len(flat) for flat in site_pixels] + [1])), -1, dtype='int64')
+    position = 0
+    for site, flat in enumerate(site_pixels):
+        index[site, :len(flat)] = inverse[position:position + len(flat)]
+        position += len(flat)
+
+    return pixels, index
+
+
+def site_stats_fn(values, index, stats):
+    """ Calculate the statistics of every site and month from the gathered pixel values with nan aware reductions.
+
+    @param values: NumPy array with shape (time, pixels) containing the gathered values (no data as nan).
+    @param index: NumPy array containing the pixel positions of each site (refer to site_pixels_fn).
+    @param stats: list object containing the rasterstats statistics names.
+    @return results: dictionary object containing a (time, sites) NumPy array per statistic (nan where a site has no
+    valid pixels in a month, count 0).
+    """
+    from rasterstats.utils import get_percentile
+
+    time_steps = values.shape[0]
+    site_count, depth = index.shape
+    results = dict((stat, np.full((time_steps, site_count), np.nan)) for stat in stats)
+
+    # pad values with a nan column for the -1 positions
+    padded = np.concatenate([values, np.full((time_steps, 1), np.nan)], axis=1)
+
+    chunk = max(1, REDUCE_BUDGET // max(1, time_steps * depth))
+    for first in range(0, site_count, chunk):
+        block = padded[:, index[first:first + chunk]]
+        valid = ~np.isnan(block)
+        counts = valid.sum(axis=2)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for stat in stats:
+                if stat == 'count':
+                    result = counts
+                elif stat == 'min':
+                    result = np.nanmin(block, axis=2)
+                elif stat == 'max':
+                    result = np.nanmax(block, axis=2)
+                elif stat == 'mean':
+                    result = np.nanmean(block, axis=2)
+                elif stat == 'sum':
+                    result = np.where(counts > 0, np.nansum(block, axis=2), np.nan)
+                elif stat == 'std':
+                    result = np.nanstd(block, axis=2)
+                elif stat == 'median':
+                    result = np.nanmedian(block, axis=2)
+                elif stat == 'range':
+                    result = np.nanmax(block, axis=2) - np.nanmin(block, axis=2)
+                elif stat.startswith('percentile_'):
+                    result = np.nanpercentile(block, get_percentile(stat), axis=2)
+                else:
+                    print('The statistic is not supported by the climate cube: ', stat)
+                    sys.exit()
+                results[stat][:, first:first + chunk] = result
+
+    return results
+
+
+def extract_fn(cube, header, geometries, grid, dates=None):
+    """ Extract the statistics of every site for every month (or the months within a date range) of a cube.
+
+    @param cube: NumPy memory map with shape (time, y, x) (refer to load_cube_fn).
+    @param header: dictionary object containing the cube header.
+    @param geometries: list object containing a geometry mapping per site (grid crs).
+    @param grid: dictionary object containing the climate grid registry entry.
+    @param dates: tuple object containing the first and last month (refer to zonal_extract.date_selected_fn), or None.
+    @return steps: list object containing the cube position of each extracted month.
+    @return results: dictionary object containing a (time, sites) NumPy array per statistic (refer to site_stats_fn).
+    """
+    import zonal_extract
+
+    steps = [step for step, im_date in enumerate(header['dates']) if zonal_extract.date_selected_fn(im_date, dates)]
+    pixels, index = site_pixels_fn(geometries, header)
+
+    # a single gather of the site pixels of every month (the months are contiguous in the date index)
+    time_steps, height, width = header['shape']
+    flat = cube.reshape((time_steps, height * width))
+    if steps and steps == list(range(steps[0], steps[-1] + 1)):
+        values = flat[steps[0]:steps[-1] + 1][:, pixels].astype('float64')
+    else:
+        values = flat[:, pixels][steps].astype('float64')
+
+    if header['no_data'] is not None:
+        values[values == header['no_data']] = np.nan
+
+    return steps, site_stats_fn(values, index, grid['stats'])
+
+
+def series_df_fn(steps, results, header, uid_list, site_list, grid):
+    """ Convert the statistics of every site and month to a dataframe (month order within each site), corrected with
+    the scale and offset of the variable (refer to step1_4_product_zonal_stats.correction_fn).
+
+    @param steps: list object containing the cube position of each extracted month.
+    @param results: dictionary object containing a (time, sites) NumPy array per statistic.
+    @param header: dictionary object containing the cube header.
+    @param uid_list: list object containing the unique identifier of each site.
+    @param site_list: list object containing the site name of each site.
+    @param grid: dictionary object containing the climate grid registry entry.
+    @return df: dataframe object containing the uid, site, im_name, im_date, year, month and statistic columns.
+    """
+    import step1_4_product_zonal_stats
+
+    time_steps = len(steps)
+    site_count = len(uid_list)
+    dates = [header['dates'][step] for step in steps]
+
+    df = pd.DataFrame({'uid': np.repeat(uid_list, time_steps), 'site': np.repeat(site_list, time_steps),
+                       'im_name': [header['names'][step] for step in steps] * site_count,
+                       'im_date': dates * site_count,
+                       'year': [im_date[:4] for im_date in dates] * site_count,
+                       'month': [im_date[4:6] for im_date in dates] * site_count})
+
+    columns = step1_4_product_zonal_stats.band_columns_fn(grid, 1)
+    for stat, column in zip(grid['stats'], columns):
+        # (time, sites) to site major rows
+        df[column] = results[stat].T.reshape(-1)
+    df[columns[grid['stats'].index('count')]] = df[columns[grid['stats'].index('count')]].astype('int64')
+
+    return step1_4_product_zonal_stats.correction_fn(df, grid)
+
+
+def export_series_fn(df, output_dir, variable):
+    """ Export the monthly time series of each site to <site>_<variable>_zonal_stats.csv.
+
+    @param df: dataframe object containing the time series of every site (refer to series_df_fn).
+    @param output_dir: string object containing the path to the variable output directory.
+    @param variable: string object containing the variable name.
+    """
+
+    for site, site_df in df.groupby('site', sort=False):
+        out_path = os.path.join(output_dir, "{0}_{1}_zonal_stats.csv".format(str(site), variable))
+        site_df.to_csv(out_path, index=False)
+
+
+def main_routine():
+    """ Extract the per site monthly time series of every climate grid variable through its cube. """
+
+    cmd_args = get_cmd_args_fn()
+    export_dir = cmd_args.export_dir
+    cube_dir = cmd_args.cube_dir or os.path.join(export_dir, CUBE_DIR_NAME)
+    variables = cmd_args.variables or [grid['name'] for grid in product_registry.CLIMATE_GRIDS]
+    grids = [product_registry.climate_grid_fn(variable) for variable in variables]
+
+    import site_batch
+    import zonal_engine
+    from rasterio.crs import CRS
+    from rasterio.warp import transform_geom
+
+    # the 1ha sites of the csv (refer to step1_3_project_buffer.py) or shapefile in Australian Albers
+    temp_dir_path = os.path.join(export_dir, 'climate_cube_temp')
+    try:
+        geo_df = site_batch.source_sites_fn(cmd_args.data, os.path.join(export_dir, 'sites'), temp_dir_path)
+    except ValueError as error:
+        print(error)
+        sys.exit()
+    geometries = zonal_engine.feature_geometries_fn(geo_df)
+    uid_list = geo_df['uid'].tolist()
+    site_list = geo_df['site_name'].tolist()
+    print('Sites: ', len(geo_df))
+
+    for grid in grids:
+        variable = grid['name']
+        print('=' * 50)
+        print('Working on climate grid: ', variable)
+        cube, header = cube_fn(grid, cmd_args.grid_dir, cube_dir, cmd_args.rebuild)
+
+        start = time.time()
+        grid_geometries = [transform_geom(ALBERS_CRS, CRS.from_wkt(header['crs']), geometry)
+                           for geometry in geometries] if header['crs'] else geometries
+        steps, results = extract_fn(cube, header, grid_geometries, grid, cmd_args.dates)
+        if not steps:
+            print('There are no ', variable, ' grids within the dates: ', cmd_args.dates)
+            continue
+
+        df = series_df_fn(steps, results, header, uid_list, site_list, grid)
+        output_dir = os.path.join(export_dir, '{0}_zonal_stats'.format(variable))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        export_series_fn(df, output_dir, variable)
+
+        print('Climate grid: ', variable, ' - ', len(steps), ' months x ', len(geo_df), ' sites in ',
+              round(time.time() - start, 2), ' seconds: ', output_dir)
+
+    if os.path.isdir(temp_dir_path):
+        shutil.rmtree(temp_dir_path)
+
+    print('Climate grid zonal stats are complete: ', export_dir)
+
+
+if __name__ == '__main__':
+    main_routine()
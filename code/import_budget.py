@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+import_budget.py
+================
+
+Description: This script checks the import time budget of the pipeline entry points and of the modules loaded by the
+worker processes, so argument errors, --help and planning stay fast and every spawned worker starts lean.
+
+ - Lean modules (LEAN_MODULES): the pipeline command line and the modules imported by a worker process at start up
+   must not import the geospatial libraries (HEAVY_MODULES); the functions which need them import them when they are
+   first called.
+ - Import time: each lean module is imported in a fresh interpreter with python -X importtime and its cumulative
+   import time (the median of --runs runs) must be within --budget_ms.
+ - Command line: python step1_1_initiate_fractional_cover_zonal_stats_pipeline.py --help must complete within
+   --budget_ms of an empty interpreter start.
+
+The results are printed; on failure the slowest imports of the failing module are listed and the script exits with
+status 1, i.e.:
+
+    python import_budget.py
+    python import_budget.py --budget_ms 500 --runs 5
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from collections import OrderedDict
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_SCRIPT = 'step1_1_initiate_fractional_cover_zonal_stats_pipeline.py'
+
+# libraries with a slow (GDAL, PROJ or pandas) start up, imported only by the functions which use them
+HEAVY_MODULES = ['rasterio', 'fiona', 'geopandas', 'rasterstats', 'shapely', 'pyproj', 'pandas']
+
+# modules which must start without the heavy libraries, and where they are imported
+LEAN_MODULES = OrderedDict([
+    ('step1_1_initiate_fractional_cover_zonal_stats_pipeline', 'pipeline command line (spawned workers import it)'),
+    ('zonal_engine', 'statistics workers (window and fused engines)'),
+    ('temporal_stack', 'statistics workers (time stack engine)'),
+    ('shared_windows', 'statistics workers (shared memory windows)'),
+    ('mosaic_transcode', 'transcode workers'),
+    ('mosaic_staging', 'staging threads'),
+    ('read_strategy', 'read cost model'),
+    ('run_report', 'worker initializer'),
+])
+
+# number of slowest imports listed for a failing module
+SLOWEST_IMPORTS = 10
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Check the import time budget of the pipeline command line and worker modules.''')
+
+    p.add_argument('-b', '--budget_ms', type=float,
+                   help='Enter the import time budget of each module in milliseconds (i.e. 400)', default=400.0)
+
+    p.add_argument('-n', '--runs', type=int, help='Enter the number of runs per measurement (median)', default=3)
+
+    cmd_args = p.parse_args()
+
+    return cmd_args
+
+
+def import_times_fn(module):
+    """ Import a module in a fresh interpreter with python -X importtime.
+
+    @param module: string object containing the module name.
+    @return imports: list object containing a tuple (cumulative microseconds, module name) per import.
+    @return heavy: list object containing the HEAVY_MODULES loaded by the import.
+    """
+
+    code = ('import sys, json; import {0}; '
+            'print(json.dumps(sorted(set(m.split(".")[0] for m in sys.modules) & set({1}))))').format(
+        module, json.dumps(HEAVY_MODULES))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=CODE_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('import {0} failed:\n{1}'.format(module, process.stderr[-2000:]))
+
+    # import time: self [us] | cumulative | imported package
+    imports = []
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                imports.append((int(cumulative), name.strip()))
+
+    return imports, json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def wall_seconds_fn(command, runs):
+    """ Return the median wall time of a command (seconds). """
+
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=CODE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        seconds.append(time.perf_counter() - start)
+
+    return sorted(seconds)[len(seconds) // 2]
+
+
+def main_routine():
+    """ Check the lean modules and the command line start up, exit with status 1 on failure. """
+
+    cmd_args = get_cmd_args_fn()
+    runs = max(cmd_args.runs, 1)
+    failures = []
+
+    for module, role in LEAN_MODULES.items():
+        measurements = [import_times_fn(module) for _ in range(runs)]
+        totals = sorted(dict((name, cumulative) for cumulative, name in imports).get(module, 0) / 1000.0
+                        for imports, _ in measurements)
+        milliseconds = totals[len(totals) // 2]
+        imports, heavy = measurements[0]
+
+        status = 'ok'
+        if heavy:
+            status = 'FAIL - imports ' + ', '.join(heavy)
+        elif milliseconds > cmd_args.budget_ms:
+            status = 'FAIL - over budget'
+        print('{0:<56} {1:>8.1f} ms  {2:<48} {3}'.format(module, milliseconds, role, status))
+
+        if status != 'ok':
+            slowest = sorted(imports, reverse=True)[1:SLOWEST_IMPORTS + 1]
+            failures.append('{0}: {1}\n'.format(module, status) + '\n'.join(
+                '    {0:>8.1f} ms  {1}'.format(cumulative / 1000.0, name) for cumulative, name in slowest))
+
+    # the command line help, relative to an empty interpreter start
+    baseline = wall_seconds_fn([sys.executable, '-c', 'pass'], runs)
+    help_seconds = wall_seconds_fn([sys.executable, PIPELINE_SCRIPT, '--help'], runs)
+    milliseconds = max(help_seconds - baseline, 0.0) * 1000.0
+    status = 'ok' if milliseconds <= cmd_args.budget_ms else 'FAIL - over budget'
+    print('{0:<56} {1:>8.1f} ms  {2:<48} {3}'.format(PIPELINE_SCRIPT + ' --help', milliseconds,
+                                                     'command line (interpreter start excluded)', status))
+    if status != 'ok':
+        failures.append('{0} --help: {1}'.format(PIPELINE_SCRIPT, status))
+
+    print('-' * 50)
+    if failures:
+        print('Import budget FAILED ({0} ms):'.format(cmd_args.budget_ms))
+        for failure in failures:
+            print(failure)
+        sys.exit(1)
+
+    print('Import budget passed ({0} ms).'.format(cmd_args.budget_ms))
+
+
+if __name__ == '__main__':
+    main_routine()
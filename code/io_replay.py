@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+
+"""
+io_replay.py
+============
+
+Description: This script replays the mosaic I/O of a recorded pipeline run (io_trace.jsonl, refer to io_trace.py)
+against synthetic local rasters through a file layer which simulates the network share, so I/O strategies can be
+compared reproducibly on a developer workstation without network access.
+
+ - Synthetic rasters: a raster is created for each dataset opened in the trace with the recorded driver, size, band
+   count, data type, block shape, interleaving and compression, so GDAL issues the same block requests as the
+   production run (the values are synthetic). Existing rasters are reused.
+ - Simulated share: datasets are opened through a rasterio opener; every file open and every read request made by
+   GDAL waits for the round trip latency (--latency_ms) and the transfer time at the link bandwidth (--bandwidth_mb,
+   shared by concurrent transfers).
+ - Replay: the opens, window reads, closes and staging copies are issued in the recorded order. With --compute the
+   gaps between events (the statistics and dataframe work of the run) are replayed as idle time, so background
+   strategies can overlap them.
+
+Strategies (--strategies):
+
+ - local: no simulated share (the lower bound).
+ - direct: every GDAL read request is a network request.
+ - readahead: the file layer fetches aligned chunks of --readahead_kb and caches them (LRU, per file).
+ - coalesce: the upcoming window reads of a dataset (up to the next open or close, reads of other datasets in between
+   are skipped) are merged into one read of their bounding window while it is no more than COALESCE_FACTOR times the
+   pixels of the windows merged.
+ - prefetch: each mosaic is copied whole from the share (sequential transfers) and read locally, and the next mosaic
+   in the trace is copied in the background (refer to mosaic_staging.py).
+
+Mosaics staged in the recorded run (copy events) are copied through the simulated share and then read locally by every
+strategy except local. The results (seconds, network requests, bytes and effective throughput per strategy) are
+printed and written to io_replay_results.json in the output directory.
+
+Command:
+
+    python io_replay.py -t <export_dir>\\io_trace.jsonl -o D:\\io_replay --latency_ms 5 --bandwidth_mb 40 --compute
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+import io_trace
+import synthetic_data
+import warnings
+
+warnings.filterwarnings("ignore")
+
+STRATEGIES = ['local', 'direct', 'readahead', 'coalesce', 'prefetch']
+
+# readahead chunks retained per run (LRU), the maximum consecutive reads merged and the bounding window limit
+READAHEAD_CHUNKS = 256
+COALESCE_READS = 32
+COALESCE_FACTOR = 4
+
+# size of the sequential transfers of a whole file copy
+COPY_CHUNK = 8 * 1024 ** 2
+
+# module level simulated network link (refer to configure_link_fn)
+_LINK = None
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Replay a recorded mosaic I/O trace against a simulated network share.''')
+
+    p.add_argument('-t', '--io_trace', help='The io_trace.jsonl file recorded by a pipeline run (--io_trace).')
+
+    p.add_argument('-o', '--output_dir', help='The directory for the synthetic rasters and replay results.')
+
+    p.add_argument('-s', '--strategies', nargs='+', choices=STRATEGIES, default=STRATEGIES,
+                   help='The I/O strategies to replay (default: all)')
+
+    p.add_argument('--latency_ms', type=float, help='Enter the round trip latency of the share (i.e. 5)', default=5.0)
+
+    p.add_argument('--bandwidth_mb', type=float, help='Enter the bandwidth of the share in MB/s (i.e. 40)',
+                   default=40.0)
+
+    p.add_argument('--readahead_kb', type=int, help='Enter the readahead chunk size in KB (i.e. 1024)', default=1024)
+
+    p.add_argument('-c', '--compute', action='store_true',
+                   help='Replay the recorded gaps between events (statistics work) as idle time (optional)')
+
+    p.add_argument('-m', '--max_events', type=int, help='Enter the number of trace events to replay (optional)',
+                   default=None)
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.io_trace is None or cmd_args.output_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def configure_link_fn(latency_ms, bandwidth_mb, readahead_kb=0):
+    """ Configure the simulated network link and reset its counters.
+
+    @param latency_ms: float object containing the round trip latency (milliseconds).
+    @param bandwidth_mb: float object containing the bandwidth (MB per second).
+    @param readahead_kb: integer object containing the readahead chunk size (KB), 0 = no readahead.
+    """
+    global _LINK
+
+    _LINK = {'latency': latency_ms / 1000.0, 'bandwidth': bandwidth_mb * 1024 ** 2,
+             'readahead': int(readahead_kb) * 1024, 'chunks': OrderedDict(), 'lock': threading.Lock(),
+             'transfer_lock': threading.Lock(), 'requests': 0, 'opens': 0, 'bytes': 0}
+
+
+def transfer_fn(nbytes, is_open=False):
+    """ Wait for a network request: the round trip latency and the transfer time of nbytes at the link bandwidth
+    (transfers share the link, so concurrent transfers queue).
+
+    @param nbytes: integer object containing the bytes transferred.
+    @param is_open: boolean object, True for a file open request.
+    """
+
+    time.sleep(_LINK['latency'])
+    if nbytes:
+        with _LINK['transfer_lock']:
+            time.sleep(nbytes / _LINK['bandwidth'])
+
+    with _LINK['lock']:
+        _LINK['requests'] += 1
+        _LINK['opens'] += int(is_open)
+        _LINK['bytes'] += nbytes
+
+
+class ThrottledFile(io.RawIOBase):
+    """ Read only file object which simulates reading the file from the network share (refer to transfer_fn). With
+    readahead each request fetches the aligned chunks covering it, and the chunks are cached. """
+
+    def __init__(self, path):
+        super(ThrottledFile, self).__init__()
+        self.path = path
+        self.f = open(path, 'rb')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = self.f.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def chunk_fn(self, index):
+        """ Return a readahead chunk of the file, fetching it over the link if it is not cached. """
+
+        key = (self.path, index)
+        with _LINK['lock']:
+            data = _LINK['chunks'].get(key)
+            if data is not None:
+                _LINK['chunks'].move_to_end(key)
+                return data
+
+        self.f.seek(index * _LINK['readahead'])
+        data = self.f.read(_LINK['readahead'])
+        transfer_fn(len(data))
+        with _LINK['lock']:
+            _LINK['chunks'][key] = data
+            while len(_LINK['chunks']) > READAHEAD_CHUNKS:
+                _LINK['chunks'].popitem(last=False)
+
+        return data
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        if not _LINK['readahead']:
+            self.f.seek(self.position)
+            data = self.f.read(size)
+            transfer_fn(len(data))
+        else:
+            chunk = _LINK['readahead']
+            parts = []
+            for index in range(self.position // chunk, (self.position + size - 1) // chunk + 1):
+                data = self.chunk_fn(index)
+                parts.append(data[max(self.position - index * chunk, 0):self.position + size - index * chunk])
+            data = b''.join(parts)
+
+        buffer[:len(data)] = data
+        self.position += len(data)
+
+        return len(data)
+
+    def close(self):
+        self.f.close()
+        super(ThrottledFile, self).close()
+
+
+def throttled_opener_fn(path, mode='rb'):
+    """ Rasterio opener which opens a file on the simulated network share (every open attempt is a request). """
+
+    transfer_fn(0, is_open=True)
+
+    return ThrottledFile(path)
+
+
+def copy_over_link_fn(path, destination):
+    """ Copy a file from the simulated share with sequential transfers (refer to mosaic_staging.py).
+
+    @param path: string object containing the path to the synthetic raster.
+    @param destination: string object containing the path of the local copy.
+    @return destination: string object.
+    """
+
+    transfer_fn(0, is_open=True)
+    with open(path, 'rb') as src, open(destination + '.part', 'wb') as dst:
+        while True:
+            data = src.read(COPY_CHUNK)
+            if not data:
+                break
+            transfer_fn(len(data))
+            dst.write(data)
+    os.replace(destination + '.part', destination)
+
+    return destination
+
+
+def write_replay_raster_fn(path, event, seed):
+    """ Create a synthetic raster with the layout of a recorded open event.
+
+    @param path: string object containing the output path.
+    @param event: dictionary object containing the open event (refer to io_trace.record_open_fn).
+    @param seed: integer object containing the random seed.
+    """
+
+    dtype = event['dtypes'][0]
+    block_height, block_width = event['block_shape']
+    profile = {'driver': event['driver'], 'width': event['width'], 'height': event['height'],
+               'count': event['count'], 'dtype': dtype, 'nodata': event['nodata'], 'crs': event['crs'],
+               'transform': Affine(*event['transform'])}
+    if event['driver'] == 'GTiff':
+        if block_width < event['width']:
+            profile.update(tiled=True, blockxsize=block_width, blockysize=block_height)
+        else:
+            profile.update(blockysize=block_height)
+        if event['compress']:
+            profile['compress'] = event['compress'].lower()
+        if event['interleave']:
+            profile['interleave'] = event['interleave'].lower()
+    elif event['driver'] == 'HFA':
+        profile['BLOCKSIZE'] = block_width
+
+    # spatially correlated values (similar compression to the mosaics) within the range of the data type
+    low, high = (1, 250) if np.dtype(dtype).itemsize == 1 else (100, 3000)
+    rng = np.random.default_rng(seed)
+    columns = np.arange(event['width'])
+    shape = (event['height'] // synthetic_data.PATCH_SIZE + 1, event['width'] // synthetic_data.PATCH_SIZE + 1)
+    coarse = [rng.random(shape) for _ in range(event['count'])]
+
+    with rasterio.open(path, 'w', **profile) as dst:
+        for r0 in range(0, event['height'], synthetic_data.WRITE_ROWS):
+            rows = np.arange(r0, min(r0 + synthetic_data.WRITE_ROWS, event['height']))
+            data = np.stack([synthetic_data.field_fn(rng, band, rows, columns, low, high) for band in coarse])
+            dst.write(np.rint(data).astype(dtype), window=Window(0, r0, event['width'], len(rows)))
+
+
+def replay_rasters_fn(events, raster_dir):
+    """ Create (or reuse) a synthetic raster for each dataset opened in the trace.
+
+    @param events: list object containing the trace events.
+    @param raster_dir: string object containing the path to the synthetic raster directory.
+    @return paths: dictionary object containing the synthetic raster path of each recorded dataset name.
+    """
+
+    if not os.path.exists(raster_dir):
+        os.makedirs(raster_dir)
+
+    paths = OrderedDict()
+    for event in events:
+        if event['op'] != 'open' or event['name'] in paths:
+            continue
+
+        # the file name is retained (the driver is identified by the extension for HFA)
+        name = os.path.basename(event['name'].replace('\\', '/'))
+        path = os.path.join(raster_dir, '{0:04d}_{1}'.format(len(paths), name))
+        paths[event['name']] = path
+
+        if os.path.isfile(path):
+            with rasterio.open(path) as src:
+                if (src.width, src.height, src.count, list(src.block_shapes[0])) == \
+                        (event['width'], event['height'], event['count'], event['block_shape']):
+                    continue
+
+        print('Writing synthetic raster: ', path)
+        write_replay_raster_fn(path, event, len(paths))
+
+    return paths
+
+
+def coalesce_fn(events, position, merged):
+    """ Return the bounding window of the upcoming reads of a dataset starting at position (refer to
+    COALESCE_READS and COALESCE_FACTOR). The positions of the reads merged are added to merged.
+
+    @param events: list object containing the trace events.
+    @param position: integer object containing the position of the first read.
+    @param merged: set object containing the positions of reads already merged into an earlier read.
+    @return window: list object containing the bounding window (row_off, col_off, height, width).
+    """
+
+    first = events[position]
+    r0, c0, height, width = first['window']
+    r1, c1 = r0 + height, c0 + width
+    pixels = height * width
+    count = 1
+
+    for later in range(position + 1, len(events)):
+        event = events[later]
+        if event['op'] != 'read' or count >= COALESCE_READS:
+            break
+        if event['name'] != first['name'] or event['bands'] != first['bands'] or later in merged:
+            continue
+        row_off, col_off, height, width = event['window']
+        b0, b1 = min(r0, row_off), max(r1, row_off + height)
+        a0, a1 = min(c0, col_off), max(c1, col_off + width)
+        if (b1 - b0) * (a1 - a0) > COALESCE_FACTOR * (pixels + height * width):
+            break
+        r0, r1, c0, c1 = b0, b1, a0, a1
+        pixels += height * width
+        count += 1
+        merged.add(later)
+
+    return [r0, c0, r1 - r0, c1 - c0]
+
+
+def replay_fn(events, paths, strategy, copy_dir, compute=False):
+    """ Replay the trace events with an I/O strategy.
+
+    @param events: list object containing the trace events.
+    @param paths: dictionary object containing the synthetic raster path of each recorded dataset name.
+    @param strategy: string object containing the strategy name (refer to STRATEGIES).
+    @param copy_dir: string object containing the path to the local copy directory (staged and prefetched rasters).
+    @param compute: boolean object, if True the recorded gaps between events are replayed as idle time.
+    @return reads: integer object containing the number of window reads issued.
+    """
+
+    shutil.rmtree(copy_dir, ignore_errors=True)
+    os.makedirs(copy_dir)
+
+    # the local copy of each staged or prefetched raster, and the prefetches in flight
+    local = {}
+    in_flight = {}
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+    upcoming = [event['name'] for event in events if event['op'] == 'open']
+
+    def local_copy_fn(name):
+        return os.path.join(copy_dir, os.path.basename(paths[name]))
+
+    datasets = {}
+    merged = set()
+    reads = 0
+    opened = 0
+    previous = None
+    position = 0
+    try:
+        while position < len(events):
+            event = events[position]
+            if position in merged:
+                position += 1
+                continue
+            if compute and previous is not None:
+                gap = event['t'] - (previous['t'] + previous['seconds'])
+                if gap > 0:
+                    time.sleep(gap)
+            previous = event
+            position += 1
+
+            if event['op'] == 'copy':
+                if strategy != 'local' and event['name'] in paths:
+                    local[event['name']] = copy_over_link_fn(paths[event['name']], local_copy_fn(event['name']))
+
+            elif event['op'] == 'open':
+                name = event['name']
+                opened += 1
+                if strategy == 'prefetch' and name not in local:
+                    future = in_flight.pop(name, None)
+                    local[name] = future.result() if future is not None else copy_over_link_fn(paths[name],
+                                                                                               local_copy_fn(name))
+                    # copy the next mosaic in the background while this one is read
+                    for next_name in upcoming[opened:opened + 1]:
+                        if next_name not in local and next_name not in in_flight:
+                            in_flight[next_name] = executor.submit(copy_over_link_fn, paths[next_name],
+                                                                   local_copy_fn(next_name))
+
+                if strategy == 'local':
+                    datasets[name] = rasterio.open(paths[name])
+                elif name in local:
+                    datasets[name] = rasterio.open(local[name])
+                else:
+                    datasets[name] = rasterio.open(paths[name], opener=throttled_opener_fn)
+
+            elif event['op'] == 'close':
+                srci = datasets.pop(event['name'], None)
+                if srci is not None:
+                    srci.close()
+
+            elif event['op'] == 'read':
+                window = event['window']
+                if strategy == 'coalesce':
+                    window = coalesce_fn(events, position - 1, merged)
+                row_off, col_off, height, width = window
+                datasets[event['name']].read(event['bands'], window=Window(col_off, row_off, width, height))
+                reads += 1
+    finally:
+        for srci in datasets.values():
+            srci.close()
+        executor.shutdown(wait=True)
+
+    return reads
+
+
+def main_routine():
+    """ Replay a recorded I/O trace with each strategy and write io_replay_results.json. """
+
+    cmd_args = get_cmd_args_fn()
+
+    events = io_trace.load_io_trace_fn(cmd_args.io_trace)[:cmd_args.max_events]
+    counts = OrderedDict((op, len([event for event in events if event['op'] == op]))
+                         for op in ['open', 'read', 'close', 'copy'])
+    print('Trace events: ', dict(counts))
+
+    paths = replay_rasters_fn(events, os.path.join(cmd_args.output_dir, 'rasters'))
+    copy_dir = os.path.join(cmd_args.output_dir, 'copies')
+
+    results = []
+    for strategy in cmd_args.strategies:
+        configure_link_fn(cmd_args.latency_ms, cmd_args.bandwidth_mb,
+                          cmd_args.readahead_kb if strategy == 'readahead' else 0)
+        start = time.perf_counter()
+        reads = replay_fn(events, paths, strategy, copy_dir, cmd_args.compute)
+        seconds = time.perf_counter() - start
+
+        result = {'strategy': strategy, 'seconds': round(seconds, 3), 'reads': reads,
+                  'requests': _LINK['requests'], 'opens': _LINK['opens'], 'bytes': _LINK['bytes'],
+                  'mb_per_second': round(_LINK['bytes'] / 1024 ** 2 / seconds, 2) if seconds > 0 else None}
+        results.append(result)
+        print('{0:<10} seconds: {1:>9.2f} reads: {2:>7} requests: {3:>7} opens: {4:>5} MB transferred: {5:>9.1f}'
+              .format(strategy, seconds, reads, result['requests'], result['opens'], result['bytes'] / 1024 ** 2))
+
+    shutil.rmtree(copy_dir, ignore_errors=True)
+
+    results_path = os.path.join(cmd_args.output_dir, 'io_replay_results.json')
+    with open(results_path, 'w') as f:
+        json.dump({'io_trace': cmd_args.io_trace, 'events': counts, 'latency_ms': cmd_args.latency_ms,
+                   'bandwidth_mb': cmd_args.bandwidth_mb, 'readahead_kb': cmd_args.readahead_kb,
+                   'compute': cmd_args.compute, 'results': results}, f, indent=1)
+    print('Replay results: ', results_path)
+
+
+if __name__ == '__main__':
+    main_routine()
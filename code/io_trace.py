@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+io_trace.py
+===========
+
+Description: This script records the sequence of mosaic file opens, window reads and staging copies performed by a
+pipeline run (command argument --io_trace) so the I/O pattern of a production run can be replayed offline against
+synthetic rasters and a simulated network share (refer to io_replay.py).
+
+The trace is a json lines file (io_trace.jsonl in the export directory), one event per line in the order issued:
+
+ - open: the dataset name and its layout (driver, size, band count, data types, no data, block shape, interleaving,
+   compression, crs and transform), so the replay can create a synthetic raster with the same block layout.
+ - read: the dataset name, the window read (row_off, col_off, height, width - clipped to the raster) and bands.
+ - close: the dataset name.
+ - copy: a mosaic (and sidecars) copied into the staging directory (source, destination and bytes).
+
+Each event records its start time relative to the start of the trace (t) and its duration (seconds), so the gaps
+between events (the statistics and dataframe work of the run) can be replayed as well. If no trace has been
+configured the record functions do nothing.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import json
+import time
+import threading
+
+IO_TRACE_NAME = 'io_trace.jsonl'
+
+# module level trace (None = recording disabled) - refer to configure_io_trace_fn
+_IO_TRACE = None
+
+
+def configure_io_trace_fn(trace_path):
+    """ Start recording the mosaic I/O of the run (command argument --io_trace).
+
+    @param trace_path: string object containing the path to the trace file (io_trace.jsonl).
+    """
+    global _IO_TRACE
+
+    _IO_TRACE = {'path': trace_path, 'file': open(trace_path, 'a'), 'start': time.time(), 'lock': threading.Lock()}
+    print('Recording mosaic I/O to: ', trace_path)
+
+
+def close_io_trace_fn():
+    """ Stop recording and close the trace file. """
+    global _IO_TRACE
+
+    if _IO_TRACE is None:
+        return
+
+    _IO_TRACE['file'].close()
+    print('Mosaic I/O trace: ', _IO_TRACE['path'])
+    _IO_TRACE = None
+
+
+def write_event_fn(event, start, end):
+    """ Append an event to the trace (thread safe - staging copies are made by background threads).
+
+    @param event: dictionary object containing the event.
+    @param start: float object containing the event start (seconds since the epoch).
+    @param end: float object containing the event end.
+    """
+
+    event['t'] = round(start - _IO_TRACE['start'], 6)
+    event['seconds'] = round(end - start, 6)
+    line = json.dumps(event) + '\n'
+    with _IO_TRACE['lock']:
+        _IO_TRACE['file'].write(line)
+
+
+def record_open_fn(srci, start, end):
+    """ Record a dataset open and its layout.
+
+    @param srci: rasterio dataset object (open).
+    @param start, end: float objects containing the open start and end (seconds since the epoch).
+    """
+
+    if _IO_TRACE is None:
+        return
+
+    path = srci.name
+    write_event_fn({'op': 'open', 'name': path, 'driver': srci.driver, 'width': srci.width,
+                    'height': srci.height, 'count': srci.count, 'dtypes': list(srci.dtypes),
+                    'nodata': srci.nodata, 'block_shape': list(srci.block_shapes[0]),
+                    'interleave': getattr(srci.interleaving, 'name', None),
+                    'compress': getattr(srci.compression, 'name', None),
+                    'crs': srci.crs.to_string() if srci.crs else None, 'transform': list(srci.transform)[:6],
+                    'size': os.path.getsize(path) if os.path.isfile(path) else None}, start, end)
+
+
+def record_read_fn(srci, window, bands, start, end):
+    """ Record a window read.
+
+    @param srci: rasterio dataset object (open).
+    @param window: tuple object containing the window read (row_off, col_off, height, width - clipped).
+    @param bands: list object containing the band numbers read.
+    @param start, end: float objects containing the read start and end (seconds since the epoch).
+    """
+
+    if _IO_TRACE is None:
+        return
+
+    write_event_fn({'op': 'read', 'name': srci.name, 'window': [int(value) for value in window],
+                    'bands': list(bands)}, start, end)
+
+
+def record_close_fn(srci):
+    """ Record a dataset close. """
+
+    if _IO_TRACE is None:
+        return
+
+    now = time.time()
+    write_event_fn({'op': 'close', 'name': srci.name}, now, now)
+
+
+def record_copy_fn(source, destination, size, start, end):
+    """ Record a mosaic copied into the staging directory (refer to mosaic_staging.copy_to_stage_fn).
+
+    @param source: string object containing the source mosaic path.
+    @param destination: string object containing the staged mosaic path.
+    @param size: integer object containing the bytes copied (mosaic and sidecars).
+    @param start, end: float objects containing the copy start and end (seconds since the epoch).
+    """
+
+    if _IO_TRACE is None:
+        return
+
+    write_event_fn({'op': 'copy', 'name': destination, 'source': source, 'bytes': int(size)}, start, end)
+
+
+def load_io_trace_fn(trace_path):
+    """ Read the events of a trace file.
+
+    @param trace_path: string object containing the path to the trace file.
+    @return events: list object containing the event dictionaries in the order recorded.
+    """
+
+    with open(trace_path, 'r') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+
+    return events
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""
+memory_budget.py
+================
+
+Description: This script keeps the zonal stats steps within a memory budget (command argument --memory_budget).
+
+ - Site windows are read and summarised in batches sized to the budget (refer to zonal_engine.py).
+ - The per image results are exported to the per site csv files by export_by_site_fn. When the concatenated results
+   fit within the budget they are concatenated in memory (as before); otherwise the rows are spilled to a per site
+   csv in the temporary directory in chunks and each site is cleaned and exported on its own.
+ - The peak resident set size (RSS) and the duration of each pipeline stage are recorded and written to
+   memory_report.csv in the export directory.
+
+With no budget configured the steps behave as before (all site windows of an image in one batch and the results
+concatenated in memory).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import csv
+import sys
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# share of the budget available to site windows and to the in memory concatenation of results
+WINDOW_FRACTION = 0.25
+OUTPUT_FRACTION = 0.5
+
+# approximate in memory size of a DataFrame relative to its csv size
+CSV_MEMORY_FACTOR = 5
+
+# module level budget in bytes (None = unlimited) and stage records
+_BUDGET = None
+_STAGES = []
+
+
+def parse_memory_fn(memory):
+    """ Convert a memory size string (i.e. '8GB', '512MB' or '8') into bytes (a bare number is read as GB).
+
+    @param memory: string object containing the memory size.
+    @return integer object containing the number of bytes.
+    """
+
+    text = str(memory).strip().upper().replace(' ', '')
+    units = [('TB', 1024 ** 4), ('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024), ('T', 1024 ** 4),
+             ('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024), ('B', 1)]
+    for unit, factor in units:
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+
+    return int(float(text) * 1024 ** 3)
+
+
+def configure_memory_budget_fn(memory_budget):
+    """ Set the memory budget for the remainder of the run.
+
+    @param memory_budget: string object containing the memory budget (i.e. '6GB') or None for no budget.
+    """
+    global _BUDGET
+
+    _BUDGET = None if memory_budget is None else parse_memory_fn(memory_budget)
+    if _BUDGET is not None:
+        print('Memory budget (MB): ', round(_BUDGET / 1024 ** 2))
+
+
+def memory_budget_fn():
+    """ Return the memory budget in bytes (None if no budget has been set). """
+
+    return _BUDGET
+
+
+def current_rss_fn():
+    """ Return the resident set size of the current process in bytes (None if it cannot be measured). """
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    return None
+
+
+def site_batch_size_fn(bytes_per_site, site_count):
+    """ Return the number of site windows which can be held in memory at once.
+
+    @param bytes_per_site: integer object containing the approximate memory required per site window (all bands).
+    @param site_count: integer object containing the number of sites.
+    @return integer object containing the batch size (all sites if no budget has been set).
+    """
+
+    if _BUDGET is None or bytes_per_site <= 0:
+        return max(site_count, 1)
+
+    return int(max(1, min(site_count, (_BUDGET * WINDOW_FRACTION) // bytes_per_site)))
+
+
+def _sample_rss_fn(record, stop):
+    """ Sample the RSS until stop is set, retaining the peak in record['peak_rss']. """
+
+    while not stop.wait(0.2):
+        rss = current_rss_fn()
+        if rss is not None and rss > record['peak_rss']:
+            record['peak_rss'] = rss
+
+
+@contextmanager
+def stage_fn(stage):
+    """ Record the duration and peak RSS of a pipeline stage.
+
+    @param stage: string object containing the stage name (i.e. 'dbi').
+    """
+
+    start_rss = current_rss_fn()
+    record = {'stage': stage, 'start_rss': start_rss or 0, 'peak_rss': start_rss or 0, 'seconds': 0.0}
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_rss_fn, args=(record, stop))
+    sampler.daemon = True
+    sampler.start()
+    start = time.time()
+
+    try:
+        yield record
+    finally:
+        stop.set()
+        sampler.join()
+        end_rss = current_rss_fn()
+        if end_rss is not None and end_rss > record['peak_rss']:
+            record['peak_rss'] = end_rss
+        record['seconds'] = time.time() - start
+        _STAGES.append(record)
+        print('Stage: ', stage, ' seconds: ', round(record['seconds'], 1), ' peak RSS (MB): ',
+              round(record['peak_rss'] / 1024 ** 2, 1))
+
+
+def write_memory_report_fn(export_dir_path):
+    """ Write the stage durations and peak RSS to memory_report.csv in the export directory.
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @return report_path: string object containing the path to the report.
+    """
+
+    report_path = os.path.join(export_dir_path, 'memory_report.csv')
+    with open(report_path, 'w') as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['stage', 'seconds', 'start_rss_mb', 'peak_rss_mb', 'memory_budget_mb'])
+        for record in _STAGES:
+            writer.writerow([record['stage'], round(record['seconds'], 2),
+                             round(record['start_rss'] / 1024 ** 2, 1), round(record['peak_rss'] / 1024 ** 2, 1),
+                             '' if _BUDGET is None else round(_BUDGET / 1024 ** 2)])
+
+    print('Memory report: ', report_path)
+
+    return report_path
+
+
+def chunk_rows_fn(csv_files):
+    """ Return the number of csv rows which can be read at once within the budget.
+
+    @param csv_files: list object containing csv file paths.
+    @return integer object containing the number of rows per chunk.
+    """
+
+    line_bytes = 200
+    for path in csv_files:
+        with open(path, 'r') as f:
+            sample = f.read(65536)
+        if sample.count('\n') > 1:
+            line_bytes = max(len(sample) // sample.count('\n'), 1)
+            break
+
+    return int(max(1000, (_BUDGET * WINDOW_FRACTION) // (line_bytes * CSV_MEMORY_FACTOR * max(len(csv_files), 1))))
+
+
+def export_site_df_fn(out_df, out_path):
+    """ Export a single site DataFrame to csv. """
+
+    import run_report
+
+    print("export to: ", out_path)
+    # export the pandas df to a csv file
+    out_df.to_csv(out_path, index=False)
+    run_report.count_fn('rows_written', len(out_df))
+
+
+def export_by_site_fn(csv_files, clean_fn, output_dir, file_name, spill_dir, site_column='site',
+                      float_precision=None):
+    """ Concatenate the per image results, clean them and export one csv per site, spilling to disk when the
+    concatenated results would not fit within the memory budget.
+
+    @param csv_files: list object containing the per image csv paths.
+    @param clean_fn: function object which accepts the concatenated DataFrame and returns the cleaned DataFrame.
+    @param output_dir: string object containing the path to the product zonal stats export directory.
+    @param file_name: string object containing the site csv file name template (i.e. '{0}_dka_zonal_stats.csv').
+    @param spill_dir: string object containing the path to a temporary directory used when spilling.
+    @param site_column: string object containing the site column name before cleaning.
+    @param float_precision: string object passed to pandas.read_csv (i.e. 'round_trip').
+    @return integer object containing the number of sites exported.
+    """
+    import pandas as pd
+
+    in_memory = sum(os.path.getsize(f) for f in csv_files) * CSV_MEMORY_FACTOR
+    if _BUDGET is None or in_memory <= _BUDGET * OUTPUT_FRACTION:
+        df_from_each_file = (pd.read_csv(f, float_precision=float_precision) for f in csv_files)
+        output_zonal_stats = pd.concat(df_from_each_file, ignore_index=False, axis=0, sort=False)
+        print(output_zonal_stats.shape)
+
+        output_zonal_stats = clean_fn(output_zonal_stats)
+
+        site_list = output_zonal_stats.site.unique().tolist()
+        print("length of site list: ", len(site_list))
+        for i in site_list:
+            export_site_df_fn(output_zonal_stats[output_zonal_stats['site'] == i],
+                              os.path.join(output_dir, file_name.format(str(i))))
+
+        return len(site_list)
+
+    # ------------------------------------------------ spill to disk -----------------------------------------------
+    print("Results exceed the memory budget, spilling to: ", spill_dir)
+    if not os.path.exists(spill_dir):
+        os.makedirs(spill_dir)
+
+    chunk_rows = chunk_rows_fn(csv_files)
+    site_files = {}
+
+    # align every chunk to the union of the csv columns (as pandas.concat would)
+    columns = []
+    for f in csv_files:
+        columns.extend(c for c in pd.read_csv(f, nrows=0).columns if c not in columns)
+    chunks = (chunk.reindex(columns=columns) for f in csv_files
+              for chunk in pd.read_csv(f, chunksize=chunk_rows, float_precision=float_precision))
+
+    for chunk in chunks:
+        for site, group in chunk.groupby(site_column, sort=False):
+            if site not in site_files:
+                site_files[site] = os.path.join(spill_dir, 'site_{0}.csv'.format(len(site_files)))
+                group.to_csv(site_files[site], index=False)
+            else:
+                group.to_csv(site_files[site], index=False, header=False, mode='a')
+
+    print("length of site list: ", len(site_files))
+    for spill_file in site_files.values():
+        # values were parsed once already, read them back exactly
+        site_df = clean_fn(pd.read_csv(spill_file, float_precision='round_trip'))
+        for i in site_df.site.unique().tolist():
+            export_site_df_fn(site_df[site_df['site'] == i], os.path.join(output_dir, file_name.format(str(i))))
+
+    shutil.rmtree(spill_dir)
+
+    return len(site_files)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+"""
+mosaic_staging.py
+=================
+
+Description: This script stages the Landsat mosaics a run needs from the network share (i.e. R:\\landsat\\mosaics)
+onto fast local disk so that each product step, and each rerun on the same workstation, reads the local copy.
+
+ - Staged files are stored under stage_dir/<source directory key>/<file name> so image names are unchanged.
+ - HFA and GeoTIFF sidecar files (.ige, .rrd, .ovr, .aux.xml) are staged alongside the image.
+ - A json index (staging_index.json) records the source size and modification time of each staged file; a staged
+   copy is only used when both still match the source, otherwise it is copied again.
+ - The cache has a size budget (GB). When a new file does not fit, the least recently used files are evicted; the
+   mosaics being read or copied are never evicted, and a file which cannot be removed (i.e. open on Windows) stays in
+   the index and the next least recently used file is evicted instead.
+ - The next images in the plan are prefetched concurrently while the current image is processed.
+
+Staging is optional: if configure_staging_fn has not been called, staged_images_fn yields the source paths.
+Images already completed in a resumed run (refer to run_manifest.py) are skipped before they are staged.
+Mosaics with a current tiled copy in the tiled cache (refer to mosaic_transcode.py) are read from that copy and are
+not staged.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import io_trace
+import mosaic_transcode
+import run_manifest
+import run_report
+
+SIDECAR_EXTENSIONS = ['.ige', '.rrd', '.ovr', '.aux.xml']
+
+# module level staging configuration (None = staging disabled)
+_STAGING = None
+
+
+def configure_staging_fn(stage_dir, budget_gb, prefetch=2):
+    """ Enable the local staging cache for the remainder of the run.
+
+    @param stage_dir: string object containing the path to a local (SSD) directory used to stage mosaics.
+    @param budget_gb: float object containing the maximum size of the staging directory in gigabytes.
+    @param prefetch: integer object containing the number of upcoming images copied in the background.
+    @return staging: dictionary object containing the staging configuration and index.
+    """
+    global _STAGING
+
+    if not os.path.exists(stage_dir):
+        os.makedirs(stage_dir)
+
+    index_path = os.path.join(stage_dir, 'staging_index.json')
+    index = {}
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            print('Staging index is unreadable and will be rebuilt: ', index_path)
+
+    # drop index entries whose local files have been removed outside of the pipeline
+    index = {source: entry for source, entry in index.items()
+             if all(os.path.isfile(path) for path in entry['local_files'])}
+
+    _STAGING = {'stage_dir': stage_dir,
+                'budget': int(float(budget_gb) * 1024 ** 3),
+                'prefetch': max(int(prefetch), 0),
+                'index_path': index_path,
+                'index': index,
+                'lock': threading.Lock(),
+                'in_flight': {},
+                'in_use': Counter(),
+                'executor': ThreadPoolExecutor(max_workers=max(int(prefetch), 1), thread_name_prefix='staging'),
+                'hits': 0,
+                'copies': 0}
+
+    print('Mosaic staging enabled: ', stage_dir, ' budget (GB): ', budget_gb)
+
+    return _STAGING
+
+
+def close_staging_fn():
+    """ Wait for outstanding prefetches, save the staging index and disable staging. """
+    global _STAGING
+
+    if _STAGING is None:
+        return
+
+    _STAGING['executor'].shutdown(wait=True)
+    with _STAGING['lock']:
+        save_index_fn(_STAGING)
+
+    print('Mosaic staging - local hits: ', _STAGING['hits'], ' copied from source: ', _STAGING['copies'])
+    _STAGING = None
+
+
+def save_index_fn(staging):
+    """ Write the staging index to disk (call while holding the staging lock).
+
+    @param staging: dictionary object returned by configure_staging_fn.
+    """
+
+    temp_path = staging['index_path'] + '.part'
+    with open(temp_path, 'w') as f:
+        json.dump(staging['index'], f, indent=1)
+    os.replace(temp_path, staging['index_path'])
+
+
+def source_files_fn(source):
+    """ Return the image path and any sidecar files which exist beside it.
+
+    @param source: string object containing the path to the source mosaic.
+    @return list object containing the source image path followed by existing sidecar paths.
+    """
+
+    files = [source]
+    stem = os.path.splitext(source)[0]
+    for ext in SIDECAR_EXTENSIONS:
+        for candidate in (stem + ext, source + ext):
+            if candidate not in files and os.path.isfile(candidate):
+                files.append(candidate)
+
+    return files
+
+
+def fingerprint_fn(files):
+    """ Return the size and modification time of each file (used to validate staged copies).
+
+    @param files: list object containing file paths.
+    @return list object containing [size, mtime] per file.
+    """
+
+    fingerprint = []
+    for path in files:
+        stat = os.stat(path)
+        fingerprint.append([stat.st_size, int(stat.st_mtime)])
+
+    return fingerprint
+
+
+def local_dir_fn(staging, source):
+    """ Return the staging sub-directory for a source directory (keeps file names unchanged).
+
+    @param staging: dictionary object returned by configure_staging_fn.
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the local directory path.
+    """
+
+    source_dir = os.path.dirname(os.path.abspath(source))
+    key = hashlib.sha1(source_dir.lower().encode('utf-8')).hexdigest()[:12]
+
+    return os.path.join(staging['stage_dir'], key)
+
+
+def evict_fn(staging, required, keep):
+    """ Remove least recently used staged files until the required number of bytes fits within the budget
+    (call while holding the staging lock).
+
+    @param staging: dictionary object returned by configure_staging_fn.
+    @param required: integer object containing the number of bytes about to be staged.
+    @param keep: set object containing source paths which must not be evicted (in use or in flight).
+    @return boolean object, True if the required bytes now fit within the budget.
+    """
+
+    index = staging['index']
+    used = sum(entry['size'] for entry in index.values())
+
+    for source in sorted(index, key=lambda s: index[s]['last_access']):
+        if used + required <= staging['budget']:
+            break
+        if source in keep:
+            continue
+        try:
+            for path in index[source]['local_files']:
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as err:
+            # the entry keeps its bytes until its files are removed (a later hit finds the files missing and copies)
+            print('Staged copy could not be evicted: ', source, err)
+            continue
+        used -= index.pop(source)['size']
+        print('Evicted from staging: ', source)
+
+    return used + required <= staging['budget']
+
+
+def copy_to_stage_fn(staging, source):
+    """ Copy a source mosaic (and sidecars) into the staging directory if there is no valid staged copy.
+
+    @param staging: dictionary object returned by configure_staging_fn.
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the path to read (staged copy, or the source if it cannot be staged).
+    """
+
+    files = source_files_fn(source)
+    fingerprint = fingerprint_fn(files)
+    size = sum(item[0] for item in fingerprint)
+    local_dir = local_dir_fn(staging, source)
+    local_files = [os.path.join(local_dir, os.path.basename(path)) for path in files]
+
+    with staging['lock']:
+        entry = staging['index'].get(source)
+        if entry is not None and entry['fingerprint'] == fingerprint \
+                and all(os.path.isfile(path) for path in entry['local_files']):
+            entry['last_access'] = time.time()
+            staging['hits'] += 1
+            return entry['local_files'][0]
+
+        keep = set(staging['in_flight']) | set(staging['in_use']) | {source}
+        if size > staging['budget'] or not evict_fn(staging, size, keep):
+            print('Mosaic exceeds the staging budget and will be read from source: ', source)
+            return source
+
+        # reserve the space before releasing the lock
+        staging['index'][source] = {'local_files': local_files, 'fingerprint': fingerprint, 'size': size,
+                                    'last_access': time.time()}
+
+    try:
+        if not os.path.exists(local_dir):
+            os.makedirs(local_dir)
+        start = time.time()
+        with run_report.span_fn('stage copy', image=os.path.basename(source), bytes=size):
+            for path, local_path in zip(files, local_files):
+                shutil.copyfile(path, local_path + '.part')
+                os.replace(local_path + '.part', local_path)
+        io_trace.record_copy_fn(source, local_files[0], size, start, time.time())
+    except (IOError, OSError) as err:
+        print('Staging failed, reading from source: ', source, err)
+        with staging['lock']:
+            staging['index'].pop(source, None)
+        return source
+
+    with staging['lock']:
+        staging['copies'] += 1
+        save_index_fn(staging)
+
+    return local_files[0]
+
+
+def stage_image_fn(source):
+    """ Return the path to read for a source mosaic, waiting on an in-flight prefetch if there is one.
+
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the staged path (or the source path when staging is disabled).
+    """
+
+    staging = _STAGING
+    if staging is None:
+        return source
+
+    with staging['lock']:
+        future = staging['in_flight'].get(source)
+
+    if future is not None:
+        # time spent waiting on a prefetch from the network share
+        with run_report.span_fn('stage wait', image=os.path.basename(source)):
+            path = future.result()
+    else:
+        path = copy_to_stage_fn(staging, source)
+
+    return path
+
+
+def use_source_fn(staging, source, count):
+    """ Add (count=1) or remove (count=-1) a mosaic handed out to a reader, so it is not evicted while it is read.
+
+    @param staging: dictionary object returned by configure_staging_fn.
+    @param source: string object containing the path to the source mosaic.
+    @param count: integer object, 1 when the mosaic is handed out and -1 when it has been read.
+    """
+
+    with staging['lock']:
+        staging['in_use'][source] += count
+        if staging['in_use'][source] <= 0:
+            del staging['in_use'][source]
+
+
+def prefetch_images_fn(sources):
+    """ Start copying upcoming mosaics into the staging directory in the background.
+
+    @param sources: list object containing the source paths of the next images in the plan.
+    """
+
+    staging = _STAGING
+    if staging is None:
+        return
+
+    with staging['lock']:
+        for source in sources:
+            if source not in staging['in_flight']:
+                future = staging['executor'].submit(copy_to_stage_fn, staging, source)
+                staging['in_flight'][source] = future
+                future.add_done_callback(lambda _, s=source: staging['in_flight'].pop(s, None))
+
+
+def staged_images_fn(csv_file, stage=None):
+    """ Yield the path to read for each image listed in an image list csv, prefetching the next images.
+
+    @param csv_file: string object containing the path to the image list csv (1 path per line).
+    @param stage: string object containing the run manifest checkpoint name (i.e. 'dbi'), images completed before
+    the run was resumed are skipped.
+    @return generator object yielding the tiled cache, staged or source image paths in list order.
+    """
+
+    with open(csv_file, 'r') as imagery_list:
+        sources = [image.rstrip() for image in imagery_list if image.strip()]
+
+    return staged_sources_fn(sources, stage)
+
+
+def staged_sources_fn(sources, stage=None):
+    """ Yield the path to read for each mosaic in a list of source paths, prefetching the next images
+    (refer to staged_images_fn).
+
+    @param sources: list object containing the source mosaic paths.
+    @param stage: string object containing the run manifest checkpoint name, or None.
+    @return generator object yielding the tiled cache, staged or source image paths in list order.
+    """
+
+    if stage is not None:
+        completed = [source for source in sources if run_manifest.image_complete_fn(stage, source)]
+        if completed:
+            print('Checkpoint - images already complete (', stage, '): ', len(completed), ' of ', len(sources))
+            sources = [source for source in sources if source not in completed]
+
+    # images with a current tiled copy are read from the tiled cache
+    tiled = {source: mosaic_transcode.tiled_image_fn(source) for source in sources}
+
+    # the mosaic handed out is held until the next image is requested or the generator is closed
+    held = None
+    try:
+        for position, source in enumerate(sources):
+            if held is not None:
+                use_source_fn(*held, count=-1)
+                held = None
+
+            if tiled[source] is not None:
+                yield tiled[source]
+                continue
+
+            staging = _STAGING
+            if staging is not None:
+                held = (staging, source)
+                use_source_fn(staging, source, 1)
+                if staging['prefetch']:
+                    upcoming = [s for s in sources[position + 1:] if tiled[s] is None]
+                    prefetch_images_fn(upcoming[:staging['prefetch']])
+            yield stage_image_fn(source)
+    finally:
+        if held is not None:
+            use_source_fn(*held, count=-1)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+"""
+mosaic_transcode.py
+===================
+
+Description: This script builds, and reads through, a local cache of internally tiled, compressed GeoTIFF copies of
+the Landsat mosaics. The h99a2, fpca2 and stc mosaics are HFA (.img) files and some seasonal composites are striped
+GeoTIFFs; a small window read from either format decodes full-width strips. A 256 x 256 tiled copy only decodes the
+tiles which intersect the site window.
+
+ - Each mosaic is transcoded once and stored as tiled_cache/<source fingerprint>/<source file name>. The fingerprint is
+   derived from the source path, size and modification time, so a changed mosaic is transcoded again.
+ - The cached file keeps the source file name (GDAL identifies the GeoTIFF by content, not extension) so image names
+   and dates recorded in the outputs are unchanged.
+ - Internal overviews (2, 4, 8, 16, 32) are built with nearest neighbour resampling (safe for classified products).
+ - Mosaics which are already tiled GeoTIFFs are read from source and are not transcoded.
+
+Cache builder command (run once, or after new mosaics are published):
+
+    python mosaic_transcode.py -c D:\\tiled_cache -l R:\\landsat\\mosaics -w 4
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+import product_registry
+import warnings
+
+warnings.filterwarnings("ignore")
+
+BLOCK_SIZE = 256
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+# module level tiled cache directory (None = read through disabled)
+_TILED_CACHE = None
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Transcode the Landsat mosaics into a local cache of tiled, compressed GeoTIFFs with overviews.''')
+
+    p.add_argument('-c', '--tiled_cache', help='The local directory used to store the tiled GeoTIFF cache.')
+
+    p.add_argument('-l', '--mosaics_dir', help="The NT seasonal mosaics directory path",
+                   default=r"R:\landsat\mosaics")
+
+    p.add_argument('-w', '--workers', type=int,
+                   help="Enter the number of mosaics transcoded at the same time (i.e. 4)", default=1)
+
+    p.add_argument('-p', '--prune', action='store_true',
+                   help="Remove cached mosaics which no longer match a current source mosaic.")
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.tiled_cache is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def configure_tiled_cache_fn(tiled_cache):
+    """ Enable reading through the tiled GeoTIFF cache for the remainder of the run.
+
+    @param tiled_cache: string object containing the path to the tiled cache directory.
+    """
+    global _TILED_CACHE
+
+    _TILED_CACHE = tiled_cache
+    print('Reading mosaics through the tiled cache: ', tiled_cache)
+
+
+def fingerprint_fn(source):
+    """ Return a key derived from the source path, size and modification time.
+
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the fingerprint key.
+    """
+
+    stat = os.stat(source)
+    key = '{0}|{1}|{2}'.format(os.path.abspath(source).lower(), stat.st_size, int(stat.st_mtime))
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_path_fn(tiled_cache, source):
+    """ Return the tiled cache path for a source mosaic.
+
+    @param tiled_cache: string object containing the path to the tiled cache directory.
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the cached GeoTIFF path (source file name retained).
+    """
+
+    return os.path.join(tiled_cache, fingerprint_fn(source), os.path.basename(source))
+
+
+def needs_transcode_fn(source):
+    """ Return True if the source mosaic is not an internally tiled GeoTIFF.
+
+    @param source: string object containing the path to the source mosaic.
+    @return boolean object.
+    """
+    import rasterio
+
+    with rasterio.open(source) as srci:
+        block_height, block_width = srci.block_shapes[0]
+        tiled = srci.driver == 'GTiff' and block_width < srci.width and block_height > 1
+
+    return not tiled
+
+
+def transcode_fn(source, destination):
+    """ Write a tiled, compressed GeoTIFF copy of a mosaic with internal overviews.
+
+    @param source: string object containing the path to the source mosaic.
+    @param destination: string object containing the path to the cached GeoTIFF.
+    @return destination: string object containing the path to the cached GeoTIFF.
+    """
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.windows import Window
+
+    destination_dir = os.path.dirname(destination)
+    if not os.path.exists(destination_dir):
+        os.makedirs(destination_dir)
+
+    temp_path = destination + '.part'
+
+    with rasterio.open(source) as srci:
+        profile = srci.profile.copy()
+        profile.update(driver='GTiff', tiled=True, blockxsize=BLOCK_SIZE, blockysize=BLOCK_SIZE,
+                       compress='deflate', predictor=2 if srci.dtypes[0].startswith(('int', 'uint')) else 3,
+                       BIGTIFF='IF_SAFER', interleave='pixel' if srci.count > 1 else 'band')
+
+        with rasterio.open(temp_path, 'w', **profile) as dst:
+            # copy in strips of tiles to bound memory use
+            for row_off in range(0, srci.height, BLOCK_SIZE * 4):
+                height = min(BLOCK_SIZE * 4, srci.height - row_off)
+                window = Window(0, row_off, srci.width, height)
+                dst.write(srci.read(window=window), window=window)
+
+    with rasterio.open(temp_path, 'r+') as dst:
+        factors = [f for f in OVERVIEW_FACTORS if min(dst.width, dst.height) // f >= BLOCK_SIZE // 4]
+        if factors:
+            dst.build_overviews(factors, Resampling.nearest)
+            dst.update_tags(ns='rio_overview', resampling='nearest')
+
+    os.replace(temp_path, destination)
+
+    return destination
+
+
+def build_cached_image_fn(tiled_cache, source):
+    """ Transcode a single mosaic into the tiled cache if it is not already cached.
+
+    @param tiled_cache: string object containing the path to the tiled cache directory.
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the path which should be read for the mosaic.
+    """
+
+    destination = cache_path_fn(tiled_cache, source)
+    if os.path.isfile(destination):
+        return destination
+
+    if not needs_transcode_fn(source):
+        print('Already tiled, read from source: ', source)
+        return source
+
+    print('Transcoding: ', source)
+    return transcode_fn(source, destination)
+
+
+def tiled_image_fn(source):
+    """ Return the cached tiled copy of a mosaic if one exists for the current source fingerprint.
+
+    @param source: string object containing the path to the source mosaic.
+    @return string object containing the cached path, or None if there is no current cached copy.
+    """
+
+    if _TILED_CACHE is None:
+        return None
+
+    try:
+        destination = cache_path_fn(_TILED_CACHE, source)
+    except OSError:
+        return None
+
+    if os.path.isfile(destination):
+        return destination
+
+    return None
+
+
+def catalog_images_fn(mosaics_dir):
+    """ Return every mosaic of the registered products (refer to product_registry.py).
+
+    @param mosaics_dir: string object containing the path to the Landsat mosaic directory.
+    @return list_image: list object containing the mosaic paths.
+    """
+
+    list_image = []
+    for product in product_registry.PRODUCTS:
+        for image in sorted(glob(os.path.join(mosaics_dir, product['sub_dir'], product['pattern']))):
+            if image not in list_image:
+                list_image.append(image)
+
+    return list_image
+
+
+def prune_cache_fn(tiled_cache, list_image):
+    """ Remove cached fingerprints which no longer match a current source mosaic.
+
+    @param tiled_cache: string object containing the path to the tiled cache directory.
+    @param list_image: list object containing the current mosaic paths.
+    """
+
+    current = set(fingerprint_fn(image) for image in list_image)
+    for key in os.listdir(tiled_cache):
+        if key not in current and os.path.isdir(os.path.join(tiled_cache, key)):
+            shutil.rmtree(os.path.join(tiled_cache, key))
+            print('Removed stale cache entry: ', key)
+
+
+def main_routine():
+    """ Transcode every catalogued mosaic into the tiled cache. """
+
+    cmd_args = get_cmd_args_fn()
+    tiled_cache = cmd_args.tiled_cache
+
+    if not os.path.exists(tiled_cache):
+        os.makedirs(tiled_cache)
+
+    list_image = catalog_images_fn(cmd_args.mosaics_dir)
+    print('Mosaics in catalog: ', len(list_image))
+
+    if cmd_args.workers > 1:
+        with ProcessPoolExecutor(max_workers=cmd_args.workers) as executor:
+            for source, path in zip(list_image, executor.map(build_cached_image_fn,
+                                                             [tiled_cache] * len(list_image), list_image)):
+                print(' - ', source, ' -> ', path)
+    else:
+        for source in list_image:
+            print(' - ', source, ' -> ', build_cached_image_fn(tiled_cache, source))
+
+    if cmd_args.prune:
+        prune_cache_fn(tiled_cache, list_image)
+
+    print('Tiled cache is complete: ', tiled_cache)
+
+
+if __name__ == '__main__':
+    main_routine()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+product_registry.py
+===================
+
+Description: This script contains the registry of the Landsat mosaic products processed by the pipeline. Each entry
+describes everything which differs between products; the zonal stats engine (step1_4_product_zonal_stats.py)
+executes any registered product, so a new mosaic type is added with a new entry rather than a new step script.
+
+Entry keys:
+
+ - name: string object containing the product name (output directory '<name>_zonal_stats' and csv file names).
+ - sub_dir: string object containing the mosaic sub-directory (relative to command argument --mosaics_dir).
+ - pattern: string object containing the glob search criteria for the mosaics.
+ - bands: list object containing the band numbers to extract.
+ - no_data: integer object containing the no data value.
+ - kind: string object, 'continuous' (one column per statistic and band) or 'categorical' (pixel counts per class,
+   one row per band).
+ - stats: list object containing the rasterstats statistics (output columns follow this order).
+ - scale, offset: float objects, value statistics are corrected to value * scale + offset (spread statistics are
+   only scaled).
+ - null_zero_min: boolean object, if True a minimum of 0 is replaced with a null value (continuous products).
+ - category_map: dictionary object mapping class values to column names (categorical products).
+ - time_stamp: boolean object, if True the image date is converted into start and end day, month, year and date
+   columns, otherwise the image date is retained as a single date column.
+
+The per scene products (SCENE_PRODUCTS, refer to scene_stack.py) use the same keys without sub_dir, pattern and
+time_stamp, plus:
+
+ - sensor_bands: dictionary object containing the band numbers of a sensor (i.e. 'l5tmre') where they differ from bands.
+ - all_touched: boolean object, the site rasterization rule (False: only the pixels whose centre is within the site,
+   as the archived per scene workflows, i.e. archive/step1_6_dp0_zonal_stats.py).
+
+The monthly climate grids (CLIMATE_GRIDS, refer to climate_cube.py) use the same keys with a single band, with suffix
+(the file name ending of the grids) in place of pattern; a no_data of None uses the no data value of the grids.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+
+CONTINUOUS_STATS = ['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50',
+                    'percentile_75', 'percentile_95', 'percentile_99', 'range']
+
+CATEGORICAL_STATS = ['count', 'min', 'max', 'mean', 'sum', 'std', 'median', 'majority', 'minority']
+
+# products are processed in registry order
+PRODUCTS = [
+    {'name': 'h99a2', 'sub_dir': os.path.join("structural_formation", "h99_mos"), 'pattern': "*h99a2*.img",
+     'bands': [1], 'no_data': 0, 'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1, 'offset': -100,
+     'null_zero_min': True, 'category_map': None, 'time_stamp': True},
+
+    {'name': 'fpca2', 'sub_dir': os.path.join("structural_formation", "h99_mos"), 'pattern': "*fpca2*.img",
+     'bands': [1], 'no_data': 0, 'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1, 'offset': 0,
+     'null_zero_min': True, 'category_map': None, 'time_stamp': True},
+
+    {'name': 'dbi', 'sub_dir': os.path.join("SeasonalComposites", "dbi"), 'pattern': "*dbi*.tif",
+     'bands': [1, 2, 3, 4, 5, 6], 'no_data': 32767, 'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1,
+     'offset': -100, 'null_zero_min': True, 'category_map': None, 'time_stamp': True},
+
+    {'name': 'dim', 'sub_dir': os.path.join("SeasonalComposites", "dim"), 'pattern': "*dim*.tif",
+     'bands': [1, 2, 3], 'no_data': 0, 'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1, 'offset': -100,
+     'null_zero_min': True, 'category_map': None, 'time_stamp': True},
+
+    {'name': 'dis', 'sub_dir': os.path.join("SeasonalComposites", "dis"), 'pattern': "*dis*.tif",
+     'bands': [1], 'no_data': 255, 'kind': 'categorical', 'stats': CATEGORICAL_STATS, 'scale': 1, 'offset': 0,
+     'null_zero_min': False, 'time_stamp': True,
+     'category_map': {1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five', 6: 'six', 7: 'seven', 8: 'eight',
+                      9: 'nine', 10: 'ten'}},
+
+    {'name': 'dja', 'sub_dir': os.path.join("SeasonalComposites", "dja"), 'pattern': "*dja*.tif",
+     'bands': [1], 'no_data': 0, 'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1, 'offset': -100,
+     'null_zero_min': True, 'category_map': None, 'time_stamp': True},
+
+    {'name': 'dka', 'sub_dir': "fire_scar", 'pattern': "*dka*.tif",
+     'bands': [1], 'no_data': 255, 'kind': 'categorical', 'stats': CATEGORICAL_STATS, 'scale': 1, 'offset': 0,
+     'null_zero_min': False, 'time_stamp': False,
+     'category_map': {1: 'jan', 2: 'feb', 3: 'mar', 4: 'april', 5: 'may', 6: 'june', 7: 'july', 8: 'aug',
+                      9: 'sep', 10: 'oct', 11: 'nov', 12: 'dec'}},
+
+    {'name': 'stc', 'sub_dir': os.path.join("structural_formation", "stc_17"), 'pattern': "*stc*.img",
+     'bands': [1], 'no_data': 0, 'kind': 'categorical', 'stats': CATEGORICAL_STATS, 'scale': 1, 'offset': 0,
+     'null_zero_min': False, 'time_stamp': True,
+     'category_map': {1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five', 6: 'six', 7: 'seven', 8: 'eight',
+                      9: 'nine', 10: 'ten', 11: 'eleven', 12: 'twelve', 13: 'thirteen', 14: 'fourteen',
+                      15: 'fifteen', 16: 'sixteen', 17: 'seventeen'}},
+]
+
+# per scene Landsat products (*_<name>m<zone>_zstdmask.img, one directory per WRS2 path_row, refer to scene_stack.py).
+# The bands of each sensor (the first field of the scene file name) are listed in sensor_bands, the remaining bands of
+# a product are null for that sensor (i.e. the Landsat 5 and 7 reflectance layout, refer to
+# archive/step1_9_reflectance_zonal_stats_working.py removel7t5_bands_fn).
+SCENE_STATS = ['count', 'min', 'max', 'mean', 'median', 'std']
+
+SCENE_PRODUCTS = [
+    {'name': 'dil', 'bands': [1, 2, 3], 'sensor_bands': {}, 'no_data': 0, 'kind': 'continuous',
+     'stats': SCENE_STATS, 'scale': 1, 'offset': -100, 'null_zero_min': True, 'category_map': None,
+     'all_touched': False},
+
+    {'name': 'dp0', 'bands': [1, 2, 3], 'sensor_bands': {}, 'no_data': 0, 'kind': 'continuous',
+     'stats': SCENE_STATS, 'scale': 1, 'offset': -100, 'null_zero_min': True, 'category_map': None,
+     'all_touched': False},
+
+    {'name': 'dp1', 'bands': [1, 2, 3], 'sensor_bands': {}, 'no_data': 0, 'kind': 'continuous',
+     'stats': SCENE_STATS, 'scale': 1, 'offset': -100, 'null_zero_min': True, 'category_map': None,
+     'all_touched': False},
+
+    {'name': 'dbg', 'bands': [1, 2, 3, 4, 5, 6, 7],
+     'sensor_bands': {'l5tmre': [1, 2, 3, 4, 5, 6], 'l7tmre': [1, 2, 3, 4, 5, 6]}, 'no_data': 0,
+     'kind': 'continuous', 'stats': CONTINUOUS_STATS, 'scale': 1, 'offset': -100, 'null_zero_min': True,
+     'category_map': None, 'all_touched': False},
+]
+
+
+# monthly climate grids (one single band grid per month, i.e. SILO rainfall and the QLD grids) under sub_dir of command
+# argument --grid_dir (year sub-directories included), refer to archive/step1_7_monthly_rainfall_zonal_stats.py and
+# archive/step1_8_qld_grid_zonal_stats.py (the QLD grids are offset by 100).
+CLIMATE_STATS = ['count', 'min', 'max', 'mean', 'median', 'std']
+
+QLD_GRID_STATS = ['count', 'min', 'max', 'mean', 'median', 'std', 'percentile_25', 'percentile_50', 'percentile_75',
+                  'percentile_95', 'percentile_99', 'range']
+
+CLIMATE_GRIDS = [
+    {'name': 'rainfall', 'sub_dir': 'rainfall', 'suffix': '.tif', 'bands': [1], 'no_data': -1, 'kind': 'continuous',
+     'stats': CLIMATE_STATS, 'scale': 1, 'offset': 0, 'null_zero_min': False, 'category_map': None},
+
+    {'name': 'max_temp', 'sub_dir': 'max_temp', 'suffix': '.tif', 'bands': [1], 'no_data': None,
+     'kind': 'continuous', 'stats': QLD_GRID_STATS, 'scale': 1, 'offset': -100, 'null_zero_min': False,
+     'category_map': None},
+]
+
+
+def product_names_fn():
+    """ Return the names of the registered products (registry order). """
+
+    return [product['name'] for product in PRODUCTS]
+
+
+def registered_product_fn(name):
+    """ Return the registry entry for a product, raising ValueError if it is not registered (the Python API).
+
+    @param name: string object containing the product name (i.e. 'dbi').
+    @return product: dictionary object containing the registry entry.
+    """
+
+    for product in PRODUCTS:
+        if product['name'] == name:
+            return product
+
+    raise ValueError('Product is not registered (refer to product_registry.py): {0} - registered products: {1}'.format(
+        name, ', '.join(product_names_fn())))
+
+
+def product_fn(name):
+    """ Return the registry entry for a product (command line scripts, exits if it is not registered).
+
+    @param name: string object containing the product name (i.e. 'dbi').
+    @return product: dictionary object containing the registry entry.
+    """
+
+    try:
+        return registered_product_fn(name)
+    except ValueError as error:
+        print(error)
+        sys.exit()
+
+
+def scene_product_fn(name):
+    """ Return the registry entry for a per scene product.
+
+    @param name: string object containing the product name (i.e. 'dp0').
+    @return product: dictionary object containing the registry entry.
+    """
+
+    for product in SCENE_PRODUCTS:
+        if product['name'] == name:
+            return product
+
+    print('Scene product is not registered (refer to product_registry.py): ', name)
+    print(' - registered scene products: ', ', '.join(product['name'] for product in SCENE_PRODUCTS))
+    sys.exit()
+
+
+def climate_grid_fn(name):
+    """ Return the registry entry for a monthly climate grid variable.
+
+    @param name: string object containing the variable name (i.e. 'rainfall').
+    @return grid: dictionary object containing the registry entry.
+    """
+
+    for grid in CLIMATE_GRIDS:
+        if grid['name'] == name:
+            return grid
+
+    print('Climate grid is not registered (refer to product_registry.py): ', name)
+    print(' - registered climate grids: ', ', '.join(grid['name'] for grid in CLIMATE_GRIDS))
+    sys.exit()
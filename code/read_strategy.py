@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+"""
+read_strategy.py
+================
+
+Description: This script chooses how the site windows of each mosaic are read (command argument --read_strategy)
+from a cost model calibrated on the reads of previous runs.
+
+ - window: each site window is read on its own (the default engine behaviour, refer to zonal_engine.read_window_fn).
+ - coalesced: site windows which share blocks or lie close together are merged into regions; each region is read once
+   and the site windows are sliced from it.
+ - full: the requested bands of the whole mosaic are read once and every site window is sliced from memory. Only
+   offered when the bands fit within FULL_READ_BYTES (and the memory budget, refer to memory_budget.py).
+
+The cost of a strategy is estimated from four features of the reads it would make: the read calls, the blocks
+(tiles or strips) fetched, the stored bytes of those blocks (from the block shape and the compression ratio of the
+file) and the pixels decoded (the blocks touched by dense sites on a small composite approach the whole raster, so a
+full read costs one call rather than a call per site). The cost per feature (the per request latency, the bandwidth
+and the decode rate) is fitted by least squares to the reads of the run (every zonal_engine.read_window_fn call
+records its seconds and features), pulled towards DEFAULT_COSTS when there are few reads.
+
+The fitted statistics are persisted in read_calibration.json in the export directory (command argument export_dir)
+and loaded by the next run with a weight of CALIBRATION_DECAY, so the model follows changes of the share or the
+workstation. Each strategy returns the same window arrays, so the zonal statistics do not depend on the strategy.
+If no strategy has been configured every window is read on its own (the step scripts can be run alone).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import json
+import threading
+from collections import Counter
+from datetime import datetime
+import numpy as np
+import memory_budget
+
+STRATEGIES = ['window', 'coalesced', 'full']
+CALIBRATION_NAME = 'read_calibration.json'
+
+# cost features of a read and the default cost of each (seconds per call, block, stored byte and decoded pixel)
+FEATURES = ['calls', 'blocks', 'bytes', 'pixels']
+DEFAULT_COSTS = {'calls': 2e-5, 'blocks': 5e-5, 'bytes': 5e-9, 'pixels': 2e-9}
+
+# reads worth of weight given to DEFAULT_COSTS, and the weight of the persisted statistics in a new run
+PRIOR_READS = 50
+CALIBRATION_DECAY = 0.5
+
+# a region is extended while its pixels are within COALESCE_FACTOR times the pixels of its site windows
+COALESCE_FACTOR = 4
+REGION_MAX_PIXELS = 4096 * 4096
+
+# largest whole mosaic read (bytes of the requested bands)
+FULL_READ_BYTES = 2 * 1024 ** 3
+
+# module level strategy, calibration statistics and choices (None = every window read on its own)
+_READ_STRATEGY = None
+
+
+def configure_read_strategy_fn(strategy, calibration_path=None):
+    """ Set the read strategy for the remainder of the run and load the persisted calibration.
+
+    @param strategy: string object containing 'auto' (choose per mosaic) or a strategy name (refer to STRATEGIES).
+    @param calibration_path: string object containing the path to read_calibration.json (None = not persisted).
+    """
+    global _READ_STRATEGY
+
+    size = len(FEATURES)
+    stats = {'xtx': np.zeros((size, size)), 'xty': np.zeros(size), 'yty': 0.0, 'reads': 0.0}
+    if calibration_path is not None and os.path.isfile(calibration_path):
+        try:
+            with open(calibration_path, 'r') as f:
+                saved = json.load(f)
+            stats = {'xtx': np.array(saved['xtx']) * CALIBRATION_DECAY,
+                     'xty': np.array(saved['xty']) * CALIBRATION_DECAY,
+                     'yty': saved['yty'] * CALIBRATION_DECAY, 'reads': saved['reads'] * CALIBRATION_DECAY}
+            print('Read calibration loaded: ', calibration_path)
+        except (ValueError, KeyError):
+            print('Read calibration is unreadable and will be rebuilt: ', calibration_path)
+
+    _READ_STRATEGY = {'strategy': strategy, 'path': calibration_path, 'stats': stats, 'lock': threading.Lock(),
+                      'choices': Counter()}
+    print('Read strategy: ', strategy, ' costs (seconds per unit): ',
+          ', '.join('{0} {1:.3g}'.format(feature, cost) for feature, cost in costs_fn().items()))
+
+
+def read_strategy_fn():
+    """ Return the configured strategy ('window' if none has been configured). """
+
+    return 'window' if _READ_STRATEGY is None else _READ_STRATEGY['strategy']
+
+
+def record_read_fn(seconds, blocks, nbytes, pixels):
+    """ Add a window read (one call) to the calibration statistics (refer to zonal_engine.read_window_fn).
+
+    @param seconds: float object containing the read duration.
+    @param blocks: integer object containing the blocks fetched by the read (blocks not fetched before).
+    @param nbytes: integer object containing the stored bytes of those blocks.
+    @param pixels: integer object containing the pixels decoded from those blocks.
+    """
+
+    if _READ_STRATEGY is None:
+        return
+
+    x = np.array([1.0, blocks, nbytes, pixels])
+    stats = _READ_STRATEGY['stats']
+    with _READ_STRATEGY['lock']:
+        stats['xtx'] += np.outer(x, x)
+        stats['xty'] += x * seconds
+        stats['yty'] += seconds * seconds
+        stats['reads'] += 1
+
+
+def costs_fn():
+    """ Return the cost of each feature (seconds per unit), fitted to the calibration statistics by least squares
+    and pulled towards DEFAULT_COSTS by PRIOR_READS reads.
+
+    @return costs: dictionary object containing the cost of each feature (refer to FEATURES).
+    """
+
+    prior = np.array([DEFAULT_COSTS[feature] for feature in FEATURES])
+    if _READ_STRATEGY is None or not _READ_STRATEGY['stats']['reads']:
+        return dict(zip(FEATURES, [float(cost) for cost in prior]))
+
+    stats = _READ_STRATEGY['stats']
+    with _READ_STRATEGY['lock']:
+        xtx, xty, reads = stats['xtx'].copy(), stats['xty'].copy(), stats['reads']
+
+    # ridge regression towards the default costs, weighted by the typical magnitude of each feature
+    weight = PRIOR_READS * np.maximum(np.diag(xtx) / reads, 1e-12)
+    scale = 1.0 / np.sqrt(np.diag(xtx) + weight)
+    a = (xtx + np.diag(weight)) * np.outer(scale, scale)
+    b = (xty + weight * prior) * scale
+    costs = np.linalg.lstsq(a, b, rcond=None)[0] * scale
+
+    # a cost cannot be negative (collinear features), keep a small share of the default
+    costs = np.maximum(costs, prior * 0.01)
+
+    return dict(zip(FEATURES, [float(cost) for cost in costs]))
+
+
+def save_calibration_fn():
+    """ Write the calibration statistics to read_calibration.json (written to a temporary file and replaced). """
+
+    if _READ_STRATEGY is None or _READ_STRATEGY['path'] is None:
+        return
+
+    stats = _READ_STRATEGY['stats']
+    calibration = {'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'features': FEATURES,
+                   'costs': costs_fn(),
+                   'xtx': stats['xtx'].tolist(), 'xty': stats['xty'].tolist(), 'yty': stats['yty'],
+                   'reads': stats['reads'], 'choices': dict(_READ_STRATEGY['choices'])}
+
+    temp_path = _READ_STRATEGY['path'] + '.part'
+    with open(temp_path, 'w') as f:
+        json.dump(calibration, f, indent=1)
+    os.replace(temp_path, _READ_STRATEGY['path'])
+    print('Read strategies chosen: ', dict(_READ_STRATEGY['choices']))
+    print('Read calibration: ', _READ_STRATEGY['path'])
+
+
+def clipped_windows_fn(windows, height, width):
+    """ Return the site windows clipped to the raster as an array (row_start, col_start, row_stop, col_stop) and the
+    positions of the windows which intersect the raster. """
+
+    array = np.array(windows, dtype=np.int64).reshape(-1, 4)
+    r0 = np.clip(array[:, 0], 0, height)
+    c0 = np.clip(array[:, 1], 0, width)
+    r1 = np.clip(array[:, 0] + array[:, 2], 0, height)
+    c1 = np.clip(array[:, 1] + array[:, 3], 0, width)
+    inside = np.flatnonzero((r1 > r0) & (c1 > c0))
+
+    return np.column_stack([r0, c0, r1, c1])[inside], inside
+
+
+def unique_blocks_fn(boxes, block_height, block_width, width):
+    """ Return the number of unique blocks touched by a set of clipped windows (row_start, col_start, row_stop,
+    col_stop). A window spans few blocks, so each block offset is added in turn. """
+
+    if not len(boxes):
+        return 0
+
+    block_columns = -(-width // block_width)
+    br0, br1 = boxes[:, 0] // block_height, (boxes[:, 2] - 1) // block_height
+    bc0, bc1 = boxes[:, 1] // block_width, (boxes[:, 3] - 1) // block_width
+    if int((br1 - br0).max() + 1) * int((bc1 - bc0).max() + 1) > 4096:
+        # large regions - count each window's blocks with a set
+        blocks = set()
+        for i0, i1, j0, j1 in zip(br0, br1, bc0, bc1):
+            blocks.update(i * block_columns + j for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+        return len(blocks)
+
+    codes = []
+    for dr in range(int((br1 - br0).max()) + 1):
+        for dc in range(int((bc1 - bc0).max()) + 1):
+            keep = (br0 + dr <= br1) & (bc0 + dc <= bc1)
+            codes.append((br0[keep] + dr) * block_columns + bc0[keep] + dc)
+
+    return len(np.unique(np.concatenate(codes)))
+
+
+def coalesce_windows_fn(windows, height, width, block_height):
+    """ Merge site windows into read regions. Windows are ordered by block row and column and a window joins the
+    current region while the region is within COALESCE_FACTOR times the pixels of its windows and REGION_MAX_PIXELS.
+
+    @param windows: list object containing the site windows (row_off, col_off, height, width).
+    @param height, width: integer objects containing the raster size.
+    @param block_height: integer object containing the block height (strips and tiles are read whole).
+    @return regions: list object containing a tuple per region (region window (row_off, col_off, height, width),
+    list object containing the positions of its windows).
+    """
+
+    boxes, inside = clipped_windows_fn(windows, height, width)
+    order = np.lexsort((boxes[:, 1], boxes[:, 0] // max(block_height, 1)))
+
+    regions = []
+    current = None
+    for k in order:
+        r0, c0, r1, c1 = [int(value) for value in boxes[k]]
+        pixels = (r1 - r0) * (c1 - c0)
+        if current is not None:
+            b0, a0 = min(current[0], r0), min(current[1], c0)
+            b1, a1 = max(current[2], r1), max(current[3], c1)
+            area = (b1 - b0) * (a1 - a0)
+            if area <= COALESCE_FACTOR * (current[4] + pixels) and area <= REGION_MAX_PIXELS:
+                current[:5] = [b0, a0, b1, a1, current[4] + pixels]
+                current[5].append(int(inside[k]))
+                continue
+            regions.append(current)
+        current = [r0, c0, r1, c1, pixels, [int(inside[k])]]
+    if current is not None:
+        regions.append(current)
+
+    return [((r0, c0, r1 - r0, c1 - c0), positions) for r0, c0, r1, c1, _, positions in regions]
+
+
+def layout_fn(srci, bands):
+    """ Return the block layout of a mosaic for the requested bands (block shape, blocks per band read, pixels and
+    estimated stored bytes per block). """
+
+    block_height, block_width = srci.block_shapes[bands[0] - 1]
+    pixel_interleaved = srci.count > 1 and getattr(srci.interleaving, 'name', None) == 'pixel'
+    item_size = np.dtype(srci.dtypes[bands[0] - 1]).itemsize
+    block_pixels = block_height * block_width * (srci.count if pixel_interleaved else 1)
+
+    # stored bytes per block from the compression ratio of the file (at most the uncompressed size)
+    ratio = 1.0
+    if os.path.isfile(srci.name):
+        ratio = min(os.path.getsize(srci.name) / float(srci.width * srci.height * srci.count * item_size), 1.0)
+
+    return {'block_height': block_height, 'block_width': block_width,
+            'band_blocks': 1 if pixel_interleaved else len(bands), 'block_pixels': block_pixels,
+            'block_bytes': block_pixels * item_size * ratio, 'item_size': item_size}
+
+
+def features_fn(srci, windows, bands, strategies):
+    """ Return the cost features (calls, blocks, bytes and pixels) of reading the site windows of a mosaic with each
+    strategy.
+
+    @param srci: rasterio dataset object (open).
+    @param windows: list object containing the site windows (row_off, col_off, height, width).
+    @param bands: list object containing the band numbers read.
+    @param strategies: list object containing the strategy names to estimate.
+    @return features: dictionary object containing a dictionary of features per strategy.
+    """
+
+    layout = layout_fn(srci, bands)
+    block_height, block_width = layout['block_height'], layout['block_width']
+
+    def blocks_features_fn(calls, blocks):
+        blocks *= layout['band_blocks']
+        return {'calls': calls, 'blocks': blocks, 'bytes': blocks * layout['block_bytes'],
+                'pixels': blocks * layout['block_pixels']}
+
+    features = {}
+    if 'window' in strategies:
+        boxes, _ = clipped_windows_fn(windows, srci.height, srci.width)
+        features['window'] = blocks_features_fn(len(boxes), unique_blocks_fn(boxes, block_height, block_width,
+                                                                             srci.width))
+    if 'coalesced' in strategies:
+        regions = coalesce_windows_fn(windows, srci.height, srci.width, block_height)
+        boxes = np.array([[r0, c0, r0 + h, c0 + w] for (r0, c0, h, w), _ in regions], dtype=np.int64).reshape(-1, 4)
+        features['coalesced'] = blocks_features_fn(len(regions), unique_blocks_fn(boxes, block_height, block_width,
+                                                                                  srci.width))
+    if 'full' in strategies:
+        blocks = -(-srci.height // block_height) * -(-srci.width // block_width)
+        features['full'] = blocks_features_fn(1, blocks)
+
+    return features
+
+
+def full_read_allowed_fn(srci, bands):
+    """ Return True if the requested bands of the whole mosaic fit within FULL_READ_BYTES and the window share of the
+    memory budget. """
+
+    nbytes = srci.width * srci.height * len(bands) * np.dtype(srci.dtypes[bands[0] - 1]).itemsize
+    budget = memory_budget.memory_budget_fn()
+    if budget is not None and nbytes > budget * memory_budget.WINDOW_FRACTION:
+        return False
+
+    return nbytes <= FULL_READ_BYTES
+
+
+def choose_strategy_fn(srci, windows, bands, allow_full=True, cache=None):
+    """ Return the read strategy of a mosaic: the configured strategy, or with 'auto' the strategy with the lowest
+    estimated cost (refer to features_fn and costs_fn).
+
+    @param srci: rasterio dataset object (open).
+    @param windows: list object containing the site windows (row_off, col_off, height, width).
+    @param bands: list object containing the band numbers read.
+    @param allow_full: boolean object, False if the caller cannot hold a whole mosaic (i.e. fused rounds).
+    @param cache: dictionary object containing the features of previous mosaics with the same layout (i.e. the site
+    plan of the grid), may be None.
+    @return strategy: string object containing the strategy name (refer to STRATEGIES).
+    """
+
+    strategy = read_strategy_fn()
+    if strategy == 'full' and not (allow_full and full_read_allowed_fn(srci, bands)):
+        strategy = 'coalesced'
+    if strategy != 'auto':
+        return strategy
+
+    strategies = ['window', 'coalesced']
+    if allow_full and full_read_allowed_fn(srci, bands):
+        strategies.append('full')
+
+    key = (srci.width, srci.height, tuple(srci.block_shapes[bands[0] - 1]), srci.count, len(bands),
+           srci.dtypes[bands[0] - 1], os.path.getsize(srci.name) if os.path.isfile(srci.name) else None,
+           tuple(strategies))
+    features = None if cache is None else cache.get(key)
+    if features is None:
+        features = features_fn(srci, windows, bands, strategies)
+        if cache is not None:
+            cache[key] = features
+
+    costs = costs_fn()
+    estimates = dict((name, sum(costs[feature] * value[feature] for feature in FEATURES))
+                     for name, value in features.items())
+    strategy = min(strategies, key=lambda name: estimates[name])
+    _READ_STRATEGY['choices'][strategy] += 1
+    print('Read strategy: ', strategy, ' estimated seconds: ',
+          ', '.join('{0} {1:.3f}'.format(name, estimates[name]) for name in strategies))
+
+    return strategy
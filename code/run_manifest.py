@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+"""
+run_manifest.py
+===============
+
+Description: This script records the progress of a pipeline run in a json manifest (run_manifest.json) stored in the
+run export directory, so that a failed run can be continued with the command argument --resume <export directory>
+rather than deleting the temporary directory and starting again.
+
+ - Stage checkpoints: the site buffer stage and each product zonal stats step are recorded when they complete; a
+   resumed run skips completed stages (the sites are read back from biomass_1ha_all_sites.shp).
+ - Image checkpoints: each zonal stats step records the temporary csv file(s) written for an image together with
+   their sizes. A resumed run skips an image only if every recorded file still exists with the recorded size; any
+   other image (including the image being processed when the run failed) is processed again.
+ - The manifest also records the command arguments and the temporary directory of the run. A resumed run restores
+   every recorded argument which is not given on the resuming command line (resume_arguments_fn), so the remaining
+   images are processed with the configuration of the original run (i.e. its memory budget). The sites and mosaics
+   of a run (RUN_ARGUMENTS) cannot be changed when it is resumed.
+
+The manifest is written to a temporary file and replaced, so a crash while saving leaves the previous manifest
+intact. If no run has been created or loaded the checkpoint functions do nothing (the step scripts can be run alone).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+import json
+from datetime import datetime
+
+MANIFEST_NAME = 'run_manifest.json'
+
+# arguments which identify the sites and mosaics of a run (a resumed run cannot change them)
+RUN_ARGUMENTS = ['data', 'mosaics_dir', 'export_dir', 'batch', 'tile_grid', 'pastoral_estate']
+
+# arguments of the resuming command which are not restored from the manifest
+RESUME_ARGUMENTS = ['resume', 'dry_run']
+
+# module level manifest of the current run (None = checkpoints disabled)
+_MANIFEST = None
+
+
+def time_stamp_fn():
+    """ Return the current local time as a string (i.e. 2026-10-19 14:05:09). """
+
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def save_manifest_fn():
+    """ Write the manifest of the current run to disk. """
+
+    if _MANIFEST is None:
+        return
+
+    manifest_path = os.path.join(_MANIFEST['export_dir_path'], MANIFEST_NAME)
+    temp_path = manifest_path + '.part'
+    with open(temp_path, 'w') as f:
+        json.dump(_MANIFEST, f, indent=1)
+    os.replace(temp_path, manifest_path)
+
+
+def create_run_fn(export_dir_path, temp_dir_path, arguments):
+    """ Create the manifest for a new run.
+
+    @param export_dir_path: string object containing the path to the run export directory (the run directory).
+    @param temp_dir_path: string object containing the path to the run temporary directory.
+    @param arguments: dictionary object containing the command arguments.
+    @return manifest: dictionary object containing the run manifest.
+    """
+    global _MANIFEST
+
+    _MANIFEST = {'status': 'running',
+                 'created': time_stamp_fn(),
+                 'export_dir_path': export_dir_path,
+                 'temp_dir_path': temp_dir_path,
+                 'arguments': arguments,
+                 'stages': {}}
+    save_manifest_fn()
+
+    return _MANIFEST
+
+
+def load_run_fn(run_dir):
+    """ Load the manifest of a previous run so the run can be resumed.
+
+    @param run_dir: string object containing the path to the export directory of the run (command argument --resume).
+    @return manifest: dictionary object containing the run manifest.
+    """
+    global _MANIFEST
+
+    manifest_path = os.path.join(run_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        print('There is no run manifest in: ', run_dir, ' - the run cannot be resumed.')
+        sys.exit()
+
+    with open(manifest_path, 'r') as f:
+        _MANIFEST = json.load(f)
+
+    # the run directory may have been moved or mapped to a different drive letter
+    _MANIFEST['export_dir_path'] = run_dir
+    _MANIFEST['status'] = 'running'
+    _MANIFEST['resumed'] = _MANIFEST.get('resumed', []) + [time_stamp_fn()]
+    save_manifest_fn()
+
+    complete = [stage for stage, entry in _MANIFEST['stages'].items() if entry['status'] == 'complete']
+    print('Resuming run: ', run_dir)
+    print(' - completed stages: ', ', '.join(complete) if complete else 'none')
+
+    return _MANIFEST
+
+
+def resume_arguments_fn(arguments, explicit):
+    """ Return the arguments of a resumed run: the recorded arguments of the original run, except the arguments
+    given on the resuming command line. The arguments given which differ from the recorded arguments are recorded in
+    the manifest (overrides) and the configuration of the run is printed.
+
+    @param arguments: dictionary object containing the command arguments of the resuming command.
+    @param explicit: list object containing the names of the arguments given on the resuming command line.
+    @return effective: dictionary object containing the command arguments the run continues with.
+    """
+
+    recorded = _MANIFEST['arguments']
+    conflicts = [name for name in RUN_ARGUMENTS
+                 if name in explicit and name in recorded and arguments[name] != recorded[name]]
+    if conflicts:
+        print('The run cannot be resumed with different {0} arguments (recorded: {1}).'.format(
+            ', '.join(conflicts), ', '.join('{0}={1}'.format(name, recorded[name]) for name in conflicts)))
+        sys.exit()
+
+    effective = dict(arguments)
+    overrides = {}
+    for name, value in recorded.items():
+        if name in RESUME_ARGUMENTS or name not in effective:
+            continue
+        if name in explicit:
+            if effective[name] != value:
+                overrides[name] = effective[name]
+        else:
+            effective[name] = value
+
+    if overrides:
+        _MANIFEST.setdefault('overrides', []).append({'resumed': time_stamp_fn(), 'arguments': overrides})
+        save_manifest_fn()
+
+    print('Resumed run configuration (recorded arguments unless given on the command line):')
+    for name in sorted(recorded):
+        if name in effective and name not in RESUME_ARGUMENTS:
+            print(' - {0}: {1}{2}'.format(name, effective[name],
+                                          ' (command line, recorded: {0})'.format(recorded[name])
+                                          if name in overrides else ''))
+
+    return effective
+
+
+def stage_entry_fn(stage):
+    """ Return the manifest entry for a stage, creating it if required. """
+
+    return _MANIFEST['stages'].setdefault(stage, {'status': 'running', 'images': {}})
+
+
+def stage_complete_fn(stage):
+    """ Return True if the stage completed in this (or the resumed) run.
+
+    @param stage: string object containing the stage name (i.e. 'stc').
+    @return boolean object.
+    """
+
+    if _MANIFEST is None or stage not in _MANIFEST['stages']:
+        return False
+
+    entry = _MANIFEST['stages'][stage]
+    if entry['status'] != 'complete':
+        return False
+
+    if not outputs_valid_fn(entry.get('outputs', [])):
+        print('Checkpoint outputs are missing or have changed, the stage will be run again: ', stage)
+        return False
+
+    print('Checkpoint - stage already complete: ', stage)
+    return True
+
+
+def complete_stage_fn(stage, outputs=None):
+    """ Record a stage as complete.
+
+    @param stage: string object containing the stage name (i.e. 'stc').
+    @param outputs: list object containing the paths of files the stage produced (validated on resume).
+    """
+
+    if _MANIFEST is None:
+        return
+
+    entry = stage_entry_fn(stage)
+    entry['status'] = 'complete'
+    entry['completed'] = time_stamp_fn()
+    entry['outputs'] = output_sizes_fn(outputs or [])
+    # the per image checkpoints are no longer required (the temporary files are removed by the step)
+    entry['images'] = {}
+    save_manifest_fn()
+
+
+def output_sizes_fn(outputs):
+    """ Return [path, size] for each output file. """
+
+    return [[path, os.path.getsize(path)] for path in outputs]
+
+
+def outputs_valid_fn(outputs):
+    """ Return True if every recorded output file exists with its recorded size.
+
+    @param outputs: list object containing [path, size] entries.
+    @return boolean object.
+    """
+
+    for path, size in outputs:
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+
+    return True
+
+
+def image_complete_fn(stage, image):
+    """ Return True if the image was completed in the stage and its temporary outputs are intact.
+
+    @param stage: string object containing the checkpoint name (i.e. 'dbi' or 'dim_band2').
+    @param image: string object containing the image path (source, staged or cached - the file name is the key).
+    @return boolean object.
+    """
+
+    if _MANIFEST is None or stage not in _MANIFEST['stages']:
+        return False
+
+    entry = _MANIFEST['stages'][stage]['images'].get(os.path.basename(image))
+
+    return entry is not None and outputs_valid_fn(entry['outputs'])
+
+
+def record_image_fn(stage, image, outputs):
+    """ Record that an image has been processed and its temporary outputs written.
+
+    @param stage: string object containing the checkpoint name (i.e. 'dbi' or 'dim_band2').
+    @param image: string object containing the image path (source, staged or cached - the file name is the key).
+    @param outputs: list object containing the paths of the temporary files written for the image.
+    """
+
+    if _MANIFEST is None:
+        return
+
+    stage_entry_fn(stage)['images'][os.path.basename(image)] = {'outputs': output_sizes_fn(outputs),
+                                                                'completed': time_stamp_fn()}
+    save_manifest_fn()
+
+
+def image_outputs_fn(stage):
+    """ Return the temporary output files of the images completed before the run was resumed (image list order).
+
+    @param stage: string object containing the checkpoint name (i.e. 'h99a2').
+    @return list object containing the output file paths.
+    """
+
+    if _MANIFEST is None or stage not in _MANIFEST['stages']:
+        return []
+
+    return [path for entry in _MANIFEST['stages'][stage]['images'].values() if outputs_valid_fn(entry['outputs'])
+            for path, size in entry['outputs']]
+
+
+def complete_run_fn():
+    """ Record the run as complete. """
+
+    if _MANIFEST is None:
+        return
+
+    _MANIFEST['status'] = 'complete'
+    _MANIFEST['completed'] = time_stamp_fn()
+    save_manifest_fn()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+
+"""
+run_planner.py
+==============
+
+Description: This script plans a pipeline run without reading pixel data (command argument --dry_run), so the worker
+count and inputs can be checked before launching a run which may take hours.
+
+ - Sites: the biomass csv is read and the unique sites are projected to Australian Albers with the 1ha square buffer
+   (as step1_3_project_buffer.py derives them) and counted once per distinct footprint, as the engine extracts them
+   (refer to zonal_engine.unique_geometries_fn); nothing is written.
+ - Catalog: the mosaics of each registered product are listed (refer to product_registry.py) and the header of each
+   mosaic is read (size, grid, bands, data type, block shape, interleaving and file size). A product without mosaics
+   is reported with the directory and search criteria, so a misconfigured mosaics_dir is found in seconds.
+ - Tasks: the site windows are calculated on each pixel grid and the sites inside each mosaic are counted as
+   site x image and site x image x band tasks.
+ - Bytes: for the read strategy of each mosaic (tiled cache copy, staged copy or read from the share, refer to
+   mosaic_staging.staged_images_fn) the blocks touched by the site windows and the bytes fetched are estimated (the
+   stored block size is estimated from the file size), together with the bytes copied from the share when the
+   mosaics are staged. The blocks and bytes follow the read strategy of the run (command argument --read_strategy):
+   the site windows read on their own, the coalesced regions or the whole mosaic, as read_strategy.py would choose
+   (auto chooses from the cost model calibrated in the export directory).
+ - Runtime: the seconds per image opened, per byte fetched and per pixel summarised are calibrated from the run
+   reports of previous runs in the export directory (run_report.json and run_manifest.json, the most recent
+   CALIBRATION_RUNS runs) by product and read strategy. The statistics time is scaled by the worker count. Without
+   previous runs the runtime is not predicted.
+
+The plan is printed (a row per product and the run totals).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import json
+import datetime
+from glob import glob
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import rasterio
+import mosaic_transcode
+import product_registry
+import read_strategy
+import run_manifest
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# number of previous runs (most recent first) used to calibrate the runtime
+CALIBRATION_RUNS = 10
+
+# phases which scale with the pixels summarised (refer to run_report.PHASES)
+COMPUTE_PHASES = ['rasterize', 'statistics', 'dataframe', 'write']
+
+
+def site_bounds_fn(data, batch=None):
+    """ Return the bounds of the distinct site footprints the engine extracts: the 1ha site squares (Australian
+    Albers) of the sites in the biomass csv (one per site, as step1_3_project_buffer.py derives them), merged with the
+    batch site sources (refer to site_batch.merge_sources_fn), deduplicated by geometry as
+    zonal_engine.unique_geometries_fn does.
+
+    @param data: string object containing the path to the biomass csv (command argument --data).
+    @param batch: list object containing the paths to the batch site csv files or shapefiles (command argument
+    --batch), or None.
+    @return bounds: NumPy array containing a row (minx, miny, maxx, maxy) per distinct footprint.
+    """
+    import geopandas as gpd
+    from shapely.geometry import mapping, shape
+    import site_batch
+    import zonal_engine
+
+    sources = []
+    for path in [data] + list(batch or []):
+        if path.lower().endswith('.csv'):
+            df = pd.read_csv(path)
+            df = df.drop_duplicates(subset=['site'])
+            points = gpd.GeoSeries(gpd.points_from_xy(df.lon_gda94, df.lat_gda94), crs='EPSG:4283').to_crs(3577)
+            sources.append(list(points.buffer(50, cap_style=3)))
+        else:
+            import zonal_extract
+            sources.append(list(zonal_extract.site_polygons_fn(gpd.read_file(path)).geometry))
+
+    geometries = sources[0]
+    if len(sources) > 1:
+        # sites with the same footprint in any source are extracted once (refer to site_batch.merge_sources_fn)
+        keys = set()
+        geometries = []
+        for geometry in [geometry for source in sources for geometry in source]:
+            key = site_batch.footprint_key_fn(geometry)
+            if key not in keys:
+                keys.add(key)
+                geometries.append(geometry)
+
+    unique, _ = zonal_engine.unique_geometries_fn([mapping(geometry) for geometry in geometries])
+
+    return np.array([shape(geometry).bounds for geometry in unique]).reshape(-1, 4)
+
+
+def image_layout_fn(path):
+    """ Read the header of a mosaic (no pixel data is read).
+
+    @param path: string object containing the path to the mosaic.
+    @return layout: dictionary object containing the grid, size, bands, block shape, interleaving and file size.
+    """
+
+    with rasterio.open(path) as srci:
+        block_height, block_width = srci.block_shapes[0]
+        interleave = getattr(srci.interleaving, 'name', None)
+        layout = {'driver': srci.driver, 'width': srci.width, 'height': srci.height, 'count': srci.count,
+                  'itemsize': np.dtype(srci.dtypes[0]).itemsize, 'transform': tuple(srci.transform)[:6],
+                  'block_height': block_height, 'block_width': block_width,
+                  'pixel_interleaved': str(interleave).upper() == 'PIXEL' and srci.count > 1}
+
+    layout['size'] = os.path.getsize(path)
+
+    return layout
+
+
+def window_blocks_fn(layout, bounds, bands, cache):
+    """ Return the sites, pixels read and blocks touched by the site windows on a mosaic layout (cached by grid and
+    block shape - mosaics of a product usually share both).
+
+    @param layout: dictionary object containing the mosaic layout (refer to image_layout_fn).
+    @param bounds: NumPy array containing the site bounds (refer to site_bounds_fn).
+    @param bands: list object containing the band numbers read.
+    @param cache: dictionary object containing the windows calculated for previous layouts.
+    @return windows: dictionary object containing sites, pixels (window pixels x bands), blocks (per band read) and
+    windows (row_off, col_off, height, width of the sites inside the mosaic).
+    """
+
+    key = (layout['transform'], layout['width'], layout['height'], layout['block_height'], layout['block_width'],
+           layout['pixel_interleaved'], len(bands))
+    if key in cache:
+        return cache[key]
+
+    # the site windows with a pixel pad (refer to zonal_engine.site_window_fn), clipped to the raster
+    a, _, x0, _, e, y0 = layout['transform']
+    c0 = np.clip(np.floor((bounds[:, 0] - x0) / a) - 1, 0, layout['width']).astype(np.int64)
+    c1 = np.clip(np.ceil((bounds[:, 2] - x0) / a) + 1, 0, layout['width']).astype(np.int64)
+    r0 = np.clip(np.floor((bounds[:, 3] - y0) / e) - 1, 0, layout['height']).astype(np.int64)
+    r1 = np.clip(np.ceil((bounds[:, 1] - y0) / e) + 1, 0, layout['height']).astype(np.int64)
+    inside = (c1 > c0) & (r1 > r0)
+    c0, c1, r0, r1 = c0[inside], c1[inside], r0[inside], r1[inside]
+
+    # the unique blocks touched by every window (a window spans few blocks, so each offset is added in turn)
+    block_columns = -(-layout['width'] // layout['block_width'])
+    br0, br1 = r0 // layout['block_height'], (r1 - 1) // layout['block_height']
+    bc0, bc1 = c0 // layout['block_width'], (c1 - 1) // layout['block_width']
+    codes = []
+    for dr in range(int((br1 - br0).max()) + 1 if len(br0) else 0):
+        for dc in range(int((bc1 - bc0).max()) + 1):
+            keep = (br0 + dr <= br1) & (bc0 + dc <= bc1)
+            codes.append((br0[keep] + dr) * block_columns + bc0[keep] + dc)
+    blocks = len(np.unique(np.concatenate(codes))) if codes else 0
+
+    cache[key] = windows = {'sites': int(inside.sum()), 'pixels': int(((r1 - r0) * (c1 - c0)).sum()) * len(bands),
+                            'blocks': blocks * (1 if layout['pixel_interleaved'] else len(bands)),
+                            'windows': [(int(r), int(c), int(h), int(w))
+                                        for r, c, h, w in zip(r0, c0, r1 - r0, c1 - c0)]}
+
+    return windows
+
+
+def read_blocks_fn(path, layout, windows, bands, allow_full, cache):
+    """ Return the read strategy chosen for a mosaic (refer to read_strategy.choose_strategy_fn) and the blocks and
+    stored bytes it fetches: the coalesced regions (read_strategy.coalesce_windows_fn) or the whole mosaic when the
+    bands fit (read_strategy.full_read_allowed_fn). Cached by layout - mosaics of a product usually share it.
+
+    @param path: string object containing the path to the mosaic read (the tiled copy or the source).
+    @param layout: dictionary object containing the mosaic layout (refer to image_layout_fn).
+    @param windows: dictionary object containing the site windows (refer to window_blocks_fn).
+    @param bands: list object containing the band numbers read.
+    @param allow_full: boolean object, False if the run cannot hold a whole mosaic (command argument --fuse).
+    @param cache: dictionary object containing the reads calculated for previous layouts.
+    @return read: tuple object containing the strategy name, the blocks and the bytes fetched, or None when the
+    site windows are read on their own.
+    """
+
+    key = ('read', layout['transform'], layout['width'], layout['height'], layout['block_height'],
+           layout['block_width'], layout['pixel_interleaved'], layout['size'], tuple(bands))
+    if key in cache:
+        return cache[key]
+
+    with rasterio.open(path) as srci:
+        strategy = read_strategy.choose_strategy_fn(srci, windows['windows'], bands, allow_full,
+                                                    cache.setdefault(('read_features', layout['transform']), {}))
+        read = None
+        if strategy != 'window':
+            features = read_strategy.features_fn(srci, windows['windows'], bands, [strategy])[strategy]
+            read = (strategy, int(features['blocks']), int(features['bytes']))
+
+    cache[key] = read
+
+    return read
+
+
+def image_estimate_fn(source, bounds, bands, staged, cache, allow_full=True):
+    """ Estimate the work of a mosaic for its read strategy (tiled cache copy, staged copy or the source) and the
+    reads of the configured read strategy (refer to read_blocks_fn).
+
+    @param source: string object containing the path to the source mosaic.
+    @param bounds: NumPy array containing the site bounds (refer to site_bounds_fn).
+    @param bands: list object containing the band numbers read.
+    @param staged: boolean object, True if the mosaics are staged (command argument --stage_dir).
+    @param cache: dictionary object containing the windows calculated for previous layouts.
+    @param allow_full: boolean object, False if the run cannot hold a whole mosaic (command argument --fuse).
+    @return estimate: dictionary object containing the strategy, read (window, coalesced or full), sites, pixels,
+    blocks, bytes_fetched and share_bytes (bytes copied from the share when staged, otherwise the bytes fetched).
+    """
+
+    tiled = mosaic_transcode.tiled_image_fn(source)
+    path = tiled if tiled is not None else source
+    layout = image_layout_fn(path)
+    windows = window_blocks_fn(layout, bounds, bands, cache)
+
+    # stored block size, from the ratio of the file size to the uncompressed raster size (at most uncompressed)
+    raster_bytes = layout['width'] * layout['height'] * layout['count'] * layout['itemsize']
+    block_bytes = layout['block_height'] * layout['block_width'] * layout['itemsize'] * \
+        (layout['count'] if layout['pixel_interleaved'] else 1)
+    read, blocks = 'window', windows['blocks']
+    bytes_fetched = int(blocks * block_bytes * min(layout['size'] / raster_bytes, 1.0))
+
+    if windows['sites'] and read_strategy.read_strategy_fn() != 'window':
+        chosen = read_blocks_fn(path, layout, windows, bands, allow_full, cache)
+        if chosen is not None:
+            read, blocks, bytes_fetched = chosen
+
+    if tiled is not None:
+        strategy, share_bytes = 'tiled', 0
+    elif staged:
+        strategy, share_bytes = 'staged', layout['size'] if windows['sites'] else 0
+    else:
+        strategy, share_bytes = 'direct', bytes_fetched
+
+    return {'strategy': strategy, 'read': read, 'sites': windows['sites'], 'pixels': windows['pixels'],
+            'blocks': blocks, 'bytes_fetched': bytes_fetched, 'share_bytes': share_bytes}
+
+
+def run_strategy_fn(arguments):
+    """ Return the read strategy of a run from its command arguments (tiled, staged or direct). """
+
+    if arguments.get('tiled_cache'):
+        return 'tiled'
+    if arguments.get('stage_dir'):
+        return 'staged'
+
+    return 'direct'
+
+
+def calibration_fn(export_dir):
+    """ Collect the timings of the most recent previous runs in the export directory.
+
+    @param export_dir: string object containing the path to the export directory (command argument --export_dir).
+    @return calibration: list object containing a dictionary per run and product (product, strategy, images, open,
+    read and compute seconds x workers, bytes_fetched and pixels_read).
+    """
+
+    report_paths = sorted(glob(os.path.join(export_dir, '*', 'run_report.json')), key=os.path.getmtime,
+                          reverse=True)[:CALIBRATION_RUNS]
+
+    calibration = []
+    for report_path in report_paths:
+        manifest_path = os.path.join(os.path.dirname(report_path), run_manifest.MANIFEST_NAME)
+        arguments = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as f:
+                arguments = json.load(f).get('arguments', {})
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+
+        for product, entry in report['products'].items():
+            if not entry['images'] or not entry['counters']['pixels_read']:
+                continue
+            calibration.append({'product': product, 'strategy': run_strategy_fn(arguments),
+                                'images': entry['images'], 'open': entry['wall']['open'],
+                                'read': entry['wall']['read'],
+                                'compute': sum(entry['wall'][phase] for phase in COMPUTE_PHASES) *
+                                int(arguments.get('workers') or 1),
+                                'bytes_fetched': entry['counters']['bytes_fetched'],
+                                'pixels_read': entry['counters']['pixels_read']})
+
+    return calibration
+
+
+def rate_fn(calibration, seconds, units, **match):
+    """ Return the seconds per unit of the calibration records which match (the closest match is used: every key,
+    then each key alone, then every record).
+
+    @param calibration: list object containing the calibration records (refer to calibration_fn).
+    @param seconds: string object containing the seconds key (i.e. 'read').
+    @param units: string object containing the units key (i.e. 'bytes_fetched').
+    @param match: keyword arguments containing the values to match (i.e. product='dbi', strategy='direct').
+    @return float object containing the rate, or None without calibration.
+    """
+
+    candidates = [match] + [{key: value} for key, value in match.items()] + [{}]
+    for candidate in candidates:
+        records = [record for record in calibration
+                   if all(record[key] == value for key, value in candidate.items())]
+        total = sum(record[units] for record in records)
+        if total:
+            return sum(record[seconds] for record in records) / total
+
+    return None
+
+
+def predict_seconds_fn(calibration, product, estimates, workers):
+    """ Predict the zonal stats seconds of a product from the calibration records.
+
+    @param calibration: list object containing the calibration records (refer to calibration_fn).
+    @param product: string object containing the product name.
+    @param estimates: list object containing the estimate of each mosaic (refer to image_estimate_fn).
+    @param workers: integer object containing the number of worker processes.
+    @return float object containing the predicted seconds, or None without calibration.
+    """
+
+    rates = [(len(estimates), rate_fn(calibration, 'open', 'images', product=product)),
+             (sum(estimate['pixels'] for estimate in estimates) / max(workers, 1),
+              rate_fn(calibration, 'compute', 'pixels_read', product=product))]
+    for strategy in set(estimate['strategy'] for estimate in estimates):
+        bytes_fetched = sum(estimate['bytes_fetched'] for estimate in estimates if estimate['strategy'] == strategy)
+        rates.append((bytes_fetched, rate_fn(calibration, 'read', 'bytes_fetched', product=product,
+                                             strategy=strategy)))
+
+    if not calibration or None in [rate for _, rate in rates]:
+        return None
+
+    return sum(units * rate for units, rate in rates)
+
+
+def duration_fn(seconds):
+    """ Return seconds as a h:mm:ss string ('-' if not predicted). """
+
+    if seconds is None:
+        return '-'
+
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+def plan_run_fn(data, mosaics_dir, export_dir, workers=1, stage_dir=None, batch=None, read_mode='window',
+                allow_full=True):
+    """ Print the plan of a run (sites, images, tasks, bytes and predicted runtime per product) without reading pixel
+    data (command argument --dry_run).
+
+    @param data: string object containing the path to the biomass csv.
+    @param mosaics_dir: string object containing the path to the Landsat mosaic directory.
+    @param export_dir: string object containing the path to the export directory (previous runs are used for the
+    runtime calibration).
+    @param workers: integer object containing the number of worker processes.
+    @param stage_dir: string object containing the staging directory (None = mosaics are not staged).
+    @param batch: list object containing the paths to the batch site sources (refer to site_bounds_fn), or None.
+    @param read_mode: string object containing the read strategy of the run (command argument --read_strategy,
+    refer to read_strategy.STRATEGIES, or auto).
+    @param allow_full: boolean object, False if the run cannot hold a whole mosaic (command argument --fuse).
+    @return plan: list object containing a dictionary per product.
+    """
+
+    print("-" * 50)
+    print("Dry run - planning (no pixel data is read)")
+    print("-" * 50)
+
+    bounds = site_bounds_fn(data, batch)
+    print('Sites: ', len(bounds))
+
+    if not os.path.isdir(mosaics_dir):
+        print('WARNING - mosaics_dir does not exist: ', mosaics_dir)
+
+    calibration = calibration_fn(export_dir)
+    if calibration:
+        print('Runtime calibrated from {0} product runs in: {1}'.format(len(calibration), export_dir))
+    else:
+        print('No previous run reports in {0} - the runtime is not predicted.'.format(export_dir))
+
+    # the reads are estimated with the costs calibrated by previous runs (nothing is written to the calibration)
+    read_strategy.configure_read_strategy_fn(read_mode, os.path.join(export_dir, read_strategy.CALIBRATION_NAME))
+
+    cache = {}
+    plan = []
+    for product in product_registry.PRODUCTS:
+        search = os.path.join(mosaics_dir, product['sub_dir'], product['pattern'])
+        sources = sorted(glob(search))
+        if not sources:
+            print('WARNING - no mosaics found for {0}: {1}'.format(product['name'], search))
+
+        estimates = []
+        for source in sources:
+            try:
+                estimates.append(image_estimate_fn(source, bounds, product['bands'], stage_dir is not None, cache,
+                                                   allow_full))
+            except (rasterio.errors.RasterioIOError, OSError) as err:
+                print('WARNING - unreadable mosaic: ', source, err)
+
+        tasks = sum(estimate['sites'] for estimate in estimates)
+        plan.append(OrderedDict([
+            ('product', product['name']), ('images', len(estimates)),
+            ('strategy', '/'.join(sorted(set(estimate['strategy'] for estimate in estimates))) or '-'),
+            ('read', '/'.join(sorted(set(estimate['read'] for estimate in estimates))) or '-'),
+            ('tasks', tasks), ('band_tasks', tasks * len(product['bands'])),
+            ('blocks', sum(estimate['blocks'] for estimate in estimates)),
+            ('fetched_mb', sum(estimate['bytes_fetched'] for estimate in estimates) / 1024 ** 2),
+            ('share_mb', sum(estimate['share_bytes'] for estimate in estimates) / 1024 ** 2),
+            ('seconds', predict_seconds_fn(calibration, product['name'], estimates, workers) if estimates else 0)]))
+
+    print('{0:<8} {1:>7} {2:<12} {3:<16} {4:>12} {5:>13} {6:>11} {7:>11} {8:>11} {9:>10}'.format(
+        'product', 'images', 'strategy', 'read', 'site_images', 'band_tasks', 'blocks', 'fetched_mb', 'share_mb',
+        'runtime'))
+    for row in plan:
+        print('{product:<8} {images:>7} {strategy:<12} {read:<16} {tasks:>12} {band_tasks:>13} {blocks:>11} '
+              '{fetched_mb:>11.1f} {share_mb:>11.1f} {0:>10}'.format(duration_fn(row['seconds']), **row))
+
+    predicted = [row['seconds'] for row in plan]
+    print('{0:<8} {1:>7} {2:<12} {3:<16} {4:>12} {5:>13} {6:>11} {7:>11.1f} {8:>11.1f} {9:>10}'.format(
+        'total', sum(row['images'] for row in plan), '', '', sum(row['tasks'] for row in plan),
+        sum(row['band_tasks'] for row in plan), sum(row['blocks'] for row in plan),
+        sum(row['fetched_mb'] for row in plan), sum(row['share_mb'] for row in plan),
+        duration_fn(sum(predicted) if None not in predicted else None)))
+    print('Workers: ', workers)
+
+    return plan
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+"""
+run_report.py
+=============
+
+Description: This script records where a pipeline run spends its time and writes a run report (run_report.json and
+run_report.html) to the export directory.
+
+ - Wall and CPU time are recorded for each phase of the hot path: listing, geometry (projection, site reads and site
+   windows), open, read, rasterize, statistics, dataframe and write.
+ - Counters are recorded for the bytes and pixels read (decoded window pixels) and the rows written (exported site
+   csv rows).
+ - I/O efficiency counters are recorded for the blocks (tiles or strips) touched by the window reads, the pixels
+   decoded from those blocks, the bytes fetched (stored block size where the format reports it, otherwise the
+   uncompressed block size) and the pixels inside the site footprints (rasterized site masks, per band). The read
+   amplification (pixels decoded / footprint pixels) and window amplification (pixels read / footprint pixels) are
+   reported per image, per product and for the run; a striped or untiled mosaic decodes whole rows of the raster
+   for each site and has a far higher read amplification than a tiled mosaic (refer to mosaic_transcode.py).
+ - Timings and counters are attributed to the current product and image (refer to context_fn), so the report lists
+   the totals of each product and the slowest images.
+
+With command argument --trace each timed phase is also recorded as a span (start, duration, product, image, process
+and thread) together with the staging copies and waits (refer to mosaic_staging.py) and the statistics chunks
+calculated by the worker processes; phases shorter than TRACE_MIN_SECONDS are omitted. Worker processes append their
+spans to a spool file per process; the spans of every thread and process are merged into a Chrome trace event file
+(trace.json in the export directory) which can be opened in a local trace viewer (i.e. chrome://tracing or Perfetto)
+to see idle workers, waits on the network share and serialisation bottlenecks.
+
+CPU time is the CPU time of the pipeline process; the statistics calculated by worker processes (command argument
+--workers) are included in the wall time of the statistics phase only. When rasterstats calculates the statistics
+the rasterization of the site is included in the statistics phase. A resumed run reports the resumed session only.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import glob
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+PHASES = ['listing', 'geometry', 'open', 'read', 'rasterize', 'statistics', 'dataframe', 'write']
+COUNTERS = ['bytes_read', 'pixels_read', 'rows_written', 'blocks_touched', 'pixels_decoded', 'bytes_fetched',
+            'footprint_pixels']
+
+# number of images listed in the slowest images table
+SLOWEST_IMAGES = 20
+
+# timed phases shorter than this are not recorded as trace spans (i.e. fast reads of single site windows)
+TRACE_MIN_SECONDS = 0.001
+
+# module level product and image the timings are attributed to, and the records by (product, image)
+_CONTEXT = {'product': None, 'image': None}
+_RECORDS = OrderedDict()
+_START = {'wall': time.time(), 'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+# module level trace settings (None = tracing disabled) - refer to configure_trace_fn
+_TRACE = None
+
+
+def new_record_fn():
+    """ Return an empty timing record. """
+
+    return {'wall': dict((phase, 0.0) for phase in PHASES),
+            'cpu': dict((phase, 0.0) for phase in PHASES),
+            'counters': dict((counter, 0) for counter in COUNTERS)}
+
+
+def current_record_fn():
+    """ Return the timing record of the current product and image, creating it if required. """
+
+    key = (_CONTEXT['product'], _CONTEXT['image'])
+    record = _RECORDS.get(key)
+    if record is None:
+        record = _RECORDS[key] = new_record_fn()
+
+    return record
+
+
+@contextmanager
+def context_fn(product=None, image=None):
+    """ Attribute the timings and counters recorded within a with block to a product and/or image (the enclosing
+    product or image is retained if not supplied).
+
+    @param product: string object containing the product name (i.e. 'dbi').
+    @param image: string object containing the image path (the file name is recorded).
+    """
+
+    previous = dict(_CONTEXT)
+    if product is not None:
+        _CONTEXT['product'] = product
+        _CONTEXT['image'] = None
+    if image is not None:
+        _CONTEXT['image'] = os.path.basename(image)
+
+    try:
+        yield
+    finally:
+        _CONTEXT.update(previous)
+
+
+@contextmanager
+def timer_fn(phase):
+    """ Add the wall and CPU time of a with block to a phase of the current product and image (and record a trace
+    span when tracing is enabled).
+
+    @param phase: string object containing the phase name (refer to PHASES).
+    @return args: dictionary object, values added within the block are recorded with the trace span (i.e. bytes).
+    """
+
+    args = {}
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+
+    try:
+        yield args
+    finally:
+        record = current_record_fn()
+        record['wall'][phase] += time.perf_counter() - wall
+        record['cpu'][phase] += time.process_time() - cpu
+
+        if _TRACE is not None and time.time() - start >= TRACE_MIN_SECONDS:
+            args['product'] = _CONTEXT['product']
+            args['image'] = _CONTEXT['image']
+            trace_event_fn(phase, start, time.time(), args)
+
+
+def count_fn(counter, value):
+    """ Add a value to a counter of the current product and image.
+
+    @param counter: string object containing the counter name (refer to COUNTERS).
+    @param value: integer object containing the value to add.
+    """
+
+    current_record_fn()['counters'][counter] += int(value)
+
+
+def blocks_seen_fn():
+    """ Return the set of blocks already counted for the current product and image (refer to
+    zonal_engine.record_blocks_fn). """
+
+    return current_record_fn().setdefault('blocks', set())
+
+
+def amplification_fn(counters):
+    """ Return the read and window amplification of a record's counters (None when no site footprint was read).
+
+    @param counters: dictionary object containing the record counters.
+    @return amplification: dictionary object containing the read_amplification and window_amplification.
+    """
+
+    footprint = counters['footprint_pixels']
+    if not footprint:
+        return {'read_amplification': None, 'window_amplification': None}
+
+    return {'read_amplification': round(counters['pixels_decoded'] / footprint, 2),
+            'window_amplification': round(counters['pixels_read'] / footprint, 2)}
+
+
+def add_record_fn(total, record):
+    """ Add the phases and counters of a record to a total record. """
+
+    for phase in PHASES:
+        total['wall'][phase] += record['wall'][phase]
+        total['cpu'][phase] += record['cpu'][phase]
+    for counter in COUNTERS:
+        total['counters'][counter] += record['counters'][counter]
+
+
+def round_record_fn(record):
+    """ Return a copy of a record with the times rounded (seconds) and the total wall and CPU time added. """
+
+    rounded = {'wall': dict((phase, round(seconds, 3)) for phase, seconds in record['wall'].items()),
+               'cpu': dict((phase, round(seconds, 3)) for phase, seconds in record['cpu'].items()),
+               'counters': dict(record['counters'])}
+    rounded['wall_total'] = round(sum(record['wall'].values()), 3)
+    rounded['cpu_total'] = round(sum(record['cpu'].values()), 3)
+    rounded.update(amplification_fn(record['counters']))
+
+    return rounded
+
+
+def run_report_fn():
+    """ Summarise the recorded timings.
+
+    @return report: dictionary object containing the per product totals, the slowest images and every image record.
+    """
+
+    products = OrderedDict()
+    images = []
+    run_total = new_record_fn()
+    for (product, image), record in _RECORDS.items():
+        add_record_fn(run_total, record)
+        name = product or 'pipeline'
+        if name not in products:
+            products[name] = {'total': new_record_fn(), 'images': 0}
+        add_record_fn(products[name]['total'], record)
+
+        if image is not None:
+            products[name]['images'] += 1
+            entry = round_record_fn(record)
+            entry['product'] = name
+            entry['image'] = image
+            images.append(entry)
+
+    report = {'created': _START['created'],
+              'written': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'wall_seconds': round(time.time() - _START['wall'], 1),
+              'phases': PHASES,
+              'counters': run_total['counters'],
+              'products': OrderedDict(),
+              'slowest_images': sorted(images, key=lambda entry: entry['wall_total'], reverse=True)[:SLOWEST_IMAGES],
+              'images': images}
+    report.update(amplification_fn(run_total['counters']))
+
+    for name, entry in products.items():
+        product_total = round_record_fn(entry['total'])
+        product_total['images'] = entry['images']
+        report['products'][name] = product_total
+
+    return report
+
+
+def html_table_fn(rows, columns):
+    """ Return a html table of a list of dictionaries. """
+
+    html = ['<table>', '<tr>' + ''.join('<th>{0}</th>'.format(column) for column in columns) + '</tr>']
+    for row in rows:
+        html.append('<tr>' + ''.join('<td>{0}</td>'.format(row.get(column, '')) for column in columns) + '</tr>')
+    html.append('</table>')
+
+    return '\n'.join(html)
+
+
+def flat_rows_fn(entries, label):
+    """ Flatten report records into table rows (wall time per phase, totals and counters). """
+
+    rows = []
+    for name, entry in entries:
+        row = OrderedDict([(label, name)])
+        row.update(('{0} (s)'.format(phase), entry['wall'][phase]) for phase in PHASES)
+        row['wall total (s)'] = entry['wall_total']
+        row['cpu total (s)'] = entry['cpu_total']
+        row.update(entry['counters'])
+        row['read amplification'] = entry['read_amplification']
+        row['window amplification'] = entry['window_amplification']
+        rows.append(row)
+
+    return rows
+
+
+def write_run_report_fn(export_dir_path):
+    """ Write the run report to run_report.json and run_report.html in the export directory.
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @return report_path: string object containing the path to the json report.
+    """
+
+    report = run_report_fn()
+
+    report_path = os.path.join(export_dir_path, 'run_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    product_rows = flat_rows_fn(report['products'].items(), 'product')
+    for row, entry in zip(product_rows, report['products'].values()):
+        row['images'] = entry['images']
+    image_rows = flat_rows_fn([(entry['product'] + ' ' + entry['image'], entry)
+                               for entry in report['slowest_images']], 'image')
+
+    html = ['<html><head><title>Run report</title>',
+            '<style>body {font-family: sans-serif;} table {border-collapse: collapse; margin-bottom: 2em;} '
+            'td, th {border: 1px solid #999; padding: 2px 6px; text-align: right;}</style></head><body>',
+            '<h1>Run report</h1>',
+            '<p>Started: {0}, written: {1}, wall time: {2} seconds.</p>'.format(
+                report['created'], report['written'], report['wall_seconds']),
+            '<p>Read amplification (pixels decoded / site footprint pixels): {0}, window amplification (pixels '
+            'read / site footprint pixels): {1}, blocks touched: {2}, bytes fetched: {3}.</p>'.format(
+                report['read_amplification'], report['window_amplification'],
+                report['counters']['blocks_touched'], report['counters']['bytes_fetched']),
+            '<h2>Product totals (wall time per phase)</h2>',
+            html_table_fn(product_rows, list(product_rows[0].keys()) if product_rows else []),
+            '<h2>Slowest images</h2>',
+            html_table_fn(image_rows, list(image_rows[0].keys()) if image_rows else []),
+            '</body></html>']
+
+    with open(os.path.join(export_dir_path, 'run_report.html'), 'w') as f:
+        f.write('\n'.join(html))
+
+    print('Run report: ', report_path)
+
+    return report_path
+
+
+def configure_trace_fn(trace_path, spool_dir):
+    """ Enable tracing (command argument --trace).
+
+    @param trace_path: string object containing the path to the Chrome trace event file to write (trace.json).
+    @param spool_dir: string object containing the path to a temporary directory for the worker process spans.
+    """
+    global _TRACE
+
+    if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir)
+
+    _TRACE = {'path': trace_path, 'spool_dir': spool_dir, 'events': [], 'worker': False}
+    print('Tracing to: ', trace_path)
+
+
+def trace_spool_fn():
+    """ Return the spool directory of the trace (None when tracing is disabled), passed to the worker processes. """
+
+    return None if _TRACE is None else _TRACE['spool_dir']
+
+
+def worker_init_fn(spool_dir):
+    """ Worker process initializer: enable tracing in the worker (refer to zonal_engine.worker_pool_fn).
+
+    @param spool_dir: string object containing the trace spool directory (None = tracing disabled).
+    """
+    global _TRACE
+
+    if spool_dir is not None:
+        _TRACE = {'path': None, 'spool_dir': spool_dir, 'events': None, 'worker': True}
+
+
+def trace_event_fn(name, start, end, args=None):
+    """ Record a complete trace span for the calling process and thread.
+
+    @param name: string object containing the span name (i.e. 'read').
+    @param start: float object containing the span start (seconds since the epoch, shared by every process).
+    @param end: float object containing the span end.
+    @param args: dictionary object containing the span details (i.e. product, image, bytes).
+    """
+
+    if _TRACE is None:
+        return
+
+    thread = threading.current_thread()
+    args = dict((key, value) for key, value in (args or {}).items() if value is not None)
+    event = {'name': name, 'cat': name, 'ph': 'X', 'ts': int(start * 1e6), 'dur': max(int((end - start) * 1e6), 1),
+             'pid': os.getpid(), 'tid': thread.ident, 'args': args, 'thread_name': thread.name,
+             'worker': _TRACE['worker']}
+
+    if _TRACE['worker']:
+        # one spool file per worker process, appended a span at a time so nothing is lost if the worker is killed
+        with open(os.path.join(_TRACE['spool_dir'], 'spans_{0}.jsonl'.format(os.getpid())), 'a') as f:
+            f.write(json.dumps(event) + '\n')
+    else:
+        _TRACE['events'].append(event)
+
+
+@contextmanager
+def span_fn(name, **args):
+    """ Record a trace span for a with block (does nothing when tracing is disabled).
+
+    @param name: string object containing the span name (i.e. 'stage copy').
+    @param args: keyword arguments recorded with the span (i.e. image, bytes).
+    @return args: dictionary object, values added within the block are recorded with the span.
+    """
+
+    if _TRACE is None:
+        yield args
+        return
+
+    start = time.time()
+    try:
+        yield args
+    finally:
+        trace_event_fn(name, start, time.time(), args)
+
+
+def write_trace_fn():
+    """ Merge the spans of every thread and process into the Chrome trace event file.
+
+    @return trace_path: string object containing the path to the trace file (None when tracing is disabled).
+    """
+
+    if _TRACE is None or _TRACE['worker']:
+        return None
+
+    events = list(_TRACE['events'])
+    for spool_file in sorted(glob.glob(os.path.join(_TRACE['spool_dir'], 'spans_*.jsonl'))):
+        with open(spool_file, 'r') as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+
+    # name the process and thread tracks
+    metadata = []
+    names = OrderedDict()
+    for event in events:
+        track = (event.pop('thread_name'), event.pop('worker'))
+        names.setdefault((event['pid'], event['tid']), track)
+    processes = set()
+    for (pid, tid), (thread_name, worker) in names.items():
+        if pid not in processes:
+            processes.add(pid)
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                             'args': {'name': 'worker {0}'.format(pid) if worker else 'pipeline {0}'.format(pid)}})
+        metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+
+    with open(_TRACE['path'], 'w') as f:
+        json.dump({'traceEvents': metadata + sorted(events, key=lambda event: event['ts']),
+                   'displayTimeUnit': 'ms'}, f)
+
+    print('Trace: ', _TRACE['path'], ' (', len(events), ' spans)')
+
+    return _TRACE['path']
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+"""
+scene_index.py
+==============
+
+Description: This script maintains a persistent index of the Landsat scene directories (one sub-directory per
+path_row, i.e. 104_072) so the scenes of a tile are listed without walking the archive. It replaces the os.walk of
+list_file_directory_fn in the archived step1_5_*_landsat_list.py workflows.
+
+ - Crawl: the tile directories are scanned concurrently by a pool of threads with os.scandir (one listing per
+   directory, the file type comes from the directory entry). Each directory is recorded with its modification time
+   and its sub-directory and scene names (the scenes are grouped by product when the directory is listed).
+ - Incremental: on later runs each recorded directory is checked with a single os.stat and listed again only when its
+   modification time has changed (a scene added to or removed from a directory changes the modification time of that
+   directory). Unchanged directories are answered from the index; directories which no longer exist are dropped.
+ - Scenes: the *_<product>m<zone>_zstdmask.img files of a tile are listed and counted per product from the index, so
+   the minimum scene count check (image_count) does not touch the archive.
+
+The index is a pickle (scene_index.pkl) in the reference cache directory, written to a temporary file and renamed into
+place. Command (i.e.):
+
+    python scene_index.py -l Z:\\Landsat\\wrs2 -x U:\\scratch\\reference_cache -p dp0 dbg -i 950 -t 16
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import csv
+import sys
+import time
+import pickle
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_NAME = 'scene_index.pkl'
+COUNTS_NAME = 'scene_counts.csv'
+SCENE_SUFFIX = '_zstdmask.img'
+
+# bump to rebuild indexes written by an earlier layout
+INDEX_VERSION = 1
+
+# the directory listings are network bound, not CPU bound (threads rather than processes)
+CRAWL_THREADS = 8
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Index the Landsat scene directories and count the scenes of each tile and product.''')
+
+    p.add_argument('-l', '--landsat_dir', help="The Landsat scene directory (one sub-directory per path_row)")
+
+    p.add_argument('-x', '--cache_dir', help='The directory the scene index is stored in (i.e. reference_cache).')
+
+    p.add_argument('-p', '--products', nargs='+',
+                   help="Enter the scene products to count (i.e. dp0 dbg, default every product in the index)",
+                   default=None)
+
+    p.add_argument('-i', '--image_count', type=int,
+                   help='Enter the minimum amount of Landsat scenes required per tile as an integer (i.e. 950).',
+                   default=1)
+
+    p.add_argument('-t', '--threads', type=int,
+                   help="Enter the number of threads scanning the tile directories (i.e. 16)", default=CRAWL_THREADS)
+
+    p.add_argument('--no_rescan', action='store_true',
+                   help="Answer from the stored index without checking the scene directories for changes")
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.landsat_dir is None or cmd_args.cache_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def load_index_fn(index_path):
+    """ Load the scene index (an empty index if it does not exist or was written by an earlier layout).
+
+    @param index_path: string object containing the path to scene_index.pkl.
+    @return index: dictionary object containing the entry (mtime, dirs and scenes) of each directory path.
+    """
+
+    if os.path.isfile(index_path):
+        with open(index_path, 'rb') as index_file:
+            stored = pickle.load(index_file)
+        if stored.get('version') == INDEX_VERSION:
+            return stored['directories']
+
+    return {}
+
+
+def save_index_fn(index_path, index):
+    """ Write the scene index to a temporary file and rename it into place.
+
+    @param index_path: string object containing the path to scene_index.pkl.
+    @param index: dictionary object containing the entry of each directory path (refer to load_index_fn).
+    """
+
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    with open(index_path + '.tmp', 'wb') as index_file:
+        pickle.dump({'version': INDEX_VERSION, 'directories': index}, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def scan_directory_fn(dir_path, entry=None):
+    """ Return the entry of a directory, listing it only when its modification time differs from the recorded entry.
+
+    @param dir_path: string object containing the path to the directory.
+    @param entry: dictionary object containing the recorded entry of the directory (or None).
+    @return entry: dictionary object containing the mtime (ns), dirs (names) and scenes (names by product) of the
+    directory, or None if the directory does not exist.
+    @return scanned: boolean object, True if the directory was listed.
+    """
+
+    try:
+        mtime = os.stat(dir_path).st_mtime_ns
+    except OSError:
+        return None, False
+
+    if entry is not None and entry['mtime'] == mtime:
+        return entry, False
+
+    dirs = []
+    scenes = {}
+    with os.scandir(dir_path) as scan:
+        for dir_entry in scan:
+            if dir_entry.is_dir():
+                dirs.append(dir_entry.name)
+            else:
+                variable = scene_variable_fn(dir_entry.name)
+                if variable is not None:
+                    scenes.setdefault(variable, []).append(dir_entry.name)
+
+    return {'mtime': mtime, 'dirs': sorted(dirs), 'scenes': scenes}, True
+
+
+def crawl_tile_fn(tile_dir, index):
+    """ Crawl a tile directory and its sub-directories, reusing the recorded entries of unchanged directories.
+
+    @param tile_dir: string object containing the path to the tile directory (i.e. landsat_dir/104_072).
+    @param index: dictionary object containing the recorded entries (refer to load_index_fn, read only).
+    @return entries: dictionary object containing the current entry of each directory of the tile.
+    @return scanned: integer object containing the number of directories listed.
+    """
+
+    entries = {}
+    scanned = 0
+    pending = [os.path.normpath(tile_dir)]
+    while pending:
+        dir_path = pending.pop()
+        entry, listed = scan_directory_fn(dir_path, index.get(dir_path))
+        if entry is None:
+            continue
+        entries[dir_path] = entry
+        scanned += listed
+        pending.extend(os.path.join(dir_path, name) for name in entry['dirs'])
+
+    return entries, scanned
+
+
+def crawl_fn(tile_dirs, index, threads=CRAWL_THREADS):
+    """ Crawl the tile directories concurrently and update the index (refer to crawl_tile_fn). The entries of other
+    tile directories in the index are retained.
+
+    @param tile_dirs: list object containing the paths to the tile directories.
+    @param index: dictionary object containing the recorded entries (refer to load_index_fn).
+    @param threads: integer object containing the number of threads scanning the tile directories.
+    @return index: dictionary object containing the updated entries.
+    """
+
+    start = time.time()
+    tile_dirs = [os.path.normpath(tile_dir) for tile_dir in tile_dirs]
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        results = list(executor.map(lambda tile_dir: crawl_tile_fn(tile_dir, index), tile_dirs))
+
+    # drop the recorded entries of the crawled tiles (directories which no longer exist) before the update
+    crawled = set(tile_dirs)
+    index = {dir_path: entry for dir_path, entry in index.items() if not tile_root_fn(dir_path, crawled)}
+
+    scanned = 0
+    total = 0
+    for entries, tile_scanned in results:
+        index.update(entries)
+        scanned += tile_scanned
+        total += len(entries)
+
+    print('Scene index: ', len(tile_dirs), ' tiles, ', total, ' directories (', scanned, ' listed, ', total - scanned,
+          ' unchanged) in ', round(time.time() - start, 2), ' seconds')
+
+    return index
+
+
+def tile_root_fn(dir_path, tile_dirs):
+    """ Return True if a directory is one of the tile directories or within one of them.
+
+    @param dir_path: string object containing the (normalised) path to the directory.
+    @param tile_dirs: set object containing the (normalised) paths to the tile directories.
+    @return boolean object.
+    """
+
+    while True:
+        if dir_path in tile_dirs:
+            return True
+        parent = os.path.dirname(dir_path)
+        if parent == dir_path:
+            return False
+        dir_path = parent
+
+
+def list_tile_dirs_fn(landsat_dir):
+    """ List the tile directories (path_row, i.e. 104_072) of the Landsat scene directory.
+
+    @param landsat_dir: string object containing the path to the Landsat scene directory.
+    @return list object containing the tile directory paths (sorted).
+    """
+
+    with os.scandir(landsat_dir) as scan:
+        # i.e. 104_072
+        return sorted(dir_entry.path for dir_entry in scan
+                      if dir_entry.is_dir() and len(dir_entry.name.split('_')) == 2)
+
+
+def scene_variable_fn(file_name):
+    """ Return the product of a scene file (i.e. dp0 for ..._dp0m2_zstdmask.img), or None if it is not a scene.
+
+    @param file_name: string object containing the file name.
+    @return string object containing the product name, or None.
+    """
+
+    name_split = file_name.split("_")
+    if not file_name.endswith(SCENE_SUFFIX) or len(name_split) < 4:
+        return None
+
+    # i.e. dp0m2 or dp0m3 (the product and zone)
+    token = name_split[-2]
+    if len(token) < 3 or token[-2] != 'm':
+        return None
+
+    return token[:-2]
+
+
+def tile_entries_fn(index, tile_dir):
+    """ Yield the index entries of a tile directory and its sub-directories.
+
+    @param index: dictionary object containing the entry of each directory path (refer to load_index_fn).
+    @param tile_dir: string object containing the path to the tile directory.
+    @return generator object yielding the directory path and entry.
+    """
+
+    pending = [os.path.normpath(tile_dir)]
+    while pending:
+        dir_path = pending.pop()
+        entry = index.get(dir_path)
+        if entry is None:
+            continue
+        yield dir_path, entry
+        pending.extend(os.path.join(dir_path, name) for name in entry['dirs'])
+
+
+def tile_scenes_fn(index, tile_dir, variable):
+    """ List the scenes of a product in a tile directory (sub-directories included) from the index.
+
+    @param index: dictionary object containing the entry of each directory path (refer to load_index_fn).
+    @param tile_dir: string object containing the path to the tile directory (i.e. landsat_dir/104_072).
+    @param variable: string object containing the scene product name (i.e. dp0).
+    @return list object containing the scene paths (unsorted).
+    """
+
+    return [os.path.join(dir_path, name) for dir_path, entry in tile_entries_fn(index, tile_dir)
+            for name in entry['scenes'].get(variable, [])]
+
+
+def tile_counts_fn(index, tile_dir):
+    """ Count the scenes of each product in a tile directory from the index.
+
+    @param index: dictionary object containing the entry of each directory path (refer to load_index_fn).
+    @param tile_dir: string object containing the path to the tile directory.
+    @return counter object containing the number of scenes of each product.
+    """
+
+    counts = Counter()
+    for dir_path, entry in tile_entries_fn(index, tile_dir):
+        for variable, names in entry['scenes'].items():
+            counts[variable] += len(names)
+
+    return counts
+
+
+def main_routine():
+    """ Update the scene index of the Landsat scene directory and report the scene count of each tile and product. """
+
+    cmd_args = get_cmd_args_fn()
+    index_path = os.path.join(cmd_args.cache_dir, INDEX_NAME)
+    index = load_index_fn(index_path)
+
+    if cmd_args.no_rescan:
+        if not index:
+            print('There is no scene index to answer from: ', index_path)
+            sys.exit()
+        landsat_dir = os.path.normpath(cmd_args.landsat_dir)
+        tile_dirs = sorted(dir_path for dir_path in index if os.path.dirname(dir_path) == landsat_dir)
+    else:
+        tile_dirs = list_tile_dirs_fn(cmd_args.landsat_dir)
+        index = crawl_fn(tile_dirs, index, cmd_args.threads)
+        save_index_fn(index_path, index)
+        print('Scene index: ', index_path)
+
+    counts_path = os.path.join(cmd_args.cache_dir, COUNTS_NAME)
+    insufficient = 0
+    with open(counts_path, 'w') as counts_file:
+        writer = csv.writer(counts_file, lineterminator='\n')
+        writer.writerow(['tile', 'product', 'scenes', 'sufficient'])
+        for tile_dir in tile_dirs:
+            counts = tile_counts_fn(index, tile_dir)
+            for variable in cmd_args.products or sorted(counts):
+                sufficient = counts[variable] >= cmd_args.image_count
+                insufficient += not sufficient
+                writer.writerow([os.path.basename(tile_dir), variable, counts[variable], sufficient])
+
+    print('Tiles: ', len(tile_dirs), ' - ', insufficient, ' tile products with fewer than ', cmd_args.image_count,
+          ' scenes')
+    print('Scene counts: ', counts_path)
+
+
+if __name__ == '__main__':
+    main_routine()
@@ -0,0 +1,542 @@
+#!/usr/bin/env python
+
+"""
+scene_stack.py
+==============
+
+Description: This script extracts a per site time series from the per scene Landsat products (dil, dp0, dp1 and dbg,
+refer to product_registry.SCENE_PRODUCTS) of the WRS2 tiles overlaying the sites. It replaces the archived per tile
+workflows (archive/step1_5_dil_landsat_list.py, step1_6_dp0_zonal_stats.py and step1_6_dbg_zonal_stats4.py), which
+read one scene and one band at a time.
+
+ - Tiles: the sites are grouped by the WRS2 tiles which overlay them (the tile grid is negatively buffered by 4000m and
+   cached between runs, refer to site_enrichment.py). A site overlaying two tiles has a time series from each tile.
+ - Scenes: the *_<product>m<zone>_zstdmask.img files under landsat_dir/<path>_<row> (i.e. 104_072), listed from the
+   scene index in the reference cache (refer to scene_index.py: the tile directories are scanned concurrently and only
+   the directories which changed since the last run are listed again). Tiles with fewer scenes than image_count are
+   not processed.
+ - Extraction: every band of a scene is read in a single windowed read per site. The scenes of a tile are split into
+   tasks of scenes_per_task scenes, processed in parallel by the worker processes; the site windows of the scenes of a
+   task are stacked into one cube per site and summarised with vectorised reductions (refer to temporal_stack.py).
+   The site plan (windows and rasterized site masks) is calculated once per pixel grid alignment and shifted to the
+   origin of each scene, so the scenes of a path / row (each with its own extent) share one plan.
+ - Sites: the site masks follow the all_touched rule of the product (False for the registered scene products: only
+   the pixels whose centre is within the site, as the archived rasterstats calls).
+ - Sensors: the bands of each sensor follow the sensor_bands layout of the product (i.e. the Landsat 5 and 7
+   reflectance has no 7th band); bands which a sensor does not have are null.
+ - Outputs: <product>_scene_zonal_stats/<site>_<path><row>_<product>_zonal_stats.csv in the export directory with one
+   row per scene (date order) and the corrected statistics of each band (i.e. b1_dp0_mean). scene_stack_status.csv
+   records the scenes, sites, seconds and status of each tile and product; completed tiles are skipped when the
+   command is run again with the same export directory.
+
+Command (i.e.):
+
+    python scene_stack.py -d U:\\biomass\\slats_tern_biomass.csv --tile_grid U:\\reference\\Landsat_wrs2_TileGrid.shp
+        -l Z:\\Landsat\\wrs2 -p dp0 dbg -x U:\\scratch\\scene_stack -w 8
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import csv
+import sys
+import time
+import shutil
+import argparse
+from collections import OrderedDict
+import product_registry
+import scene_index
+import zonal_engine
+import warnings
+
+warnings.filterwarnings("ignore")
+
+STATUS_NAME = 'scene_stack_status.csv'
+STATUS_COLUMNS = ['tile', 'product', 'scenes', 'sites', 'seconds', 'status']
+
+# the sites are passed to the workers in Australian Albers and projected to the crs of each scene
+ALBERS_CRS = 'EPSG:3577'
+
+# number of projected site sets and site plans retained per process (one per crs and grid alignment of a tile)
+PLAN_CACHE_SIZE = 8
+
+# module level projected sites by crs and site plans by grid alignment (refer to aligned_plan_fn)
+_GEOMETRIES = OrderedDict()
+_PLANS = OrderedDict()
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Extract a per site time series from the per scene Landsat products of the WRS2 tiles.''')
+
+    p.add_argument('-d', '--data', help='The site points csv file (biomass csv format) or point / polygon shapefile.')
+
+    p.add_argument('--tile_grid', help='The Landsat tile grid shapefile (i.e. Landsat_wrs2_TileGrid.shp).')
+
+    p.add_argument('-l', '--landsat_dir', help="The Landsat scene directory (one sub-directory per path_row)")
+
+    p.add_argument('-p', '--products', nargs='+',
+                   help="Enter the scene products to extract (i.e. dp0 dbg, default all registered scene products)",
+                   default=None)
+
+    p.add_argument('-x', '--export_dir',
+                   help='Enter the export directory for all of the final outputs.',
+                   default=r'U:\scratch\rob\pipelines\outputs')
+
+    p.add_argument('-w', '--workers', type=int,
+                   help="Enter the number of worker processes reading the scenes (i.e. 8)", default=1)
+
+    p.add_argument('-i', '--image_count', type=int,
+                   help='Enter the minimum amount of Landsat scenes required per tile as an integer (i.e. 950).',
+                   default=1)
+
+    p.add_argument('-n', '--scenes_per_task', type=int,
+                   help="Enter the number of scenes processed by a worker as one task (i.e. 32)", default=32)
+
+    p.add_argument('--reference_cache',
+                   help="Enter the directory the tile grid is cached in between runs (default "
+                        "export_dir\\\\reference_cache)",
+                   default=None)
+
+    p.add_argument('--crawl_threads', type=int,
+                   help="Enter the number of threads scanning the tile directories (i.e. 16)",
+                   default=scene_index.CRAWL_THREADS)
+
+    p.add_argument('--no_rescan', action='store_true',
+                   help="List the scenes from the stored scene index without checking the tile directories for changes")
+
+    cmd_args = p.parse_args()
+
+    if cmd_args.data is None or cmd_args.tile_grid is None or cmd_args.landsat_dir is None:
+        p.print_help()
+
+        sys.exit()
+
+    return cmd_args
+
+
+def scene_attributes_fn(image_s):
+    """ Return the sensor and date of a scene from its file name (i.e. l8olre_p104r072_20200101_dp0m2_zstdmask.img).
+
+    @param image_s: string object containing the path to the scene.
+    @return sensor: string object containing the sensor (i.e. l8olre).
+    @return im_date: string object containing the scene date (YYYYMMDD).
+    """
+
+    image_name_split = os.path.basename(image_s).split("_")
+    sensor = image_name_split[0]
+
+    im_date = image_name_split[-3]
+    if im_date.startswith("m"):
+        im_date = im_date[1:]
+
+    return sensor, im_date
+
+
+def list_scenes_fn(index, tile_dir, variable):
+    """ List the scenes of a product in a tile directory (sub-directories included) in date order, from the scene index.
+
+    @param index: dictionary object containing the scene index entries (refer to scene_index.load_index_fn).
+    @param tile_dir: string object containing the path to the tile directory (i.e. landsat_dir/104_072).
+    @param variable: string object containing the scene product name (i.e. dp0).
+    @return list_scene: list object containing the scene paths.
+    """
+
+    list_scene = scene_index.tile_scenes_fn(index, tile_dir, variable)
+
+    return sorted(list_scene, key=lambda image_s: (scene_attributes_fn(image_s)[1], os.path.basename(image_s)))
+
+
+def scene_bands_fn(product, sensor):
+    """ Return the bands of a product for a sensor (refer to product_registry.SCENE_PRODUCTS). """
+
+    return product['sensor_bands'].get(sensor, product['bands'])
+
+
+def tile_sites_fn(geo_df, tile_grid, cache_dir):
+    """ Group the sites by the WRS2 tiles which overlay them.
+
+    @param geo_df: geo-dataframe object containing the uid, site_name and geometry of each site (Australian Albers).
+    @param tile_grid: string object containing the path to the Landsat tile grid shapefile.
+    @param cache_dir: string object containing the path to the reference cache directory.
+    @return tiles: ordered dictionary object containing the site positions of each tile (i.e. '104_072'), tile order.
+    """
+    import site_enrichment
+
+    tile_attributes, tile_geometries = site_enrichment.reference_layer_fn(
+        tile_grid, site_enrichment.TILE_COLUMNS, cache_dir, site_enrichment.TILE_BUFFER)
+    wrspr_list = tile_attributes['WRSPR'].tolist()
+
+    tiles = {}
+    for site, tile in site_enrichment.query_pairs_fn(tile_geometries, list(geo_df.geometry)):
+        wrspr = int(wrspr_list[tile])
+        tiles.setdefault('{0:03d}_{1:03d}'.format(wrspr // 1000, wrspr % 1000), []).append(site)
+
+    outside = len(geo_df) - len(set(site for sites in tiles.values() for site in sites))
+    if outside:
+        print('Sites outside the Landsat tile grid: ', outside)
+
+    return OrderedDict(sorted(tiles.items()))
+
+
+def scene_geometries_fn(geometries, crs):
+    """ Return the site geometries projected to the crs of a scene (retained for the following scenes).
+
+    @param geometries: list object containing a geometry mapping per site (Australian Albers).
+    @param crs: rasterio crs object of the scene.
+    @return list object containing a geometry mapping per site (scene crs).
+    """
+    from rasterio.warp import transform_geom
+
+    key = (str(crs), hash(repr(geometries)))
+    projected = _GEOMETRIES.get(key)
+    if projected is None:
+        projected = _GEOMETRIES[key] = [transform_geom(ALBERS_CRS, crs, geometry) for geometry in geometries]
+        while len(_GEOMETRIES) > PLAN_CACHE_SIZE:
+            _GEOMETRIES.popitem(last=False)
+
+    return projected
+
+
+def aligned_plan_fn(geometries, srci, all_touched=False):
+    """ Return the site plan of a scene. Scenes with the same crs, pixel size and pixel alignment share a plan: the
+    plan is calculated for the first scene (refer to zonal_engine.site_plan_fn) and the site windows are shifted by the
+    whole pixel offset between the origin of that scene and the origin of each following scene. The sub-windows and
+    site masks are relative to the site windows and are unchanged.
+
+    @param geometries: list object containing a geometry mapping per site (scene crs).
+    @param srci: rasterio dataset object (open, north up).
+    @param all_touched: boolean object, the rasterization rule of the site masks (refer to zonal_engine.site_plan_fn).
+    @return key: tuple object identifying the shared plan (scenes with the same key have the same site masks).
+    @return plan: dictionary object containing the windows, sub_windows and masks of each site (site order).
+    """
+
+    transform = srci.transform
+    # the pixel alignment of the scene origin (as a fraction of a pixel)
+    key = (str(srci.crs), transform.a, transform.e, round((transform.c / transform.a) % 1, 6),
+           round((transform.f / transform.e) % 1, 6), hash(repr(geometries)), all_touched)
+
+    entry = _PLANS.get(key)
+    if entry is None:
+        entry = _PLANS[key] = (transform, zonal_engine.site_plan_fn(geometries, transform, all_touched))
+        while len(_PLANS) > PLAN_CACHE_SIZE:
+            _PLANS.popitem(last=False)
+
+    origin, plan = entry
+    row_shift = int(round((origin.f - transform.f) / transform.e))
+    col_shift = int(round((origin.c - transform.c) / transform.a))
+    if row_shift or col_shift:
+        plan = dict(plan, windows=[(row_off + row_shift, col_off + col_shift, height, width)
+                                   for row_off, col_off, height, width in plan['windows']])
+
+    return key, plan
+
+
+def scene_windows_fn(image_s, geometries, product):
+    """ Read the site windows of a scene (all bands of the sensor in one read per site).
+
+    @param image_s: string object containing the path to the scene.
+    @param geometries: list object containing a geometry mapping per site (Australian Albers).
+    @param product: dictionary object containing the scene product registry entry.
+    @return key: tuple object identifying the site plan, bands and data type of the scene.
+    @return plan: dictionary object containing the site plan of the scene (refer to aligned_plan_fn).
+    @return arrays: list object containing a window array (bands, height, width) per site.
+    """
+
+    sensor, im_date = scene_attributes_fn(image_s)
+    bands = scene_bands_fn(product, sensor)
+
+    with zonal_engine.open_image_fn(image_s) as srci:
+        plan_key, plan = aligned_plan_fn(scene_geometries_fn(geometries, srci.crs), srci,
+                                        product['all_touched'])
+        arrays = [zonal_engine.read_window_fn(srci, window, bands, product['no_data']) for window in plan['windows']]
+        key = (plan_key, tuple(bands), srci.dtypes[bands[0] - 1])
+
+    return key, plan, arrays
+
+
+def task_stats_fn(scenes, geometries, product):
+    """ Extract the zonal statistics of every site from a task of scenes. The scenes which share a site plan, band
+    layout and data type are stacked into one (scene, band, y, x) cube per site and summarised with vectorised
+    reductions (refer to temporal_stack.stack_stats_fn).
+
+    @param scenes: list object containing the scene paths.
+    @param geometries: list object containing a geometry mapping per site (Australian Albers).
+    @param product: dictionary object containing the scene product registry entry.
+    @return results: list object containing a dictionary of zonal statistic lists per band for each scene.
+    """
+    import numpy as np
+    import temporal_stack
+
+    groups = OrderedDict()
+    plans = {}
+    scene_arrays = []
+    for position, image_s in enumerate(scenes):
+        key, plan, arrays = scene_windows_fn(image_s, geometries, product)
+        groups.setdefault(key, []).append(position)
+        plans[key] = plan
+        scene_arrays.append(arrays)
+
+    results = [None] * len(scenes)
+    for key, positions in groups.items():
+        plan = plans[key]
+        bands = list(key[1])
+        for position in positions:
+            results[position] = {band: [] for band in bands}
+
+        for site in range(len(geometries)):
+            cube = np.stack([scene_arrays[position][site] for position in positions])
+            zones = temporal_stack.stack_stats_fn(cube, plan['sub_windows'][site], plan['masks'][site],
+                                                  product['no_data'], product['stats'],
+                                                  product['kind'] == 'categorical', product['category_map'])
+            for position, band_zones in zip(positions, zones):
+                for band, zone in zip(bands, band_zones):
+                    results[position][band].append(zone)
+
+    return results
+
+
+def _scene_task_worker_fn(scenes, geometries, product):
+    """ Worker process: extract the zonal statistics of a task of scenes (refer to task_stats_fn). """
+
+    return task_stats_fn(scenes, geometries, product)
+
+
+def tile_stats_fn(list_scene, geometries, product, executor=None, scenes_per_task=32):
+    """ Extract the zonal statistics of every site from the scenes of a tile, in tasks of scenes processed in parallel
+    by the worker processes.
+
+    @param list_scene: list object containing the scene paths (date order).
+    @param geometries: list object containing a geometry mapping per distinct site footprint (Australian Albers).
+    @param product: dictionary object containing the scene product registry entry.
+    @param executor: ProcessPoolExecutor object (refer to zonal_engine.worker_pool_fn) - if None the scenes are
+    processed in-process.
+    @param scenes_per_task: integer object containing the number of scenes per task.
+    @return generator object yielding the scene path and zonal statistics (refer to task_stats_fn) in scene order.
+    """
+
+    tasks = [list_scene[start:start + scenes_per_task] for start in range(0, len(list_scene), scenes_per_task)]
+
+    if executor is None:
+        for scenes in tasks:
+            for image_s, zs_bands in zip(scenes, _scene_task_worker_fn(scenes, geometries, product)):
+                yield image_s, zs_bands
+        return
+
+    futures = [executor.submit(_scene_task_worker_fn, scenes, geometries, product) for scenes in tasks]
+
+    # collect in submission order to preserve the scene order
+    try:
+        for scenes, future in zip(tasks, futures):
+            for image_s, zs_bands in zip(scenes, future.result()):
+                yield image_s, zs_bands
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def tile_df_fn(scene_results, tile, uid_list, site_list, product):
+    """ Convert the zonal statistics of the scenes of a tile into the corrected site time series.
+
+    @param scene_results: iterable object containing the scene path and zonal statistics of each scene.
+    @param tile: string object containing the tile (i.e. '104_072').
+    @param uid_list: list object containing the unique identifier of each site.
+    @param site_list: list object containing the site name of each site.
+    @param product: dictionary object containing the scene product registry entry.
+    @return df: dataframe object containing a row per site and scene.
+    """
+    import numpy as np
+    import pandas as pd
+    import step1_4_product_zonal_stats
+
+    df_list = []
+    for image_s, zs_bands in scene_results:
+        sensor, im_date = scene_attributes_fn(image_s)
+        df = pd.DataFrame({'uid': uid_list, 'site': site_list, 'image': os.path.basename(image_s),
+                           'sensor': sensor, 'tile': tile.replace('_', ''), 'date': im_date})
+        for band in product['bands']:
+            columns = step1_4_product_zonal_stats.band_columns_fn(product, band)
+            for stat, column in zip(product['stats'], columns):
+                # bands which the sensor does not have are null
+                df[column] = [zone[stat] for zone in zs_bands[band]] if band in zs_bands else np.nan
+        df_list.append(df)
+
+    df = pd.concat(df_list, ignore_index=True)
+    df = step1_4_product_zonal_stats.correction_fn(df, product)
+
+    df.insert(6, 'year', df['date'].str[:4])
+    df.insert(7, 'month', df['date'].str[4:6])
+    df.insert(8, 'day', df['date'].str[6:])
+
+    return df
+
+
+def export_tile_fn(df, output_dir, tile, variable):
+    """ Export the time series of each site of a tile.
+
+    @param df: dataframe object containing the site time series of the tile (refer to tile_df_fn).
+    @param output_dir: string object containing the path to the product scene zonal stats directory.
+    @param tile: string object containing the tile (i.e. '104_072').
+    @param variable: string object containing the scene product name.
+    """
+
+    for site, site_df in df.groupby('site', sort=False):
+        out_path = os.path.join(output_dir, "{0}_{1}_{2}_zonal_stats.csv".format(
+            str(site), tile.replace('_', ''), variable))
+        site_df.to_csv(out_path, index=False)
+
+
+def read_status_fn(status_path):
+    """ Return the tiles and products completed by an earlier run (scene_stack_status.csv). """
+
+    complete = set()
+    if os.path.isfile(status_path):
+        with open(status_path, 'r') as status:
+            for record in csv.DictReader(status):
+                if record['status'] == 'complete':
+                    complete.add((record['tile'], record['product']))
+
+    return complete
+
+
+def record_status_fn(status_path, record):
+    """ Append the status of a tile and product to scene_stack_status.csv. """
+
+    new_file = not os.path.isfile(status_path)
+    with open(status_path, 'a') as status:
+        writer = csv.writer(status, lineterminator='\n')
+        if new_file:
+            writer.writerow(STATUS_COLUMNS)
+        writer.writerow([record[column] for column in STATUS_COLUMNS])
+
+
+def main_routine():
+    """ Extract the per site scene time series of every tile and scene product. """
+
+    cmd_args = get_cmd_args_fn()
+    export_dir = cmd_args.export_dir
+    variables = cmd_args.products or [product['name'] for product in product_registry.SCENE_PRODUCTS]
+    products = [product_registry.scene_product_fn(variable) for variable in variables]
+
+    import site_batch
+    import site_enrichment
+
+    # the 1ha sites of the csv (refer to step1_3_project_buffer.py) or shapefile in Australian Albers
+    temp_dir_path = os.path.join(export_dir, 'scene_stack_temp')
+    try:
+        geo_df = site_batch.source_sites_fn(cmd_args.data, os.path.join(export_dir, 'sites'), temp_dir_path)
+    except ValueError as error:
+        print(error)
+        sys.exit()
+    print('Sites: ', len(geo_df))
+
+    cache_dir = cmd_args.reference_cache or os.path.join(export_dir, site_enrichment.CACHE_DIR_NAME)
+    tiles = tile_sites_fn(geo_df, cmd_args.tile_grid, cache_dir)
+    print('Landsat tiles: ', len(tiles))
+
+    # the scenes of each tile are listed from the scene index, updated for the directories which changed
+    index_path = os.path.join(cache_dir, scene_index.INDEX_NAME)
+    scene_dirs = scene_index.load_index_fn(index_path)
+    if cmd_args.no_rescan and scene_dirs:
+        print('Scene index (stored): ', index_path)
+    else:
+        scene_dirs = scene_index.crawl_fn([os.path.join(cmd_args.landsat_dir, tile) for tile in tiles], scene_dirs,
+                                          cmd_args.crawl_threads)
+        scene_index.save_index_fn(index_path, scene_dirs)
+
+    status_path = os.path.join(export_dir, STATUS_NAME)
+    complete = read_status_fn(status_path)
+    for variable in variables:
+        output_dir = os.path.join(export_dir, '{0}_scene_zonal_stats'.format(variable))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    all_geometries = zonal_engine.feature_geometries_fn(geo_df)
+    uid_all = geo_df['uid'].tolist()
+    site_all = geo_df['site_name'].tolist()
+
+    # create the worker pool once for all tiles (None when running in a single process)
+    executor = zonal_engine.worker_pool_fn(cmd_args.workers)
+
+    try:
+        for tile, positions in tiles.items():
+            # repeat visits to a site are extracted once
+            geometries, index = zonal_engine.unique_geometries_fn([all_geometries[i] for i in positions])
+            uid_list = [uid_all[i] for i in positions]
+            site_list = [site_all[i] for i in positions]
+
+            for product in products:
+                variable = product['name']
+                if (tile, variable) in complete:
+                    print('Tile complete (', STATUS_NAME, '): ', tile, variable)
+                    continue
+
+                list_scene = list_scenes_fn(scene_dirs, os.path.join(cmd_args.landsat_dir, tile), variable)
+                print('=' * 50)
+                print('Working on tile: ', tile, ' ', variable, ' - scenes: ', len(list_scene), ' sites: ',
+                      len(positions))
+                record = {'tile': tile, 'product': variable, 'scenes': len(list_scene), 'sites': len(positions),
+                          'seconds': 0, 'status': 'complete'}
+
+                if len(list_scene) < cmd_args.image_count:
+                    print('There are insufficient Landsat scenes for: ', tile, variable)
+                    record['status'] = 'insufficient'
+                    record_status_fn(status_path, record)
+                    continue
+
+                start = time.time()
+                scene_results = ((image_s, zonal_engine.fan_out_fn(zs_bands, index)) for image_s, zs_bands in
+                                 tile_stats_fn(list_scene, geometries, product, executor, cmd_args.scenes_per_task))
+                df = tile_df_fn(scene_results, tile, uid_list, site_list, product)
+                export_tile_fn(df, os.path.join(export_dir, '{0}_scene_zonal_stats'.format(variable)), tile,
+                               variable)
+
+                record['seconds'] = round(time.time() - start, 1)
+                record_status_fn(status_path, record)
+                print('Tile: ', tile, ' ', variable, ' - ', len(list_scene), ' scenes in ', record['seconds'],
+                      ' seconds (', round(len(list_scene) / max(record['seconds'], 0.1), 1), ' scenes per second)')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if os.path.isdir(temp_dir_path):
+        shutil.rmtree(temp_dir_path)
+
+    print('Scene stack zonal stats are complete: ', export_dir)
+
+
+if __name__ == '__main__':
+    main_routine()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+shared_windows.py
+=================
+
+Description: This script places decoded raster windows into a single multiprocessing.shared_memory block so that
+worker processes can compute zonal statistics on zero-copy NumPy views instead of receiving pickled pixel arrays.
+Only a small descriptor (segment name, dtype, offsets and shapes) is passed between processes.
+
+Ownership is explicit: the process that creates a block (the parent) is the only process that unlinks it. Workers
+attach, compute and close their handle. The owning context manager unlinks the block in a finally clause, so a worker
+crash (BrokenProcessPool) does not leak the segment.
+
+Note: multiprocessing.shared_memory requires Python 3.8 or later.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+# byte alignment of each window within the shared block
+ALIGNMENT = 64
+
+
+def segment_name_fn():
+    """ Return a unique, recognisable shared memory segment name for the current process.
+
+    @return name: string object containing the segment name (i.e. ntmz_1234_1a2b3c4d).
+    """
+    name = 'ntmz_{0}_{1}'.format(os.getpid(), uuid.uuid4().hex[:8])
+
+    return name
+
+
+def create_shared_windows_fn(arrays):
+    """ Copy a list of window arrays into a newly created shared memory block.
+
+    @param arrays: list object containing NumPy arrays (one per site window) of a single dtype.
+    @return shm: SharedMemory object owned by the calling process (caller must close and unlink).
+    @return descriptor: dictionary object containing the segment name, dtype and an (offset, shape) entry per window.
+    """
+
+    dtype = np.dtype(arrays[0].dtype) if arrays else np.dtype('uint8')
+
+    # calculate aligned offsets for each window
+    windows = []
+    offset = 0
+    for array in arrays:
+        windows.append((offset, tuple(array.shape)))
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    shm = shared_memory.SharedMemory(name=segment_name_fn(), create=True, size=max(offset, 1))
+
+    try:
+        for array, (start, shape) in zip(arrays, windows):
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+            view[...] = array
+            del view
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+
+    descriptor = {'name': shm.name, 'dtype': dtype.str, 'windows': windows}
+
+    return shm, descriptor
+
+
+def sub_descriptor_fn(descriptor, indices):
+    """ Return a descriptor limited to a subset of windows (i.e. a site chunk handed to one worker).
+
+    @param descriptor: dictionary object returned by create_shared_windows_fn.
+    @param indices: list object containing the window positions to retain.
+    @return dictionary object containing the same segment name and dtype with the selected windows only.
+    """
+
+    return {'name': descriptor['name'], 'dtype': descriptor['dtype'],
+            'windows': [descriptor['windows'][i] for i in indices]}
+
+
+def attach_shared_windows_fn(descriptor):
+    """ Attach to an existing shared memory block and return zero-copy views of each window.
+
+    @param descriptor: dictionary object returned by create_shared_windows_fn or sub_descriptor_fn.
+    @return shm: SharedMemory object (caller must close, but never unlink).
+    @return views: list object containing a read-only NumPy view per window.
+    """
+
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    dtype = np.dtype(descriptor['dtype'])
+
+    views = []
+    for start, shape in descriptor['windows']:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view.flags.writeable = False
+        views.append(view)
+
+    return shm, views
+
+
+@contextmanager
+def owned_shared_windows_fn(arrays):
+    """ Create a shared memory block for the duration of a with block and always close and unlink it afterwards.
+
+    @param arrays: list object containing NumPy arrays (one per site window) of a single dtype.
+    @return descriptor: dictionary object to be passed to worker processes.
+    """
+
+    shm, descriptor = create_shared_windows_fn(arrays)
+    try:
+        yield descriptor
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+@contextmanager
+def attached_shared_windows_fn(descriptor):
+    """ Attach to a shared memory block for the duration of a with block and close the handle afterwards.
+    The yielded list is emptied on exit so no view outlives the mapping; do not keep references to its elements.
+
+    @param descriptor: dictionary object returned by create_shared_windows_fn or sub_descriptor_fn.
+    @return views: list object containing a read-only NumPy view per window.
+    """
+
+    shm, views = attach_shared_windows_fn(descriptor)
+    try:
+        yield views
+    finally:
+        del views[:]
+        shm.close()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+site_batch.py
+=============
+
+Description: This script merges several site sources into a single zone set so the pipeline reads the mosaics once
+for all of them (command argument --batch), then splits the outputs back out per source.
+
+ - Sources: the biomass csv (command argument --data, 1ha sites built by step1_3_project_buffer.py) and any number of
+   site csv files or point / polygon shapefiles (i.e. NT_StarTransect_20200713.shp, points are buffered to the 1ha
+   square sites, refer to zonal_extract.site_polygons_fn). Each source is named after its file (i.e.
+   NT_StarTransect_20200713).
+ - Zones: sites with the same footprint (Australian Albers geometry, to the millimetre) in one or more sources are
+   extracted once as a single zone. batch_zones.csv in the export directory records the zone of each source site.
+ - Outputs: the zonal stats of each zone are exported as usual (<product>_zonal_stats, one csv per zone) and then
+   written per source to <source>/<product>_zonal_stats with the uid and site name of each source site, exactly as a
+   separate run of the source would name them.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+from collections import OrderedDict
+import pandas as pd
+
+ZONES_NAME = 'batch_zones.csv'
+
+# the site name of each merged zone (the zone csv files are named after it)
+ZONE_NAME = 'zone{0}'
+
+# footprints are compared with a normalised vertex order to the millimetre (the same point projected and buffered by
+# different routes differs by nanometres)
+FOOTPRINT_PRECISION = 3
+
+
+def source_names_fn(paths):
+    """ Name each site source after its file (a repeated file name is numbered, i.e. sites_2).
+
+    @param paths: list object containing the paths to the site sources.
+    @return names: list object containing the source names (source order).
+    """
+
+    names = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        candidate = name
+        count = 1
+        while candidate in names:
+            count += 1
+            candidate = '{0}_{1}'.format(name, count)
+        names.append(candidate)
+
+    return names
+
+
+def source_sites_fn(path, source_dir, source_temp_dir):
+    """ Read the 1ha sites of a site source.
+
+    @param path: string object containing the path to a site csv (biomass csv format) or shapefile.
+    @param source_dir: string object containing the path to the export sub-directory of the source.
+    @param source_temp_dir: string object containing the path to the temporary buffer sub-directory of the source.
+    @return geo_df: geo-dataframe object containing the uid, site_name and geometry of each site (Australian Albers,
+    ValueError is raised if a shapefile has no crs).
+    """
+    import zonal_extract
+
+    if path.lower().endswith('.csv'):
+        # the same 1ha sites, names and uids as a run of the csv (refer to step1_3_project_buffer.py)
+        import step1_3_project_buffer
+        for directory in [source_dir, source_temp_dir]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        geo_df, crs_name = step1_3_project_buffer.main_routine(path, source_dir, source_temp_dir)
+        geo_df.reset_index(drop=True, inplace=True)
+        geo_df['uid'] = geo_df.index + 1
+    else:
+        import geopandas as gpd
+        geo_df = gpd.read_file(path)
+
+    return zonal_extract.site_polygons_fn(geo_df)
+
+
+def footprint_key_fn(geometry):
+    """ Return the key of a site footprint (normalised Australian Albers geometry to FOOTPRINT_PRECISION). """
+    from shapely import wkt
+
+    return wkt.dumps(geometry.normalize(), rounding_precision=FOOTPRINT_PRECISION)
+
+
+def merge_sources_fn(sources):
+    """ Merge the sites of every source into one zone per distinct footprint (Australian Albers geometry to the
+    millimetre, refer to FOOTPRINT_PRECISION). The geometry of the first site with a footprint is extracted.
+
+    @param sources: ordered dictionary object containing the sites geo-dataframe of each source
+    (refer to source_sites_fn).
+    @return geo_df: geo-dataframe object containing the uid, site_name and geometry of each zone.
+    @return zones_df: dataframe object containing the zone, source, uid and site of each source site.
+    """
+    import geopandas as gpd
+
+    zone_index = OrderedDict()
+    geometries = []
+    rows = []
+    for source, source_df in sources.items():
+        for uid, site, geometry in zip(source_df['uid'], source_df['site_name'], source_df.geometry):
+            key = footprint_key_fn(geometry)
+            zone = zone_index.get(key)
+            if zone is None:
+                zone = zone_index[key] = len(zone_index) + 1
+                geometries.append(geometry)
+            rows.append({'zone': zone, 'source': source, 'uid': uid, 'site': site})
+        print('Batch source: ', source, ' - ', len(source_df), ' sites')
+
+    zones_df = pd.DataFrame(rows, columns=['zone', 'source', 'uid', 'site'])
+    zones = list(range(1, len(geometries) + 1))
+    geo_df = gpd.GeoDataFrame({'uid': zones, 'site_name': [ZONE_NAME.format(zone) for zone in zones]},
+                              geometry=geometries, crs='EPSG:3577')
+    print('Batch zones: ', len(geo_df), ' distinct footprints from ', len(zones_df), ' source sites')
+
+    return geo_df, zones_df
+
+
+def batch_sites_fn(paths, export_dir_path, prime_temp_buffer_dir):
+    """ Read and merge the site sources of a batch run and record the zone of each source site.
+
+    @param paths: list object containing the paths to the site sources (the biomass csv first).
+    @param export_dir_path: string object containing the path to the export directory.
+    @param prime_temp_buffer_dir: string object containing the path to the temporary buffer directory.
+    @return geo_df: geo-dataframe object containing the merged zones (refer to merge_sources_fn).
+    @return zones_path: string object containing the path to batch_zones.csv.
+    """
+
+    sources = OrderedDict()
+    for name, path in zip(source_names_fn(paths), paths):
+        sources[name] = source_sites_fn(path, os.path.join(export_dir_path, name),
+                                        os.path.join(prime_temp_buffer_dir, name))
+
+    geo_df, zones_df = merge_sources_fn(sources)
+
+    zones_path = os.path.join(export_dir_path, ZONES_NAME)
+    zones_df.to_csv(zones_path, index=False)
+    print("Exported batch zones: ", zones_path)
+
+    return geo_df, zones_path
+
+
+def split_outputs_fn(export_dir_path, variables):
+    """ Write the zonal stats of each zone to the product directory of every source which contains the zone, with the
+    uid and site name of the source site (refer to batch_zones.csv). The values are copied as text, unchanged.
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @param variables: list object containing the product names.
+    """
+    import run_report
+
+    zones_df = pd.read_csv(os.path.join(export_dir_path, ZONES_NAME), dtype={'source': str, 'site': str})
+
+    for variable in variables:
+        with run_report.context_fn(product=variable), run_report.timer_fn('write'):
+            zone_dir = os.path.join(export_dir_path, '{0}_zonal_stats'.format(variable))
+            file_name = '{0}_' + variable + '_zonal_stats.csv'
+
+            zone_dfs = {}
+            for (source, site), members in zones_df.groupby(['source', 'site'], sort=False):
+                df_list = []
+                for member in members.itertuples():
+                    if member.zone not in zone_dfs:
+                        zone_csv = os.path.join(zone_dir, file_name.format(ZONE_NAME.format(member.zone)))
+                        # zones outside the mosaics have no outputs
+                        zone_dfs[member.zone] = (pd.read_csv(zone_csv, dtype=str, keep_default_na=False)
+                                                 if os.path.isfile(zone_csv) else None)
+                    if zone_dfs[member.zone] is not None:
+                        zone_df = zone_dfs[member.zone]
+                        df_list.append(zone_df.assign(uid=str(member.uid), site=site, row=range(len(zone_df))))
+
+                if df_list:
+                    output_dir = os.path.join(export_dir_path, source, '{0}_zonal_stats'.format(variable))
+                    if not os.path.isdir(output_dir):
+                        os.makedirs(output_dir)
+                    # image (and band) order, then uid order - as the rows of a separate run of the source
+                    out_df = pd.concat(df_list, ignore_index=True).sort_values('row', kind='mergesort')
+                    out_df = out_df.drop(columns='row')
+                    out_df.to_csv(os.path.join(output_dir, file_name.format(site)), index=False)
+                    run_report.count_fn('rows_written', len(out_df))
+
+        print('Batch outputs split by source: ', variable)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+site_enrichment.py
+==================
+
+Description: This script attaches the Landsat WRS2 tile (path / row) and the pastoral property (PROP_TAG) of every
+site through bulk spatial index (STRtree) queries (command arguments --tile_grid and --pastoral_estate).
+
+ - Tiles: the Landsat tile grid (i.e. Landsat_wrs2_TileGrid.shp, WRSPR column) is projected to Australian Albers and
+   each tile is negatively buffered by 4000m (refer to archive/step1_4_landsat_tile_grid_identify.py). Every tile
+   which overlays a 1ha site is listed (tiles column, ; separated) and the path and row of the tile whose centre is
+   nearest to the site are reported.
+ - Properties: the pastoral estate (i.e. NT_Pastoral_Estate.shp, PROPERTY and PROP_TAG columns) property which
+   contains the centre of each site (blank outside the pastoral estate).
+ - Cache: each reference layer is read, projected and buffered once and cached in the reference cache directory as a
+   pickle of the attributes and WKB geometries, keyed by the source path, size and modification time of every file
+   of the shapefile. Later runs load the cache rather than the shapefile.
+
+The results are written to site_enrichment.csv in the export directory (uid, site_name, path, row, wrspr, tiles,
+prop_tag and property). The spatial index queries work with shapely 1.8 (STRtree returns geometries) and shapely 2
+(STRtree returns indices).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import sys
+import glob
+import pickle
+import hashlib
+import pandas as pd
+
+ENRICHMENT_NAME = 'site_enrichment.csv'
+CACHE_DIR_NAME = 'reference_cache'
+
+# reference layers are cached in Australian Albers
+ALBERS_EPSG = 3577
+
+# negative buffer applied to each Landsat tile (metres), sites on the tile edges are left to the neighbouring tile
+TILE_BUFFER = -4000
+
+# the columns retained from each reference layer
+TILE_COLUMNS = ['WRSPR']
+PROPERTY_COLUMNS = ['PROPERTY', 'PROP_TAG']
+
+# bump to invalidate cached layers written by an earlier layout
+CACHE_VERSION = 1
+
+
+def fingerprint_fn(shapefile, buffer_distance):
+    """ Return a key derived from the path, size and modification time of every file of the shapefile and the buffer.
+
+    @param shapefile: string object containing the path to the shapefile.
+    @param buffer_distance: integer object containing the buffer applied to the layer (metres).
+    @return string object containing the fingerprint key.
+    """
+
+    # the .shp, .dbf, .prj (etc.) files of the shapefile
+    files = sorted(glob.glob(os.path.splitext(shapefile)[0] + '.*'))
+    key = [os.path.abspath(shapefile).lower(), str(buffer_distance), str(CACHE_VERSION)]
+    for path in files:
+        stat = os.stat(path)
+        key.append('{0}|{1}|{2}'.format(os.path.basename(path).lower(), stat.st_size, int(stat.st_mtime)))
+
+    return hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:16]
+
+
+def read_layer_fn(shapefile, columns, buffer_distance=0):
+    """ Read a reference layer, project it to Australian Albers and apply the buffer.
+
+    @param shapefile: string object containing the path to the shapefile.
+    @param columns: list object containing the attribute columns to retain.
+    @param buffer_distance: integer object containing the buffer applied to each feature (metres, 0 for none).
+    @return attributes: dataframe object containing the retained columns and the centre (x, y) of each feature.
+    @return geometries: list object containing the (buffered) geometry of each feature.
+    """
+    import geopandas as gpd
+
+    if not os.path.isfile(shapefile):
+        print('The reference layer does not exist: ', shapefile)
+        sys.exit()
+
+    layer = gpd.read_file(shapefile)
+    missing = [column for column in columns if column not in layer.columns]
+    if missing:
+        print('The reference layer: ', shapefile, ' is missing the columns: ', ', '.join(missing))
+        sys.exit()
+
+    layer = layer[~(layer.geometry.isna() | layer.geometry.is_empty)].to_crs(epsg=ALBERS_EPSG)
+    centres = layer.geometry.centroid
+
+    attributes = pd.DataFrame({column: layer[column].tolist() for column in columns})
+    attributes['x'] = centres.x.tolist()
+    attributes['y'] = centres.y.tolist()
+
+    geometries = list(layer.geometry.buffer(buffer_distance) if buffer_distance else layer.geometry)
+
+    return attributes, geometries
+
+
+def reference_layer_fn(shapefile, columns, cache_dir, buffer_distance=0):
+    """ Return a reference layer from the reference cache, reading (and caching) the shapefile when the cache is
+    missing or the shapefile has changed.
+
+    @param shapefile: string object containing the path to the shapefile.
+    @param columns: list object containing the attribute columns to retain.
+    @param cache_dir: string object containing the path to the reference cache directory.
+    @param buffer_distance: integer object containing the buffer applied to each feature (metres, 0 for none).
+    @return attributes: dataframe object containing the retained columns and the centre (x, y) of each feature.
+    @return geometries: list object containing the (buffered) geometry of each feature.
+    """
+    from shapely import wkb
+
+    fingerprint = fingerprint_fn(shapefile, buffer_distance)
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+    cache_path = os.path.join(cache_dir, '{0}_{1}.pkl'.format(name, fingerprint))
+
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as cache:
+            entry = pickle.load(cache)
+        print('Reference layer (cache): ', cache_path)
+        return pd.DataFrame(entry['attributes']), [wkb.loads(geometry) for geometry in entry['wkb']]
+
+    attributes, geometries = read_layer_fn(shapefile, columns, buffer_distance)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # remove the caches of earlier versions of the shapefile
+    for stale in glob.glob(os.path.join(cache_dir, '{0}_*.pkl'.format(name))):
+        os.remove(stale)
+
+    # WKB is independent of the shapely version, the cache is written to a temporary file and renamed into place
+    entry = {'source': shapefile, 'attributes': attributes.to_dict('list'),
+             'wkb': [wkb.dumps(geometry) for geometry in geometries]}
+    with open(cache_path + '.tmp', 'wb') as cache:
+        pickle.dump(entry, cache, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + '.tmp', cache_path)
+    print('Reference layer: ', shapefile, ' cached: ', cache_path)
+
+    return attributes, geometries
+
+
+def query_pairs_fn(geometries, sites, tree=None):
+    """ Return the (site, feature) index pairs of every site which intersects a feature, through a single STRtree.
+
+    @param geometries: list object containing the reference layer geometries.
+    @param sites: list object containing the site geometries (polygons or points).
+    @param tree: STRtree object built from geometries and retained by the caller (built here if None).
+    @return list object containing (site index, feature index) tuples in site order.
+    """
+    import numpy as np
+    from shapely.strtree import STRtree
+
+    if not geometries or not sites:
+        return []
+
+    if tree is None:
+        tree = STRtree(geometries)
+
+    try:
+        # shapely 2: a bulk query of every site returns the site and feature indices
+        site_index, feature_index = tree.query(np.array(sites, dtype=object), predicate='intersects')
+        return sorted(zip(site_index.tolist(), feature_index.tolist()))
+    except TypeError:
+        pass
+
+    # shapely 1.8: the tree returns the candidate geometries of one site at a time
+    positions = dict((id(geometry), position) for position, geometry in enumerate(geometries))
+    pairs = []
+    for position, site in enumerate(sites):
+        features = sorted(positions[id(candidate)] for candidate in tree.query(site))
+        pairs.extend((position, feature) for feature in features if geometries[feature].intersects(site))
+
+    return pairs
+
+
+def site_tiles_fn(sites, tile_attributes, tile_geometries):
+    """ Identify the Landsat tiles overlaying each site.
+
+    @param sites: list object containing the site geometries (Australian Albers).
+    @param tile_attributes: dataframe object containing the WRSPR and centre of each tile.
+    @param tile_geometries: list object containing the negatively buffered tile geometries.
+    @return list object containing a dictionary (path, row, wrspr and tiles) per site.
+    """
+
+    site_pairs = {}
+    for site, tile in query_pairs_fn(tile_geometries, sites):
+        site_pairs.setdefault(site, []).append(tile)
+
+    wrspr_list = tile_attributes['WRSPR'].tolist()
+    x_list = tile_attributes['x'].tolist()
+    y_list = tile_attributes['y'].tolist()
+
+    tiles = []
+    for position, site in enumerate(sites):
+        candidates = site_pairs.get(position, [])
+        if not candidates:
+            tiles.append({'path': '', 'row': '', 'wrspr': '', 'tiles': ''})
+            continue
+
+        centre = site.centroid
+        nearest = min(candidates, key=lambda tile: ((x_list[tile] - centre.x) ** 2 + (y_list[tile] - centre.y) ** 2,
+                                                    int(wrspr_list[tile])))
+        wrspr = int(wrspr_list[nearest])
+        tiles.append({'path': wrspr // 1000, 'row': wrspr % 1000, 'wrspr': wrspr,
+                      'tiles': ';'.join(str(int(wrspr_list[tile])) for tile in sorted(
+                          candidates, key=lambda tile: int(wrspr_list[tile])))})
+
+    return tiles
+
+
+def site_properties_fn(sites, property_attributes, property_geometries):
+    """ Identify the pastoral property containing the centre of each site.
+
+    @param sites: list object containing the site geometries (Australian Albers).
+    @param property_attributes: dataframe object containing the PROPERTY and PROP_TAG of each property.
+    @param property_geometries: list object containing the property geometries.
+    @return list object containing a dictionary (prop_tag and property) per site.
+    """
+
+    centres = [site.centroid for site in sites]
+    site_property = {}
+    for site, feature in query_pairs_fn(property_geometries, centres):
+        # the first property (layer order) where properties overlap
+        site_property.setdefault(site, feature)
+
+    tag_list = property_attributes['PROP_TAG'].tolist()
+    name_list = property_attributes['PROPERTY'].tolist()
+
+    properties = []
+    for position in range(len(sites)):
+        feature = site_property.get(position)
+        if feature is None:
+            properties.append({'prop_tag': '', 'property': ''})
+        else:
+            properties.append({'prop_tag': tag_list[feature], 'property': name_list[feature]})
+
+    return properties
+
+
+def enrich_sites_fn(geo_df, tile_grid=None, pastoral_estate=None, cache_dir=CACHE_DIR_NAME):
+    """ Attach the Landsat tile and pastoral property of every site.
+
+    @param geo_df: geo-dataframe object containing the uid, site_name and geometry of each site (with a crs).
+    @param tile_grid: string object containing the path to the Landsat tile grid shapefile (optional).
+    @param pastoral_estate: string object containing the path to the pastoral estate shapefile (optional).
+    @param cache_dir: string object containing the path to the reference cache directory.
+    @return enrichment_df: dataframe object containing the uid, site_name, path, row, wrspr, tiles, prop_tag and property
+    of each site (the columns of a layer which was not given are omitted).
+    """
+    import zonal_extract
+
+    albers_gdf = zonal_extract.site_polygons_fn(geo_df)
+    sites = list(albers_gdf.geometry)
+    enrichment_df = pd.DataFrame({'uid': albers_gdf['uid'].tolist(), 'site_name': albers_gdf['site_name'].tolist()})
+
+    if tile_grid is not None:
+        tile_attributes, tile_geometries = reference_layer_fn(tile_grid, TILE_COLUMNS, cache_dir, TILE_BUFFER)
+        tiles_df = pd.DataFrame(site_tiles_fn(sites, tile_attributes, tile_geometries),
+                                columns=['path', 'row', 'wrspr', 'tiles'])
+        enrichment_df = pd.concat([enrichment_df, tiles_df], axis=1)
+        print('Sites within a Landsat tile: ', int((tiles_df['tiles'] != '').sum()), ' of ', len(sites))
+
+    if pastoral_estate is not None:
+        property_attributes, property_geometries = reference_layer_fn(pastoral_estate, PROPERTY_COLUMNS, cache_dir)
+        properties_df = pd.DataFrame(site_properties_fn(sites, property_attributes, property_geometries),
+                                     columns=['prop_tag', 'property'])
+        enrichment_df = pd.concat([enrichment_df, properties_df], axis=1)
+        print('Sites within a pastoral property: ', int((properties_df['prop_tag'] != '').sum()), ' of ', len(sites))
+
+    return enrichment_df
+
+
+def main_routine(geo_df, export_dir_path, tile_grid=None, pastoral_estate=None, cache_dir=None):
+    """ Enrich the sites of a run and export site_enrichment.csv to the export directory.
+
+    @param geo_df: geo-dataframe object containing the uid, site_name and geometry of each site.
+    @param export_dir_path: string object containing the path to the export directory.
+    @param tile_grid: string object containing the path to the Landsat tile grid shapefile (optional).
+    @param pastoral_estate: string object containing the path to the pastoral estate shapefile (optional).
+    @param cache_dir: string object containing the path to the reference cache directory (export directory
+    reference_cache if None).
+    @return output_path: string object containing the path to site_enrichment.csv.
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.join(export_dir_path, CACHE_DIR_NAME)
+
+    enrichment_df = enrich_sites_fn(geo_df, tile_grid, pastoral_estate, cache_dir)
+
+    output_path = os.path.join(export_dir_path, ENRICHMENT_NAME)
+    enrichment_df.to_csv(output_path, index=False)
+    print('Exported site enrichment: ', output_path)
+
+    return output_path
@@ -4,12 +4,14 @@
 Fractional cover zonal statistics pipeline
 ==========================================
 
-Description: This pipeline comprises 11 scripts which read in the AGB biomass csv. Pipeline converts data to
+Description: This pipeline comprises 4 step scripts which read in the AGB biomass csv. Pipeline converts data to
 geo-dataframe and created a 1ha polygon (site) for each point. Once this is complete the pipeline runs zonal statistics
 on the current Landsat mosaic and exports a csv per site into an outputs directory. Note, seasonal composites can be
-6 band, 3 band, greyscale and classified.
+6 band, 3 band, greyscale and classified. The products processed (mosaic directory, search criteria, bands, no data,
+scaling, statistics and class names) are registered in product_registry.py and a single zonal stats script
+(step1_4_product_zonal_stats.py) processes every registered product.
 Once pipeline is complete a temporary directory which was created will be deleted from the working drive, if script fails
-the temporary directory requires manual deletion.
+the run can be continued with the command argument --resume (the temporary directory is retained for this purpose).
 
 
 step1_1_initiate_fractional_cover_zonal_stats_pipeline.py
@@ -20,10 +22,17 @@ This script:
 1. Imports and passes the command line arguments.
 
 2. Creates two directories named: user_YYYYMMDD_HHMM. If either of the directories exist, they WILL BE DELETED.
+When a run is resumed the existing directories of the run are reused.
 
-3. Controls the workflow of the pipeline.
+3. Controls the workflow of the pipeline, recording the completed stages and images in run_manifest.json (export
+directory) so that a failed run can be resumed (refer to run_manifest.py).
 
-4. deletes the temporary directory and its contents once the pipeline has completed.
+4. Records the wall and CPU time of each phase (listing, geometry, open, read, rasterize, statistics, dataframe and
+write), the bytes and pixels read, the rows written and the read amplification (blocks touched, pixels decoded and
+bytes fetched against the pixels inside the site footprints) per product and image, and writes run_report.json and
+run_report.html (product totals and the slowest images) to the export directory (refer to run_report.py).
+
+5. deletes the temporary directory and its contents once the pipeline has completed.
 
 
 Author: Rob McGregor
@@ -63,7 +72,17 @@ Command arguments:
 ------------------
 
  - tile_grid
-    - String object containing the path to the Landsat tile grid shapefile.
+    - String object containing the path to the Landsat tile grid shapefile (i.e. Landsat_wrs2_TileGrid.shp, optional).
+   The WRS2 path and row of the tiles overlaying each site are written to site_enrichment.csv in the export directory
+   (refer to site_enrichment.py).
+
+ - pastoral_estate
+    - String object containing the path to the pastoral estate shapefile (i.e. NT_Pastoral_Estate.shp, optional). The
+   property name and PROP_TAG containing each site are written to site_enrichment.csv.
+
+ - reference_cache
+    - String object containing the path to the directory the projected tile grid and pastoral estate are cached in
+   between runs (default value is reference_cache in export_dir).
 
  - data:
     - String object containing the file path to the agb biomass csv created from biomass_field_data_clean_v4.ipynb notebook.
@@ -76,7 +95,79 @@ exported here.
  - mosaic_dir
     - String object containing the path to the Landsat seasonal mosaic directory (default value is r'Z:\Landsat\mosaic').
    Note: deviation from this structure fill cause the pipeline to fail; however, path changes can be easily made on
-   step1_1_initiate_fractional_cover_zonal_stats_pipeline.py
+   product_registry.py
+
+ - workers
+    - Integer object containing the number of worker processes used to calculate the zonal statistics (default value
+   is 1). Site windows are shared with the workers through shared memory (Python 3.8 or later).
+
+ - stage_dir
+    - String object containing the path to a local (SSD) directory. When set, the mosaics are copied from
+   mosaics_dir into this directory (validated against the source size and modification time) and read locally.
+   Staged mosaics are retained between runs.
+
+ - stage_budget
+    - Float object containing the maximum size of the staging directory in gigabytes (default value is 200). The
+   least recently used mosaics are evicted when the budget is exceeded.
+
+ - tiled_cache
+    - String object containing the path to a tiled GeoTIFF cache built by mosaic_transcode.py (optional). Mosaics
+   with a current tiled copy (matching source size and modification time) are read from the cache.
+
+ - memory_budget
+    - String object containing the memory available to the pipeline (i.e. 6GB or 512MB, optional). Site windows are
+   read in batches and results are spilled to the temporary directory to stay within the budget. The duration and
+   peak memory (RSS) of each stage are written to memory_report.csv in the export directory.
+
+ - resume
+    - String object containing the path to the export directory of a failed run (optional). The run continues in its
+   existing export and temporary directories: completed stages and images (recorded in run_manifest.json) are
+   skipped after their outputs are validated. The arguments of the original run are restored unless they are given
+   on the command line (i.e. --resume <run> --workers 4); the sites and mosaics (data, mosaics_dir, export_dir,
+   batch, tile_grid and pastoral_estate) cannot be changed. The configuration of the resumed run is printed.
+
+ - fuse
+    - Boolean flag (optional). Process the registered products together rather than one after another: the sites are
+   projected and read once, the site windows and rasterized site masks are calculated once per pixel grid and shared
+   by every product on the grid, and each round reads the next mosaic of every product in the same site-major pass.
+   Products on a different grid are planned separately. The outputs are identical to an unfused run.
+
+ - stack_depth
+    - Integer object containing the number of composites of a product read as one time stack (i.e. 64, optional).
+   Each site window is read from every composite of the stack as a single (time, band, y, x) cube and the statistics
+   of every composite are calculated with vectorised reductions (refer to temporal_stack.py). Cannot be combined with
+   fuse.
+
+ - trace
+    - Boolean flag (optional). Records a span (phase, product, image, bytes, process and thread) for every timed
+   phase, staging copy and wait, and worker statistics chunk, and merges the spans of every thread and process into
+   trace.json (Chrome trace event format) in the export directory. Open the file in a local trace viewer
+   (chrome://tracing or Perfetto) to see idle workers, waits on the network share and serialisation bottlenecks.
+
+ - io_trace
+    - Boolean flag (optional). Records every mosaic open (with the raster layout), window read, close and staging
+   copy of the run in order to io_trace.jsonl in the export directory. Replay the trace offline against synthetic
+   rasters and a simulated network share with io_replay.py to compare I/O strategies.
+
+ - dry_run
+    - Boolean flag (optional). Prints the plan of the run and exits without reading pixel data or creating the export
+   and temporary directories: the sites, the mosaics listed per product (a product without mosaics is reported with
+   its search path), the site x image and site x image x band tasks, the blocks and bytes fetched under the read
+   strategy (tiled cache, staging or the share, and the window, coalesced or full reads of read_strategy) and the
+   runtime predicted from previous runs in export_dir (refer to run_planner.py).
+
+ - batch
+    - String objects containing the paths to further site sources (site csv files in the biomass csv format or point /
+   polygon shapefiles, i.e. NT_StarTransect_20200713.shp, optional). The sites of data and every batch source are
+   merged into one set of zones (sites with an identical 1ha footprint are extracted once) and the mosaics are read
+   once for all of them. The zonal stats are then written per source to <source>/<product>_zonal_stats in the export
+   directory, and batch_zones.csv records the zone of each source site (refer to site_batch.py).
+
+ - read_strategy
+    - String object containing how the site windows of each mosaic are read (auto, window, coalesced or full, default
+   auto). With auto the strategy of each mosaic is chosen from a cost model of the read calls, blocks, stored bytes
+   and decoded pixels, calibrated on the reads of this and previous runs (read_calibration.json in export_dir, refer
+   to read_strategy.py). The statistics do not depend on the strategy.
 
 
 ======================================================================================================
@@ -113,17 +204,102 @@ def get_cmd_args_fn():
     p.add_argument('-l', '--mosaics_dir', help="The NT seasonal mosaics directory path",
                    default=r"R:\landsat\mosaics")
 
+    p.add_argument('-w', '--workers', type=int,
+                   help="Enter the number of worker processes used to calculate the zonal statistics (i.e. 4)",
+                   default=1)
+
+    p.add_argument('-s', '--stage_dir',
+                   help="Local (SSD) directory used to stage the mosaics from the network share (optional)",
+                   default=None)
+
+    p.add_argument('-b', '--stage_budget', type=float,
+                   help="Enter the maximum size of the staging directory in gigabytes (i.e. 200)",
+                   default=200)
+
+    p.add_argument('-c', '--tiled_cache',
+                   help="Local tiled GeoTIFF cache built by mosaic_transcode.py, read in place of the source (optional)",
+                   default=None)
+
+    p.add_argument('-m', '--memory_budget',
+                   help="Enter the memory available to the pipeline (i.e. 6GB or 512MB), work is batched and spilled to "
+                        "disk to stay within it (optional)",
+                   default=None)
+
+    p.add_argument('-r', '--resume',
+                   help="Enter the export directory of a failed run to continue the run from its last checkpoint "
+                        "(optional)",
+                   default=None)
+
+    p.add_argument('-f', '--fuse', action='store_true',
+                   help="Process the products on a shared pixel grid together in a single fused pass (optional)")
+
+    p.add_argument('-t', '--stack_depth', type=int,
+                   help="Enter the number of composites of a product read as one time stack (i.e. 64, optional)",
+                   default=None)
+
+    p.add_argument('--trace', action='store_true',
+                   help="Record a Chrome trace event timeline of every thread and worker process (trace.json in the "
+                        "export directory, optional)")
+
+    p.add_argument('--io_trace', action='store_true',
+                   help="Record the mosaic opens, window reads and staging copies of the run (io_trace.jsonl in the "
+                        "export directory, optional)")
+
+    p.add_argument('--read_strategy', choices=['auto', 'window', 'coalesced', 'full'],
+                   help="Enter how the site windows of each mosaic are read (auto chooses per mosaic from a calibrated "
+                        "cost model, default auto)",
+                   default='auto')
+
+    p.add_argument('--batch', nargs='+',
+                   help="Enter further site sources (csv or shapefile) extracted with data in a single run, the "
+                        "outputs are split per source (optional)",
+                   default=None)
+
+    p.add_argument('--tile_grid',
+                   help="Enter the Landsat tile grid shapefile, the WRS2 path and row of each site are written to "
+                        "site_enrichment.csv (optional)",
+                   default=None)
+
+    p.add_argument('--pastoral_estate',
+                   help="Enter the pastoral estate shapefile, the property and PROP_TAG of each site are written to "
+                        "site_enrichment.csv (optional)",
+                   default=None)
+
+    p.add_argument('--reference_cache',
+                   help="Enter the directory the reference layers are cached in between runs (default "
+                        "export_dir\\reference_cache)",
+                   default=None)
+
+    p.add_argument('--dry_run', action='store_true',
+                   help="Print the sites, tasks, bytes and predicted runtime of each product and exit without reading "
+                        "pixel data (optional)")
+
     # p.add_argument('-n', '--no_data', help="Enter the Landsat Fractional Cover no data value (i.e. 0)",
     #                default=0)
 
 
     cmd_args = p.parse_args()
 
-    if cmd_args.data is None:
+    if cmd_args.data is None and cmd_args.resume is None:
         p.print_help()
 
         sys.exit()
 
+    if cmd_args.fuse and cmd_args.stack_depth:
+        print('The fuse and stack_depth arguments cannot be used together.')
+        sys.exit()
+
+    if cmd_args.dry_run and cmd_args.data is None:
+        print('The dry_run argument requires the data argument.')
+        sys.exit()
+
+    if cmd_args.resume is not None:
+        # the arguments given on the command line (the parser only sets those), the others are restored from the run
+        # manifest
+        unset = object()
+        given = p.parse_args(namespace=argparse.Namespace(**dict((name, unset) for name in vars(cmd_args))))
+        cmd_args.explicit = [name for name, value in vars(given).items() if value is not unset]
+
     return cmd_args
 
 
@@ -234,43 +410,23 @@ def export_dir_folders_fn(export_dir_path):
     @return rainfall_output_dir:
     """
 
-    h99a2_zonal_stats_output_dir = (export_dir_path + '\\h99a2_zonal_stats')
-    print("h99a2_zonal_stats_output_dir: ", h99a2_zonal_stats_output_dir)
-    os.mkdir(h99a2_zonal_stats_output_dir)
+    import product_registry
+    for product in product_registry.PRODUCTS:
+        zonal_stats_output_dir = os.path.join(export_dir_path, '{0}_zonal_stats'.format(product['name']))
+        print("{0}_zonal_stats_output_dir: ".format(product['name']), zonal_stats_output_dir)
+        os.mkdir(zonal_stats_output_dir)
 
-    fpca2_zonal_stats_output_dir = (export_dir_path + '\\fpca2_zonal_stats')
-    os.mkdir(fpca2_zonal_stats_output_dir)
-    #
     dp0_zonal_stats_output_dir = (export_dir_path + '\\dp0_zonal_stats')
     os.mkdir(dp0_zonal_stats_output_dir)
 
     dp1_zonal_stats_output_dir = (export_dir_path + '\\dp1_zonal_stats')
     os.mkdir(dp1_zonal_stats_output_dir)
-    #
-    dbi_zonal_stats_output_dir = (export_dir_path + '\\dbi_zonal_stats')
-    os.mkdir(dbi_zonal_stats_output_dir)
-
-    dim_zonal_stats_output_dir = (export_dir_path + '\\dim_zonal_stats')
-    os.mkdir(dim_zonal_stats_output_dir)
-
-    dis_zonal_stats_output_dir = (export_dir_path + '\\dis_zonal_stats')
-    os.mkdir(dis_zonal_stats_output_dir)
-
-    dja_zonal_stats_output_dir = (export_dir_path + '\\dja_zonal_stats')
-    os.mkdir(dja_zonal_stats_output_dir)
-
-    dka_zonal_stats_output_dir = (export_dir_path + '\\dka_zonal_stats')
-    os.mkdir(dka_zonal_stats_output_dir)
-
-    stc_zonal_stats_output_dir = (export_dir_path + '\\stc_zonal_stats')
-    os.mkdir(stc_zonal_stats_output_dir)
-    #
 
 
 
 def main_routine():
     """" Description: This pipeline creates a 1ha plot from biomass extent point data and extracts zonal statistics
-    from the following Landsat mosaics:
+    from the Landsat mosaics registered in product_registry.py:
      - h99a2
      - fpca2
      - dbi
@@ -287,188 +443,206 @@ def main_routine():
 
     # read in the command arguments
     cmd_args = get_cmd_args_fn()
-    data = cmd_args.data
-    export_dir = cmd_args.export_dir
-    mosaics_dir = cmd_args.mosaics_dir
-
 
-    # call the temporaryDir function.
-    temp_dir_path, final_user = temporary_dir_fn()
-    # call the tempDirFolders function.
-    prime_temp_grid_dir, prime_temp_buffer_dir, zonal_stats_ready_dir = temp_dir_folders_fn(temp_dir_path)
-    # call the exportFilepath function.
-    export_dir_path = export_file_path_fn(export_dir, final_user)
+    import run_manifest
+    if cmd_args.resume is not None:
+        # continue a failed run with the arguments it recorded (refer to run_manifest.resume_arguments_fn)
+        manifest = run_manifest.load_run_fn(cmd_args.resume)
+        for name, value in run_manifest.resume_arguments_fn(vars(cmd_args), cmd_args.explicit).items():
+            setattr(cmd_args, name, value)
 
-    export_dir_folders_fn(export_dir_path)
+        if cmd_args.fuse and cmd_args.stack_depth:
+            print('The fuse and stack_depth arguments cannot be used together.')
+            sys.exit()
 
-    print(data)
-    import step1_3_project_buffer
-    geo_df2, crs_name = step1_3_project_buffer.main_routine(data, export_dir_path, prime_temp_buffer_dir)
-
-    geo_df2.reset_index(drop=True, inplace=True)
-    geo_df2['uid'] = geo_df2.index + 1
+    data = cmd_args.data
+    export_dir = cmd_args.export_dir
+    mosaics_dir = cmd_args.mosaics_dir
+    workers = cmd_args.workers
+    batch = cmd_args.batch
+    tile_grid = cmd_args.tile_grid
+    pastoral_estate = cmd_args.pastoral_estate
+
+    if cmd_args.tiled_cache is not None:
+        import mosaic_transcode
+        mosaic_transcode.configure_tiled_cache_fn(cmd_args.tiled_cache)
+
+    # a whole mosaic read is only offered within the memory budget (refer to read_strategy.full_read_allowed_fn)
+    import memory_budget
+    memory_budget.configure_memory_budget_fn(cmd_args.memory_budget)
+
+    if cmd_args.dry_run:
+        # plan the run from the csv and the mosaic headers only (refer to run_planner.py)
+        import run_planner
+        try:
+            run_planner.plan_run_fn(data, mosaics_dir, export_dir, workers, cmd_args.stage_dir, batch,
+                                    cmd_args.read_strategy, not cmd_args.fuse)
+        except ValueError as error:
+            print(error)
+            sys.exit()
+        return
+
+    if cmd_args.stage_dir is not None:
+        import mosaic_staging
+        mosaic_staging.configure_staging_fn(cmd_args.stage_dir, cmd_args.stage_budget)
+
+    # wall and CPU time of each phase, product and image (refer to run_report.py)
+    import run_report
+
+    if cmd_args.resume is not None:
+        # continue a failed run in its existing directories (refer to run_manifest.py)
+        export_dir_path = manifest['export_dir_path']
+        temp_dir_path = manifest['temp_dir_path']
+        prime_temp_buffer_dir = temp_dir_path + '\\temp_1ha_buffer'
+
+        if not os.path.isdir(temp_dir_path):
+            print('The temporary directory no longer exists and will be created: ', temp_dir_path)
+            os.makedirs(temp_dir_path)
+            temp_dir_folders_fn(temp_dir_path)
+
+    else:
+        # call the temporaryDir function.
+        temp_dir_path, final_user = temporary_dir_fn()
+        # call the tempDirFolders function.
+        prime_temp_grid_dir, prime_temp_buffer_dir, zonal_stats_ready_dir = temp_dir_folders_fn(temp_dir_path)
+        # call the exportFilepath function.
+        export_dir_path = export_file_path_fn(export_dir, final_user)
+
+        export_dir_folders_fn(export_dir_path)
+
+        # record the run so it can be resumed if it fails
+        run_manifest.create_run_fn(export_dir_path, temp_dir_path, vars(cmd_args))
+
+    if cmd_args.trace:
+        # spans of every thread and worker process, merged into trace.json at the end of the run
+        run_report.configure_trace_fn(os.path.join(export_dir_path, 'trace.json'),
+                                      os.path.join(temp_dir_path, 'trace_spool'))
+
+    if cmd_args.io_trace:
+        # mosaic I/O in the order issued, for offline replay (refer to io_replay.py)
+        import io_trace
+        io_trace.configure_io_trace_fn(os.path.join(export_dir_path, io_trace.IO_TRACE_NAME))
+
+    # the read calibration is shared by every run in the export directory (refer to read_strategy.py)
+    import read_strategy
+    read_strategy.configure_read_strategy_fn(cmd_args.read_strategy,
+                                             os.path.join(export_dir, read_strategy.CALIBRATION_NAME))
 
     shapefile_path = os.path.join(export_dir_path, "biomass_1ha_all_sites.shp")
-    geo_df2.to_file(os.path.join(shapefile_path),
-                    driver="ESRI Shapefile")
 
-    print("Exported shapefile: ", shapefile_path)
-    # ----------------------------------------------------- h99 --------------------------------------------------------
+    if run_manifest.stage_complete_fn('project_buffer'):
+        import geopandas as gpd
+        geo_df2 = gpd.read_file(shapefile_path)
+
+    elif batch:
+        # one zone per distinct site footprint of every source (refer to site_batch.py)
+        import site_batch
+        with memory_budget.stage_fn('project_buffer'), run_report.context_fn(product='project_buffer'), \
+                run_report.timer_fn('geometry'):
+            try:
+                geo_df2, zones_path = site_batch.batch_sites_fn([data] + batch, export_dir_path,
+                                                                prime_temp_buffer_dir)
+            except ValueError as error:
+                print(error)
+                sys.exit()
+
+        geo_df2.to_file(os.path.join(shapefile_path),
+                        driver="ESRI Shapefile")
+
+        print("Exported shapefile: ", shapefile_path)
+        run_manifest.complete_stage_fn('project_buffer', [shapefile_path, zones_path])
+
+    else:
+        print(data)
+        import step1_3_project_buffer
+        with memory_budget.stage_fn('project_buffer'), run_report.context_fn(product='project_buffer'), \
+                run_report.timer_fn('geometry'):
+            geo_df2, crs_name = step1_3_project_buffer.main_routine(data, export_dir_path, prime_temp_buffer_dir)
+
+        geo_df2.reset_index(drop=True, inplace=True)
+        geo_df2['uid'] = geo_df2.index + 1
+
+        geo_df2.to_file(os.path.join(shapefile_path),
+                        driver="ESRI Shapefile")
+
+        print("Exported shapefile: ", shapefile_path)
+        run_manifest.complete_stage_fn('project_buffer', [shapefile_path])
+
+    if (tile_grid is not None or pastoral_estate is not None) and not run_manifest.stage_complete_fn('enrichment'):
+        # tile path / row and property of each site, the reference layers are cached between runs
+        import site_enrichment
+        cache_dir = cmd_args.reference_cache or os.path.join(export_dir, site_enrichment.CACHE_DIR_NAME)
+        with memory_budget.stage_fn('enrichment'), run_report.context_fn(product='enrichment'), \
+                run_report.timer_fn('geometry'):
+            enrichment_path = site_enrichment.main_routine(geo_df2, export_dir_path, tile_grid, pastoral_estate,
+                                                           cache_dir)
+        run_manifest.complete_stage_fn('enrichment', [enrichment_path])
 
     print("-" * 50)
     print("Creating lists of tiff's")
     print("-" * 50)
 
-    h99a2_dir = os.path.join(mosaics_dir, "structural_formation", "h99_mos")
-    print("h99: ")
+    # the mosaic directory, search criteria, bands and no data of each product are registered in product_registry.py
+    import product_registry
     import step1_2_list_of_images
-    h99a2_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, h99a2_dir, 'h99a2', "*h99a2*.img")
-
-    # ---------------------------------------------------- fpca2 -------------------------------------------------------
-
-    fpca2_dir = os.path.join(mosaics_dir, "structural_formation", "h99_mos")
-    print("Fpc: ")
-    fpca2_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, fpca2_dir, 'fpca2', "*fpca2*.img")
-
-    # ---------------------------------------------------- dbi ---------------------------------------------------------
-
-    dbi_dir = os.path.join(mosaics_dir, "SeasonalComposites", "dbi")
-    print("Dbi: ")
-    dbi_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, dbi_dir, 'dbi', "*dbi*.tif")
-
-    # ---------------------------------------------------- dim ---------------------------------------------------------
-
-    dim_dir = os.path.join(mosaics_dir, "SeasonalComposites", "dim")
-    print("Dim: ")
-    dim_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, dim_dir, 'dim', "*dim*.tif")
-
-    # ---------------------------------------------------- dis ---------------------------------------------------------
-
-    dis_dir = os.path.join(mosaics_dir, "SeasonalComposites", "dis")
-    print("Dis: ")
-    dis_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, dis_dir, 'dis', "*dis*.tif")
-
-    # ---------------------------------------------------- dja ---------------------------------------------------------
-
-    dja_dir = os.path.join(mosaics_dir, "SeasonalComposites", "dja")
-    print("Dja: ")
-    dja_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, dja_dir, 'dja', "*dja*.tif")
-
-    # # ---------------------------------------------------- dka -------------------------------------------------------
-
-    dka_dir = os.path.join(mosaics_dir, "fire_scar")
-    print("Dka: ")
-    dka_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, dka_dir, 'dka', "*dka*.tif")
-    # # ---------------------------------------------------- stc -------------------------------------------------------
-
-    stc_dir = os.path.join(mosaics_dir, "structural_formation", "stc_17")
-    print("Stc: ")
-    stc_export_csv = step1_2_list_of_images.main_routine(
-        export_dir_path, stc_dir, 'stc', "*stc*.img")
-
+    export_csv_dict = {}
+    for product in product_registry.PRODUCTS:
+        print(product['name'] + ": ")
+        with run_report.context_fn(product=product['name']), run_report.timer_fn('listing'):
+            export_csv_dict[product['name']] = step1_2_list_of_images.main_routine(
+                export_dir_path, os.path.join(mosaics_dir, product['sub_dir']), product['name'], product['pattern'])
 
     print("-"*50)
     print("Zonal stats............")
     print("-" * 50)
     # ------------------------------------------------------------------------------------------------------------------
     # Zonal Stats
-    # ------------------------------------------------ h99a2 -----------------------------------------------------------
-
-    h99a2_zonal_stats_output = os.path.join(export_dir_path, 'h99a2_zonal_stats')
-    print('h99a2 zonal_stats_output: ', h99a2_zonal_stats_output)
-
-    # no data for persistent green is 0
-    no_data = 0
-    import step1_4_seasonal_h99a2_zonal_stats
-    step1_4_seasonal_h99a2_zonal_stats.main_routine(
-        export_dir_path, 'h99a2', h99a2_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # ------------------------------------------------ fpca2 3 bands ---------------------------------------------------
-
-    fpca2_zonal_stats_output = os.path.join(export_dir_path, 'fpca2_zonal_stats')
-    print('fpca2 zonal_stats_output: ', fpca2_zonal_stats_output)
-
-    no_data = 0
-
-    import step1_5_seasonal_fpca2_zonal_stats
-    step1_5_seasonal_fpca2_zonal_stats.main_routine(
-        export_dir_path, 'fpca2', fpca2_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # ---------------------------------------------------- dbi 6 bands working -----------------------------------------
-
-    dbi_zonal_stats_output = os.path.join(export_dir_path, 'dbi_zonal_stats')
-    print('dbi zonal_stats_output: ', dbi_zonal_stats_output)
-
-    no_data = 32767
-
-    import step1_6_seasonal_dbi_zonal_stats
-    step1_6_seasonal_dbi_zonal_stats.main_routine(
-        export_dir_path, 'dbi', dbi_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # ------------------------------------------------ dim 3 bands working ---------------------------------------------
-
-    dim_zonal_stats_output = os.path.join(export_dir_path, 'dim_zonal_stats')
-    print('dim zonal_stats_output: ', dim_zonal_stats_output)
-
-    no_data = 0
-
-    import step1_7_seasonal_dim_zonal_stats
-    step1_7_seasonal_dim_zonal_stats.main_routine(
-        export_dir_path, 'dim', dim_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # -------------------------------------------------- dis classified working ----------------------------------------
-
-    dis_zonal_stats_output = os.path.join(export_dir_path, 'dis_zonal_stats')
-    print('dis zonal_stats_output: ', dis_zonal_stats_output)
-
-    no_data = 255
-
-    import step1_8_seasonal_dis_zonal_stats
-    step1_8_seasonal_dis_zonal_stats.main_routine(
-        export_dir_path, 'dis', dis_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # ------------------------------------------------ dja greyscale working -------------------------------------------
-
-    dja_zonal_stats_output = os.path.join(export_dir_path, 'dja_zonal_stats')
-    print('dja zonal_stats_output: ', dja_zonal_stats_output)
-
-    no_data = 0
-
-    import step1_9_seasonal_dja_zonal_stats
-    step1_9_seasonal_dja_zonal_stats.main_routine(
-        export_dir_path, 'dja', dja_export_csv, temp_dir_path, geo_df2, no_data)
-
-    # ---------------------------------------------------- dka classified working --------------------------------------
-
-    dka_zonal_stats_output = os.path.join(export_dir_path, 'dka_zonal_stats')
-    print('dka zonal_stats_output: ', dka_zonal_stats_output)
-
-    no_data = 255
+    # ------------------------------------------------------------------------------------------------------------------
 
-    import step1_10_seasonal_dka_zonal_stats
-    step1_10_seasonal_dka_zonal_stats.main_routine(
-        export_dir_path, 'dka', dka_export_csv, temp_dir_path, geo_df2, no_data)
+    import step1_4_product_zonal_stats
+    if cmd_args.fuse:
+        # the site plan is shared by the products on each pixel grid and the products are read in the same pass
+        variables = [product['name'] for product in product_registry.PRODUCTS
+                     if not run_manifest.stage_complete_fn(product['name'])]
+        if variables:
+            with memory_budget.stage_fn('fused'):
+                step1_4_product_zonal_stats.fused_main_routine(
+                    export_dir_path, variables, export_csv_dict, temp_dir_path, geo_df2, workers)
+            for variable in variables:
+                run_manifest.complete_stage_fn(variable)
+
+    else:
+        for product in product_registry.PRODUCTS:
+            variable = product['name']
+            print('{0} zonal_stats_output: '.format(variable), os.path.join(export_dir_path,
+                                                                             '{0}_zonal_stats'.format(variable)))
+
+            if not run_manifest.stage_complete_fn(variable):
+                with memory_budget.stage_fn(variable):
+                    step1_4_product_zonal_stats.main_routine(
+                        export_dir_path, variable, export_csv_dict[variable], temp_dir_path, geo_df2, workers,
+                        cmd_args.stack_depth)
+                run_manifest.complete_stage_fn(variable)
+
+    if batch:
+        # the zone outputs are written to the product directories of each source
+        import site_batch
+        site_batch.split_outputs_fn(export_dir_path, product_registry.product_names_fn())
 
-    # ---------------------------------------------------- stc classified working --------------------------------------
+    # ---------------------------------------------------- Clean up ----------------------------------------------------
 
-    print("beginning STC")
-    stc_zonal_stats_output = os.path.join(export_dir_path, 'stc_zonal_stats')
-    print('stc zonal_stats_output: ', stc_zonal_stats_output)
+    memory_budget.write_memory_report_fn(export_dir_path)
+    run_report.write_run_report_fn(export_dir_path)
+    run_report.write_trace_fn()
+    read_strategy.save_calibration_fn()
 
-    no_data = 0
+    if cmd_args.stage_dir is not None:
+        mosaic_staging.close_staging_fn()
 
-    import step1_11_seasonal_stc_zonal_stats
-    step1_11_seasonal_stc_zonal_stats.main_routine(
-        export_dir_path, 'stc', stc_export_csv, temp_dir_path, geo_df2, no_data)
+    if cmd_args.io_trace:
+        io_trace.close_io_trace_fn()
 
-    # ---------------------------------------------------- Clean up ----------------------------------------------------
+    run_manifest.complete_run_fn()
 
     shutil.rmtree(temp_dir_path)
     print('Temporary directory and its contents has been deleted from your working drive.')
@@ -74,7 +74,7 @@ def output_csv_fn(list_image, export_dir_path, variable):
     @return export_rainfall: string object containing the path to the populated csv.
     """
     # assumes that file_list is a flat list, it adds a new path in a new row, producing multiple observations.
-    export_file = (export_dir_path + '\\{0}_image_list.csv'.format(variable))
+    export_file = os.path.join(export_dir_path, '{0}_image_list.csv'.format(variable))
     print("export_file: ", export_file)
     with open(export_file, "w") as output:
         writer = csv.writer(output, lineterminator='\n')
@@ -0,0 +1,657 @@
+#!/usr/bin/env python
+
+"""
+step1_4_product_zonal_stats.py
+==============================
+
+Description: This script reads in the Landsat mosaics of a registered product (refer to product_registry.py) and
+extracts zonal statistics for each 1ha plot. Returns a csv file containing the statistics for each site for all files
+listed in the product image list.
+
+ - Continuous products (i.e. h99a2, fpca2, dbi, dim and dja) produce one row per site and image, with one column per
+   statistic and band (i.e. b1_dbi_mean). Value statistics are corrected with the product scale and offset.
+ - Categorical products (i.e. dis, dka and stc) produce one row per site, image and band, with the pixel count of each
+   class in a named column (refer to the product category_map).
+
+All bands of an image are read from each site window in a single read (refer to zonal_engine.py). Images are staged
+(refer to mosaic_staging.py), checkpointed (refer to run_manifest.py) and the results exported within the memory budget
+(refer to memory_budget.py) for every product.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import shutil
+import calendar
+from contextlib import ExitStack
+from functools import partial
+from itertools import islice
+import numpy as np
+import pandas as pd
+import mosaic_staging
+import memory_budget
+import product_registry
+import run_manifest
+import run_report
+import zonal_engine
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# value statistics are scaled and offset, spread statistics are only scaled
+VALUE_STATS = ['min', 'max', 'mean', 'median', 'majority', 'minority']
+SPREAD_STATS = ['std', 'range']
+
+TIME_STAMP_COLUMNS = ['s_day', 's_month', 's_year', 's_date', 'e_day', 'e_month', 'e_year', 'e_date']
+
+
+def project_shapefile_gcs_wgs84_fn(albers, geo_df):
+    """ Re-project the 1ha sites to Australian Albers to match the projection of the Landsat mosaics.
+
+    @param albers: string object containing the path to the subdirectory located in the temporary_dir\\albers.
+    @param geo_df: geo-dataframe object containing the 1ha sites.
+    @return cgs_df: geo-dataframe object containing the re-projected 1ha sites.
+    @return projected_shape_path: string object containing the path to the re-projected shapefile.
+    """
+
+    # project to Australian Albers
+    cgs_df = geo_df.to_crs(epsg=3577)
+
+    # define crs file/path name variable.
+    crs_name = 'albers'
+
+    # Export re-projected shapefiles.
+    projected_shape_path = os.path.join(albers, 'geo_df_' + str(crs_name) + '.shp')
+
+    # Export re-projected shapefiles.
+    cgs_df.to_file(projected_shape_path)
+
+    return cgs_df, projected_shape_path
+
+
+def image_date_fn(im_name):
+    """ Extract the date from a mosaic file name (i.e. lztmre_nt_m198712198802_dbia2.tif -> 198712198802).
+
+    @param im_name: string object containing the mosaic file name.
+    @return im_date: string object containing the seasonal (YYYYMMYYYYMM) or single (i.e. YYYY) date.
+    """
+
+    image_name_split = im_name.split("_")
+
+    if str(image_name_split[-2]).startswith("m"):
+        print("seasonal")
+        im_date = str(image_name_split[-2][1:])
+    else:
+        print("single date")
+        im_date = str(image_name_split[-2])
+
+    return im_date
+
+
+def stat_column_fn(stat):
+    """ Return the column name of a rasterstats statistic (i.e. median -> med, percentile_95 -> p95). """
+
+    if stat.startswith('percentile_'):
+        return 'p' + stat.split('_')[1]
+    if stat == 'median':
+        return 'med'
+
+    return stat
+
+
+def band_columns_fn(product, band):
+    """ Return the statistic columns of a continuous product band in registry stats order.
+
+    @param product: dictionary object containing the product registry entry.
+    @param band: integer object containing the band number.
+    @return list object containing the column names (i.e. b1_dbi_count).
+    """
+
+    return ['b{0}_{1}_{2}'.format(str(band), product['name'], stat_column_fn(stat)) for stat in product['stats']]
+
+
+def output_columns_fn(product):
+    """ Return the columns of the exported site csv files.
+
+    @param product: dictionary object containing the product registry entry.
+    @return columns: list object containing the column names.
+    """
+
+    date_columns = TIME_STAMP_COLUMNS if product['time_stamp'] else ['date']
+
+    if product['kind'] == 'categorical':
+        return (['uid', 'site', product['name'] + '_image'] + date_columns + ['band'] + product['stats'] +
+                list(product['category_map'].values()))
+
+    columns = ['uid', 'site', 'image'] + date_columns
+    for band in product['bands']:
+        columns.extend(band_columns_fn(product, band))
+
+    return columns
+
+
+def site_attributes_fn(src, uid):
+    """ Return the unique identifier and site name of each 1ha site (shapefile record order).
+
+    @param src: fiona collection object containing the 1ha sites.
+    @param uid: string object containing the unique identifier feature name.
+    @return uid_list: list object containing the unique identifiers.
+    @return site_list: list object containing the site names.
+    """
+
+    uid_list = []
+    site_list = []
+    for i in src:
+        table_attributes = i['properties']  # reads in the attribute table for each record
+        uid_list.append(table_attributes[uid])
+        site_list.append(table_attributes['site_name'])
+
+    return uid_list, site_list
+
+
+def read_sites_fn(projected_shape_path, uid):
+    """ Read the geometries and attributes of the 1ha sites once (fused and time stack extraction).
+
+    @param projected_shape_path: string object containing the path to the re-projected shapefile.
+    @param uid: string object containing the unique identifier feature name.
+    @return geometries: list object containing a geometry mapping per site.
+    @return uid_list: list object containing the unique identifiers.
+    @return site_list: list object containing the site names.
+    """
+    import fiona
+
+    with run_report.timer_fn('geometry'), fiona.open(projected_shape_path) as src:
+        geometries = zonal_engine.feature_geometries_fn(src)
+        uid_list, site_list = site_attributes_fn(src, uid)
+
+    return geometries, uid_list, site_list
+
+
+def extraction_spec_fn(product):
+    """ Return the extraction settings of a product (refer to zonal_engine.extract_fused_fn).
+
+    @param product: dictionary object containing the product registry entry.
+    @return dictionary object containing the bands, no_data, stats, categorical and category_map keys.
+    """
+
+    return {'bands': product['bands'], 'no_data': product['no_data'], 'stats': product['stats'],
+            'categorical': product['kind'] == 'categorical', 'category_map': product['category_map']}
+
+
+def apply_zonal_stats_fn(image_s, projected_shape_path, uid, product, executor=None, workers=1):
+    """ Derive the zonal stats of every band of a single mosaic for each 1ha site.
+
+    @param image_s: string object containing the file path to the current mosaic.
+    @param projected_shape_path: string object containing the path to the current 1ha shapefile path.
+    @param uid: string object containing the unique identifier feature name.
+    @param product: dictionary object containing the product registry entry.
+    @param executor: ProcessPoolExecutor object or None (refer to zonal_engine.worker_pool_fn).
+    @param workers: integer object containing the number of worker processes.
+    @return df: dataframe object containing the image results.
+    """
+    import fiona
+
+    path_, im_name = os.path.split(image_s)
+    im_date = image_date_fn(im_name)
+    print("im_date: ", im_date)
+
+    with fiona.open(projected_shape_path) as src:
+
+        # windowed reads of each site (all bands in a single read), batched to the memory budget
+        zs_bands = zonal_engine.extract_image_fn(image_s, src, product['bands'], product['no_data'],
+                                                 stats=product['stats'], categorical=product['kind'] == 'categorical',
+                                                 category_map=product['category_map'], executor=executor,
+                                                 workers=workers)
+
+        with run_report.timer_fn('geometry'):
+            uid_list, site_list = site_attributes_fn(src, uid)
+
+    with run_report.timer_fn('dataframe'):
+        df = image_df_fn(zs_bands, im_name, im_date, uid_list, site_list, product)
+
+    return df
+
+
+def image_df_fn(zs_bands, im_name, im_date, uid_list, site_list, product):
+    """ Convert the zonal stats of a single mosaic into the image results dataframe.
+
+    @param zs_bands: dictionary object containing a list of zonal statistic dictionaries per band (site order).
+    @param im_name: string object containing the mosaic file name.
+    @param im_date: string object containing the mosaic date (refer to image_date_fn).
+    @param uid_list: list object containing the unique identifier of each site.
+    @param site_list: list object containing the site name of each site.
+    @param product: dictionary object containing the product registry entry.
+    @return df: dataframe object containing the image results.
+    """
+
+    if product['kind'] == 'categorical':
+        # one row per site and band, classes which are not present are null
+        numeric = product['stats'] + list(product['category_map'].values())
+        df_list = []
+        for band in product['bands']:
+            df = pd.DataFrame.from_records(zs_bands[band]).reindex(columns=numeric).astype(float)
+            df.insert(0, 'band', band)
+            df.insert(0, 'site', site_list)
+            df.insert(0, 'uid', uid_list)
+            df.insert(0, product['name'] + '_image', im_name)
+            df.insert(0, 'date', im_date)
+            df_list.append(df)
+
+        return pd.concat(df_list, ignore_index=True)
+
+    df = pd.DataFrame({'uid': uid_list, 'site': site_list, 'date': im_date})
+    for band in product['bands']:
+        for stat, column in zip(product['stats'], band_columns_fn(product, band)):
+            df[column] = [zone[stat] for zone in zs_bands[band]]
+    df['image'] = im_name
+
+    return df
+
+
+def time_stamp_fn(output_zonal_stats):
+    """Insert a timestamp into feature position 4, convert timestamp into year, month and day strings and append to
+    dataframe.
+
+    @param output_zonal_stats: dataframe object containing the zonal stats.
+    @return output_zonal_stats: processed dataframe object containing the zonal stats and updated features.
+    """
+
+    s_year_ = []
+    s_month_ = []
+    s_day_ = []
+    s_date_ = []
+    e_year_ = []
+    e_month_ = []
+    e_day_ = []
+    e_date_ = []
+
+    print("init time stamp")
+    # Convert the date to a time stamp
+    for n in output_zonal_stats.date:
+        i = str(n)
+        if len(i) == 4:
+            # annual date, i.e. 2017
+            i = i + '01' + i + '12'
+
+        s_year = i[:4]
+        s_month = i[4:6]
+        s_day = "01"
+        s_date = str(s_year) + str(s_month) + str(s_day)
+
+        s_year_.append(s_year)
+        s_month_.append(s_month)
+        s_day_.append(s_day)
+        s_date_.append(s_date)
+
+        e_year = i[6:10]
+        e_month = i[10:12]
+        m, d = calendar.monthrange(int(e_year), int(e_month))
+        e_day = str(d)
+        e_date = str(e_year) + str(e_month) + str(d)
+
+        e_year_.append(e_year)
+        e_month_.append(e_month)
+        e_day_.append(e_day)
+        e_date_.append(e_date)
+
+    output_zonal_stats.insert(4, 'e_date', e_date_)
+    output_zonal_stats.insert(4, 'e_year', e_year_)
+    output_zonal_stats.insert(4, 'e_month', e_month_)
+    output_zonal_stats.insert(4, 'e_day', e_day_)
+
+    output_zonal_stats.insert(4, 's_date', s_date_)
+    output_zonal_stats.insert(4, 's_year', s_year_)
+    output_zonal_stats.insert(4, 's_month', s_month_)
+    output_zonal_stats.insert(4, 's_day', s_day_)
+
+    return output_zonal_stats
+
+
+def correction_fn(output_zonal_stats, product):
+    """ Replace 0 minimum values with Null values and apply the product scale and offset (i.e. remove 100).
+
+    @param output_zonal_stats: dataframe object containing the zonal stats.
+    @param product: dictionary object containing the product registry entry.
+    @return output_zonal_stats: processed dataframe object containing the corrected zonal stats.
+    """
+
+    scale = product.get('scale', 1)
+    offset = product.get('offset', 0)
+
+    for band in product['bands']:
+        if product['kind'] == 'categorical':
+            columns = dict((stat, stat) for stat in product['stats'])
+        else:
+            columns = dict(zip(product['stats'], band_columns_fn(product, band)))
+
+        if product['null_zero_min'] and 'min' in columns:
+            output_zonal_stats[columns['min']] = output_zonal_stats[columns['min']].replace(0, np.nan)
+
+        for stat, column in columns.items():
+            is_value = stat in VALUE_STATS or stat.startswith('percentile_')
+            if is_value and scale != 1:
+                output_zonal_stats[column] = output_zonal_stats[column] * scale
+            if is_value and offset != 0:
+                output_zonal_stats[column] = output_zonal_stats[column] + offset
+            if stat in SPREAD_STATS and scale != 1:
+                output_zonal_stats[column] = output_zonal_stats[column] * abs(scale)
+
+        if product['kind'] == 'categorical':
+            # the statistics columns are shared by every band
+            break
+
+    return output_zonal_stats
+
+
+def clean_zonal_stats_fn(product, output_zonal_stats):
+    """ Clean and reshape the concatenated zonal stats (all sites, or a single site when spilled to disk).
+
+    @param product: dictionary object containing the product registry entry.
+    @param output_zonal_stats: dataframe object containing the concatenated image results.
+    @return output_zonal_stats: dataframe object containing the cleaned zonal stats.
+    """
+
+    if product['time_stamp']:
+        # Convert the date to a time stamp
+        output_zonal_stats = time_stamp_fn(output_zonal_stats)
+
+    output_zonal_stats = correction_fn(output_zonal_stats, product)
+
+    # reshape the final dataframe
+    return output_zonal_stats[output_columns_fn(product)]
+
+
+def export_image_fn(df, temp_dir_images, image_s, variable):
+    """ Write the image results to a temporary csv (rather than holding every image in memory) and record the image
+    as complete in the run manifest.
+
+    @param df: dataframe object containing the image results.
+    @param temp_dir_images: string object containing the path to the product temporary image directory.
+    @param image_s: string object containing the file path to the mosaic.
+    @param variable: string object containing the product name.
+    @return image_results: string object containing the path to the image results csv.
+    """
+
+    image_results = os.path.join(temp_dir_images, 'image_' + os.path.basename(image_s) + '.csv')
+    with run_report.timer_fn('write'):
+        df.to_csv(image_results, index=False)
+    run_manifest.record_image_fn(variable, image_s, [image_results])
+    print("exported to: ", image_results)
+
+    return image_results
+
+
+def export_product_fn(export_dir_path, product, image_files, temp_dir_path):
+    """ Concatenate, clean (refer to clean_zonal_stats_fn) and export a csv per site to the product zonal stats
+    directory - the results are spilled to disk by site when they would exceed the memory budget
+    (refer to memory_budget.py).
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @param product: dictionary object containing the product registry entry.
+    @param image_files: list object containing the paths to the image results csv files.
+    @param temp_dir_path: string object containing the path to the temporary directory.
+    """
+
+    variable = product['name']
+
+    # define the zonal stats output directory pathway
+    output_dir = (os.path.join(export_dir_path, "{0}_zonal_stats".format(variable)))
+
+    if image_files:
+        with run_report.timer_fn('write'):
+            memory_budget.export_by_site_fn(image_files, partial(clean_zonal_stats_fn, product), output_dir,
+                                            "{0}_" + variable + "_zonal_stats.csv",
+                                            os.path.join(temp_dir_path, '{0}_temp_spill'.format(variable)),
+                                            float_precision='round_trip')
+    else:
+        print("No {0} images were listed, there are no zonal stats to export.".format(variable))
+
+
+def stack_zonal_stats_fn(csv_file, projected_shape_path, uid, product, temp_dir_images, stack_depth, executor=None,
+                         workers=1):
+    """ Derive the zonal stats of the product mosaics as time stacks of up to stack_depth composites (refer to
+    temporal_stack.py) and write the results of each mosaic to the temporary image directory.
+
+    @param csv_file: string object containing the path to the product image list csv.
+    @param projected_shape_path: string object containing the path to the re-projected shapefile.
+    @param uid: string object containing the unique identifier feature name.
+    @param product: dictionary object containing the product registry entry.
+    @param temp_dir_images: string object containing the path to the product temporary image directory.
+    @param stack_depth: integer object containing the maximum number of composites read as one time stack.
+    @param executor: ProcessPoolExecutor object or None (refer to zonal_engine.worker_pool_fn).
+    @param workers: integer object containing the number of worker processes.
+    @return image_files: list object containing the paths to the image results csv files.
+    """
+    import temporal_stack
+
+    variable = product['name']
+    geometries, uid_list, site_list = read_sites_fn(projected_shape_path, uid)
+    spec = extraction_spec_fn(product)
+
+    # the site plan of each grid, shared by every stack
+    plans = {}
+    image_files = []
+    images = mosaic_staging.staged_images_fn(csv_file, variable)
+
+    while True:
+        block = []
+        with ExitStack() as stack:
+            for image_s in islice(images, int(stack_depth)):
+                print("image_s: ", image_s)
+                # open the mosaic as soon as it is staged so it is held for the whole stack
+                block.append((image_s, stack.enter_context(zonal_engine.open_image_fn(image_s))))
+
+            if not block:
+                break
+
+            zs_list = temporal_stack.extract_stack_fn([srci for _, srci in block], geometries, spec, plans,
+                                                      executor, workers)
+
+        for (image_s, _), zs_bands in zip(block, zs_list):
+            im_name = os.path.basename(image_s)
+            with run_report.context_fn(image=image_s):
+                with run_report.timer_fn('dataframe'):
+                    df = image_df_fn(zs_bands, im_name, image_date_fn(im_name), uid_list, site_list, product)
+                image_files.append(export_image_fn(df, temp_dir_images, image_s, variable))
+
+    return image_files
+
+
+def main_routine(export_dir_path, variable, csv_file, temp_dir_path, geo_df, workers=1, stack_depth=None):
+    """ Calculate the zonal statistics for each 1ha site per mosaic of a registered product.
+    Concatenate and clean final output DataFrame and export to the Export directory/zonal stats.
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @param variable: string object containing the product name (refer to product_registry.py).
+    @param csv_file: string object containing the path to the product image list csv.
+    @param temp_dir_path: string object containing the path to the temporary directory.
+    @param geo_df: geo-dataframe object containing the 1ha sites.
+    @param workers: integer object containing the number of worker processes.
+    @param stack_depth: integer object containing the maximum number of composites read as one time stack (refer
+    to temporal_stack.py), if None each mosaic is read on its own.
+    @return projected_shape_path: string object containing the path to the re-projected shapefile.
+    """
+
+    product = product_registry.product_fn(variable)
+
+    print("Mosaic {0} zonal stats beginning.........".format(variable))
+    print("no_data: ", product['no_data'])
+
+    # timings and counters are recorded for the product (refer to run_report.py)
+    with run_report.context_fn(product=variable):
+        uid = 'uid'
+
+        albers_dir = os.path.join(temp_dir_path, "albers")
+
+        # call the project_shapefile_gcs_wgs84_fn function
+        with run_report.timer_fn('geometry'):
+            cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+
+        temp_dir_images = os.path.join(temp_dir_path, '{0}_temp_individual_images'.format(variable))
+        os.makedirs(temp_dir_images, exist_ok=True)
+        # the image results completed before the run was resumed (refer to run_manifest.py)
+        image_files = run_manifest.image_outputs_fn(variable)
+
+        # create the worker pool once for all images (None when running in a single process)
+        executor = zonal_engine.worker_pool_fn(workers)
+
+        try:
+            if stack_depth:
+                # read the composites as time stacks (refer to temporal_stack.py)
+                image_files.extend(stack_zonal_stats_fn(csv_file, projected_shape_path, uid, product,
+                                                        temp_dir_images, stack_depth, executor, workers))
+
+            else:
+                # loop through the list of imagery (staged on local disk when --stage_dir is set) and input the
+                # image into the raster zonal_stats function
+                for image_s in mosaic_staging.staged_images_fn(csv_file, variable):
+                    print("image_s: ", image_s)
+
+                    # timings and counters are recorded per image (refer to run_report.py)
+                    with run_report.context_fn(image=image_s):
+                        df = apply_zonal_stats_fn(image_s, projected_shape_path, uid, product, executor, workers)
+                        image_files.append(export_image_fn(df, temp_dir_images, image_s, variable))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        export_product_fn(export_dir_path, product, image_files, temp_dir_path)
+
+        # remove the temp dir and single image csv files
+        shutil.rmtree(temp_dir_images)
+
+    return projected_shape_path
+
+
+def fused_main_routine(export_dir_path, variables, export_csv_dict, temp_dir_path, geo_df, workers=1):
+    """ Calculate the zonal statistics of several registered products in a single fused pass (command argument
+    --fuse). The sites are projected and read once, and the site plan (windows and rasterized site masks) of each pixel
+    grid is calculated once and shared by every product on the grid (refer to zonal_engine.extract_fused_fn). The
+    image lists are processed in rounds: each round reads the site windows from the next mosaic of every product in
+    the same site-major pass. The outputs are identical to running main_routine for each product.
+
+    @param export_dir_path: string object containing the path to the export directory.
+    @param variables: list object containing the product names (refer to product_registry.py).
+    @param export_csv_dict: dictionary object containing the path to the image list csv of each product.
+    @param temp_dir_path: string object containing the path to the temporary directory.
+    @param geo_df: geo-dataframe object containing the 1ha sites.
+    @param workers: integer object containing the number of worker processes.
+    @return projected_shape_path: string object containing the path to the re-projected shapefile.
+    """
+
+    products = [product_registry.product_fn(variable) for variable in variables]
+
+    print("Fused mosaic zonal stats beginning ({0}).........".format(', '.join(variables)))
+
+    uid = 'uid'
+
+    albers_dir = os.path.join(temp_dir_path, "albers")
+
+    # call the project_shapefile_gcs_wgs84_fn function (once for every product)
+    with run_report.context_fn(product='fused'):
+        with run_report.timer_fn('geometry'):
+            cgs_df, projected_shape_path = project_shapefile_gcs_wgs84_fn(albers_dir, geo_df)
+
+        geometries, uid_list, site_list = read_sites_fn(projected_shape_path, uid)
+    specs = [extraction_spec_fn(product) for product in products]
+
+    temp_dirs = {}
+    image_files = {}
+    for variable in variables:
+        temp_dirs[variable] = os.path.join(temp_dir_path, '{0}_temp_individual_images'.format(variable))
+        os.makedirs(temp_dirs[variable], exist_ok=True)
+        # the image results completed before the run was resumed (refer to run_manifest.py)
+        image_files[variable] = run_manifest.image_outputs_fn(variable)
+
+    streams = [mosaic_staging.staged_images_fn(export_csv_dict[variable], variable) for variable in variables]
+    active = list(range(len(products)))
+
+    # the site plan of each grid, shared by every round
+    plans = {}
+
+    # create the worker pool once for all images (None when running in a single process)
+    executor = zonal_engine.worker_pool_fn(workers)
+
+    try:
+        # the shared reads and statistics of each round are recorded as 'fused' (refer to run_report.py)
+        while active:
+            round_positions = []
+            round_images = []
+            with ExitStack() as stack, run_report.context_fn(product='fused'):
+                for position in list(active):
+                    image_s = next(streams[position], None)
+                    if image_s is None:
+                        active.remove(position)
+                        continue
+                    print("image_s: ", image_s)
+                    # open the mosaic as soon as it is staged so it is held for the whole round
+                    round_positions.append(position)
+                    round_images.append((image_s, stack.enter_context(zonal_engine.open_image_fn(image_s))))
+
+                if not round_positions:
+                    break
+
+                zs_list = zonal_engine.extract_fused_fn([srci for _, srci in round_images], geometries,
+                                                        [specs[position] for position in round_positions], plans,
+                                                        executor, workers)
+
+            for position, (image_s, _), zs_bands in zip(round_positions, round_images, zs_list):
+                product = products[position]
+                variable = product['name']
+                im_name = os.path.basename(image_s)
+                im_date = image_date_fn(im_name)
+                with run_report.context_fn(product=variable, image=image_s):
+                    with run_report.timer_fn('dataframe'):
+                        df = image_df_fn(zs_bands, im_name, im_date, uid_list, site_list, product)
+                    image_files[variable].append(export_image_fn(df, temp_dirs[variable], image_s, variable))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print('Site plans calculated: ', len(plans), ' (shared by ', len(products), ' products)')
+
+    for product in products:
+        with run_report.context_fn(product=product['name']):
+            export_product_fn(export_dir_path, product, image_files[product['name']], temp_dir_path)
+
+        # remove the temp dir and single image csv files
+        shutil.rmtree(temp_dirs[product['name']])
+
+    return projected_shape_path
+
+
+if __name__ == "__main__":
+    main_routine()
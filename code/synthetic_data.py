@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+synthetic_data.py
+=================
+
+Description: This script generates synthetic Landsat mosaics and biomass site csv files so the pipeline can be run
+and measured without access to the mosaics on the network share or the field data (refer to benchmark_suite.py).
+
+ - Mosaics: one file per image for each registered product (product_registry.py), written to
+   <mosaics_dir>/<sub_dir> with a file name matching the product search pattern and the band count, data type, no data
+   value and classes of the product (i.e. dbi 6 band int16 with no data 32767, dim 3 band uint8, dis, dka and stc uint8
+   classified, h99a2 and fpca2 HFA .img). The extent is a fraction of the NT on the Australian Albers 30 m grid
+   (scale 1.0 = the full NT mosaic extent), and the values are spatially correlated fields or class patches with a no
+   data margin, so compression and read patterns resemble the real mosaics. Existing mosaics are reused.
+ - Sites: a biomass csv (uid, site, bio_agb_kg1ha, date, lon_gda94, lat_gda94) with the sites clustered around
+   properties and a proportion of the sites revisited on a later date, from 100 to 100,000 sites.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import numpy as np
+import pandas as pd
+import product_registry
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# top left corner and size (30 m pixels) of the NT mosaics on the Australian Albers grid
+NT_ORIGIN = (-360000.0, -1200000.0)
+NT_WIDTH = 31500
+NT_HEIGHT = 56500
+PIXEL_SIZE = 30.0
+
+# data type and value range of each product (class products are drawn from their category map)
+PRODUCT_LAYOUTS = {
+    'h99a2': {'dtype': 'int16', 'low': 100, 'high': 135},
+    'fpca2': {'dtype': 'uint8', 'low': 1, 'high': 90},
+    'dbi': {'dtype': 'int16', 'low': 150, 'high': 4500},
+    'dim': {'dtype': 'uint8', 'low': 100, 'high': 200},
+    'dis': {'dtype': 'uint8'},
+    'dja': {'dtype': 'uint8', 'low': 100, 'high': 200},
+    'dka': {'dtype': 'uint8'},
+    'stc': {'dtype': 'uint8'},
+}
+
+# size (pixels) of the patches of the spatially correlated fields, and the rows generated and written at a time
+PATCH_SIZE = 64
+WRITE_ROWS = 1024
+
+# mean number of sites per property cluster, cluster spread (metres) and proportion of revisited sites
+SITES_PER_CLUSTER = 40
+CLUSTER_SIGMA = 3000.0
+REVISIT_FRACTION = 0.15
+
+
+def mosaic_extent_fn(scale):
+    """ Return the transform and size of a synthetic mosaic covering a fraction of the NT.
+
+    @param scale: float object containing the fraction of the NT mosaic width and height (i.e. 0.05).
+    @return transform: affine object containing the mosaic transform.
+    @return width: integer object containing the mosaic width (pixels).
+    @return height: integer object containing the mosaic height (pixels).
+    """
+    from rasterio.transform import from_origin
+
+    width = max(int(NT_WIDTH * scale), PATCH_SIZE)
+    height = max(int(NT_HEIGHT * scale), PATCH_SIZE)
+
+    return from_origin(NT_ORIGIN[0], NT_ORIGIN[1], PIXEL_SIZE, PIXEL_SIZE), width, height
+
+
+def image_names_fn(product, n_images):
+    """ Return the file names of the synthetic mosaics of a product (i.e. lztmre_nt_m198712198802_dbia2.tif).
+    HFA products are annual (i.e. lztmre_nt_1988_h99a2.img), the others are seasonal composites.
+
+    @param product: dictionary object containing the product registry entry.
+    @param n_images: integer object containing the number of images.
+    @return list object containing the file names in date order.
+    """
+
+    extension = os.path.splitext(product['pattern'])[1]
+    names = []
+    for k in range(n_images):
+        if extension == '.img':
+            names.append('lztmre_nt_{0}_{1}{2}'.format(1988 + k, product['name'], extension))
+        else:
+            # consecutive three month seasons starting December 1987
+            start = 1987 * 12 + 11 + 3 * k
+            end = start + 2
+            season = 'm{0}{1:02d}{2}{3:02d}'.format(start // 12, start % 12 + 1, end // 12, end % 12 + 1)
+            names.append('lztmre_nt_{0}_{1}a2{2}'.format(season, product['name'], extension))
+
+    return names
+
+
+def field_fn(rng, coarse, rows, columns, low, high):
+    """ Return a spatially correlated field of values for a block of rows (patch values plus pixel noise).
+
+    @param rng: NumPy random generator object.
+    @param coarse: NumPy array containing a value between 0 and 1 per patch.
+    @param rows, columns: NumPy arrays containing the row and column numbers of the block.
+    @param low, high: integer objects containing the value range.
+    @return NumPy array of floats.
+    """
+
+    patch = coarse[np.ix_(rows // PATCH_SIZE, columns // PATCH_SIZE)]
+    noise = rng.normal(0.0, 0.05, patch.shape)
+
+    return low + np.clip(patch + noise, 0.0, 1.0) * (high - low)
+
+
+def write_mosaic_fn(path, product, transform, width, height, seed):
+    """ Write a synthetic mosaic with the band count, data type, no data value and classes of a product.
+
+    @param path: string object containing the output path (.img is written as HFA, otherwise GeoTIFF).
+    @param product: dictionary object containing the product registry entry.
+    @param transform: affine object containing the mosaic transform.
+    @param width, height: integer objects containing the mosaic size (pixels).
+    @param seed: integer object containing the random seed of the image.
+    """
+    import rasterio
+    from rasterio.windows import Window
+
+    layout = PRODUCT_LAYOUTS[product['name']]
+    driver = 'HFA' if path.endswith('.img') else 'GTiff'
+    rng = np.random.default_rng(seed)
+    bands = len(product['bands'])
+    columns = np.arange(width)
+    shape = (height // PATCH_SIZE + 1, width // PATCH_SIZE + 1)
+
+    if product['kind'] == 'categorical':
+        classes = np.array(sorted(product['category_map']), dtype=layout['dtype'])
+        coarse = [rng.integers(0, len(classes), shape) for _ in range(bands)]
+    else:
+        coarse = [rng.random(shape) for _ in range(bands)]
+
+    # the no data margin (outside the coast line) is a diagonal across the top left corner of the mosaic
+    margin = min(width, height) // 8
+
+    with rasterio.open(path, 'w', driver=driver, width=width, height=height, count=bands, dtype=layout['dtype'],
+                       crs='EPSG:3577', transform=transform, nodata=product['no_data']) as dst:
+        for r0 in range(0, height, WRITE_ROWS):
+            rows = np.arange(r0, min(r0 + WRITE_ROWS, height))
+            data = np.empty((bands, len(rows), width), dtype=layout['dtype'])
+            for band in range(bands):
+                if product['kind'] == 'categorical':
+                    data[band] = classes[coarse[band][np.ix_(rows // PATCH_SIZE, columns // PATCH_SIZE)]]
+                else:
+                    data[band] = np.rint(field_fn(rng, coarse[band], rows, columns, layout['low'], layout['high']))
+
+            outside = (rows[:, None] + columns[None, :]) < margin
+            data[:, outside] = product['no_data']
+            dst.write(data, window=Window(0, r0, width, len(rows)))
+
+
+def generate_mosaics_fn(mosaics_dir, products, n_images, scale, seed=1):
+    """ Write the synthetic mosaics of each product in the mosaic directory structure of the registry, reusing
+    mosaics which already exist with the requested extent.
+
+    @param mosaics_dir: string object containing the path to the synthetic mosaic directory.
+    @param products: list object containing the product names (refer to product_registry.py).
+    @param n_images: integer object containing the number of images per product.
+    @param scale: float object containing the fraction of the NT mosaic width and height.
+    @param seed: integer object containing the random seed.
+    @return images: dictionary object containing the list of mosaic paths of each product.
+    """
+    import rasterio
+
+    transform, width, height = mosaic_extent_fn(scale)
+    print('Synthetic mosaics: ', width, ' x ', height, ' pixels, ', n_images, ' images per product')
+
+    images = {}
+    for position, name in enumerate(products):
+        product = product_registry.product_fn(name)
+        product_dir = os.path.join(mosaics_dir, product['sub_dir'])
+        if not os.path.exists(product_dir):
+            os.makedirs(product_dir)
+
+        images[name] = []
+        for k, image_name in enumerate(image_names_fn(product, n_images)):
+            path = os.path.join(product_dir, image_name)
+            images[name].append(path)
+
+            if os.path.isfile(path):
+                with rasterio.open(path) as src:
+                    if (src.width, src.height) == (width, height):
+                        continue
+
+            print('Writing synthetic mosaic: ', path)
+            write_mosaic_fn(path, product, transform, width, height, seed * 1000 + position * 100 + k)
+
+    return images
+
+
+def generate_sites_fn(csv_path, n_sites, scale, seed=1):
+    """ Write a synthetic biomass csv of sites clustered around properties within the synthetic mosaic extent.
+
+    @param csv_path: string object containing the output csv path.
+    @param n_sites: integer object containing the number of site visits (i.e. 100 to 100000).
+    @param scale: float object containing the fraction of the NT mosaic width and height (refer to mosaic_extent_fn).
+    @param seed: integer object containing the random seed.
+    @return df: dataframe object containing the site visits.
+    """
+    from pyproj import Transformer
+
+    transform, width, height = mosaic_extent_fn(scale)
+    rng = np.random.default_rng(seed)
+
+    # sites are kept 200 m inside the mosaic so every 1ha site is fully covered
+    x_min, x_max = transform.c + 200, transform.c + width * PIXEL_SIZE - 200
+    y_min, y_max = transform.f - height * PIXEL_SIZE + 200, transform.f - 200
+
+    n_visits = int(n_sites)
+    n_new = n_visits - int(n_visits * REVISIT_FRACTION)
+    n_clusters = max(1, int(round(n_new / SITES_PER_CLUSTER)))
+    centres_x = rng.uniform(x_min, x_max, n_clusters)
+    centres_y = rng.uniform(y_min, y_max, n_clusters)
+
+    cluster = rng.integers(0, n_clusters, n_new)
+    x = np.clip(centres_x[cluster] + rng.normal(0.0, CLUSTER_SIGMA, n_new), x_min, x_max)
+    y = np.clip(centres_y[cluster] + rng.normal(0.0, CLUSTER_SIGMA, n_new), y_min, y_max)
+
+    # site names follow the field data convention <property>_<number> (i.e. P0012_0003)
+    numbers = np.zeros(n_clusters, dtype=int)
+    sites = []
+    for c in cluster:
+        numbers[c] += 1
+        sites.append('P{0:04d}_{1:04d}'.format(c, numbers[c]))
+    dates = rng.integers(2000, 2020, n_new) * 10000 + rng.integers(4, 10, n_new) * 100 + rng.integers(1, 29, n_new)
+
+    # a proportion of the sites are revisited in a later year
+    revisit = rng.integers(0, n_new, n_visits - n_new)
+    x = np.concatenate([x, x[revisit]])
+    y = np.concatenate([y, y[revisit]])
+    sites = sites + [sites[k] for k in revisit]
+    dates = np.concatenate([dates, dates[revisit] + rng.integers(1, 5, len(revisit)) * 10000])
+
+    lon, lat = Transformer.from_crs('EPSG:3577', 'EPSG:4283', always_xy=True).transform(x, y)
+
+    df = pd.DataFrame({'uid': np.arange(1, n_visits + 1), 'site': sites,
+                       'bio_agb_kg1ha': np.round(rng.gamma(2.0, 15000.0, n_visits), 1),
+                       'date': dates, 'lon_gda94': lon, 'lat_gda94': lat})
+    df.to_csv(csv_path, index=False)
+    print('Synthetic sites: ', csv_path, ' (', n_visits, ' site visits, ', n_clusters, ' properties)')
+
+    return df
+
+
+def site_polygons_fn(df):
+    """ Return the 1ha sites of a biomass dataframe as step1_3_project_buffer.py derives them (site names without
+    the underscore, 1ha square buffer in Australian Albers) with the uid assigned by the pipeline.
+
+    @param df: dataframe object containing the biomass csv (refer to generate_sites_fn).
+    @return geo_df: geo-dataframe object containing the 1ha sites (uid and site_name).
+    """
+    import geopandas as gpd
+
+    site_names = []
+    for i in df.site:
+        n = i.replace("_", "")
+        site_names.append(n[:-4] + "." + n[-4:])
+
+    points = gpd.GeoSeries(gpd.points_from_xy(df.lon_gda94, df.lat_gda94), crs='EPSG:4283').to_crs(epsg=3577)
+
+    return gpd.GeoDataFrame({'uid': np.arange(1, len(df) + 1), 'site_name': site_names},
+                            geometry=points.buffer(50, cap_style=3).values, crs='EPSG:3577')
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+"""
+temporal_stack.py
+=================
+
+Description: This script contains the temporal stack engine (command argument --stack_depth). Rather than opening,
+reading and summarising each seasonal composite of a product on its own, the composites are assembled into an
+in-memory time stack: the open composites of a block (up to stack_depth composites), grouped by pixel grid and data
+type, share one site plan (refer to zonal_engine.site_plan_fn) and each site window is read as a single
+(time, band, y, x) cube. The zonal statistics of every composite and band of the site are then calculated with
+vectorised reductions along the layer axis (stack_stats_fn) rather than a rasterstats call per composite, band and
+site, so the per file overhead no longer dominates when a product has hundreds of composites.
+
+The statistics match rasterstats (the same site masks and all_touched rasterization); the spread statistics (std)
+may differ from rasterstats in the last decimal place due to the order of the floating point summation.
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import sys
+from collections import OrderedDict
+from contextlib import ExitStack
+import numpy as np
+import memory_budget
+import run_report
+import zonal_engine
+import warnings
+
+warnings.filterwarnings("ignore")
+
+
+def stack_stats_fn(cube, sub_window, mask, no_data, stats, categorical=False, category_map=None):
+    """ Calculate the zonal statistics of a single site for every layer of its window cube with vectorised reductions.
+
+    @param cube: NumPy array with shape (time, bands, height, width) containing the site window of each composite.
+    @param sub_window: tuple object containing the planned rasterstats window ((row_start, row_stop), (col_start,
+    col_stop)).
+    @param mask: boolean NumPy array containing the rasterized site (True within the site).
+    @param no_data: integer object containing the no data value.
+    @param stats: list object containing the rasterstats statistics names.
+    @param categorical: boolean object, if True the pixel counts per category are returned.
+    @param category_map: dictionary object mapping category values to column names.
+    @return zones: list object containing a list (band order) of zonal statistic dictionaries per composite.
+    """
+    from rasterstats.io import boundless_array
+    from rasterstats.utils import get_percentile, key_assoc_val, remap_categories
+
+    time_steps, band_count = cube.shape[:2]
+    nodata = -999 if no_data is None else no_data
+
+    # one row per layer (composite and band), one column per pixel within the site
+    layers = boundless_array(cube.reshape((time_steps * band_count,) + cube.shape[2:]), window=sub_window,
+                             nodata=nodata)
+    values = layers[:, mask]
+
+    valid = values != nodata
+    if np.issubdtype(values.dtype, np.floating):
+        valid &= ~np.isnan(values)
+
+    # accumulate integers in 64 bit to avoid overflow (as rasterstats)
+    if sys.maxsize > 2 ** 32 and issubclass(values.dtype.type, np.integer):
+        accum_dtype = 'int64'
+    else:
+        accum_dtype = None
+
+    masked = np.ma.MaskedArray(values, mask=~valid)
+    counts = valid.sum(axis=1)
+
+    reductions = {}
+    if 'min' in stats or 'range' in stats:
+        reductions['min'] = masked.min(axis=1)
+    if 'max' in stats or 'range' in stats:
+        reductions['max'] = masked.max(axis=1)
+    if 'mean' in stats:
+        reductions['mean'] = masked.mean(axis=1, dtype=accum_dtype)
+    if 'sum' in stats:
+        reductions['sum'] = masked.sum(axis=1, dtype=accum_dtype)
+    if 'std' in stats:
+        reductions['std'] = masked.std(axis=1)
+
+    # order statistics on a float copy with the invalid pixels set to nan
+    percentiles = [stat for stat in stats if stat.startswith('percentile_') or stat == 'median']
+    if percentiles:
+        ordered = np.where(valid, values.astype('float64'), np.nan)
+        for stat in percentiles:
+            q = 50.0 if stat == 'median' else get_percentile(stat)
+            reductions[stat] = np.nanpercentile(ordered, q, axis=1)
+
+    zones = []
+    for layer in range(time_steps * band_count):
+        if layer % band_count == 0:
+            zones.append([])
+
+        if counts[layer] == 0:
+            zone = dict((stat, None) for stat in stats)
+            if 'count' in stats:
+                zone['count'] = 0
+            zones[-1].append(zone)
+            continue
+
+        pixel_count = {}
+        if categorical or 'majority' in stats or 'minority' in stats or 'unique' in stats:
+            keys, key_counts = np.unique(values[layer][valid[layer]], return_counts=True)
+            pixel_count = dict(zip([k.item() for k in keys], [c.item() for c in key_counts]))
+
+        zone = {}
+        if categorical:
+            zone = dict(pixel_count)
+            if category_map:
+                zone = remap_categories(category_map, zone)
+
+        for stat in stats:
+            if stat == 'count':
+                zone['count'] = int(counts[layer])
+            elif stat == 'majority':
+                zone['majority'] = float(key_assoc_val(pixel_count, max))
+            elif stat == 'minority':
+                zone['minority'] = float(key_assoc_val(pixel_count, min))
+            elif stat == 'unique':
+                zone['unique'] = len(pixel_count)
+            elif stat == 'range':
+                zone['range'] = float(reductions['max'][layer]) - float(reductions['min'][layer])
+            elif stat in reductions:
+                zone[stat] = float(reductions[stat][layer])
+
+        zones[-1].append(zone)
+
+    return zones
+
+
+def site_stack_stats_fn(cubes, sub_windows, masks, spec):
+    """ Calculate the zonal statistics of a batch of site cubes.
+
+    @param cubes: list object containing the window cube of each site (site order).
+    @param sub_windows: list object containing the planned rasterstats window per site.
+    @param masks: list object containing the planned site mask per site.
+    @param spec: dictionary object containing the extraction settings (refer to extract_stack_fn).
+    @return list object containing the stack_stats_fn result of each site.
+    """
+
+    return [stack_stats_fn(cube, sub_window, mask, spec['no_data'], spec['stats'], spec['categorical'],
+                           spec['category_map']) for cube, sub_window, mask in zip(cubes, sub_windows, masks)]
+
+
+def _stack_worker_fn(descriptor, sub_windows, masks, spec):
+    """ Worker process: attach to the shared site cubes and return the zonal statistics for a chunk of sites. """
+    import shared_windows
+
+    with run_report.span_fn('statistics chunk', sites=len(masks)), \
+            shared_windows.attached_shared_windows_fn(descriptor) as cubes:
+        return site_stack_stats_fn(cubes, sub_windows, masks, spec)
+
+
+def batch_stack_stats_fn(cubes, sub_windows, masks, spec, executor=None, workers=1):
+    """ Calculate the zonal statistics for a batch of site cubes, in-process or farmed out to the worker processes
+    through shared memory (refer to shared_windows.py).
+
+    @param executor: ProcessPoolExecutor object (refer to zonal_engine.worker_pool_fn) - if None the batch is processed
+    in-process.
+    @param workers: integer object containing the number of worker processes.
+    @return results: list object containing the stack_stats_fn result of each site (site order).
+    """
+
+    if executor is None or len(cubes) < 2:
+        return site_stack_stats_fn(cubes, sub_windows, masks, spec)
+
+    import shared_windows
+
+    results = []
+    with shared_windows.owned_shared_windows_fn(cubes) as descriptor:
+        del cubes[:]
+        futures = []
+        with run_report.span_fn('submit', sites=len(masks)):
+            for chunk in zonal_engine.chunk_indices_fn(len(masks), max(int(workers), 1) * 4):
+                futures.append(executor.submit(_stack_worker_fn, shared_windows.sub_descriptor_fn(descriptor, chunk),
+                                               [sub_windows[i] for i in chunk], [masks[i] for i in chunk], spec))
+
+        # collect in submission order to preserve the site order
+        try:
+            for future in futures:
+                results.extend(future.result())
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
+
+
+def read_cube_fn(datasets, window, bands, no_data):
+    """ Read a site window from every composite of a stack into a single (time, band, y, x) cube.
+
+    @param datasets: list object containing the open rasterio datasets of the stack (time order).
+    @param window: tuple object containing the window (row_off, col_off, height, width).
+    @param bands: list object containing the band numbers to read.
+    @param no_data: integer object containing the no data value.
+    @return cube: NumPy array with shape (time, bands, height, width).
+    """
+
+    _, _, height, width = window
+    cube = np.empty((len(datasets), len(bands), height, width), dtype=datasets[0].dtypes[bands[0] - 1])
+    for position, srci in enumerate(datasets):
+        cube[position] = zonal_engine.read_window_fn(srci, window, bands, no_data)
+
+    return cube
+
+
+def extract_stack_fn(images, geometries, spec, plans=None, executor=None, workers=1):
+    """ Extract zonal statistics for every site from a block of composites of a single product as a time stack.
+    The composites are grouped by pixel grid and data type; each group shares the site plan of its grid (cached in
+    plans) and is read one site cube at a time, in batches sized to the memory budget.
+
+    @param images: list object containing the file path (or open rasterio dataset) of each composite (time order).
+    @param geometries: list object containing a geometry mapping per site (raster crs).
+    @param spec: dictionary object containing the keys bands, no_data, stats, categorical and category_map.
+    @param plans: dictionary object containing the site plans by grid (shared between calls, may be None).
+    @param executor: ProcessPoolExecutor object or None (refer to zonal_engine.worker_pool_fn).
+    @param workers: integer object containing the number of site chunks to submit to the executor.
+    @return results: list object containing a dictionary of zonal statistic lists per band for each composite
+    (refer to zonal_engine.extract_image_fn).
+    """
+
+    plans = {} if plans is None else plans
+    bands = spec['bands']
+    # repeat visits to a site are extracted once (refer to zonal_engine.unique_geometries_fn)
+    geometries, index = zonal_engine.unique_geometries_fn(geometries)
+    results = [{band: [] for band in bands} for _ in images]
+
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(zonal_engine.open_image_fn(image_s)) for image_s in images]
+
+        groups = OrderedDict()
+        for position, srci in enumerate(datasets):
+            key = zonal_engine.grid_key_fn(srci)
+            groups.setdefault((key, srci.dtypes[bands[0] - 1]), []).append(position)
+
+        for (key, dtype), positions in groups.items():
+            if key not in plans:
+                print('Planning site windows for grid: ', key[0], key[1])
+                plans[key] = zonal_engine.site_plan_fn(geometries, datasets[positions[0]].transform)
+            plan = plans[key]
+            group = [datasets[position] for position in positions]
+            print('Time stack: ', len(group), ' composites, ', len(bands), ' bands')
+            run_report.count_fn('footprint_pixels', sum(plan['footprints']) * len(bands) * len(group))
+
+            # cube pixels plus the layer, mask and masked array copies
+            pixels = max([h * w for _, _, h, w in plan['windows']] or [0])
+            bytes_per_site = pixels * len(group) * len(bands) * (np.dtype(dtype).itemsize + 2) * 3
+            batch_size = memory_budget.site_batch_size_fn(bytes_per_site, len(geometries))
+
+            for start in range(0, len(geometries), batch_size):
+                stop = start + batch_size
+                cubes = [read_cube_fn(group, window, bands, spec['no_data']) for window in plan['windows'][start:stop]]
+                with run_report.timer_fn('statistics'):
+                    site_zones = batch_stack_stats_fn(cubes, plan['sub_windows'][start:stop],
+                                                      plan['masks'][start:stop], spec, executor, workers)
+                for zones in site_zones:
+                    for position, band_zones in zip(positions, zones):
+                        for band, zone in zip(bands, band_zones):
+                            results[position][band].append(zone)
+
+    return [zonal_engine.fan_out_fn(image_results, index) for image_results in results]
@@ -0,0 +1,801 @@
+#!/usr/bin/env python
+
+"""
+zonal_engine.py
+===============
+
+Description: This script contains the windowed zonal statistics extraction engine used by the mosaic zonal stats steps.
+Rather than reading a full mosaic band into memory, the engine derives a small pixel window for each 1ha site, reads
+only those windows (all requested bands in a single read) and runs rasterstats on each window with the window affine.
+Results are identical to running rasterstats on the full band array.
+
+When workers > 1 the decoded windows are placed in a shared memory block (refer to shared_windows.py) and site chunks
+are farmed out to worker processes which receive zero-copy views and a small descriptor rather than pickled arrays.
+
+Sites are read in batches sized to the memory budget (refer to memory_budget.py), so only one batch of windows is held
+in memory at a time.
+
+Co-registered mosaics (i.e. every product on the Albers 30m grid) can be processed together with extract_fused_fn: the
+site plan (read windows, window affines and the rasterized site masks) is calculated once per grid and reused for every
+mosaic, and each site window is read from every mosaic in the same site-major pass. The statistics are calculated from
+the planned masks (masked_stats_fn) and match rasterstats.
+
+The site windows of a mosaic are read one at a time, as coalesced regions or from a single read of the whole mosaic
+(read_windows_fn); the strategy is chosen per mosaic from a calibrated cost model (refer to read_strategy.py) and does
+not change the window arrays.
+
+Sites which share an identical geometry (i.e. repeat surveys of a site under different uids) are extracted once per
+mosaic and the statistics are fanned back out to every site (unique_geometries_fn).
+
+The geospatial libraries (rasterio, rasterstats and shapely) are imported by the functions which use them, so a
+worker process starts with NumPy and the engine only and imports rasterstats when it calculates its first chunk
+(refer to import_budget.py).
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import math
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import io_trace
+import memory_budget
+import read_strategy
+import run_report
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# number of site plans retained by plan_cache_fn (i.e. one per pixel grid of the current run)
+PLAN_CACHE_SIZE = 4
+
+# module level site plans by grid and sites, and whether each dataset reports its block sizes (refer to
+# record_blocks_fn)
+_PLANS = OrderedDict()
+_BLOCK_SIZES = {}
+
+
+def feature_geometries_fn(features):
+    """ Convert fiona features (or a geo-dataframe) into a list of plain GeoJSON-like geometry dictionaries.
+
+    @param features: iterable object containing fiona records or a geo-dataframe.
+    @return geometries: list object containing a geometry mapping per site (picklable).
+    """
+    from shapely.geometry import shape, mapping
+
+    if hasattr(features, 'geometry') and hasattr(features, 'iterrows'):
+        geometries = [mapping(geom) for geom in features.geometry]
+    else:
+        geometries = [mapping(shape(feature['geometry'])) for feature in features]
+
+    return geometries
+
+
+def unique_geometries_fn(geometries):
+    """ Deduplicate the site geometries by exact geometry, so each distinct footprint is extracted once.
+
+    @param geometries: list object containing a geometry mapping per site.
+    @return unique: list object containing the distinct geometry mappings (first occurrence order).
+    @return index: list object containing the position in unique of each site, or None if every site is distinct.
+    """
+
+    positions = {}
+    unique = []
+    index = []
+    for geometry in geometries:
+        key = repr(geometry)
+        position = positions.get(key)
+        if position is None:
+            position = positions[key] = len(unique)
+            unique.append(geometry)
+        index.append(position)
+
+    if len(unique) == len(geometries):
+        return geometries, None
+
+    print('Distinct site footprints: ', len(unique), ' of ', len(geometries), ' sites')
+
+    return unique, index
+
+
+def fan_out_fn(results, index):
+    """ Expand the zonal statistics of the distinct footprints to every site (refer to unique_geometries_fn).
+
+    @param results: dictionary object containing a list of zonal statistic dictionaries per band (distinct footprints).
+    @param index: list object containing the position in the distinct footprints of each site, or None.
+    @return dictionary object containing a list of zonal statistic dictionaries per band (site order).
+    """
+
+    if index is None:
+        return results
+
+    return {band: [zones[position] for position in index] for band, zones in results.items()}
+
+
+def site_window_fn(bounds, transform, pad=1):
+    """ Calculate the pixel window which covers a site bounding box (plus a pixel pad for all_touched).
+
+    @param bounds: tuple object containing the site bounds (minx, miny, maxx, maxy) in the raster crs.
+    @param transform: affine object containing the raster geo-transform (north up).
+    @param pad: integer object containing the number of pixels added to each side of the window.
+    @return tuple object containing the window (row_off, col_off, height, width) - may extend past the raster.
+    """
+
+    minx, miny, maxx, maxy = bounds
+    col_start = int(math.floor((minx - transform.c) / transform.a)) - pad
+    col_stop = int(math.ceil((maxx - transform.c) / transform.a)) + pad
+    row_start = int(math.floor((maxy - transform.f) / transform.e)) - pad
+    row_stop = int(math.ceil((miny - transform.f) / transform.e)) + pad
+
+    return row_start, col_start, row_stop - row_start, col_stop - col_start
+
+
+def read_window_fn(srci, window, bands, no_data):
+    """ Read a site window for all requested bands in one read, filling any part outside the raster with no data.
+
+    @param srci: rasterio dataset object (open).
+    @param window: tuple object containing the window (row_off, col_off, height, width).
+    @param bands: list object containing the band numbers to read (i.e. [1, 2, 3, 4, 5, 6]).
+    @param no_data: integer object containing the no data value.
+    @return array: NumPy array with shape (bands, height, width).
+    """
+    from rasterio.windows import Window
+
+    row_off, col_off, height, width = window
+    fill = 0 if no_data is None else no_data
+    array = np.full((len(bands), height, width), fill, dtype=srci.dtypes[bands[0] - 1])
+
+    # clip the window to the raster extent
+    r0, c0 = max(row_off, 0), max(col_off, 0)
+    r1, c1 = min(row_off + height, srci.height), min(col_off + width, srci.width)
+
+    if r1 > r0 and c1 > c0:
+        start = time.time()
+        with run_report.timer_fn('read') as span:
+            data = srci.read(bands, window=Window(c0, r0, c1 - c0, r1 - r0))
+            span['bytes'] = data.nbytes
+        end = time.time()
+        io_trace.record_read_fn(srci, (r0, c0, r1 - r0, c1 - c0), bands, start, end)
+        run_report.count_fn('bytes_read', data.nbytes)
+        run_report.count_fn('pixels_read', data.size)
+        blocks, nbytes, pixels = record_blocks_fn(srci, bands, r0, r1, c0, c1)
+        read_strategy.record_read_fn(end - start, blocks, nbytes, pixels)
+        array[:, r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = data
+
+    return array
+
+
+def record_blocks_fn(srci, bands, r0, r1, c0, c1):
+    """ Record the blocks (tiles or strips) decoded for a window read in the read amplification counters
+    (refer to run_report.py). GDAL caches decoded blocks, so each block is counted once per image: a pixel interleaved
+    block holds every band of the mosaic, otherwise each band has its own blocks.
+
+    @param srci: rasterio dataset object (open).
+    @param bands: list object containing the band numbers read.
+    @param r0, r1, c0, c1: integer objects containing the rows and columns read (clipped to the raster).
+    @return blocks, nbytes, pixels: integer objects containing the blocks, bytes and pixels not counted before.
+    """
+
+    seen = run_report.blocks_seen_fn()
+    pixel_interleaved = srci.count > 1 and getattr(srci.interleaving, 'name', None) == 'pixel'
+    block_bands = bands[:1] if pixel_interleaved else bands
+    item_size = np.dtype(srci.dtypes[bands[0] - 1]).itemsize
+    blocks = total_bytes = total_pixels = 0
+
+    for band in block_bands:
+        block_height, block_width = srci.block_shapes[band - 1]
+        for i in range(r0 // block_height, (r1 - 1) // block_height + 1):
+            for j in range(c0 // block_width, (c1 - 1) // block_width + 1):
+                key = (srci.name, band, i, j)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                pixels = block_height * block_width * (srci.count if pixel_interleaved else 1)
+                run_report.count_fn('blocks_touched', 1)
+                run_report.count_fn('pixels_decoded', pixels)
+
+                # the stored (compressed) size of the block where the format reports it (i.e. GeoTIFF)
+                nbytes = None
+                if _BLOCK_SIZES.get(srci.name, True):
+                    try:
+                        nbytes = srci.block_size(band, i, j)
+                    except Exception:
+                        _BLOCK_SIZES[srci.name] = False
+                nbytes = pixels * item_size if nbytes is None else nbytes
+                run_report.count_fn('bytes_fetched', nbytes)
+                blocks += 1
+                total_bytes += nbytes
+                total_pixels += pixels
+
+    return blocks, total_bytes, total_pixels
+
+
+def slice_window_fn(source, source_row, source_col, window, srci, fill):
+    """ Return a site window sliced from an array read from a region of the mosaic, filling any part outside the
+    raster with no data (as read_window_fn).
+
+    @param source: NumPy array with shape (bands, height, width) containing the region read.
+    @param source_row, source_col: integer objects containing the region offset in the raster.
+    @param window: tuple object containing the site window (row_off, col_off, height, width).
+    @param srci: rasterio dataset object (open).
+    @param fill: integer object containing the no data fill value.
+    @return array: NumPy array with shape (bands, height, width).
+    """
+
+    row_off, col_off, height, width = window
+    array = np.full((source.shape[0], height, width), fill, dtype=source.dtype)
+    r0, c0 = max(row_off, 0), max(col_off, 0)
+    r1, c1 = min(row_off + height, srci.height), min(col_off + width, srci.width)
+    if r1 > r0 and c1 > c0:
+        array[:, r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = \
+            source[:, r0 - source_row:r1 - source_row, c0 - source_col:c1 - source_col]
+
+    return array
+
+
+def read_windows_fn(srci, windows, bands, no_data, strategy='window', full=None):
+    """ Read the site windows of a mosaic with a read strategy (refer to read_strategy.py): each window on its own,
+    as coalesced regions (one region is held at a time), or sliced from the whole mosaic.
+
+    @param srci: rasterio dataset object (open).
+    @param windows: list object containing the site windows (row_off, col_off, height, width).
+    @param bands: list object containing the band numbers to read.
+    @param no_data: integer object containing the no data value.
+    @param strategy: string object containing 'window', 'coalesced' or 'full'.
+    @param full: NumPy array containing the requested bands of the whole mosaic (strategy 'full', read if None).
+    @return arrays: list object containing a window array (bands, height, width) per site (site order).
+    """
+
+    if strategy == 'window':
+        return [read_window_fn(srci, window, bands, no_data) for window in windows]
+
+    if strategy == 'full':
+        if full is None:
+            full = read_window_fn(srci, (0, 0, srci.height, srci.width), bands, no_data)
+        sources = [((0, 0), full, range(len(windows)))]
+    else:
+        regions = read_strategy.coalesce_windows_fn(windows, srci.height, srci.width, srci.block_shapes[0][0])
+        sources = (((region[0], region[1]), read_window_fn(srci, region, bands, no_data), positions)
+                   for region, positions in regions)
+
+    fill = 0 if no_data is None else no_data
+    arrays = [None] * len(windows)
+    for (source_row, source_col), source, positions in sources:
+        for position in positions:
+            arrays[position] = slice_window_fn(source, source_row, source_col, windows[position], srci, fill)
+
+    # windows outside the raster
+    for position, array in enumerate(arrays):
+        if array is None:
+            arrays[position] = read_window_fn(srci, windows[position], bands, no_data)
+
+    return arrays
+
+
+def window_stats_fn(geometry, array, affine, no_data, stats, categorical=False, category_map=None):
+    """ Run rasterstats for a single site on its window array.
+
+    @param geometry: dictionary object containing the site geometry mapping.
+    @param array: two dimensional NumPy array containing the window pixels.
+    @param affine: affine object containing the window geo-transform.
+    @return dictionary object containing the zonal statistic values.
+    """
+    from rasterstats import zonal_stats
+
+    zs = zonal_stats(geometry, array, affine=affine, nodata=no_data, stats=stats,
+                     categorical=categorical, category_map=category_map, all_touched=True)
+
+    return zs[0]
+
+
+def _stats_worker_fn(descriptor, geometries, affines, bands, no_data, stats, categorical, category_map):
+    """ Worker process: attach to the shared windows and return the zonal statistics for a chunk of sites.
+
+    @return results: dictionary object containing a list of zonal statistic dictionaries per band.
+    """
+    import shared_windows
+
+    results = {band: [] for band in bands}
+    with run_report.span_fn('statistics chunk', sites=len(geometries)), \
+            shared_windows.attached_shared_windows_fn(descriptor) as views:
+        for view, geometry, affine in zip(views, geometries, affines):
+            for position, band in enumerate(bands):
+                results[band].append(window_stats_fn(geometry, view[position], affine, no_data, stats,
+                                                     categorical, category_map))
+
+    return results
+
+
+def worker_pool_fn(workers):
+    """ Return a process pool for the requested number of workers (None if running in a single process).
+
+    @param workers: integer object containing the number of worker processes.
+    @return executor: ProcessPoolExecutor object or None.
+    """
+
+    if workers is None or int(workers) <= 1:
+        return None
+
+    # the workers record trace spans when the run is traced (refer to run_report.py)
+    return ProcessPoolExecutor(max_workers=int(workers), initializer=run_report.worker_init_fn,
+                               initargs=(run_report.trace_spool_fn(),))
+
+
+def chunk_indices_fn(count, chunks):
+    """ Split a range of site positions into contiguous chunks.
+
+    @param count: integer object containing the number of sites.
+    @param chunks: integer object containing the number of chunks required.
+    @return list object containing a list of site positions per chunk.
+    """
+
+    chunks = max(1, min(int(chunks), count))
+    size = int(math.ceil(count / float(chunks))) if count else 1
+
+    return [list(range(start, min(start + size, count))) for start in range(0, count, size)]
+
+
+def batch_stats_fn(arrays, geometries, affines, bands, no_data, stats, categorical=False, category_map=None,
+                   executor=None, workers=1):
+    """ Calculate the zonal statistics for a batch of decoded site windows.
+
+    @param arrays: list object containing a window array (bands, height, width) per site.
+    @param geometries: list object containing a geometry mapping per site.
+    @param affines: list object containing the window affine per site.
+    @param executor: ProcessPoolExecutor object (refer to worker_pool_fn) - if None the batch is processed in-process.
+    @param workers: integer object containing the number of worker processes.
+    @return results: dictionary object containing a list of zonal statistic dictionaries per band (site order).
+    """
+
+    if executor is None or len(geometries) < 2:
+        results = {band: [] for band in bands}
+        for array, geometry, affine in zip(arrays, geometries, affines):
+            for position, band in enumerate(bands):
+                results[band].append(window_stats_fn(geometry, array[position], affine, no_data, stats,
+                                                     categorical, category_map))
+        return results
+
+    import shared_windows
+
+    # place the decoded windows in shared memory and hand each worker a descriptor of its site chunk
+    results = {band: [] for band in bands}
+    with shared_windows.owned_shared_windows_fn(arrays) as descriptor:
+        del arrays[:]
+        futures = []
+        with run_report.span_fn('submit', sites=len(geometries)):
+            for chunk in chunk_indices_fn(len(geometries), max(int(workers), 1) * 4):
+                futures.append(executor.submit(
+                    _stats_worker_fn, shared_windows.sub_descriptor_fn(descriptor, chunk),
+                    [geometries[i] for i in chunk], [affines[i] for i in chunk], bands, no_data, stats,
+                    categorical, category_map))
+
+        # collect in submission order to preserve the site order
+        try:
+            for future in futures:
+                chunk_results = future.result()
+                for band in bands:
+                    results[band].extend(chunk_results[band])
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
+
+
+@contextmanager
+def open_image_fn(image_s):
+    """ Open a mosaic path for reading, or pass through a dataset which is already open (left open on exit).
+
+    @param image_s: string object containing the file path to the mosaic, or an open rasterio dataset object.
+    @return srci: rasterio dataset object.
+    """
+
+    if hasattr(image_s, 'read'):
+        yield image_s
+    else:
+        import rasterio
+        start = time.time()
+        with run_report.timer_fn('open'):
+            srci = rasterio.open(image_s)
+        io_trace.record_open_fn(srci, start, time.time())
+        try:
+            with srci:
+                yield srci
+        finally:
+            io_trace.record_close_fn(srci)
+
+
+def extract_image_fn(image_s, features, bands, no_data, stats, categorical=False, category_map=None,
+                     executor=None, workers=1):
+    """ Extract zonal statistics for every site from a single mosaic using windowed reads. Sites are read in batches
+    sized to the memory budget (refer to memory_budget.py); with no budget all sites form a single batch.
+
+    @param image_s: string object containing the file path to the current mosaic (or an open rasterio dataset).
+    @param features: iterable object containing fiona records, geometry mappings or a geo-dataframe (raster crs).
+    @param bands: list object containing the band numbers to extract.
+    @param no_data: integer object containing the no data value.
+    @param stats: list object containing the rasterstats statistics names.
+    @param categorical: boolean object, if True rasterstats returns pixel counts per category.
+    @param category_map: dictionary object mapping category values to column names.
+    @param executor: ProcessPoolExecutor object (refer to worker_pool_fn) - if None the image is processed in-process.
+    @param workers: integer object containing the number of site chunks to submit to the executor.
+    @return results: dictionary object containing a list of zonal statistic dictionaries per band (site order).
+    """
+    if isinstance(features, list) and features and 'coordinates' in features[0]:
+        geometries = features
+    else:
+        geometries = feature_geometries_fn(features)
+
+    # repeat visits to a site are extracted once
+    geometries, index = unique_geometries_fn(geometries)
+    results = {band: [] for band in bands}
+
+    with open_image_fn(image_s) as srci:
+        # the site windows are planned once per grid and reused by every mosaic on the grid
+        plan = plan_cache_fn(geometries, srci)
+        windows = plan['windows']
+        affines = plan['affines']
+        run_report.count_fn('footprint_pixels', sum(plan['footprints']) * len(bands))
+
+        # window pixels plus the rasterstats mask and masked array copies
+        item_size = np.dtype(srci.dtypes[bands[0] - 1]).itemsize
+        bytes_per_site = max([h * w for _, _, h, w in windows] or [0]) * len(bands) * (item_size + 2) * 3
+        batch_size = memory_budget.site_batch_size_fn(bytes_per_site, len(geometries))
+
+        # windowed, coalesced or whole mosaic reads (refer to read_strategy.py)
+        strategy = read_strategy.choose_strategy_fn(srci, windows, bands, cache=plan.setdefault('read_features', {}))
+        full = None
+        if strategy == 'full':
+            full = read_window_fn(srci, (0, 0, srci.height, srci.width), bands, no_data)
+
+        for start in range(0, len(geometries), batch_size):
+            stop = start + batch_size
+            arrays = read_windows_fn(srci, windows[start:stop], bands, no_data, strategy, full)
+            with run_report.timer_fn('statistics'):
+                batch_results = batch_stats_fn(arrays, geometries[start:stop], affines[start:stop], bands, no_data,
+                                               stats, categorical, category_map, executor, workers)
+            for band in bands:
+                results[band].extend(batch_results[band])
+
+    return fan_out_fn(results, index)
+
+
+def site_plan_fn(geometries, transform, all_touched=True):
+    """ Plan the site windows of a raster grid: the read window and window affine of each site, plus the sub-window
+    and rasterized site mask which rasterstats derives from the window. The plan depends only on the grid
+    geo-transform and rasterization rule, so it is calculated once and shared by every mosaic on the grid.
+
+    @param geometries: list object containing a geometry mapping per site (raster crs).
+    @param transform: affine object containing the raster geo-transform (north up).
+    @param all_touched: boolean object, if True every pixel touched by a site is included (the mosaic products),
+    otherwise only the pixels whose centre is within the site (rasterstats default, the per scene products).
+    @return plan: dictionary object containing the windows, affines, sub_windows and masks of each site (site order).
+    """
+    from rasterio import features as rio_features
+    from rasterio.transform import Affine
+    from rasterstats.io import bounds_window, window_bounds
+    from shapely.geometry import shape
+
+    with run_report.timer_fn('geometry'):
+        windows = [site_window_fn(shape(geometry).bounds, transform) for geometry in geometries]
+        affines = [transform * Affine.translation(col_off, row_off) for row_off, col_off, _, _ in windows]
+
+    sub_windows = []
+    masks = []
+    footprints = []
+    with run_report.timer_fn('rasterize'):
+        for geometry, affine in zip(geometries, affines):
+            geom = shape(geometry)
+            sub_window = bounds_window(tuple(geom.bounds), affine)
+            west, _, _, north = window_bounds(sub_window, affine)
+            sub_affine = Affine(affine.a, affine.b, west, affine.d, affine.e, north)
+            (row_start, row_stop), (col_start, col_stop) = sub_window
+
+            mask = rio_features.rasterize([(geom, 1)], out_shape=(row_stop - row_start, col_stop - col_start),
+                                          transform=sub_affine, fill=0, dtype='uint8', all_touched=all_touched)
+            sub_windows.append(sub_window)
+            masks.append(mask.astype(bool))
+            footprints.append(int(mask.sum()))
+
+    return {'windows': windows, 'affines': affines, 'sub_windows': sub_windows, 'masks': masks,
+            'footprints': footprints}
+
+
+def plan_cache_fn(geometries, srci, all_touched=True):
+    """ Return the site plan of a mosaic grid, calculated on first use and retained for the following mosaics.
+
+    @param geometries: list object containing a geometry mapping per site (raster crs).
+    @param srci: rasterio dataset object (open).
+    @param all_touched: boolean object, the rasterization rule of the site masks (refer to site_plan_fn).
+    @return plan: dictionary object returned by site_plan_fn.
+    """
+
+    key = (grid_key_fn(srci), hash(repr(geometries)), all_touched)
+    plan = _PLANS.get(key)
+    if plan is None:
+        plan = _PLANS[key] = site_plan_fn(geometries, srci.transform, all_touched)
+        while len(_PLANS) > PLAN_CACHE_SIZE:
+            _PLANS.popitem(last=False)
+
+    return plan
+
+
+def masked_stats_fn(array, sub_window, mask, no_data, stats, categorical=False, category_map=None):
+    """ Calculate the zonal statistics of a single site from its window array and planned site mask (the rasterstats
+    statistics without rasterizing the site geometry again).
+
+    @param array: two dimensional NumPy array containing the window pixels.
+    @param sub_window: tuple object containing the rasterstats window ((row_start, row_stop), (col_start, col_stop)).
+    @param mask: boolean NumPy array containing the rasterized site (True within the site).
+    @return zone: dictionary object containing the zonal statistic values.
+    """
+    from rasterstats.io import boundless_array
+    from rasterstats.utils import get_percentile, key_assoc_val, remap_categories
+
+    nodata = -999 if no_data is None else no_data
+    data = boundless_array(array, window=sub_window, nodata=nodata)
+
+    isnodata = data == nodata
+    if np.issubdtype(data.dtype, np.floating) and np.isnan(data.min()):
+        isnodata = isnodata | np.isnan(data)
+
+    masked = np.ma.MaskedArray(data, mask=(isnodata | ~mask))
+
+    # accumulate integers in 64 bit to avoid overflow (as rasterstats)
+    if sys.maxsize > 2 ** 32 and issubclass(masked.dtype.type, np.integer):
+        accum_dtype = 'int64'
+    else:
+        accum_dtype = None
+
+    values = masked.compressed()
+    if values.size == 0:
+        zone = dict((stat, None) for stat in stats)
+        if 'count' in stats:
+            zone['count'] = 0
+        return zone
+
+    pixel_count = {}
+    if categorical or 'majority' in stats or 'minority' in stats or 'unique' in stats:
+        keys, counts = np.unique(values, return_counts=True)
+        pixel_count = dict(zip([k.item() for k in keys], [c.item() for c in counts]))
+
+    zone = {}
+    if categorical:
+        zone = dict(pixel_count)
+        if category_map:
+            zone = remap_categories(category_map, zone)
+
+    if 'min' in stats:
+        zone['min'] = float(masked.min())
+    if 'max' in stats:
+        zone['max'] = float(masked.max())
+    if 'mean' in stats:
+        zone['mean'] = float(masked.mean(dtype=accum_dtype))
+    if 'count' in stats:
+        zone['count'] = int(masked.count())
+    if 'sum' in stats:
+        zone['sum'] = float(masked.sum(dtype=accum_dtype))
+    if 'std' in stats:
+        zone['std'] = float(masked.std())
+    if 'median' in stats:
+        zone['median'] = float(np.median(values))
+    if 'majority' in stats:
+        zone['majority'] = float(key_assoc_val(pixel_count, max))
+    if 'minority' in stats:
+        zone['minority'] = float(key_assoc_val(pixel_count, min))
+    if 'unique' in stats:
+        zone['unique'] = len(pixel_count)
+    if 'range' in stats:
+        zone['range'] = float(masked.max()) - float(masked.min())
+
+    for stat in [s for s in stats if s.startswith('percentile_')]:
+        zone[stat] = float(np.percentile(values, get_percentile(stat)))
+
+    return zone
+
+
+def fused_stats_fn(arrays, sub_windows, masks, specs):
+    """ Calculate the zonal statistics of a batch of sites for each co-registered mosaic from the planned site masks.
+
+    @param arrays: list object containing the window arrays (site order) of each mosaic.
+    @param sub_windows: list object containing the planned rasterstats window per site.
+    @param masks: list object containing the planned site mask per site.
+    @param specs: list object containing the extraction settings of each mosaic (refer to extract_fused_fn).
+    @return results: list object containing a dictionary of zonal statistic lists per band for each mosaic.
+    """
+
+    results = []
+    for spec, image_arrays in zip(specs, arrays):
+        image_results = {band: [] for band in spec['bands']}
+        for array, sub_window, mask in zip(image_arrays, sub_windows, masks):
+            for position, band in enumerate(spec['bands']):
+                image_results[band].append(masked_stats_fn(array[position], sub_window, mask, spec['no_data'],
+                                                           spec['stats'], spec['categorical'],
+                                                           spec['category_map']))
+        results.append(image_results)
+
+    return results
+
+
+def _fused_worker_fn(descriptors, sub_windows, masks, specs):
+    """ Worker process: attach to the shared windows of each mosaic and return the zonal statistics for a chunk of
+    sites (refer to fused_stats_fn). """
+    import shared_windows
+
+    with run_report.span_fn('statistics chunk', sites=len(masks)), ExitStack() as stack:
+        arrays = [stack.enter_context(shared_windows.attached_shared_windows_fn(descriptor))
+                  for descriptor in descriptors]
+        return fused_stats_fn(arrays, sub_windows, masks, specs)
+
+
+def fused_batch_stats_fn(arrays, sub_windows, masks, specs, executor=None, workers=1):
+    """ Calculate the zonal statistics for a batch of sites read from several co-registered mosaics.
+
+    @param arrays: list object containing the window arrays (site order) of each mosaic.
+    @param executor: ProcessPoolExecutor object (refer to worker_pool_fn) - if None the batch is processed in-process.
+    @param workers: integer object containing the number of worker processes.
+    @return results: list object containing a dictionary of zonal statistic lists per band for each mosaic.
+    """
+
+    if executor is None or len(masks) < 2:
+        return fused_stats_fn(arrays, sub_windows, masks, specs)
+
+    import shared_windows
+
+    # one shared memory block per mosaic (the mosaics may differ in data type)
+    results = [{band: [] for band in spec['bands']} for spec in specs]
+    with ExitStack() as stack:
+        descriptors = [stack.enter_context(shared_windows.owned_shared_windows_fn(image_arrays))
+                       for image_arrays in arrays]
+        del arrays[:]
+        futures = []
+        with run_report.span_fn('submit', sites=len(masks)):
+            for chunk in chunk_indices_fn(len(masks), max(int(workers), 1) * 4):
+                futures.append(executor.submit(
+                    _fused_worker_fn, [shared_windows.sub_descriptor_fn(descriptor, chunk)
+                                       for descriptor in descriptors],
+                    [sub_windows[i] for i in chunk], [masks[i] for i in chunk], specs))
+
+        # collect in submission order to preserve the site order
+        try:
+            for future in futures:
+                for image_results, chunk_results in zip(results, future.result()):
+                    for band, zones in chunk_results.items():
+                        image_results[band].extend(zones)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
+
+
+def grid_key_fn(srci):
+    """ Return the key identifying the pixel grid of a mosaic (crs and geo-transform). """
+
+    return str(srci.crs), tuple(srci.transform)[:6]
+
+
+def extract_fused_fn(images, geometries, specs, plans=None, executor=None, workers=1):
+    """ Extract zonal statistics for every site from several mosaics in a single site-major pass. Mosaics are grouped
+    by pixel grid; the site plan of each grid (refer to site_plan_fn) is calculated once and cached in plans, and each
+    site window is read from every mosaic on the grid before moving to the next site. Mosaics on a different grid are
+    processed as a separate group with their own plan.
+
+    @param images: list object containing the file path (or open rasterio dataset) of each mosaic.
+    @param geometries: list object containing a geometry mapping per site (raster crs).
+    @param specs: list object containing a dictionary per mosaic with the keys bands, no_data, stats, categorical and
+    category_map.
+    @param plans: dictionary object containing the site plans of the distinct footprints by grid (shared between calls
+    with the same geometries, may be None).
+    @param executor: ProcessPoolExecutor object (refer to worker_pool_fn) - if None the mosaics are processed in-process.
+    @param workers: integer object containing the number of site chunks to submit to the executor.
+    @return results: list object containing a dictionary of zonal statistic lists per band for each mosaic
+    (refer to extract_image_fn).
+    """
+
+    plans = {} if plans is None else plans
+    # repeat visits to a site are extracted once (the plans are of the distinct footprints)
+    geometries, index = unique_geometries_fn(geometries)
+    results = [{band: [] for band in spec['bands']} for spec in specs]
+
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(open_image_fn(image_s)) for image_s in images]
+
+        groups = OrderedDict()
+        for position, srci in enumerate(datasets):
+            groups.setdefault(grid_key_fn(srci), []).append(position)
+
+        for key, positions in groups.items():
+            if key not in plans:
+                print('Planning site windows for grid: ', key[0], key[1])
+                plans[key] = site_plan_fn(geometries, datasets[positions[0]].transform)
+            plan = plans[key]
+            group_specs = [specs[position] for position in positions]
+            for position in positions:
+                with run_report.context_fn(image=datasets[position].name):
+                    run_report.count_fn('footprint_pixels', sum(plan['footprints']) * len(specs[position]['bands']))
+
+            # window pixels plus the mask and masked array copies of every mosaic in the group
+            pixels = max([h * w for _, _, h, w in plan['windows']] or [0])
+            bytes_per_site = 0
+            for position in positions:
+                bands = specs[position]['bands']
+                item_size = np.dtype(datasets[position].dtypes[bands[0] - 1]).itemsize
+                bytes_per_site += pixels * len(bands) * (item_size + 2) * 3
+            batch_size = memory_budget.site_batch_size_fn(bytes_per_site, len(geometries))
+
+            # windowed or coalesced reads per mosaic (a round cannot hold whole mosaics, refer to read_strategy.py)
+            strategies = []
+            for position in positions:
+                with run_report.context_fn(image=datasets[position].name):
+                    strategies.append(read_strategy.choose_strategy_fn(
+                        datasets[position], plan['windows'], specs[position]['bands'], allow_full=False,
+                        cache=plan.setdefault('read_features', {})))
+
+            for start in range(0, len(geometries), batch_size):
+                stop = start + batch_size
+                # the reads and I/O counters are attributed to each mosaic of the round
+                arrays = [[] for _ in positions]
+                for image_arrays, position, strategy in zip(arrays, positions, strategies):
+                    if strategy != 'window':
+                        with run_report.context_fn(image=datasets[position].name):
+                            image_arrays.extend(read_windows_fn(datasets[position], plan['windows'][start:stop],
+                                                                specs[position]['bands'], specs[position]['no_data'],
+                                                                strategy))
+
+                # site-major: read the site window from every windowed mosaic before moving to the next site
+                for window in plan['windows'][start:stop]:
+                    for image_arrays, position, strategy in zip(arrays, positions, strategies):
+                        if strategy == 'window':
+                            with run_report.context_fn(image=datasets[position].name):
+                                image_arrays.append(read_window_fn(datasets[position], window,
+                                                                   specs[position]['bands'],
+                                                                   specs[position]['no_data']))
+
+                with run_report.timer_fn('statistics'):
+                    batch_results = fused_batch_stats_fn(arrays, plan['sub_windows'][start:stop],
+                                                         plan['masks'][start:stop], group_specs, executor, workers)
+                for position, image_results in zip(positions, batch_results):
+                    for band, zones in image_results.items():
+                        results[position][band].extend(zones)
+
+    return [fan_out_fn(image_results, index) for image_results in results]
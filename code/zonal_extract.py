@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""
+zonal_extract.py
+================
+
+Description: This script contains the in-memory Python API of the zonal statistics extraction, for notebooks and
+small interactive runs. The sites are passed as a geo-dataframe and the results are returned as a dataframe: no
+temporary or export directories, shapefiles or image list csv files are written.
+
+ - Sites: points are buffered to the 1ha square sites of the pipeline (50m, square cap, Australian Albers) and
+   polygons are used as they are. The uid column (or the row position + 1) and the site_name or site column identify
+   each site.
+ - Products: registered product names (refer to product_registry.py), all products by default. The mosaics of each
+   product are listed from mosaics_dir and optionally restricted to a date range (dates).
+ - Results: extract_fn returns a single dataframe with a product column, cleaned, corrected and time stamped as in
+   the exported site csv files (refer to step1_4_product_zonal_stats.py). extract_images_fn yields the results of each
+   mosaic as soon as it is complete.
+
+The site plan of each pixel grid is calculated once and shared by every mosaic and product (refer to
+zonal_engine.extract_fused_fn). The tiled cache, staging, memory budget and read strategy settings configured for the
+pipeline (i.e. mosaic_transcode.configure_tiled_cache_fn) also apply to the API, i.e.:
+
+    import zonal_extract
+    df = zonal_extract.extract_fn(sites_gdf, products=['dbi', 'dis'], dates=('2015', '201812'))
+
+    for product, image_s, df in zonal_extract.extract_images_fn(sites_gdf, products=['dbi']):
+        print(product, image_s, df.shape)
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+from glob import glob
+import pandas as pd
+import mosaic_staging
+import product_registry
+import run_report
+import step1_4_product_zonal_stats
+import zonal_engine
+
+# the NT seasonal mosaics directory (command argument --mosaics_dir)
+MOSAICS_DIR = r"R:\landsat\mosaics"
+
+# the 1ha site buffer (metres, square cap) applied to point sites in Australian Albers
+SITE_BUFFER = 50
+ALBERS_EPSG = 3577
+
+
+def site_polygons_fn(sites_gdf):
+    """ Project the sites to Australian Albers, buffer points to the 1ha square sites and identify each site.
+
+    @param sites_gdf: geo-dataframe object containing the site points or polygons (with a crs).
+    @return albers_gdf: geo-dataframe object containing the uid, site_name and geometry of each site (Australian
+    Albers).
+    """
+
+    if sites_gdf.crs is None:
+        raise ValueError('The sites geo-dataframe has no crs, set one before extracting (i.e. '
+                         'sites_gdf.set_crs(epsg=4283)).')
+
+    albers_gdf = sites_gdf.to_crs(epsg=ALBERS_EPSG)
+    geometry = albers_gdf.geometry
+    points = geometry.geom_type == 'Point'
+    if points.any():
+        # the 1ha square site of each point (refer to step1_3_project_buffer.square_buffer_fn)
+        geometry = geometry.where(~points, geometry.buffer(SITE_BUFFER, cap_style=3))
+
+    if 'uid' in albers_gdf.columns:
+        uid_list = albers_gdf['uid'].tolist()
+    else:
+        uid_list = list(range(1, len(albers_gdf) + 1))
+
+    if 'site_name' in albers_gdf.columns:
+        site_list = albers_gdf['site_name'].tolist()
+    elif 'site' in albers_gdf.columns:
+        site_list = albers_gdf['site'].tolist()
+    else:
+        site_list = [str(uid) for uid in uid_list]
+
+    return albers_gdf[[]].assign(uid=uid_list, site_name=site_list).set_geometry(geometry.values, crs=albers_gdf.crs)
+
+
+def sites_fn(sites_gdf):
+    """ Return the geometries and attributes of the sites (refer to site_polygons_fn).
+
+    @param sites_gdf: geo-dataframe object containing the site points or polygons (with a crs).
+    @return geometries: list object containing a geometry mapping per site (Australian Albers).
+    @return uid_list: list object containing the unique identifier of each site.
+    @return site_list: list object containing the site name of each site.
+    """
+
+    albers_gdf = site_polygons_fn(sites_gdf)
+    geometries = zonal_engine.feature_geometries_fn(albers_gdf)
+
+    return geometries, albers_gdf['uid'].tolist(), albers_gdf['site_name'].tolist()
+
+
+def date_selected_fn(im_date, dates):
+    """ Return True if a mosaic starts within a date range.
+
+    @param im_date: string object containing the mosaic date (refer to step1_4_product_zonal_stats.image_date_fn).
+    @param dates: tuple object containing the first and last month (YYYYMM or YYYY, either may be None), or None.
+    @return boolean object.
+    """
+
+    if dates is None:
+        return True
+
+    start, end = dates
+    # annual mosaics start in January, a year range covers January to December
+    month = im_date[:4] + (im_date[4:6] or '01')
+    if start is not None and month < (str(start) + '01')[:6]:
+        return False
+    if end is not None and month > (str(end) + '12')[:6]:
+        return False
+
+    return True
+
+
+def product_images_fn(product, mosaics_dir, dates=None):
+    """ List the mosaics of a product (refer to step1_2_list_of_images.py) within a date range.
+
+    @param product: dictionary object containing the product registry entry.
+    @param mosaics_dir: string object containing the path to the NT seasonal mosaics directory.
+    @param dates: tuple object containing the first and last month (refer to date_selected_fn), or None.
+    @return list_image: list object containing the mosaic paths (sorted).
+    """
+
+    with run_report.context_fn(product=product['name']), run_report.timer_fn('listing'):
+        search = os.path.join(mosaics_dir, product['sub_dir'], product['pattern'])
+        list_image = [image_s for image_s in sorted(glob(search)) if date_selected_fn(
+            step1_4_product_zonal_stats.image_date_fn(os.path.basename(image_s)), dates)]
+
+    print('{0}: '.format(product['name']), len(list_image), ' mosaics (', search, ')')
+
+    return list_image
+
+
+def extract_images_fn(sites_gdf, products=None, dates=None, mosaics_dir=MOSAICS_DIR, workers=1):
+    """ Extract the zonal statistics of every site from each mosaic of the products, yielding the results of each
+    mosaic as soon as it is complete.
+
+    @param sites_gdf: geo-dataframe object containing the site points or polygons (refer to sites_fn).
+    @param products: list object containing the product names (all registered products if None).
+    @param dates: tuple object containing the first and last month (refer to date_selected_fn), or None for all.
+    @param mosaics_dir: string object containing the path to the NT seasonal mosaics directory.
+    @param workers: integer object containing the number of worker processes.
+    @return generator object yielding a tuple (product name, mosaic path, dataframe) per mosaic (ValueError is raised
+    if the sites have no crs or a product is not registered).
+    """
+
+    if products is None:
+        products = product_registry.product_names_fn()
+    # unknown products are reported before any site or mosaic is read
+    registered = [product_registry.registered_product_fn(variable) for variable in products]
+
+    with run_report.timer_fn('geometry'):
+        geometries, uid_list, site_list = sites_fn(sites_gdf)
+
+    # the site plan of each grid, shared by every product and mosaic
+    plans = {}
+
+    # create the worker pool once for all images (None when running in a single process)
+    executor = zonal_engine.worker_pool_fn(workers)
+
+    try:
+        for variable, product in zip(products, registered):
+            spec = step1_4_product_zonal_stats.extraction_spec_fn(product)
+            list_image = product_images_fn(product, mosaics_dir, dates)
+
+            for image_s in mosaic_staging.staged_sources_fn(list_image):
+                print("image_s: ", image_s)
+                im_name = os.path.basename(image_s)
+                with run_report.context_fn(product=variable, image=image_s):
+                    zs_bands = zonal_engine.extract_fused_fn([image_s], geometries, [spec], plans, executor,
+                                                             workers)[0]
+                    with run_report.timer_fn('dataframe'):
+                        df = step1_4_product_zonal_stats.image_df_fn(
+                            zs_bands, im_name, step1_4_product_zonal_stats.image_date_fn(im_name), uid_list,
+                            site_list, product)
+                        df = step1_4_product_zonal_stats.clean_zonal_stats_fn(product, df)
+
+                yield variable, image_s, df
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def extract_fn(sites_gdf, products=None, dates=None, mosaics_dir=MOSAICS_DIR, workers=1):
+    """ Extract the zonal statistics of every site from the mosaics of the products (refer to extract_images_fn).
+
+    @param sites_gdf: geo-dataframe object containing the site points or polygons (refer to sites_fn).
+    @param products: list object containing the product names (all registered products if None).
+    @param dates: tuple object containing the first and last month (refer to date_selected_fn), or None for all.
+    @param mosaics_dir: string object containing the path to the NT seasonal mosaics directory.
+    @param workers: integer object containing the number of worker processes.
+    @return df: dataframe object containing the results of every mosaic with a leading product column (the columns of
+    each product as exported, refer to step1_4_product_zonal_stats.output_columns_fn).
+    """
+
+    df_list = []
+    for variable, image_s, df in extract_images_fn(sites_gdf, products, dates, mosaics_dir, workers):
+        df.insert(0, 'product', variable)
+        df_list.append(df)
+
+    if not df_list:
+        print('No mosaics were listed, there are no zonal stats to return.')
+        return pd.DataFrame(columns=['product'])
+
+    return pd.concat(df_list, ignore_index=True, sort=False)
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+
+"""
+zonal_service.py
+================
+
+Description: This script runs a long-running local zonal statistics service. Analysts post ad-hoc batches of point
+or polygon sites and receive the zonal statistics of the registered products (refer to product_registry.py) without
+paying the pipeline start up, mosaic listing and site rasterization on every request.
+
+The service keeps warm in memory:
+
+ - the mosaic catalog: the mosaics of every product, listed once at start up (POST /refresh lists them again).
+ - dataset handles: open mosaics (the least recently used idle handles are closed beyond --max_open). Each handle is
+   read by one request at a time; requests for different mosaics run concurrently.
+ - site plans: the read window, window affine and rasterized site mask of each site on each pixel grid (refer to
+   zonal_engine.site_plan_fn), keyed by the site geometry, so a site posted again is not rasterized again (the least
+   recently used plans are dropped beyond --plan_cache sites).
+ - site index: a spatial index (STRtree, refer to site_enrichment.query_pairs_fn) of the planned site footprints of
+   each pixel grid. A posted site whose footprint is within FOOTPRINT_TOLERANCE of a pixel of a planned site
+   (Hausdorff distance, i.e. the same point posted in another crs or with another vertex order) is found through the
+   index and reuses the plan of that site. The index is rebuilt on the next lookup after planned sites are added or
+   dropped.
+
+Requests are served on localhost by a threaded HTTP server, so several clients are answered concurrently:
+
+ - GET /health - the catalog, cache and request counts.
+ - GET /catalog - the mosaics of each product.
+ - POST /refresh - list the mosaics again.
+ - POST /extract - a json body containing features (a GeoJSON FeatureCollection or a list of features; points are
+   buffered to the 1ha square sites, refer to zonal_extract.sites_fn), epsg (the crs of the features, default 4283),
+   products (default all registered products) and dates (first and last start month, refer to
+   zonal_extract.date_selected_fn). The response contains the records of each product, cleaned and time stamped as in
+   the exported site csv files.
+
+i.e.:
+
+    python zonal_service.py -l R:\\landsat\\mosaics -p 8765 -w 4
+
+    curl -X POST http://127.0.0.1:8765/extract -d "{\"products\": [\"dbi\"], \"epsg\": 4283, \"features\": [{\"type\":
+    \"Feature\", \"properties\": {\"site\": \"a\"}, \"geometry\": {\"type\": \"Point\", \"coordinates\": [133.1,
+    -19.5]}}]}"
+
+
+Author: Rob McGregor
+email: Robert.Mcgregor@nt.gov.au
+Date: 19/10/2026
+Version: 1.0
+
+###############################################################################################
+
+MIT License
+
+Copyright (c) 2022 Rob McGregor
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the 'Software'), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+
+THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+##################################################################################################
+
+"""
+
+# Import modules
+from __future__ import print_function, division
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# open mosaics and planned sites retained by the service
+MAX_OPEN = 64
+PLAN_CACHE = 100000
+
+# footprints within this fraction of a pixel (Hausdorff distance) share a site plan
+FOOTPRINT_TOLERANCE = 0.001
+
+# connections waiting to be accepted (concurrent clients beyond the queue are refused)
+REQUEST_QUEUE = 64
+
+# the crs of posted features when none is given (the biomass csv is GDA94 geographic)
+DEFAULT_EPSG = 4283
+
+_SERVICE = None
+
+
+def get_cmd_args_fn():
+    p = argparse.ArgumentParser(
+        description='''Serve zonal statistics queries for ad-hoc sites on localhost with warm caches.''')
+
+    p.add_argument('-l', '--mosaics_dir', help="The NT seasonal mosaics directory path",
+                   default=r"R:\landsat\mosaics")
+
+    p.add_argument('--host', help="Enter the address the service listens on (default 127.0.0.1)",
+                   default='127.0.0.1')
+
+    p.add_argument('-p', '--port', type=int, help="Enter the port the service listens on (i.e. 8765)", default=8765)
+
+    p.add_argument('-w', '--workers', type=int,
+                   help="Enter the number of worker processes used to calculate the zonal statistics (i.e. 4)",
+                   default=1)
+
+    p.add_argument('-c', '--tiled_cache',
+                   help="Local tiled GeoTIFF cache built by mosaic_transcode.py, read in place of the source (optional)",
+                   default=None)
+
+    p.add_argument('--max_open', type=int, help="Enter the number of mosaics held open (i.e. 64)", default=MAX_OPEN)
+
+    p.add_argument('--plan_cache', type=int, help="Enter the number of planned sites retained (i.e. 100000)",
+                   default=PLAN_CACHE)
+
+    cmd_args = p.parse_args()
+
+    return cmd_args
+
+
+def configure_service_fn(mosaics_dir, workers=1, max_open=MAX_OPEN, plan_cache=PLAN_CACHE):
+    """ Set up the service caches, list the mosaic catalog and create the worker pool.
+
+    @param mosaics_dir: string object containing the path to the NT seasonal mosaics directory.
+    @param workers: integer object containing the number of worker processes.
+    @param max_open: integer object containing the number of mosaics held open.
+    @param plan_cache: integer object containing the number of planned sites retained.
+    """
+    global _SERVICE
+    import zonal_engine
+
+    _SERVICE = {'mosaics_dir': mosaics_dir, 'workers': workers, 'max_open': max(int(max_open), 1),
+                'plan_cache': max(int(plan_cache), 1), 'catalog': {}, 'datasets': OrderedDict(),
+                'plans': OrderedDict(), 'footprints': {}, 'site_index': {}, 'lock': threading.Lock(), 'requests': 0,
+                'plan_hits': 0, 'plan_matches': 0, 'plan_misses': 0, 'started': time.time(),
+                'executor': zonal_engine.worker_pool_fn(workers)}
+    catalog_fn(refresh=True)
+
+
+def close_service_fn():
+    """ Close the open mosaics and shut down the worker pool. """
+    global _SERVICE
+
+    if _SERVICE is None:
+        return
+
+    for srci, _ in _SERVICE['datasets'].values():
+        srci.close()
+    if _SERVICE['executor'] is not None:
+        _SERVICE['executor'].shutdown()
+    _SERVICE = None
+
+
+def catalog_fn(refresh=False):
+    """ Return the mosaic catalog, listing the mosaics of every registered product when refresh is True.
+
+    @param refresh: boolean object, if True the mosaics are listed again.
+    @return catalog: dictionary object containing the list of mosaic paths per product.
+    """
+    import product_registry
+    import zonal_extract
+
+    if refresh:
+        catalog = OrderedDict()
+        for product in product_registry.PRODUCTS:
+            catalog[product['name']] = zonal_extract.product_images_fn(product, _SERVICE['mosaics_dir'])
+        with _SERVICE['lock']:
+            _SERVICE['catalog'] = catalog
+
+    return _SERVICE['catalog']
+
+
+@contextmanager
+def dataset_fn(image_s):
+    """ Hold the open dataset of a mosaic (opened on first use, read from the tiled cache when a current tiled copy
+    exists) for the duration of a with block - one request reads a dataset at a time.
+
+    @param image_s: string object containing the path to the source mosaic.
+    @return srci: rasterio dataset object.
+    """
+    import rasterio
+    import mosaic_transcode
+
+    while True:
+        with _SERVICE['lock']:
+            entry = _SERVICE['datasets'].get(image_s)
+
+        if entry is None:
+            # a slow open (i.e. on the network share) does not hold up the requests for the other datasets
+            opened = rasterio.open(mosaic_transcode.tiled_image_fn(image_s) or image_s)
+        else:
+            opened = None
+
+        with _SERVICE['lock']:
+            entry = _SERVICE['datasets'].get(image_s)
+            if entry is None and opened is not None:
+                entry = _SERVICE['datasets'][image_s] = (opened, threading.Lock())
+                opened = None
+            if entry is None:
+                # the dataset was opened and closed again by other requests in the mean time
+                continue
+            _SERVICE['datasets'].move_to_end(image_s)
+
+            # close the least recently used datasets which are not being read
+            for key in list(_SERVICE['datasets'])[:-1]:
+                if len(_SERVICE['datasets']) <= _SERVICE['max_open']:
+                    break
+                srci, lock = _SERVICE['datasets'][key]
+                if lock.acquire(False):
+                    del _SERVICE['datasets'][key]
+                    srci.close()
+                    lock.release()
+
+        # another request opened the dataset first, the duplicate handle is closed
+        if opened is not None:
+            opened.close()
+
+        srci, lock = entry
+        lock.acquire()
+        # the dataset may have been closed by another request before it was locked
+        if not srci.closed:
+            break
+        lock.release()
+
+    try:
+        yield srci
+    finally:
+        lock.release()
+
+
+def site_index_fn(grid):
+    """ Return the spatial index of the planned site footprints of a pixel grid, rebuilding it when the planned sites
+    of the grid have changed (call with the service lock held).
+
+    @param grid: tuple object containing the grid key (refer to zonal_engine.grid_key_fn).
+    @return index: dictionary object containing the plan keys, footprints and STRtree of the planned sites.
+    """
+    from shapely.strtree import STRtree
+
+    index = _SERVICE['site_index'].get(grid)
+    if index is None:
+        keys = [key for key in _SERVICE['footprints'] if key[0] == grid]
+        footprints = [_SERVICE['footprints'][key] for key in keys]
+        index = _SERVICE['site_index'][grid] = {'keys': keys, 'footprints': footprints,
+                                                'tree': STRtree(footprints) if footprints else None}
+
+    return index
+
+
+def footprint_matches_fn(grid, unmatched, pixel_size):
+    """ Find the planned sites with the same footprint (to FOOTPRINT_TOLERANCE of a pixel) as the posted sites which
+    were not found by geometry, through the spatial index of the grid.
+
+    @param grid: tuple object containing the grid key (refer to zonal_engine.grid_key_fn).
+    @param unmatched: ordered dictionary object containing the footprint (shapely geometry) of each unmatched plan key.
+    @param pixel_size: float object containing the pixel width of the grid (raster crs units).
+    @return matches: dictionary object containing the planned site plan of each matched key.
+    """
+    import site_enrichment
+
+    keys = list(unmatched)
+    sites = list(unmatched.values())
+    matches = {}
+    with _SERVICE['lock']:
+        index = site_index_fn(grid)
+        if index['tree'] is None:
+            return matches
+        for site, feature in site_enrichment.query_pairs_fn(index['footprints'], sites, index['tree']):
+            planned = _SERVICE['plans'].get(index['keys'][feature])
+            if keys[site] in matches or planned is None:
+                continue
+            if index['footprints'][feature].hausdorff_distance(sites[site]) <= FOOTPRINT_TOLERANCE * abs(pixel_size):
+                matches[keys[site]] = planned
+
+    return matches
+
+
+def site_plans_fn(geometries, srci):
+    """ Return the site plan of a mosaic grid (refer to zonal_engine.site_plan_fn), planning only the sites which are
+    not already in the plan cache (by geometry, or by footprint through the site index).
+
+    @param geometries: list object containing a geometry mapping per site (raster crs).
+    @param srci: rasterio dataset object (open).
+    @return plan: dictionary object containing the windows, affines, sub_windows, masks and footprints (site order).
+    """
+    from shapely.geometry import shape
+    import zonal_engine
+
+    grid = zonal_engine.grid_key_fn(srci)
+    keys = [(grid, repr(geometry)) for geometry in geometries]
+    with _SERVICE['lock']:
+        cached = dict((key, _SERVICE['plans'][key]) for key in set(keys) if key in _SERVICE['plans'])
+
+    unmatched = OrderedDict((key, shape(geometry)) for key, geometry in zip(keys, geometries) if key not in cached)
+    matched = footprint_matches_fn(grid, unmatched, srci.transform.a) if unmatched else {}
+    cached.update(matched)
+
+    missing = OrderedDict((key, geometry) for key, geometry in zip(keys, geometries) if key not in cached)
+    if missing:
+        plan = zonal_engine.site_plan_fn(list(missing.values()), srci.transform)
+        for position, key in enumerate(missing):
+            cached[key] = dict((name, values[position]) for name, values in plan.items())
+
+    with _SERVICE['lock']:
+        _SERVICE['plan_hits'] += len(keys) - len(missing) - len(matched)
+        _SERVICE['plan_matches'] += len(matched)
+        _SERVICE['plan_misses'] += len(missing)
+        for key in keys:
+            _SERVICE['plans'][key] = cached[key]
+            _SERVICE['plans'].move_to_end(key)
+        # the footprints of the newly planned sites are indexed on the next lookup
+        for key in missing:
+            _SERVICE['footprints'][key] = unmatched[key]
+        if missing:
+            _SERVICE['site_index'].pop(grid, None)
+        while len(_SERVICE['plans']) > _SERVICE['plan_cache']:
+            key, _ = _SERVICE['plans'].popitem(last=False)
+            if _SERVICE['footprints'].pop(key, None) is not None:
+                _SERVICE['site_index'].pop(key[0], None)
+
+    return dict((name, [cached[key][name] for key in keys])
+                for name in ['windows', 'affines', 'sub_windows', 'masks', 'footprints'])
+
+
+def query_fn(query):
+    """ Calculate the zonal statistics of the sites posted to /extract.
+
+    @param query: dictionary object containing the features, epsg, products and dates keys.
+    @return results: dictionary object containing the records of each product (refer to
+    step1_4_product_zonal_stats.output_columns_fn).
+    """
+    import geopandas as gpd
+    import pandas as pd
+    import pyproj
+    import shapely.errors
+    import shapely.geometry
+    import shapely.validation
+    import product_registry
+    import step1_4_product_zonal_stats
+    import zonal_engine
+    import zonal_extract
+
+    features = query.get('features')
+    if isinstance(features, dict):
+        features = features.get('features')
+    if not features:
+        raise ValueError('the query contains no features')
+
+    # a feature without a geometry, or with an empty or invalid geometry, is answered with a 400
+    for position, feature in enumerate(features):
+        geometry = feature.get('geometry') if isinstance(feature, dict) else None
+        if not geometry:
+            raise ValueError('feature {0} has no geometry'.format(position))
+        try:
+            shape = shapely.geometry.shape(geometry)
+        except (AttributeError, KeyError, TypeError, ValueError, IndexError, shapely.errors.ShapelyError) as err:
+            raise ValueError('feature {0} has a malformed geometry: {1}'.format(position, err))
+        if shape.is_empty:
+            raise ValueError('feature {0} has an empty geometry'.format(position))
+        if not shape.is_valid:
+            raise ValueError('feature {0} has an invalid geometry: {1}'.format(
+                position, shapely.validation.explain_validity(shape)))
+
+    products = query.get('products') or product_registry.product_names_fn()
+    unknown = [variable for variable in products if variable not in product_registry.product_names_fn()]
+    if unknown:
+        raise ValueError('products are not registered: ' + ', '.join(unknown))
+
+    dates = query.get('dates')
+    if dates is not None and len(dates) != 2:
+        raise ValueError('dates must contain the first and last start month, i.e. ["2015", "201812"]')
+
+    epsg = query.get('epsg', DEFAULT_EPSG)
+    try:
+        crs = pyproj.CRS.from_user_input('EPSG:{0}'.format(epsg))
+    except pyproj.exceptions.CRSError:
+        raise ValueError('epsg is not a valid crs: {0}'.format(epsg))
+
+    sites_gdf = gpd.GeoDataFrame.from_features(features, crs=crs)
+    geometries, uid_list, site_list = zonal_extract.sites_fn(sites_gdf)
+    # the plans are of the distinct footprints (refer to zonal_engine.unique_geometries_fn)
+    geometries, index = zonal_engine.unique_geometries_fn(geometries)
+
+    results = OrderedDict()
+    catalog = catalog_fn()
+    for variable in products:
+        product = product_registry.registered_product_fn(variable)
+        spec = step1_4_product_zonal_stats.extraction_spec_fn(product)
+
+        df_list = []
+        for image_s in catalog.get(variable, []):
+            im_name = os.path.basename(image_s)
+            im_date = step1_4_product_zonal_stats.image_date_fn(im_name)
+            if not zonal_extract.date_selected_fn(im_date, dates):
+                continue
+
+            with dataset_fn(image_s) as srci:
+                plans = {zonal_engine.grid_key_fn(srci): site_plans_fn(geometries, srci)}
+                zs_bands = zonal_engine.fan_out_fn(zonal_engine.extract_fused_fn(
+                    [srci], geometries, [spec], plans, _SERVICE['executor'], _SERVICE['workers'])[0], index)
+
+            df = step1_4_product_zonal_stats.image_df_fn(zs_bands, im_name, im_date, uid_list, site_list, product)
+            df_list.append(step1_4_product_zonal_stats.clean_zonal_stats_fn(product, df))
+
+        if df_list:
+            results[variable] = json.loads(pd.concat(df_list, ignore_index=True).to_json(orient='records'))
+        else:
+            results[variable] = []
+
+    return results
+
+
+def health_fn():
+    """ Return the catalog, cache and request counts of the service. """
+
+    with _SERVICE['lock']:
+        return {'uptime_seconds': round(time.time() - _SERVICE['started'], 1), 'requests': _SERVICE['requests'],
+                'mosaics': dict((variable, len(images)) for variable, images in _SERVICE['catalog'].items()),
+                'open_datasets': len(_SERVICE['datasets']), 'planned_sites': len(_SERVICE['plans']),
+                'indexed_sites': len(_SERVICE['footprints']), 'plan_hits': _SERVICE['plan_hits'],
+                'plan_matches': _SERVICE['plan_matches'], 'plan_misses': _SERVICE['plan_misses']}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """ Route the service requests (refer to the script description). """
+
+    def respond_fn(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def route_fn(self, routes):
+        start = time.time()
+        with _SERVICE['lock']:
+            _SERVICE['requests'] += 1
+
+        route = routes.get(self.path.split('?')[0])
+        if route is None:
+            self.respond_fn(404, {'error': 'unknown path: ' + self.path})
+            return
+
+        try:
+            body = route()
+        except (ValueError, KeyError, TypeError) as error:
+            self.respond_fn(400, {'error': str(error)})
+        except Exception as error:
+            print('Request failed: ', self.path, repr(error))
+            self.respond_fn(500, {'error': repr(error)})
+        else:
+            self.respond_fn(200, body)
+        print('{0} {1} {2:.3f}s'.format(self.command, self.path, time.time() - start))
+
+    def read_json_fn(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+
+    def do_GET(self):
+        self.route_fn({'/health': health_fn, '/catalog': catalog_fn})
+
+    def do_POST(self):
+        self.route_fn({'/extract': lambda: query_fn(self.read_json_fn()),
+                       '/refresh': lambda: dict((variable, len(images))
+                                                for variable, images in catalog_fn(refresh=True).items())})
+
+    def log_message(self, format, *args):
+        # requests are printed with their duration by route_fn
+        pass
+
+
+def serve_fn(host, port):
+    """ Serve requests until interrupted (Ctrl+C), answering each client on its own thread.
+
+    @param host: string object containing the address the service listens on.
+    @param port: integer object containing the port the service listens on.
+    """
+
+    server = ThreadingHTTPServer((host, port), ServiceHandler, bind_and_activate=False)
+    server.daemon_threads = True
+    server.request_queue_size = REQUEST_QUEUE
+    server.server_bind()
+    server.server_activate()
+
+    # stop on a termination signal as on Ctrl+C, so the worker processes are shut down
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print('Zonal stats service listening on: http://{0}:{1}'.format(host, server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Zonal stats service stopping.')
+    finally:
+        server.server_close()
+        close_service_fn()
+
+
+def main_routine():
+    """ Start the zonal statistics service. """
+
+    cmd_args = get_cmd_args_fn()
+
+    if cmd_args.tiled_cache is not None:
+        import mosaic_transcode
+        mosaic_transcode.configure_tiled_cache_fn(cmd_args.tiled_cache)
+
+    configure_service_fn(cmd_args.mosaics_dir, cmd_args.workers, cmd_args.max_open, cmd_args.plan_cache)
+    serve_fn(cmd_args.host, cmd_args.port)
+
+
+if __name__ == '__main__':
+    main_routine()